@@ -50,6 +50,6 @@ def get_response_content(fs):
         msg_b = 'as the number of rows in the matrix'
         raise HandlingError(msg_a + msg_b)
     # get the newick tree
-    tree = NeighborJoining.make_tree(D.tolist(), ordered_labels)
+    tree = NeighborJoining.make_tree_fast(D, ordered_labels)
     # return the response
     return NewickIO.get_newick_string(tree) + '\n'
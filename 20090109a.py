@@ -19,8 +19,8 @@ import FormOut
 
 # define some web locations that should probably be moved to a config file
 g_base_dir = '/var/www/python_scripts/data/exon-alignments'
-g_fasta_dir = g_base_dir + '/fasta-pieces'
-g_index_dir = g_base_dir + '/piece-index-files'
+g_fasta_pathname = g_base_dir + '/knownGene.exonAA.fa'
+g_index_dir = g_base_dir + '/index-files'
 g_valid_chromosome_strings_pathname = g_base_dir + '/valid-chromosome-strings.txt'
 
 
@@ -43,7 +43,7 @@ def get_form_out():
 def get_response_content(fs):
     try:
         finder = KGEA.Finder(
-                g_index_dir, g_valid_chromosome_strings_pathname, g_fasta_dir)
+                g_index_dir, g_valid_chromosome_strings_pathname, g_fasta_pathname)
         if fs.show_alignment:
             lines = finder.get_alignment_lines(fs.chromosome, fs.position)
         elif fs.show_column:
@@ -74,9 +74,7 @@ def main(options, args):
     # get this file from the web directory
     # http://hgdownload.cse.ucsc.edu/goldenPath/hg18/multiz28way/alignments/
     original_fasta_filename = 'knownGene.exonAA.fa'
-    # the original fasta file is broken into a bunch of pieces and put into this directory
-    pieces_directory = 'fasta'
-    # the index files that map genomic locations to fasta subfiles are in this directory
+    # the index files that map genomic locations to fasta byte ranges are in this directory
     index_directory = 'index'
     # this file keeps a list of valid chromosome names from the original fasta file
     chromosome_filename = 'chromosomes.txt'
@@ -86,15 +84,9 @@ def main(options, args):
     # try to dispatch the command
     command = args[0]
     command_args = args[1:]
-    if command == 'split':
+    if command == 'index':
         if command_args:
-            raise MySyntaxError('the split command does not take any arguments')
-        # assert that the fasta directory has been created
-        if not os.path.isdir(pieces_directory):
-            err_lines = [
-                    'The directory for the split fasta files was not found: ' + pieces_directory,
-                    'Please create this directory or cd to its parent directory.']
-            raise MyConfigError('\n'.join(err_lines))
+            raise MySyntaxError('the index command does not take any arguments')
         # assert that the current directory has the original huge fasta file
         pathnames = os.listdir('.')
         if original_fasta_filename not in pathnames:
@@ -103,26 +95,13 @@ def main(options, args):
                     'Please download this file from:',
                     'http://hgdownload.cse.ucsc.edu/goldenPath/hg18/multiz28way/alignments/']
             raise MyConfigError('\n'.join(err_lines))
-        splitter = KGEA.Splitter(original_fasta_filename, pieces_directory)
-        splitter.run(verbose=options.verbose)
-        return ''
-    elif command == 'index':
-        if command_args:
-            raise MySyntaxError('the index command does not take any arguments')
-        # assert that the fasta directory has been created
-        if not os.path.isdir(pieces_directory):
-            err_lines = [
-                    'The directory for the split fasta files was not found: ' + pieces_directory,
-                    'If this directory exists somewhere else, then cd to its parent directory.',
-                    'If this directory has not been created, then create it and run the split command.']
-            raise MyConfigError('\n'.join(err_lines))
         # assert that the index directory has been created
         if not os.path.isdir(index_directory):
             err_lines = [
                     'The directory for the index files was not found: ' + index_directory,
                     'Please create this directory or cd to its parent directory.']
             raise MyConfigError('\n'.join(err_lines))
-        indexer = KGEA.Indexer(index_directory, chromosome_filename, pieces_directory)
+        indexer = KGEA.Indexer(index_directory, chromosome_filename, original_fasta_filename)
         indexer.run(verbose=options.verbose)
         return ''
     elif command == 'find-alignment':
@@ -135,12 +114,11 @@ def main(options, args):
             chromosome_position = int(chromosome_position_string)
         except ValueError as e:
             raise MySyntaxError('the chromosome position should be an integer')
-        # assert that the fasta directory has been created
-        if not os.path.isdir(pieces_directory):
+        # assert that the current directory has the original huge fasta file
+        if not os.path.isfile(original_fasta_filename):
             err_lines = [
-                    'The directory for the split fasta files was not found: ' + pieces_directory,
-                    'If this directory exists somewhere else, then cd to its parent directory.',
-                    'If this directory has not been created, then create it and run the split command.']
+                    'The file %s was not found in the current directory.' % original_fasta_filename,
+                    'If this file exists somewhere else, then cd to its directory.']
             raise MyConfigError('\n'.join(err_lines))
         # assert that the index directory has been created
         if not os.path.isdir(index_directory):
@@ -150,7 +128,7 @@ def main(options, args):
                     'If this directory has not been created, then create it and run the index command.']
             raise MyConfigError('\n'.join(err_lines))
         # look for the alignment using the finder
-        finder = KGEA.Finder(index_directory, chromosome_filename, pieces_directory)
+        finder = KGEA.Finder(index_directory, chromosome_filename, original_fasta_filename)
         fasta_lines = finder.get_alignment_lines(chromosome_string, chromosome_position, verbose=options.verbose)
         if not fasta_lines:
             return 'no amino acid was found at this position'
@@ -165,12 +143,11 @@ def main(options, args):
             chromosome_position = int(chromosome_position_string)
         except ValueError as e:
             raise MySyntaxError('the chromosome position should be an integer')
-        # assert that the fasta directory has been created
-        if not os.path.isdir(pieces_directory):
+        # assert that the current directory has the original huge fasta file
+        if not os.path.isfile(original_fasta_filename):
             err_lines = [
-                    'The directory for the split fasta files was not found: ' + pieces_directory,
-                    'If this directory exists somewhere else, then cd to its parent directory.',
-                    'If this directory has not been created, then create it and run the split command.']
+                    'The file %s was not found in the current directory.' % original_fasta_filename,
+                    'If this file exists somewhere else, then cd to its directory.']
             raise MyConfigError('\n'.join(err_lines))
         # assert that the index directory has been created
         if not os.path.isdir(index_directory):
@@ -180,7 +157,7 @@ def main(options, args):
                     'If this directory has not been created, then create it and run the index command.']
             raise MyConfigError('\n'.join(err_lines))
         # look for the column using the finder
-        finder = KGEA.Finder(index_directory, chromosome_filename, pieces_directory)
+        finder = KGEA.Finder(index_directory, chromosome_filename, original_fasta_filename)
         column_lines = finder.get_column_lines(chromosome_string, chromosome_position, verbose=options.verbose)
         if not column_lines:
             return 'no amino acid was found at this position'
@@ -245,7 +222,6 @@ if __name__ == '__main__':
         print 'Here are some examples:'
         print 'python %s find-alignment chr7 15393678' % sys.argv[0]
         print 'python %s find-column chr7 15393678' % sys.argv[0]
-        print 'python %s split' % sys.argv[0]
         print 'python %s index' % sys.argv[0]
         print 'python %s summarize' % sys.argv[0]
     except MyConfigError as e:
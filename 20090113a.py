@@ -21,8 +21,8 @@ g_default_string = const.read('20100730r')
 
 # Define some web locations which should probably be moved to a config file.
 g_base_dir = '/var/www/python_scripts/data/exon-alignments'
-g_fasta_dir = g_base_dir + '/fasta-pieces'
-g_index_dir = g_base_dir + '/piece-index-files'
+g_fasta_pathname = g_base_dir + '/knownGene.exonAA.fa'
+g_index_dir = g_base_dir + '/index-files'
 g_valid_chromosome_strings_pathname = g_base_dir + '/valid-chromosome-strings.txt'
 
 
@@ -88,7 +88,7 @@ def get_response_content(fs):
     out = StringIO()
     try:
         finder = KGEA.Finder(
-                g_index_dir, g_valid_chromosome_strings_pathname, g_fasta_dir)
+                g_index_dir, g_valid_chromosome_strings_pathname, g_fasta_pathname)
         # note that some of these amino acids can be gaps
         taxon_aa_pairs = list(
                 finder.gen_taxon_aa_pairs(fs.chromosome, fs.position))
@@ -203,7 +203,7 @@ class TreeSearch:
             # check the dendrogram
             if self.invalid_dendrogram:
                 labels = range(len(D))
-                hierarchy = Dendrogram.get_hierarchy(D, Dendrogram.spectral_split, labels)
+                hierarchy = Dendrogram.get_spectral_hierarchy(D, labels)
                 dendrogram_splits = set(Dendrogram.hierarchy_to_nontrivial_splits(hierarchy))
                 if dendrogram_splits == true_splits:
                     self.valid_dendrogram_count += 1
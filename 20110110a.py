@@ -15,6 +15,7 @@ the path to the output directory for the images, a scaling factor, a tree,
 and a physical width and height.
 To convert a sequence of png images to an mpeg video:
 ffmpeg -i frames/frame-%04d.png test.mpg
+or use the --animation option.
 Resolutions preferred by YouTube are 640x360 and 480x360.
 """
 
@@ -38,6 +39,7 @@ import CairoUtil
 import Progress
 import MatrixUtil
 import ProofDecoration
+import FramePipeline
 import const
 
 g_plane_opacity = 0.1
@@ -340,6 +342,17 @@ def get_ordered_ids(tree):
     ordered_ids.extend(id(node) for node in tree.gen_internal_nodes())
     return ordered_ids
 
+def get_frame_geometry(shared, progress):
+    """
+    The distance matrix and the reference points are shared by all frames.
+    @param shared: D, nleaves, and reference_points
+    @param progress: animation progress between 0.0 and 1.0
+    @return: the weighted MDS points
+    """
+    D, nleaves, reference_points = shared
+    mass_vector = get_mass_vector(len(D), nleaves, progress)
+    return get_canonical_3d_mds(D, mass_vector, reference_points)
+
 def sigmoid(x):
     t = (x - .5) * 12
     return 1.0 / (1.0 + math.exp(-t))
@@ -362,19 +375,25 @@ def main(args):
     # Create the reference points
     # so that the video frames are not reflected arbitrarily.
     reference_points = Euclid.edm_to_points(D).T[:3].T
-    # create the animation frames and write them as image files
-    pbar = Progress.Bar(args.nframes)
+    # get the progress of each frame
+    args_list = []
     for frame_index in range(args.nframes):
         linear_progress = frame_index / float(args.nframes - 1)
         if args.interpolation == 'sigmoid':
             progress = sigmoid(linear_progress)
         else:
             progress = linear_progress
-        mass_vector = get_mass_vector(nvertices, nleaves, progress)
-        points = get_canonical_3d_mds(D, mass_vector, reference_points)
-        crossings = get_crossings(index_edges, points)
+        args_list.append((progress,))
+    # Compute the frame geometry in parallel,
+    # and render the frames in order in this process.
+    shared = (D, nleaves, reference_points)
+    frames = FramePipeline.gen_frames(
+            get_frame_geometry, shared, args_list, args.nprocesses)
+    pbar = Progress.Bar(args.nframes)
+    for frame_index, points in enumerate(frames):
         # define the frame path name
-        image_filename = 'frame-%04d.%s' % (frame_index, args.image_format)
+        image_filename = FramePipeline.get_frame_filename(
+                frame_index, args.image_format)
         image_pathname = os.path.join(args.output_directory, image_filename)
         # clear the old figure and render the new figure
         mlab.clf()
@@ -388,6 +407,9 @@ def main(args):
         # update the progress bar
         pbar.update(frame_index+1)
     pbar.finish()
+    if args.animation:
+        FramePipeline.encode_animation(
+                args.output_directory, args.image_format, args.animation)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=__doc__)
@@ -407,6 +429,10 @@ if __name__ == '__main__':
     parser.add_argument('--interpolation', default='sigmoid',
             choices=('sigmoid', 'linear'),
             help='weights change according to this function')
+    parser.add_argument('--nprocesses', type=int,
+            help='number of processes (default is the number of cpus)')
+    parser.add_argument('--animation',
+            help='also encode the frames to this file, e.g. tree.gif')
     parser.add_argument('output_directory',
             help='path to the output directory for .png frames')
     main(parser.parse_args())
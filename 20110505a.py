@@ -3,6 +3,7 @@ Animate a 3D tree.
 
 To convert a sequence of png images to an mpeg video:
 ffmpeg -i frames/frame-%04d.png test.mpg
+or use the --animation option.
 Resolutions preferred by YouTube are 640x360 and 480x360. 
 """
 
@@ -22,10 +23,10 @@ import Ftree
 import FtreeIO
 import Euclid
 import CairoUtil
-import Progress
 import const
 import TreeProjection
 import NewickIO
+import FramePipeline
 
 #g_tree_string = const.read('20100730g').rstrip()
 g_tree_string = NewickIO.daylight_example_tree
@@ -92,6 +93,19 @@ def get_animation_frame(
     @param scale: a scaling factor
     @return: the animation frame as an image as a string
     """
+    projection = TreeProjection.get_projection(newick, eigenvector_index)
+    return get_projection_frame(
+            (image_format, physical_size, scale, projection), yaw, pitch)
+
+def get_projection_frame(shared, yaw, pitch):
+    """
+    The layout and the valuations are shared by all frames.
+    @param shared: image format, physical size, scale, and projection
+    @param yaw: an angle; rotate the tree layout around its center
+    @param pitch: an angle; worm eye vs bird eye view of the tree
+    @return: the animation frame as an image as a string
+    """
+    image_format, physical_size, scale, projection = shared
     # before we begin drawing we need to create the cairo surface and context
     cairo_helper = CairoUtil.CairoHelper(image_format)
     surface = cairo_helper.create_surface(physical_size[0], physical_size[1])
@@ -108,8 +122,7 @@ def get_animation_frame(
     ctx.translate(x0, y0)
     ctx.scale(1, -1)
     # draw the info
-    TreeProjection.draw_cairo_frame(
-            ctx, scale, newick, eigenvector_index, yaw, pitch)
+    TreeProjection.draw_cairo_projection(ctx, scale, projection, yaw, pitch)
     # create the image
     return cairo_helper.get_image_string()
 
@@ -119,20 +132,20 @@ def main(args):
         raise ValueError('nframes should be at least 2')
     # define the requested physical size of the images (in pixels)
     physical_size = (args.physical_width, args.physical_height)
+    # compute the layout and the valuations once for all frames
+    projection = TreeProjection.get_projection(
+            args.tree, args.eigenvector_index)
+    shared = (args.image_format, physical_size, args.scale, projection)
     # create the animation frames and write them as image files
-    pbar = Progress.Bar(args.nframes)
+    args_list = []
     for frame_index in range(args.nframes):
         t = frame_index / float(args.nframes - 1)
-        image_string = get_animation_frame(
-                args.image_format, physical_size, args.scale,
-                args.tree, args.eigenvector_index,
-                t_to_yaw(t), t_to_pitch(t))
-        image_filename = 'frame-%04d.%s' % (frame_index, args.image_format)
-        image_pathname = os.path.join(args.output_directory, image_filename)
-        with open(image_pathname, 'wb') as fout:
-            fout.write(image_string)
-        pbar.update(frame_index+1)
-    pbar.finish()
+        args_list.append((t_to_yaw(t), t_to_pitch(t)))
+    FramePipeline.write_frames(get_projection_frame, shared, args_list,
+            args.output_directory, args.image_format, args.nprocesses)
+    if args.animation:
+        FramePipeline.encode_animation(
+                args.output_directory, args.image_format, args.animation)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=__doc__)
@@ -152,6 +165,10 @@ if __name__ == '__main__':
             help='image format')
     parser.add_argument('--nframes', type=int, default=100,
             help='number of animation frames (image files) to create') 
+    parser.add_argument('--nprocesses', type=int,
+            help='number of processes (default is the number of cpus)')
+    parser.add_argument('--animation',
+            help='also encode the frames to this file, e.g. tree.gif')
     parser.add_argument('output_directory',
             help='path to the output directory for .png frames')
     main(parser.parse_args())
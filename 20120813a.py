@@ -28,7 +28,7 @@ import Form
 import FormOut
 import MatrixUtil
 import StatsUtil
-import wfengine
+from wfbackend import wfengine
 
 def get_form():
     """
@@ -31,7 +31,7 @@ import MatrixUtil
 import StatsUtil
 import StatsVectorized
 import Util
-import wfengine
+from wfbackend import wfengine
 
 def get_form():
     """
@@ -19,7 +19,7 @@ import kaizeng
 import wrightfisher
 import RUtil
 from RUtil import mk_call_str
-import wfengine
+from wfbackend import wfengine
 
 def get_form():
     """
@@ -25,7 +25,7 @@ import wrightfisher
 import Util
 import RUtil
 from RUtil import mk_call_str
-import wfengine
+from wfbackend import wfengine
 
 def get_form():
     """
@@ -19,7 +19,7 @@ import StatsUtil
 import Util
 import RUtil
 from RUtil import mk_call_str
-import wfengine
+from wfbackend import wfengine
 import kimura
 
 def get_form():
@@ -13,8 +13,8 @@ import FormOut
 import RUtil
 from RUtil import mk_call_str
 import MatrixUtil
-import wfengine
-import wfcompens
+from wfbackend import wfengine
+from wfbackend import wfcompens
 import multinomstate
 
 def get_form():
@@ -42,7 +42,7 @@ def get_plot_array(N_diploid, Nr, theta_values, Ns_values):
     # set up the state space
     k = 4
     M = multinomstate.get_sorted_states(2*N_diploid, k)
-    T = multinomstate.get_inverse_map(M)
+    T = multinomstate.get_rank_index(M)
     nstates = M.shape[0]
     lmcs = wfengine.get_lmcs(M)
     # precompute rate matrices
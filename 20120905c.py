@@ -25,8 +25,8 @@ import FormOut
 import RUtil
 from RUtil import mk_call_str
 import MatrixUtil
-import wfengine
-import wfcompens
+from wfbackend import wfengine
+from wfbackend import wfcompens
 import multinomstate
 import wfbckcompens
 
@@ -61,8 +61,8 @@ def get_plot_array(N_diploid, theta, Nr_values, Ns_values):
     k = 4
     M = multinomstate.get_sorted_states(N_hap, k)
     nstates = M.shape[0]
-    # compute the inverse map
-    T = multinomstate.get_inverse_map(M)
+    # index the states by rank
+    T = multinomstate.get_rank_index(M)
     #
     lmcs = wfengine.get_lmcs(M)
     # precompute rate matrices
@@ -29,8 +29,8 @@ import FormOut
 import RUtil
 from RUtil import mk_call_str
 import MatrixUtil
-import wfengine
-import wfcompens
+from wfbackend import wfengine
+from wfbackend import wfcompens
 import multinomstate
 import wffwdcompens
 import wfbckcompens
@@ -80,7 +80,7 @@ def get_backward_info(N_diploid, theta, Nr, Ns):
     # set up the state space
     k = 4
     M = multinomstate.get_sorted_states(2*N_diploid, k)
-    T = multinomstate.get_inverse_map(M)
+    T = multinomstate.get_rank_index(M)
     nstates = M.shape[0]
     lmcs = wfengine.get_lmcs(M)
     # compute rate matrices
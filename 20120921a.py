@@ -16,7 +16,7 @@ import FormOut
 import MatrixUtil
 import StatsUtil
 import kaizeng
-import wfengine
+from wfbackend import wfengine
 import wrightfisher
 
 def get_form():
@@ -31,7 +31,7 @@ from RUtil import mk_call_str
 import MatrixUtil
 import StatsUtil
 import kimura
-import wfengine
+from wfbackend import wfengine
 
 def get_form():
     """
@@ -20,6 +20,7 @@ import FelTree
 import MatrixUtil
 import SchurAlgebra
 import Euclid
+import EigUtil
 import Xtree
 import iterutils
 
@@ -336,11 +337,19 @@ def update_generalized_nj(D, index_set):
             D_out[i,outgroup_index] = D_out[outgroup_index,i] = d
     return D_out
 
-def laplacian_to_fiedler(L):
+def laplacian_to_fiedler(L, v0=None):
     """
+    Large Laplacians that are positive semidefinite
+    are handled by a partial eigensolver.
     @param L: the Laplacian matrix
+    @param v0: an optional guess of the Fiedler vector
     @return: the Fiedler vector of a related graph
     """
+    try:
+        w, v = EigUtil.laplacian_fiedler_partial(L, v0)
+        return v.tolist()
+    except EigUtil.PartialEighError:
+        pass
     # get the eigendecomposition
     eigenvalues, V_T = np.linalg.eigh(L)
     eigenvectors = V_T.T.tolist()
@@ -350,11 +359,16 @@ def laplacian_to_fiedler(L):
     w, v = eigensystem[1]
     return v
 
-def dccov_to_fiedler(HSH):
+def dccov_to_fiedler(HSH, v0=None):
     """
+    Large matrices are handled by a partial eigensolver.
     @param HSH: the doubly centered covariance matrix
+    @param v0: an optional guess of the Fiedler vector
     @return: the Fiedler vector of a related graph
     """
+    if len(HSH) >= EigUtil.g_partial_min_order:
+        w, v = EigUtil.principal_eigh_partial(HSH, v0)
+        return v.tolist()
     # get the eigendecomposition
     eigenvalues, V_T = np.linalg.eigh(HSH)
     eigenvectors = V_T.T.tolist()
@@ -362,23 +376,25 @@ def dccov_to_fiedler(HSH):
     w, v = max(zip(eigenvalues, eigenvectors))
     return v
 
-def edm_to_fiedler(D):
+def edm_to_fiedler(D, v0=None):
     """
     @param D: the distance matrix
+    @param v0: an optional guess of the Fiedler vector
     @return: the Fiedler vector of a related graph
     """
-    return dccov_to_fiedler(Euclid.edm_to_dccov(D))
+    return dccov_to_fiedler(Euclid.edm_to_dccov(D), v0)
 
-def split_using_eigenvector(D, epsilon=1e-14):
+def split_using_eigenvector(D, epsilon=1e-14, v0=None):
     """
     Split the distance matrix using signs of an eigenvector of -HDH/2.
     If a degenerate split is found then a DegenerateSplitException is raised.
     @param D: the distance matrix
     @param epsilon: small eigenvector loadings will be treated as zero
+    @param v0: an optional guess of the eigenvector
     @return: a set of two index sets defining a split of the indices
     """
     # get the fiedler vector
-    v = edm_to_fiedler(D)
+    v = edm_to_fiedler(D, v0)
     # get the eigensplit
     eigensplit = eigenvector_to_split(v, epsilon)
     # validate the split
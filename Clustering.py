@@ -4,13 +4,18 @@ Clustering related algorithms.
 
 from StringIO import StringIO
 import unittest
+import time
+import argparse
 import random
+import multiprocessing
 
 import numpy as np
 import scipy
 
 import Euclid
+import EigUtil
 import NeighborJoining
+import StoerWagner
 
 # This distance matrix is from a neighbor joining paper by Lior Pachter.
 g_lior = [
@@ -91,6 +96,24 @@ def get_R_balaji(distance_matrix):
     R = scipy.linalg.pinv(R_pinv)
     return R
 
+def get_fiedler_eigenvector(L):
+    """
+    Get the eigenvector whose eigenvalue is second smallest in absolute value.
+    Large positive semidefinite matrices are handled by a partial eigensolver.
+    @param L: a symmetric matrix with the constant vector in its null space
+    @return: the eigenvector as a numpy array
+    """
+    try:
+        w, v = EigUtil.laplacian_fiedler_partial(L)
+        return v
+    except EigUtil.PartialEighError:
+        pass
+    w, v = scipy.linalg.eigh(L)
+    eigenvalue_info = list(sorted((abs(x), i) for i, x in enumerate(w)))
+    stationary_eigenvector_index = eigenvalue_info[0][1]
+    fiedler_eigenvector_index = eigenvalue_info[1][1]
+    return v.T[fiedler_eigenvector_index]
+
 def gen_assignments(n):
     """
     Generates Y vectors using the notation of Eric Stone.
@@ -122,6 +145,200 @@ def get_exact_criterion(R_in, Y_in):
     return np.dot(Y, np.dot(R_in, Y.T))
 
 
+# use a pool of processes for exact splits of at least this many taxa
+g_parallel_min_order = 16
+
+# enumerate this many of the last indices of the search at once
+g_leaf_block_size = 10
+
+
+class BipartitionSearch:
+    """
+    Branch and bound search for the Y vector maximizing Y R Y^T.
+    The matrix R is negative semidefinite with rows that sum to zero,
+    so the constant vector is excluded and the first index is fixed at 1.
+    Indices are assigned in a fixed order, and for a partial assignment
+    the criterion splits into the assigned part, a part that is linear
+    in the unassigned elements with coefficients h,
+    and the criterion of the unassigned elements alone.
+    The bound adds the absolute values of h and a bound
+    on the unassigned criterion that depends only on the depth.
+    Assigning one more index changes h by one row of R,
+    so each node of the search takes O(n) time.
+    The last few indices are enumerated together with one matrix product.
+    """
+
+    def __init__(self, R, order):
+        """
+        @param R: negative one half of a Laplacian as a numpy array
+        @param order: the order in which indices are assigned
+        """
+        self.order = np.array(order)
+        self.R = np.array(R, dtype=float)[np.ix_(self.order, self.order)]
+        n = len(self.R)
+        # Bound the criterion restricted to each suffix of indices
+        # using the largest eigenvalue and using the absolute values.
+        absolute = np.abs(self.R)
+        self.suffix_bounds = np.zeros(n + 1)
+        for k in range(1, n):
+            X = self.R[k:, k:]
+            m = n - k
+            eigenvalue_bound = m * scipy.linalg.eigvalsh(X)[-1]
+            offdiag = np.sum(np.abs(X)) - np.sum(np.abs(np.diag(X)))
+            absolute_bound = np.trace(X) + offdiag
+            self.suffix_bounds[k] = min(0, eigenvalue_bound, absolute_bound)
+        self.tol = 1e-9 * (1 + np.max(absolute))
+        # Enumerate the last few indices all at once.
+        # The rows of the sign matrix are the assignments of the leaf block,
+        # the first row has all positive signs,
+        # and the quadratic part of the criterion of each row
+        # does not depend on the assigned indices.
+        self.leaf_size = min(g_leaf_block_size, n - 1)
+        k = n - self.leaf_size
+        m = self.leaf_size
+        codes = np.arange(2**m)[:, np.newaxis] >> np.arange(m)
+        self.leaf_signs = 1.0 - 2.0 * (codes & 1)
+        S = self.leaf_signs
+        self.leaf_quadratic = np.sum(np.dot(S, self.R[k:, k:]) * S, axis=1)
+
+    def get_prefix_state(self, prefix):
+        """
+        @param prefix: the signs of the first indices in the search order
+        @return: the criterion of the prefix and the coefficients h
+        """
+        d = len(prefix)
+        y = np.array(prefix, dtype=float)
+        value = np.dot(y, np.dot(self.R[:d, :d], y))
+        h = 2 * np.dot(y, self.R[:d])
+        return value, h
+
+    def search_prefix(self, prefix, shared_best, lock):
+        """
+        Search the assignments that extend the prefix.
+        @param prefix: the signs of the first indices in the search order
+        @param shared_best: an object whose value is the best criterion so far
+        @param lock: a lock for updating the best criterion
+        @return: None or a better criterion and its Y vector in input order
+        """
+        R = self.R
+        n = len(R)
+        y = np.zeros(n)
+        y[:len(prefix)] = prefix
+        value, h = self.get_prefix_state(prefix)
+        found = []
+        leaf_k = n - self.leaf_size
+        def search(k, value, all_plus):
+            if k == leaf_k:
+                values = value + np.dot(self.leaf_signs, h[k:])
+                values += self.leaf_quadratic
+                if all_plus:
+                    values[0] = -np.inf
+                i = values.argmax()
+                if values[i] > shared_best.value + self.tol:
+                    with lock:
+                        if values[i] > shared_best.value:
+                            shared_best.value = values[i]
+                    y[k:] = self.leaf_signs[i]
+                    found.append((values[i], y.copy()))
+                return
+            bound = value + np.abs(h[k:]).sum() + self.suffix_bounds[k]
+            if bound <= shared_best.value + self.tol:
+                return
+            # try the sign that agrees with the linear term first
+            first_sign = 1.0 if h[k] >= 0 else -1.0
+            # only the coefficients of the unassigned indices are updated
+            for sign in (first_sign, -first_sign):
+                y[k] = sign
+                next_value = value + sign*h[k] + R[k, k]
+                row = (2 * sign) * R[k, k+1:]
+                h[k+1:] += row
+                search(k+1, next_value, all_plus and sign > 0)
+                h[k+1:] -= row
+        search(len(prefix), value, all(x > 0 for x in prefix))
+        if not found:
+            return None
+        best_value, best_y = max(found, key=lambda pair: pair[0])
+        Y = np.empty(n)
+        Y[self.order] = best_y
+        return best_value, Y
+
+    def gen_prefixes(self, depth):
+        """
+        @param depth: the length of the prefixes
+        @return: the sign prefixes starting with 1
+        """
+        for i in range(2**(depth-1)):
+            yield (1,) + tuple(
+                    (-1 if (i >> j) & 1 else 1) for j in range(depth-1))
+
+
+# These globals are set in each worker process by the pool initializer.
+g_search = None
+g_shared_best = None
+g_lock = None
+
+def _init_worker(search, shared_best, lock):
+    global g_search
+    global g_shared_best
+    global g_lock
+    g_search = search
+    g_shared_best = shared_best
+    g_lock = lock
+
+def _search_prefix(prefix):
+    return g_search.search_prefix(prefix, g_shared_best, g_lock)
+
+def get_exact_assignment(R, incumbent=None, nprocesses=1, depth=None):
+    """
+    Find the Y vector maximizing the exact criterion by branch and bound.
+    The result is the same as that of checking every Y from gen_assignments.
+    @param R: negative one half of a Laplacian as a numpy array
+    @param incumbent: None or a Y vector that is a good initial guess
+    @param nprocesses: the number of processes or None for the number of cpus
+    @param depth: the length of the prefixes defining the parallel subtrees
+    @return: the best criterion value and a Y vector with elements in {1, -1}
+    """
+    R = np.array(R, dtype=float)
+    n = len(R)
+    if n < 2:
+        raise ValueError('n must be at least two')
+    if nprocesses is None:
+        nprocesses = multiprocessing.cpu_count()
+    # assign first the indices that the spectral guess is most sure about
+    if incumbent is None:
+        order = range(n)
+    else:
+        v = get_fiedler_eigenvector(-R)
+        order = list(np.argsort(-np.abs(v), kind='mergesort'))
+    search = BipartitionSearch(R, order)
+    best_value = -np.inf
+    best_Y = None
+    if incumbent is not None and len(set(incumbent)) == 2:
+        best_Y = np.array(incumbent, dtype=float)
+        best_value = get_exact_criterion(R, best_Y)
+    shared_best = multiprocessing.RawValue('d', best_value)
+    lock = multiprocessing.Lock()
+    if nprocesses == 1:
+        results = [search.search_prefix((1,), shared_best, lock)]
+    else:
+        if depth is None:
+            depth = int(np.ceil(np.log2(nprocesses))) + 4
+        depth = max(1, min(depth, n - search.leaf_size))
+        pool = multiprocessing.Pool(
+                nprocesses, _init_worker, (search, shared_best, lock))
+        try:
+            results = list(pool.imap_unordered(
+                _search_prefix, search.gen_prefixes(depth)))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    for result in results:
+        if result is not None and result[0] > best_value:
+            best_value, best_Y = result
+    return best_value, best_Y
+
+
 class DistanceMatrixSplitter:
 
     def get_complexity(self, n):
@@ -171,18 +388,14 @@ class UnnormalizedSpectralSignCutDMS(DistanceMatrixSplitter):
         # The fiedler eigenvector is calculated for the laplacian matrix associated with the distance matrix.
         # The signs of the elements of the fiedler eigenvector determine group assignment.
         L = Euclid.edm_to_laplacian(np.array(D))
-        w, v = scipy.linalg.eigh(L)
-        eigenvalue_info = list(sorted((abs(x), i) for i, x in enumerate(w)))
-        stationary_eigenvector_index = eigenvalue_info[0][1]
-        fiedler_eigenvector_index = eigenvalue_info[1][1]
-        fiedler_eigenvector = v.T[fiedler_eigenvector_index]
+        fiedler_eigenvector = get_fiedler_eigenvector(L)
         index_selection = set(i for i, value in enumerate(fiedler_eigenvector) if value > 0)
         return index_selection
 
 
 class AffinityMinCutDMS(DistanceMatrixSplitter):
     """
-    This method may fail if the laplacian matrix has a positive off-diagonal element.
+    This method fails if the laplacian matrix has a positive off-diagonal element.
     """
 
     def get_complexity(self, n):
@@ -199,11 +412,14 @@ class AffinityMinCutDMS(DistanceMatrixSplitter):
         """
         # Get the selection corresponding to the min cut of the affinity matrix associated with the distance matrix.
         # Note that the negative off diagonals of the laplacian matrix form the affinity matrix.
-        #L = Euclid.edm_to_laplacian(np.array(D))
-        #index_selection = stoer_wagner_min_cut((-L).tolist())
-        #return index_selection
-        #TODO use brute force instead of the stoer wagner cut
-        raise NotImplementedError()
+        L = Euclid.edm_to_laplacian(np.array(D))
+        A = -0.5 * (L + L.T)
+        np.fill_diagonal(A, 0)
+        # allow negative affinities only at the level of rounding error
+        if np.any(A < -1e-10 * np.max(np.abs(A))):
+            raise ValueError('the laplacian matrix has a positive off-diagonal element')
+        A[A < 0] = 0
+        return StoerWagner.stoer_wagner_min_cut(A)
 
 
 class NeighborJoiningDMS(DistanceMatrixSplitter):
@@ -263,16 +479,13 @@ class StoneExactDMS(DistanceMatrixSplitter):
         """
         n = len(distance_matrix)
         R = get_R_balaji(distance_matrix)
+        # the spectral sign cut is the initial guess of the branch and bound
+        fiedler_eigenvector = get_fiedler_eigenvector(-R)
+        incumbent = [(1 if value > 0 else -1) for value in fiedler_eigenvector]
+        nprocesses = None if n >= g_parallel_min_order else 1
         # find the best Y vector, where each element of Y is one or negative one
-        best_value_vector_pair = None
-        for assignment in gen_assignments(n):
-            Y = np.array(assignment)
-            value = get_exact_criterion(R, Y)
-            value_vector_pair = (value, Y)
-            if (best_value_vector_pair is None) or (value_vector_pair[0] > best_value_vector_pair[0]):
-                best_value_vector_pair = value_vector_pair
+        best_value, best_vector = get_exact_assignment(R, incumbent, nprocesses)
         # get the index set associated with the best vector
-        best_value, best_vector = best_value_vector_pair
         index_selection = set(i for i, element in enumerate(best_vector) if element > 0)
         return index_selection
 
@@ -294,11 +507,8 @@ class StoneSpectralSignDMS(DistanceMatrixSplitter):
         n = len(distance_matrix)
         R = get_R_balaji(distance_matrix)
         # The signs of the elements of the fiedler eigenvector determine group assignment.
-        w, v = scipy.linalg.eigh(R)
-        eigenvalue_info = list(sorted((abs(x), i) for i, x in enumerate(w)))
-        stationary_eigenvector_index = eigenvalue_info[0][1]
-        fiedler_eigenvector_index = eigenvalue_info[1][1]
-        fiedler_eigenvector = v.T[fiedler_eigenvector_index]
+        # R is negative one half of a Laplacian.
+        fiedler_eigenvector = get_fiedler_eigenvector(-R)
         index_selection = set(i for i, value in enumerate(fiedler_eigenvector) if value > 0)
         return index_selection
 
@@ -319,11 +529,7 @@ class StoneSpectralThresholdDMS(DistanceMatrixSplitter):
         n = len(distance_matrix)
         R = get_R_balaji(distance_matrix)
         # define the Fiedler eigenvector
-        w, v = scipy.linalg.eigh(R)
-        eigenvalue_info = list(sorted((abs(x), i) for i, x in enumerate(w)))
-        stationary_eigenvector_index = eigenvalue_info[0][1]
-        fiedler_eigenvector_index = eigenvalue_info[1][1]
-        fiedler_eigenvector = v.T[fiedler_eigenvector_index]
+        fiedler_eigenvector = get_fiedler_eigenvector(-R)
         # find the bipartition defined by the best cut of the fiedler eigenvector
         element_index_pairs = [(element, i) for i, element in enumerate(fiedler_eigenvector)]
         sorted_indices = [i for element, i in sorted(element_index_pairs)]
@@ -347,6 +553,55 @@ class StoneSpectralThresholdDMS(DistanceMatrixSplitter):
 
 
 
+def _get_enumerated_assignment(R):
+    """
+    This is the exhaustive search previously used by StoneExactDMS.
+    @param R: negative one half of a Laplacian as a numpy array
+    @return: the best criterion value and a Y vector with elements in {1, -1}
+    """
+    best_value_vector_pair = None
+    for assignment in gen_assignments(len(R)):
+        Y = np.array(assignment)
+        value = get_exact_criterion(R, Y)
+        if (best_value_vector_pair is None) or (value > best_value_vector_pair[0]):
+            best_value_vector_pair = (value, Y)
+    return best_value_vector_pair
+
+def benchmark(sizes, naxes=None, seed=0):
+    """
+    Time the enumeration and the branch and bound search
+    on squared distances between random points.
+    @param sizes: the numbers of points
+    @param naxes: the dimension of the points or None for the number of points
+    @param seed: random seed
+    """
+    rs = np.random.RandomState(seed)
+    print 'n', 'enumeration', 'serial', 'parallel', 'criterion'
+    for n in sizes:
+        X = rs.randn(n, n if naxes is None else naxes)
+        D = np.sum((X[:, np.newaxis] - X[np.newaxis, :])**2, axis=2)
+        R = get_R_balaji(D)
+        v = get_fiedler_eigenvector(-R)
+        incumbent = [(1 if x > 0 else -1) for x in v]
+        row = [n]
+        if n <= 16:
+            tm = time.time()
+            _get_enumerated_assignment(R)
+            row.append('%.3f' % (time.time() - tm))
+        else:
+            row.append('-')
+        tm = time.time()
+        value, Y = get_exact_assignment(R, incumbent, 1)
+        row.append('%.3f' % (time.time() - tm))
+        tm = time.time()
+        parallel_value, Y = get_exact_assignment(R, incumbent, None)
+        row.append('%.3f' % (time.time() - tm))
+        if not np.allclose(value, parallel_value):
+            raise ValueError('the serial and parallel criteria differ')
+        row.append(value)
+        print '\t'.join(str(x) for x in row)
+
+
 class TestClustering(unittest.TestCase):
 
     def test_pseudoinverse_a(self):
@@ -403,7 +658,60 @@ class TestClustering(unittest.TestCase):
         if spectral_value > best_exact_value:
             self.fail('the spectral approximation should be no better than the exact criterion')
 
+    def test_exact_assignment(self):
+        """
+        Compare the branch and bound search to the enumeration.
+        """
+        rs = np.random.RandomState(0)
+        for n in (2, 3, 7, 14):
+            X = rs.randn(n, 3)
+            D = np.sum((X[:, np.newaxis] - X[np.newaxis, :])**2, axis=2)
+            R = get_R_balaji(D)
+            expected, expected_Y = _get_enumerated_assignment(R)
+            for incumbent in (None, [1]*(n-1) + [-1]):
+                for nprocesses in (1, 2):
+                    value, Y = get_exact_assignment(R, incumbent, nprocesses)
+                    self.assertTrue(np.allclose(value, expected))
+                    self.assertTrue(np.allclose(get_exact_criterion(R, Y), value))
+                    self.assertEqual(len(set(Y)), 2)
+        # the splitter agrees with the enumeration
+        R = get_R_balaji(g_lior)
+        best_value, best_Y = _get_enumerated_assignment(R)
+        selection = StoneExactDMS().get_selection(g_lior)
+        Y = np.array([(1 if i in selection else -1) for i in range(len(g_lior))])
+        self.assertTrue(np.allclose(get_exact_criterion(R, Y), best_value))
+
+    def test_affinity_min_cut(self):
+        """
+        The min cut separates the two clades of the tree.
+        """
+        selection = AffinityMinCutDMS().get_selection(g_lior)
+        self.assertTrue(selection in (set([0, 2, 3, 4]), set([1, 5, 6, 7])))
+
+    def test_large_fiedler_eigenvector(self):
+        """
+        Large Laplacians use a partial eigensolver.
+        """
+        np.random.seed(0)
+        n = EigUtil.g_partial_min_order + 50
+        X = np.random.rand(n, n)
+        A = X + X.T
+        L = np.diag(np.sum(A, axis=1)) - A
+        w, v = scipy.linalg.eigh(L)
+        expected = v.T[1]
+        observed = get_fiedler_eigenvector(L)
+        self.assertTrue(np.allclose(abs(np.dot(expected, observed)), 1))
+        observed = get_fiedler_eigenvector(-0.5 * L)
+        self.assertTrue(np.allclose(abs(np.dot(expected, observed)), 1))
+
 
 if __name__ == '__main__':
-    suite = unittest.TestLoader().loadTestsFromTestCase(TestClustering)
-    unittest.TextTestRunner(verbosity=2).run(suite)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmark', action='store_true',
+            help='time the exact bipartition searches')
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark([8, 12, 16, 20, 24, 28])
+    else:
+        suite = unittest.TestLoader().loadTestsFromTestCase(TestClustering)
+        unittest.TextTestRunner(verbosity=2).run(suite)
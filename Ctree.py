@@ -0,0 +1,483 @@
+"""
+A compiled tree is an immutable array representation of a rooted tree.
+
+Vertices are integer indices in a depth first preorder.
+So the root is vertex zero, each parent precedes its children,
+the reversed preorder is a postorder,
+and the vertices of each subtree form a contiguous range of indices.
+The parent of each vertex is stored in an integer array,
+and children are stored in compressed sparse row form.
+Branch lengths are stored in a float64 array indexed by the child vertex,
+where the root and branches without lengths have the value nan.
+Names are stored in a side table.
+Converters to and from the Ftree topologies and the FelTree
+and Newick tree objects let algorithms run over arrays
+instead of over sets of edges or graphs of objects.
+"""
+
+import unittest
+
+import numpy as np
+
+import NewickIO
+import FelTree
+import Newick
+
+
+class CtreeError(Exception): pass
+
+
+def _get_argmin_table(values):
+    """
+    This is a helper function for range minimum queries.
+    Row k of the table gives the index of the minimum value
+    in the window of length 2^k starting at each index.
+    @param values: a one dimensional numpy array
+    @return: a two dimensional numpy array of indices
+    """
+    n = len(values)
+    rows = [np.arange(n)]
+    width = 1
+    while 2*width <= n:
+        prev = rows[-1]
+        a = prev[:n - 2*width + 1]
+        b = prev[width:n - width + 1]
+        row = np.where(values[a] <= values[b], a, b)
+        rows.append(np.hstack([row, prev[len(row):]]))
+        width *= 2
+    return np.vstack(rows)
+
+
+class Ctree:
+    """
+    The arrays of this object should not be modified.
+    """
+
+    def __init__(self, parents, blens=None, names=None):
+        """
+        @param parents: parent indices in depth first preorder with -1 for the root
+        @param blens: branch lengths to the parents or None
+        @param names: a name for each vertex or None
+        """
+        self.parents = np.array(parents, dtype=int)
+        n = len(self.parents)
+        if not n:
+            raise CtreeError('the tree has no vertices')
+        if blens is None:
+            self.blens = np.empty(n)
+            self.blens.fill(np.nan)
+        else:
+            self.blens = np.array(blens, dtype=float)
+        self.blens[0] = np.nan
+        if names is None:
+            self.names = [None] * n
+        else:
+            self.names = list(names)
+        if len(self.blens) != n or len(self.names) != n:
+            raise CtreeError('the arrays have different lengths')
+        if self.parents[0] != -1:
+            raise CtreeError('the first vertex should be the root')
+        if np.any(self.parents[1:] < 0):
+            raise CtreeError('the tree has more than one root')
+        if np.any(self.parents[1:] >= np.arange(1, n)):
+            raise CtreeError('each parent should precede its children')
+        # Children are in increasing order because they follow the preorder.
+        counts = np.bincount(self.parents[1:], minlength=n)
+        self.child_offsets = np.hstack([[0], np.cumsum(counts)])
+        self.children = np.arange(1, n)[np.argsort(self.parents[1:], kind='mergesort')]
+        # get the end of the index range of each subtree
+        sizes = [1] * n
+        parents = self.parents.tolist()
+        for v in range(n-1, 0, -1):
+            sizes[parents[v]] += sizes[v]
+        self.subtree_stops = np.arange(n) + np.array(sizes)
+        # check that the order is depth first
+        expected_starts = self.subtree_stops[self.children[:-1]]
+        first_children = self.parents[self.children[1:]] + 1
+        is_first = (self.parents[self.children[1:]] != self.parents[self.children[:-1]])
+        expected_starts = np.where(is_first, first_children, expected_starts)
+        if n > 1 and (self.children[0] != 1 or
+                np.any(expected_starts != self.children[1:])):
+            raise CtreeError('the vertex order should be a depth first preorder')
+        self.preorder = np.arange(n)
+        self.postorder = self.preorder[::-1]
+        self._root_distances = None
+        self._levels = None
+
+    def get_nvertices(self):
+        return len(self.parents)
+
+    def get_children(self, v):
+        """
+        @param v: a vertex index
+        @return: a numpy array view of the child indices
+        """
+        return self.children[self.child_offsets[v]:self.child_offsets[v+1]]
+
+    def get_child_counts(self):
+        return np.diff(self.child_offsets)
+
+    def get_tips(self):
+        """
+        @return: the indices of vertices without children
+        """
+        return np.flatnonzero(self.get_child_counts() == 0)
+
+    def get_internal_vertices(self):
+        """
+        @return: the indices of vertices with children
+        """
+        return np.flatnonzero(self.get_child_counts())
+
+    def get_subtree(self, v):
+        """
+        @param v: a vertex index
+        @return: the indices of v and its descendants
+        """
+        return np.arange(v, self.subtree_stops[v])
+
+    def get_name_to_index(self):
+        """
+        @return: a map from each name to its vertex index
+        """
+        return dict((name, i) for i, name in enumerate(self.names)
+                if name is not None)
+
+    def get_levels(self):
+        """
+        @return: the number of branches between each vertex and the root
+        """
+        if self._levels is None:
+            levels = [0] * len(self.parents)
+            parents = self.parents.tolist()
+            for v in range(1, len(parents)):
+                levels[v] = levels[parents[v]] + 1
+            self._levels = np.array(levels, dtype=int)
+        return self._levels
+
+    def get_root_distances(self):
+        """
+        @return: the sum of branch lengths between each vertex and the root
+        """
+        if self._root_distances is None:
+            depths = [0.0] * len(self.parents)
+            parents = self.parents.tolist()
+            blens = self.blens.tolist()
+            for v in range(1, len(parents)):
+                depths[v] = depths[parents[v]] + blens[v]
+            self._root_distances = np.array(depths)
+        return self._root_distances
+
+    def get_distance_matrix(self, indices=None, block_size=1<<20):
+        """
+        Get the matrix of path lengths among the given vertices.
+        The distance between two vertices is the sum of their root distances
+        minus twice the root distance of their lowest common ancestor.
+        In a depth first preorder, the lowest common ancestor of two vertices
+        is the parent of the shallowest vertex in the interval between them,
+        so ancestors are found by vectorized range minimum queries.
+        @param indices: ordered vertex indices or None for all vertices
+        @param block_size: the number of vertex pairs per vectorized block
+        @return: a distance matrix
+        """
+        n = len(self.parents)
+        if indices is None:
+            indices = self.preorder
+        indices = np.asarray(indices, dtype=int)
+        depths = self.get_root_distances()
+        levels = self.get_levels()
+        table = _get_argmin_table(levels)
+        log2 = np.zeros(n + 1, dtype=int)
+        for k in range(2, n + 1):
+            log2[k] = log2[k // 2] + 1
+        N = len(indices)
+        D = np.zeros((N, N))
+        nrows = max(1, block_size // max(1, N))
+        for start in range(0, N, nrows):
+            stop = min(N, start + nrows)
+            rows = indices[start:stop, np.newaxis]
+            cols = indices[np.newaxis, :]
+            lo = np.minimum(rows, cols) + 1
+            hi = np.maximum(rows, cols)
+            same = (lo > hi)
+            lo[same] = hi[same]
+            k = log2[hi - lo + 1]
+            a = table[k, lo]
+            b = table[k, hi - (1 << k) + 1]
+            shallowest = np.where(levels[a] <= levels[b], a, b)
+            ancestors = self.parents[shallowest]
+            ancestors[same] = hi[same]
+            D[start:stop] = depths[rows] + depths[cols] - 2*depths[ancestors]
+        return D
+
+    def to_RB(self):
+        """
+        The names are used as the vertices.
+        @return: a directed topology and branch lengths
+        """
+        if len(set(self.names)) != len(self.names) or None in self.names:
+            raise CtreeError('each vertex needs a distinct name')
+        R = set()
+        B = {}
+        for v in range(1, len(self.parents)):
+            a, b = self.names[self.parents[v]], self.names[v]
+            R.add((a, b))
+            if not np.isnan(self.blens[v]):
+                B[frozenset([a, b])] = float(self.blens[v])
+        return R, B
+
+    def to_TB(self):
+        """
+        The names are used as the vertices.
+        @return: an undirected topology and branch lengths
+        """
+        R, B = self.to_RB()
+        return set(frozenset(e) for e in R), B
+
+    def to_RBN(self):
+        """
+        The vertex indices are used as the vertices.
+        @return: a directed topology, branch lengths, and a map from vertex to name
+        """
+        R = set()
+        B = {}
+        for v in range(1, len(self.parents)):
+            p = int(self.parents[v])
+            R.add((p, v))
+            if not np.isnan(self.blens[v]):
+                B[frozenset([p, v])] = float(self.blens[v])
+        N = dict((v, name) for v, name in enumerate(self.names)
+                if name is not None)
+        return R, B, N
+
+    def to_tree(self, tree_factory):
+        """
+        Build a tree object using the calls of the NewickIO parser.
+        @param tree_factory: a tree class like FelTree.NewickTree or Newick.NewickTree
+        @return: a tree object
+        """
+        tree = tree_factory()
+        nodes = []
+        for v in range(len(self.parents)):
+            node = tree.NodeFactory()
+            name = self.names[v]
+            if name is not None:
+                node.add_name(name)
+            p = self.parents[v]
+            if p >= 0:
+                parent = nodes[p]
+                parent.add_child(node)
+                node.set_parent(parent)
+                if not np.isnan(self.blens[v]):
+                    node.set_branch_length(float(self.blens[v]))
+            nodes.append(node)
+        tree.set_root(nodes[0])
+        return tree
+
+
+def _from_children(root, v_to_children, v_to_blen, v_to_name):
+    """
+    This is a helper function that visits vertices in depth first preorder.
+    @param root: the root vertex
+    @param v_to_children: a function that gives the ordered children of a vertex
+    @param v_to_blen: a function that gives the branch length above a vertex or None
+    @param v_to_name: a function that gives the name of a vertex or None
+    @return: a compiled tree
+    """
+    parents = []
+    blens = []
+    names = []
+    stack = [(root, -1)]
+    while stack:
+        v, parent = stack.pop()
+        index = len(parents)
+        parents.append(parent)
+        blen = v_to_blen(v) if parent >= 0 else None
+        blens.append(np.nan if blen is None else blen)
+        names.append(v_to_name(v))
+        for child in reversed(v_to_children(v)):
+            stack.append((child, index))
+    return Ctree(parents, blens, names)
+
+def _sorted_if_possible(vertices):
+    """
+    This is a helper function to make the vertex order reproducible.
+    """
+    try:
+        return sorted(vertices)
+    except TypeError:
+        return list(vertices)
+
+def from_RB(R, B=None, root=None):
+    """
+    The vertices become the names.
+    @param R: a directed topology
+    @param B: branch lengths or None
+    @param root: the root vertex, by default the vertex with no source
+    @return: a compiled tree
+    """
+    v_to_sinks = {}
+    v_to_source = {}
+    for a, b in R:
+        v_to_sinks.setdefault(a, []).append(b)
+        v_to_source[b] = a
+    if root is None:
+        roots = set(v_to_sinks) - set(v_to_source)
+        if len(roots) != 1:
+            raise CtreeError('the directed topology should have one root')
+        root, = roots
+    B = B or {}
+    return _from_children(root,
+            lambda v: _sorted_if_possible(v_to_sinks.get(v, ())),
+            lambda v: B.get(frozenset([v, v_to_source[v]])),
+            lambda v: v)
+
+def from_TB(T, B=None, root=None):
+    """
+    The vertices become the names.
+    The default root is the vertex chosen by Ftree.T_to_root.
+    @param T: an undirected topology
+    @param B: branch lengths or None
+    @param root: the root vertex or None
+    @return: a compiled tree
+    """
+    v_to_neighbors = {}
+    for edge in T:
+        a, b = edge
+        v_to_neighbors.setdefault(a, []).append(b)
+        v_to_neighbors.setdefault(b, []).append(a)
+    if root is None:
+        pairs = [(-len(adj), v) for v, adj in v_to_neighbors.items()]
+        best_neg_deg, root = min(pairs)
+    v_to_source = {root : None}
+    def v_to_children(v):
+        children = [x for x in v_to_neighbors.get(v, ()) if x != v_to_source[v]]
+        for child in children:
+            v_to_source[child] = v
+        return _sorted_if_possible(children)
+    B = B or {}
+    return _from_children(root, v_to_children,
+            lambda v: B.get(frozenset([v, v_to_source[v]])),
+            lambda v: v)
+
+def from_RBN(R, B, N):
+    """
+    This reads the FtreeIO representation.
+    The vertices are discarded and the names are kept.
+    @param R: a directed topology
+    @param B: branch lengths
+    @param N: a map from a vertex to a name
+    @return: a compiled tree
+    """
+    ctree = from_RB(R, B)
+    return Ctree(ctree.parents, ctree.blens, [N.get(v) for v in ctree.names])
+
+def from_tree(tree):
+    """
+    This reads FelTree and Newick tree objects.
+    @param tree: a tree object
+    @return: a compiled tree
+    """
+    return _from_children(tree.get_root(),
+            lambda node: list(node.gen_children()),
+            lambda node: node.get_branch_length(),
+            lambda node: node.get_name())
+
+class _NewickBuilder:
+    """
+    This implements the simplified NewickIO API.
+    """
+    def __init__(self):
+        self.v_to_children = []
+        self.v_to_blen = []
+        self.v_to_name = []
+        self.root = None
+    def create_root(self):
+        self.v_to_children.append([])
+        self.v_to_blen.append(None)
+        self.v_to_name.append(None)
+        return len(self.v_to_children) - 1
+    def add_child(self, parent, v):
+        self.v_to_children[parent].append(v)
+    def set_branch_length(self, v, blen):
+        self.v_to_blen[v] = blen
+    def set_name(self, v, name):
+        self.v_to_name[v] = name
+    def set_root(self, v):
+        self.root = v
+    def finish(self):
+        pass
+
+def from_newick(s):
+    """
+    @param s: a newick string
+    @return: a compiled tree
+    """
+    builder = NewickIO.parse_simple(s, _NewickBuilder())
+    return _from_children(builder.root,
+            builder.v_to_children.__getitem__,
+            builder.v_to_blen.__getitem__,
+            builder.v_to_name.__getitem__)
+
+
+class TestCtree(unittest.TestCase):
+
+    def setUp(self):
+        self.newick = '((a:1, b:2)x:3, c:4, (d:5, (e:6, f:7)y:8)z:9)r;'
+
+    def test_structure(self):
+        ctree = from_newick(self.newick)
+        self.assertEqual(ctree.names, list('rxabczdyef'))
+        self.assertEqual(ctree.parents.tolist(), [-1, 0, 1, 1, 0, 0, 5, 5, 7, 7])
+        self.assertEqual(ctree.get_children(0).tolist(), [1, 4, 5])
+        self.assertEqual(ctree.get_subtree(5).tolist(), [5, 6, 7, 8, 9])
+        self.assertEqual([ctree.names[v] for v in ctree.get_tips()], list('abcdef'))
+        self.assertEqual(ctree.get_levels().tolist(), [0, 1, 2, 2, 1, 1, 2, 2, 3, 3])
+        self.assertTrue(np.isnan(ctree.blens[0]))
+        self.assertEqual(ctree.blens[1:].tolist(), [3, 1, 2, 4, 9, 5, 8, 6, 7])
+
+    def test_invalid_order(self):
+        # this is a breadth first order
+        self.assertRaises(CtreeError, Ctree, [-1, 0, 0, 1, 1, 2])
+        self.assertRaises(CtreeError, Ctree, [-1, 0, -1])
+        self.assertRaises(CtreeError, Ctree, [-1, 2, 0])
+
+    def test_distance_matrix(self):
+        ctree = from_newick(self.newick)
+        tips = ctree.get_tips()
+        D = ctree.get_distance_matrix(tips)
+        name_to_index = dict((ctree.names[v], i) for i, v in enumerate(tips))
+        self.assertEqual(D[name_to_index['a'], name_to_index['b']], 3)
+        self.assertEqual(D[name_to_index['a'], name_to_index['f']], 1+3+9+8+7)
+        self.assertEqual(D[name_to_index['e'], name_to_index['f']], 13)
+        self.assertEqual(D[name_to_index['c'], name_to_index['c']], 0)
+        self.assertTrue(np.allclose(D, ctree.get_distance_matrix(tips, 3)))
+
+    def test_tree_round_trip(self):
+        for tree_factory in (FelTree.NewickTree, Newick.NewickTree):
+            tree = NewickIO.parse(self.newick, tree_factory)
+            ctree = from_tree(tree)
+            self.assertEqual(ctree.names, list('rxabczdyef'))
+            tree = ctree.to_tree(tree_factory)
+            ctree_b = from_tree(tree)
+            self.assertEqual(ctree.names, ctree_b.names)
+            self.assertEqual(ctree.parents.tolist(), ctree_b.parents.tolist())
+            self.assertTrue(np.allclose(ctree.blens[1:], ctree_b.blens[1:]))
+
+    def test_ftree_round_trip(self):
+        # the children of Ftree vertices are put in sorted order
+        ctree = from_newick(self.newick)
+        R, B = ctree.to_RB()
+        ctree_b = from_RB(R, B)
+        self.assertEqual(ctree_b.names, list('rcxabzdyef'))
+        self.assertEqual(ctree_b.to_RB(), (R, B))
+        T, B = ctree.to_TB()
+        ctree_c = from_TB(T, B, 'r')
+        self.assertEqual(ctree_c.to_RB(), (R, B))
+        R, B, N = ctree.to_RBN()
+        ctree_d = from_RBN(R, B, N)
+        self.assertEqual(ctree_d.names, ctree.names)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -25,16 +25,27 @@ def random_split(D):
     right = frozenset(range(n)) - left
     return frozenset([left, right])
 
-def spectral_split(D):
+def _spectral_split_and_vector(D, v0=None):
     """
+    This is a helper function.
     @param D: numpy distance matrix
-    @return: a split of the indices of the distance matrix
+    @param v0: an optional guess of the eigenvector
+    @return: a split of the indices of the distance matrix and the eigenvector
     """
-    v = BuildTreeTopology.edm_to_fiedler(D)
+    v = BuildTreeTopology.edm_to_fiedler(D, v0)
     split = BuildTreeTopology.eigenvector_to_split(v)
     # if one side of the split is empty then there is a failure
     if frozenset() in split:
         raise ValueError('failed split')
+    return split, v
+
+def spectral_split(D, v0=None):
+    """
+    @param D: numpy distance matrix
+    @param v0: an optional guess of the eigenvector
+    @return: a split of the indices of the distance matrix
+    """
+    split, v = _spectral_split_and_vector(D, v0)
     return split
 
 def get_hierarchy(D, split_function, labels, nlevel_limit=None):
@@ -71,6 +82,45 @@ def get_hierarchy(D, split_function, labels, nlevel_limit=None):
         sides.append(get_hierarchy(D_next, split_function, labels_next, next_nlevel_limit))
     return frozenset(sides)
 
+def get_spectral_hierarchy(D, labels, nlevel_limit=None, v0=None):
+    """
+    This is like get_hierarchy with the spectral split function.
+    The eigenvector of each split restricted to a side of the split
+    is the starting guess for the eigenvector of that side.
+    @param D: numpy distance matrix
+    @param labels: an ordered list of labels
+    @param nlevel_limit: the depth to which the indices should be split
+    @param v0: an optional guess of the first eigenvector
+    @return: a nested frozenset of indices of the original distance matrix
+    """
+    # sanity check
+    if len(D) != len(labels):
+        raise ValueError
+    # if labels cannot be split further then stop
+    if len(labels) == 1:
+        return labels[0]
+    # if we have reached the requested depth then stop
+    if nlevel_limit == 0:
+        return frozenset(labels)
+    # if there are only two labels then there can be only one split
+    if len(labels) == 2:
+        alpha, beta = labels
+        return frozenset([frozenset([alpha]), frozenset([beta])])
+    # get the next split limit
+    next_nlevel_limit = None if nlevel_limit is None else nlevel_limit - 1
+    # do the split
+    index_split, v = _spectral_split_and_vector(D, v0)
+    # get each side of the split recursively
+    sides = []
+    for index_set in index_split:
+        indices = list(sorted(index_set))
+        D_next = MatrixUtil.get_principal_submatrix(D, indices)
+        labels_next = [labels[i] for i in indices]
+        v_next = [v[i] for i in indices]
+        sides.append(get_spectral_hierarchy(
+            D_next, labels_next, next_nlevel_limit, v_next))
+    return frozenset(sides)
+
 def _build_clusters(hierarchy, clusters):
     """
     This is a helper function.
@@ -163,6 +213,26 @@ class TestDendrogram(unittest.TestCase):
             frozenset([frozenset([200, 400, 500]), frozenset([300, 100])])])
         self.assertEqual(expected_nontrivial_splits, observed_nontrivial_splits)
 
+    def test_large_spectral_hierarchy(self):
+        """
+        Large matrices use a partial eigensolver with warm starts.
+        """
+        np.random.seed(0)
+        centers = np.array([[0, 0], [0, 10], [40, 0], [40, 10]])
+        npoints = 60
+        X = np.vstack([c + np.random.randn(npoints, 2) for c in centers])
+        D = np.sum((X[:, np.newaxis, :] - X[np.newaxis, :, :])**2, axis=2)
+        labels = range(len(D))
+        expected = get_hierarchy(D, spectral_split, labels, 2)
+        observed = get_spectral_hierarchy(D, labels, 2)
+        self.assertEqual(expected, observed)
+        # the second level of the hierarchy recovers the clusters
+        clusters = [frozenset(range(i*npoints, (i+1)*npoints)) for i in range(4)]
+        expected_hierarchy = frozenset([
+            frozenset([clusters[0], clusters[1]]),
+            frozenset([clusters[2], clusters[3]])])
+        self.assertEqual(expected_hierarchy, observed)
+
 
 if __name__ == '__main__':
     unittest.main()
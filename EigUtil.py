@@ -4,9 +4,26 @@ This module is unnecessary because the linalg module of the scipy package
 already does more intelligent things with eigendecomposition than numpy does.
 """
 
+import unittest
+
 import numpy as np
 import scipy
 from scipy import linalg
+from scipy import sparse
+from scipy.sparse import linalg as splinalg
+
+# Dense matrices smaller than this are given to the dense solver.
+g_partial_min_order = 200
+
+# Relative tolerance of the Lanczos iterations.
+g_partial_tol = 1e-12
+
+# The Laplacian is shifted by this fraction of its mean diagonal
+# so that its null space does not make the shifted matrix singular.
+g_laplacian_shift = 1e-6
+
+
+class PartialEighError(Exception): pass
 
 def eigh(M):
     """
@@ -49,3 +66,163 @@ def principal_eigh(M):
     W, VT = scipy.linalg.eigh(M)
     return W[-1], VT.T[-1]
 
+def _get_start_vector(v0, n):
+    """
+    @param v0: None or a guess of the eigenvector
+    @param n: the order of the matrix
+    @return: None or a float vector usable as an ARPACK starting vector
+    """
+    if v0 is None:
+        return None
+    v = np.array(v0, dtype=float)
+    if v.shape != (n,) or not np.any(v):
+        return None
+    return v
+
+def principal_eigh_partial(M, v0=None):
+    """
+    Get the principal eigenpair without the full eigendecomposition.
+    Only the one eigenpair is computed, by Lanczos iterations,
+    so the cost is dominated by a few matrix vector products.
+    Small dense matrices and failures to converge
+    fall back to the dense solver.
+    @param M: a symmetric numpy 2D array, sparse matrix, or linear operator
+    @param v0: an optional guess of the eigenvector, for example from a related matrix
+    @return: principal eigenvalue and eigenvector
+    """
+    if isinstance(M, list):
+        M = np.array(M, dtype=float)
+    n = M.shape[0]
+    is_dense = isinstance(M, np.ndarray)
+    if n < 3 or (is_dense and n < g_partial_min_order):
+        if sparse.issparse(M):
+            M = M.toarray()
+        return principal_eigh(M)
+    v0 = _get_start_vector(v0, n)
+    try:
+        W, V = splinalg.eigsh(M, k=1, which='LA', v0=v0, tol=g_partial_tol)
+    except splinalg.ArpackNoConvergence:
+        if sparse.issparse(M):
+            M = M.toarray()
+        elif not is_dense:
+            M = M.matmat(np.eye(n))
+        return principal_eigh(M)
+    return W[0], V[:, 0]
+
+def laplacian_fiedler_partial(L, v0=None):
+    """
+    Get the second smallest eigenpair of a Laplacian matrix.
+    The matrix should be positive semidefinite
+    with the constant vector in its null space.
+    Only the one eigenpair is computed,
+    by Lanczos iterations on the inverse of the slightly shifted Laplacian
+    restricted to the space orthogonal to the constant vector.
+    Dense matrices are factored by Cholesky decomposition
+    and sparse matrices by sparse LU decomposition.
+    A PartialEighError is raised when the dense solver should be used
+    because the matrix is small, is not a Laplacian, or is indefinite;
+    this lets each caller keep its own eigenvalue ordering conventions.
+    @param L: a symmetric numpy 2D array or scipy sparse matrix
+    @param v0: an optional guess of the eigenvector, for example from a related matrix
+    @return: the Fiedler eigenvalue and eigenvector
+    """
+    is_sparse = sparse.issparse(L)
+    if not is_sparse:
+        L = np.asarray(L, dtype=float)
+    n = L.shape[0]
+    if n < 3 or (not is_sparse and n < g_partial_min_order):
+        raise PartialEighError('the matrix is small')
+    diagonal = L.diagonal()
+    scale = np.mean(np.abs(diagonal))
+    if not scale:
+        raise PartialEighError('the matrix has a zero diagonal')
+    row_sums = np.asarray(L.sum(axis=1)).ravel()
+    if np.max(np.abs(row_sums)) > 1e-8 * scale * n:
+        raise PartialEighError('the rows of the matrix do not sum to zero')
+    shift = -g_laplacian_shift * scale
+    if is_sparse:
+        L_shifted = (L - shift * sparse.identity(n)).tocsc()
+        try:
+            solve = splinalg.factorized(L_shifted)
+        except RuntimeError:
+            raise PartialEighError('the shifted matrix is singular')
+    else:
+        L_shifted = L.copy()
+        L_shifted.flat[::n+1] -= shift
+        try:
+            cho = linalg.cho_factor(L_shifted)
+        except np.linalg.LinAlgError:
+            raise PartialEighError('the matrix is indefinite')
+        solve = lambda x: linalg.cho_solve(cho, x)
+    def matvec(x):
+        x = np.ravel(x)
+        y = solve(x - np.mean(x))
+        return y - np.mean(y)
+    op = splinalg.LinearOperator((n, n), matvec=matvec, dtype=float)
+    v0 = _get_start_vector(v0, n)
+    if v0 is not None:
+        v0 -= np.mean(v0)
+        if not np.any(v0):
+            v0 = None
+    try:
+        W, V = splinalg.eigsh(op, k=1, which='LA', v0=v0, tol=g_partial_tol)
+    except splinalg.ArpackNoConvergence:
+        raise PartialEighError('the Lanczos iterations did not converge')
+    if W[0] <= 0:
+        raise PartialEighError('the matrix is indefinite')
+    return shift + 1.0 / W[0], V[:, 0]
+
+
+class TestEigUtil(unittest.TestCase):
+
+    def _get_tree_laplacian(self, n):
+        """
+        Get the weighted Laplacian of a random tree.
+        @param n: the number of vertices
+        @return: a dense Laplacian matrix
+        """
+        np.random.seed(0)
+        L = np.zeros((n, n))
+        for i in range(1, n):
+            j = np.random.randint(i)
+            w = np.random.rand() + 0.5
+            L[i, j] -= w
+            L[j, i] -= w
+            L[i, i] += w
+            L[j, j] += w
+        return L
+
+    def test_principal_eigh_partial(self):
+        np.random.seed(0)
+        n = g_partial_min_order + 50
+        X = np.random.randn(n, n)
+        M = np.dot(X, X.T)
+        w_dense, v_dense = principal_eigh(M)
+        w, v = principal_eigh_partial(M)
+        self.assertTrue(np.allclose(w, w_dense))
+        self.assertTrue(np.allclose(abs(np.dot(v, v_dense)), 1))
+        w, v = principal_eigh_partial(M, v_dense)
+        self.assertTrue(np.allclose(abs(np.dot(v, v_dense)), 1))
+
+    def test_laplacian_fiedler_partial(self):
+        n = g_partial_min_order + 50
+        L = self._get_tree_laplacian(n)
+        W, VT = linalg.eigh(L)
+        for M in (L, sparse.csr_matrix(L)):
+            w, v = laplacian_fiedler_partial(M)
+            self.assertTrue(np.allclose(w, W[1]))
+            self.assertTrue(np.allclose(abs(np.dot(v, VT.T[1])), 1))
+
+    def test_laplacian_fiedler_partial_fallback(self):
+        L = self._get_tree_laplacian(g_partial_min_order + 50)
+        L_small = self._get_tree_laplacian(10)
+        self.assertRaises(PartialEighError,
+                laplacian_fiedler_partial, L_small)
+        self.assertRaises(PartialEighError,
+                laplacian_fiedler_partial, L + np.eye(len(L)))
+        self.assertRaises(PartialEighError,
+                laplacian_fiedler_partial, -L)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,6 +4,9 @@ Use a C extension module to do fast tree layout.
 
 import unittest
 from optparse import OptionParser
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
 
 import SpatialTree
 import EqualArcLayout
@@ -12,22 +15,40 @@ import day
 class LayoutError(Exception): pass
 
 
-def _build_dtree(dtree, node, count):
+def _equalize(tree, min_neighbor_count, iteration_count, tolerance):
     """
-    @param dtree: an object that lives in my C extension
-    @param node: like a SpatialNode
-    @param count: the number of nodes added so far
+    Equalize the daylight of each node with enough neighbors.
+    The C extension does all of the iterations without the interpreter lock.
+    @param tree: something like a SpatialTree with an initial layout
+    @param min_neighbor_count: equalize nodes with more neighbors than this
+    @param iteration_count: the maximum number of equalizing iterations
+    @param tolerance: stop when no subtree turns by more than this many radians
     """
-    x, y = node.location
-    node.dtree_id = count
-    count += 1
-    dtree.begin_node(node.dtree_id)
-    dtree.set_x(x)
-    dtree.set_y(y)
-    for child in node.children:
-        count = _build_dtree(dtree, child, count)
-    dtree.end_node()
-    return count
+    # the extension node ids are the preorder indices
+    # and the children keep their order
+    nodes = []
+    stack = [tree.root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(reversed(node.children))
+    node_to_id = dict((id(node), i) for i, node in enumerate(nodes))
+    parents = [node_to_id[id(node.parent)] if node.parent else -1
+            for node in nodes]
+    xs, ys = zip(*[node.location for node in nodes])
+    dtree = day.Day()
+    dtree.build(parents, xs, ys)
+    # repeatedly reroot and equalize
+    ids = [node_to_id[id(node)] for node in tree.breadth_first()
+            if get_neighbor_count(node) > min_neighbor_count]
+    try:
+        dtree.equalize_all(ids, iteration_count, tolerance)
+    except RuntimeError as e:
+        raise LayoutError(e)
+    # extract the x and y coordinates from the parallel tree
+    locations = np.fromstring(dtree.get_coordinates(), dtype=float)
+    for node, (x, y) in zip(nodes, locations.reshape((-1, 2)).tolist()):
+        node.location = (x, y)
 
 def get_neighbor_count(node):
     neighbor_count = len(node.children)
@@ -40,6 +61,7 @@ class StraightBranchLayout:
 
     def __init__(self):
         self.iteration_count = 3
+        self.tolerance = 0.0
 
     def set_iteration_count(self, iteration_count):
         """
@@ -47,37 +69,33 @@ class StraightBranchLayout:
         """
         self.iteration_count = iteration_count
 
+    def set_tolerance(self, tolerance):
+        """
+        Stop early when the layout has converged.
+        @param tolerance: the largest subtree rotation in radians at convergence
+        """
+        self.tolerance = tolerance
+
     def do_layout(self, tree):
         """
         @param tree: something like a SpatialTree
         """
         # create the initial layout
         EqualArcLayout.do_layout(tree)
-        # use sax-like events to create a parallel tree in the C extension
-        dtree = day.Day()
-        count = _build_dtree(dtree, tree.root, 0)
-        # repeatedly reroot and equalize
-        for iteration in range(self.iteration_count):
-            for node in tree.breadth_first():
-                neighbor_count = len(node.children)
-                if node.parent:
-                    neighbor_count += 1
-                if neighbor_count > 2:
-                    dtree.select_node(node.dtree_id)
-                    dtree.reroot()
-                    try:
-                        dtree.equalize()
-                    except RuntimeError as e:
-                        raise LayoutError(e)
-        # extract the x and y coordinates from the parallel tree
-        for node in tree.preorder():
-            dtree.select_node(node.dtree_id)
-            x = dtree.get_x()
-            y = dtree.get_y()
-            node.location = (x, y)
-        # take off the silly dtree_id members
-        for node in tree.preorder():
-            del node.dtree_id
+        # equalize the nodes with more than two neighbors
+        _equalize(tree, 2, self.iteration_count, self.tolerance)
+
+    def do_layouts(self, trees, nthreads=None):
+        """
+        Lay out the trees concurrently.
+        @param trees: a sequence of things like SpatialTrees
+        @param nthreads: the number of threads or None for the number of cpus
+        """
+        pool = ThreadPool(nthreads)
+        try:
+            pool.map(self.do_layout, trees)
+        finally:
+            pool.close()
 
 
 class CurvedBranchLayout:
@@ -119,24 +137,8 @@ class CurvedBranchLayout:
         iteration = 0
         while True:
             print 'progressive iteration', iteration+1
-            # write the extension tree
-            dtree = day.Day()
-            _build_dtree(dtree, tree.root, 0)
             # equalize the layout
-            for node in tree.breadth_first():
-                if get_neighbor_count(node) > 1:
-                    dtree.select_node(node.dtree_id)
-                    dtree.reroot()
-                    try:
-                        dtree.equalize()
-                    except RuntimeError as e:
-                        raise LayoutError(e)
-            # read the extension tree
-            for node in tree.preorder():
-                dtree.select_node(node.dtree_id)
-                x = dtree.get_x()
-                y = dtree.get_y()
-                node.location = (x, y)
+            _equalize(tree, 1, 1, 0.0)
             # break the branches
             old_nodes = list(tree.preorder())
             for node in old_nodes:
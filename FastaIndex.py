@@ -0,0 +1,582 @@
+"""
+Random access to the records of large fasta files.
+
+An index is built in a single streaming pass over the fasta file.
+It is written in the five column format used by samtools faidx,
+so each row gives the name of a record,
+the number of residues in the record,
+the byte offset of the first residue,
+the number of residues per line,
+and the number of bytes per line including the line terminator.
+Records and subsequences are then read by seeking into
+a memory map of the original file.
+Block gzip compressed (bgzip) files are also supported;
+as in samtools the offsets then refer to the uncompressed stream,
+and a table of compressed block boundaries is used for seeking.
+"""
+
+from StringIO import StringIO
+import unittest
+import tempfile
+import shutil
+import bisect
+import struct
+import mmap
+import gzip
+import zlib
+import sys
+import os
+
+
+class FastaIndexError(Exception): pass
+
+
+# the magic prefix of a gzip member with extra fields
+g_bgzf_magic = '\x1f\x8b\x08\x04'
+
+# the fixed part of a bgzf block header
+g_bgzf_header_size = 18
+
+# the empty block that terminates a bgzf file
+g_bgzf_eof = (
+        '\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43'
+        '\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+# bgzf blocks hold at most 64KB of uncompressed data
+g_bgzf_block_size = 0xff00
+
+
+class IndexEntry:
+
+    def __init__(self, name, length, offset, line_bases, line_width):
+        """
+        @param name: the first word of the fasta header
+        @param length: the number of residues in the record
+        @param offset: the byte offset of the first residue
+        @param line_bases: the number of residues per full line
+        @param line_width: the number of bytes per full line
+        """
+        self.name = name
+        self.length = length
+        self.offset = offset
+        self.line_bases = line_bases
+        self.line_width = line_width
+
+    def get_byte_offset(self, position):
+        """
+        @param position: a residue position within the record
+        @return: the byte offset of the residue within the file
+        """
+        if not self.line_bases:
+            return self.offset
+        nlines, remainder = divmod(position, self.line_bases)
+        return self.offset + nlines * self.line_width + remainder
+
+    def get_stop_offset(self):
+        """
+        This assumes that the last line has the usual line terminator.
+        @return: one past the byte offset of the end of the last line
+        """
+        if not self.line_bases:
+            return self.offset
+        nlines, remainder = divmod(self.length, self.line_bases)
+        stop = self.offset + nlines * self.line_width
+        if remainder:
+            stop += remainder + self.line_width - self.line_bases
+        return stop
+
+    def to_line(self):
+        """
+        @return: a row of a faidx style index file
+        """
+        return '\t'.join(str(x) for x in (self.name, self.length,
+            self.offset, self.line_bases, self.line_width))
+
+
+def line_to_entry(line):
+    """
+    @param line: a row of a faidx style index file
+    @return: an IndexEntry
+    """
+    values = line.rstrip('\r\n').split('\t')
+    if len(values) != 5:
+        raise FastaIndexError('expected five columns in each index row')
+    name = values[0]
+    try:
+        length, offset, line_bases, line_width = [int(x) for x in values[1:]]
+    except ValueError as e:
+        raise FastaIndexError('expected integers in the index row of ' + name)
+    return IndexEntry(name, length, offset, line_bases, line_width)
+
+
+class _EntryBuilder:
+    """
+    Accumulate the sequence lines of a single record.
+    """
+
+    def __init__(self, name, offset):
+        self.name = name
+        self.offset = offset
+        self.length = 0
+        self.line_bases = 0
+        self.line_width = 0
+        self.short_line_seen = False
+        self.blank_line_seen = False
+
+    def add_line(self, line):
+        stripped = line.rstrip('\r\n')
+        if not stripped.strip():
+            self.blank_line_seen = True
+            return
+        if self.blank_line_seen or self.short_line_seen:
+            raise FastaIndexError(
+                    'the sequence lines of %s '
+                    'have irregular lengths' % self.name)
+        nbases = len(stripped)
+        if not self.line_bases:
+            self.line_bases = nbases
+            self.line_width = len(line)
+        elif nbases > self.line_bases:
+            raise FastaIndexError(
+                    'the sequence lines of %s '
+                    'have irregular lengths' % self.name)
+        elif nbases < self.line_bases or len(line) != self.line_width:
+            self.short_line_seen = True
+        self.length += nbases
+
+    def get_entry(self):
+        return IndexEntry(self.name, self.length, self.offset,
+                self.line_bases, self.line_width)
+
+
+def gen_index_entries(fin):
+    """
+    Read the fasta file in one streaming pass.
+    Yield (header offset, header line, index entry) triples.
+    The header line is stripped of the leading '>' and trailing whitespace.
+    @param fin: a fasta file opened in binary mode
+    """
+    position = 0
+    builder = None
+    header_info = None
+    names = set()
+    for line in fin:
+        if line.startswith('>'):
+            if builder is not None:
+                yield header_info + (builder.get_entry(),)
+            header_line = line[1:].rstrip()
+            words = header_line.split()
+            if not words:
+                raise FastaIndexError('each sequence should have a header')
+            name = words[0]
+            if name in names:
+                raise FastaIndexError('duplicate sequence name: ' + name)
+            names.add(name)
+            header_info = (position, header_line)
+            builder = _EntryBuilder(name, position + len(line))
+        elif builder is not None:
+            builder.add_line(line)
+        elif line.strip():
+            raise FastaIndexError('expected a header before the first sequence')
+        position += len(line)
+    if builder is not None:
+        yield header_info + (builder.get_entry(),)
+
+def get_index_pathname(fasta_pathname):
+    """
+    @param fasta_pathname: the path to a fasta file
+    @return: the path to its conventional faidx style index
+    """
+    return fasta_pathname + '.fai'
+
+def read_index(fin):
+    """
+    @param fin: an open faidx style index file
+    @return: a list of index entries
+    """
+    return [line_to_entry(line) for line in fin if line.strip()]
+
+def write_index(entries, fout):
+    """
+    @param entries: a sequence of index entries
+    @param fout: an open file
+    """
+    for entry in entries:
+        print >> fout, entry.to_line()
+
+def is_bgzf(pathname):
+    """
+    @param pathname: the path to a possibly compressed file
+    @return: True if the file starts with a bgzf block header
+    """
+    with open(pathname, 'rb') as fin:
+        header = fin.read(g_bgzf_header_size)
+    return header.startswith(g_bgzf_magic) and header[12:14] == 'BC'
+
+def open_stream(pathname):
+    """
+    This is for the streaming indexing pass.
+    @param pathname: the path to a plain or bgzf compressed file
+    @return: a file-like object over the uncompressed bytes
+    """
+    if is_bgzf(pathname):
+        return gzip.GzipFile(pathname, 'rb')
+    return open(pathname, 'rb')
+
+def build_index(fasta_pathname):
+    """
+    @param fasta_pathname: the path to a plain or bgzf compressed fasta file
+    @return: a list of index entries
+    """
+    fin = open_stream(fasta_pathname)
+    try:
+        return [entry for offset, header, entry in gen_index_entries(fin)]
+    finally:
+        fin.close()
+
+def write_bgzf(fin, fout, block_size=g_bgzf_block_size):
+    """
+    Compress a stream into the block gzip format read by this module.
+    @param fin: an open file to compress
+    @param fout: an open binary file
+    @param block_size: the number of uncompressed bytes per block
+    """
+    while True:
+        data = fin.read(block_size)
+        if not data:
+            break
+        compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+        cdata = compressor.compress(data) + compressor.flush()
+        bsize = g_bgzf_header_size + len(cdata) + 8
+        header = g_bgzf_magic + struct.pack('<IBBHBBHH',
+                0, 0, 0xff, 6, ord('B'), ord('C'), 2, bsize - 1)
+        crc = zlib.crc32(data) & 0xffffffff
+        fout.write(header + cdata + struct.pack('<II', crc, len(data)))
+    fout.write(g_bgzf_eof)
+
+
+class PlainReader:
+    """
+    Read byte ranges of an uncompressed file through a memory map.
+    """
+
+    def __init__(self, pathname):
+        self.fin = open(pathname, 'rb')
+        if os.path.getsize(pathname):
+            self.data = mmap.mmap(
+                    self.fin.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = ''
+
+    def read(self, start, stop):
+        return self.data[start:stop]
+
+    def close(self):
+        if self.data:
+            self.data.close()
+        self.fin.close()
+
+
+class BgzfReader:
+    """
+    Read byte ranges of the uncompressed stream of a bgzf file.
+    Only the blocks overlapping a requested range are decompressed.
+    """
+
+    def __init__(self, pathname):
+        self.fin = open(pathname, 'rb')
+        self.coffsets = []
+        self.csizes = []
+        self.uoffsets = []
+        self.cached_block_index = None
+        self.cached_block = None
+        self._read_block_table()
+
+    def _read_block_table(self):
+        coffset = 0
+        uoffset = 0
+        while True:
+            self.fin.seek(coffset)
+            header = self.fin.read(g_bgzf_header_size)
+            if not header:
+                break
+            if len(header) < g_bgzf_header_size:
+                raise FastaIndexError('truncated bgzf block header')
+            if not header.startswith(g_bgzf_magic) or header[12:14] != 'BC':
+                raise FastaIndexError('expected a bgzf block header')
+            bsize = struct.unpack('<H', header[16:18])[0] + 1
+            self.fin.seek(coffset + bsize - 4)
+            isize = struct.unpack('<I', self.fin.read(4))[0]
+            if isize:
+                self.coffsets.append(coffset)
+                self.csizes.append(bsize)
+                self.uoffsets.append(uoffset)
+            coffset += bsize
+            uoffset += isize
+        self.uoffsets.append(uoffset)
+
+    def _get_block(self, block_index):
+        if block_index != self.cached_block_index:
+            self.fin.seek(self.coffsets[block_index])
+            raw = self.fin.read(self.csizes[block_index])
+            self.cached_block = zlib.decompress(raw, 16 + zlib.MAX_WBITS)
+            self.cached_block_index = block_index
+        return self.cached_block
+
+    def read(self, start, stop):
+        stop = min(stop, self.uoffsets[-1])
+        if start >= stop:
+            return ''
+        arr = []
+        i = bisect.bisect_right(self.uoffsets, start) - 1
+        while i < len(self.uoffsets) - 1 and self.uoffsets[i] < stop:
+            block = self._get_block(i)
+            base = self.uoffsets[i]
+            arr.append(block[max(start - base, 0):stop - base])
+            i += 1
+        return ''.join(arr)
+
+    def close(self):
+        self.fin.close()
+
+
+def open_reader(pathname):
+    """
+    @param pathname: the path to a plain or bgzf compressed file
+    @return: a PlainReader or a BgzfReader
+    """
+    if is_bgzf(pathname):
+        return BgzfReader(pathname)
+    return PlainReader(pathname)
+
+
+class IndexedFasta:
+    """
+    Random access to the records of a plain or bgzf compressed fasta file.
+    """
+
+    def __init__(self, fasta_pathname, index_pathname=None):
+        """
+        If the index file does not exist then it is built and written.
+        @param fasta_pathname: the path to the fasta file
+        @param index_pathname: the path to the faidx style index file
+        """
+        if index_pathname is None:
+            index_pathname = get_index_pathname(fasta_pathname)
+        if os.path.exists(index_pathname):
+            with open(index_pathname) as fin:
+                entries = read_index(fin)
+        else:
+            entries = build_index(fasta_pathname)
+            # the index can still be used if it cannot be saved
+            try:
+                with open(index_pathname, 'w') as fout:
+                    write_index(entries, fout)
+            except IOError as e:
+                print >> sys.stderr, 'could not write the fasta index %s: %s' % (
+                        index_pathname, e)
+        self.entries = entries
+        self.name_to_entry = dict((entry.name, entry) for entry in entries)
+        self.reader = open_reader(fasta_pathname)
+
+    def __contains__(self, name):
+        return name in self.name_to_entry
+
+    def get_names(self):
+        """
+        @return: the record names in file order
+        """
+        return [entry.name for entry in self.entries]
+
+    def get_length(self, name):
+        return self._get_entry(name).length
+
+    def _get_entry(self, name):
+        try:
+            return self.name_to_entry[name]
+        except KeyError as e:
+            raise FastaIndexError('no sequence is named ' + name)
+
+    def read_bytes(self, start, stop):
+        """
+        @param start: the first uncompressed byte offset
+        @param stop: one past the last uncompressed byte offset
+        @return: the raw bytes including headers and line terminators
+        """
+        return self.reader.read(start, stop)
+
+    def get_subsequence(self, name, start, stop):
+        """
+        The interval is zero-based and half open.
+        @param name: the name of the record
+        @param start: the first residue position
+        @param stop: one past the last residue position
+        @return: the residues as a string
+        """
+        entry = self._get_entry(name)
+        start = max(start, 0)
+        stop = min(stop, entry.length)
+        if start >= stop:
+            return ''
+        raw = self.reader.read(
+                entry.get_byte_offset(start), entry.get_byte_offset(stop))
+        sequence = raw.translate(None, '\r\n')
+        if len(sequence) != stop - start:
+            raise FastaIndexError(
+                    'the index does not match the fasta file at ' + name)
+        return sequence
+
+    def get_sequence(self, name):
+        """
+        @param name: the name of the record
+        @return: the residues of the whole record
+        """
+        return self.get_subsequence(name, 0, self.get_length(name))
+
+    def gen_header_sequence_pairs(self):
+        """
+        Yield (name, sequence) pairs in file order.
+        """
+        for entry in self.entries:
+            yield entry.name, self.get_sequence(entry.name)
+
+    def close(self):
+        self.reader.close()
+
+
+g_test_fasta = '\n'.join([
+    '>first some description',
+    'ACGTACGTAC',
+    'GTACGTACGT',
+    'ACG',
+    '>second',
+    'TTTTGGGGCC',
+    'AA',
+    '',
+    '>empty',
+    '>third',
+    'MKVLLA']) + '\n'
+
+
+class TestFastaIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pathname = os.path.join(self.directory, 'test.fa')
+        with open(self.pathname, 'wb') as fout:
+            fout.write(g_test_fasta)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_index_entries(self):
+        entries = build_index(self.pathname)
+        observed = [entry.to_line() for entry in entries]
+        expected = [
+                'first\t23\t24\t10\t11',
+                'second\t12\t58\t10\t11',
+                'empty\t0\t80\t0\t0',
+                'third\t6\t87\t6\t7']
+        self.assertEqual(observed, expected)
+
+    def test_index_round_trip(self):
+        entries = build_index(self.pathname)
+        fout = StringIO()
+        write_index(entries, fout)
+        observed = read_index(StringIO(fout.getvalue()))
+        expected = [entry.to_line() for entry in entries]
+        self.assertEqual([entry.to_line() for entry in observed], expected)
+
+    def test_header_offsets(self):
+        with open(self.pathname, 'rb') as fin:
+            triples = list(gen_index_entries(fin))
+        for offset, header, entry in triples:
+            self.assertEqual(g_test_fasta[offset:].split('\n')[0], '>' + header)
+
+    def test_unwritable_index(self):
+        index_pathname = os.path.join(self.directory, 'missing', 'test.fa.fai')
+        old_stderr = sys.stderr
+        sys.stderr = StringIO()
+        try:
+            fasta = IndexedFasta(self.pathname, index_pathname)
+            message = sys.stderr.getvalue()
+        finally:
+            sys.stderr = old_stderr
+        self.assertTrue(message.startswith('could not write the fasta index'))
+        self.assertEqual(fasta.get_sequence('third'), 'MKVLLA')
+        fasta.close()
+
+    def test_stop_offsets(self):
+        entries = build_index(self.pathname)
+        observed = [entry.get_stop_offset() for entry in entries]
+        self.assertEqual(observed, [50, 72, 80, 94])
+
+    def test_sequences(self):
+        fasta = IndexedFasta(self.pathname)
+        self.assertTrue(os.path.exists(get_index_pathname(self.pathname)))
+        self.assertEqual(fasta.get_names(),
+                ['first', 'second', 'empty', 'third'])
+        self.assertEqual(fasta.get_sequence('first'), 'ACGTACGTACGTACGTACGTACG')
+        self.assertEqual(fasta.get_sequence('second'), 'TTTTGGGGCCAA')
+        self.assertEqual(fasta.get_sequence('empty'), '')
+        self.assertEqual(fasta.get_sequence('third'), 'MKVLLA')
+        fasta.close()
+
+    def test_subsequences(self):
+        fasta = IndexedFasta(self.pathname)
+        sequence = fasta.get_sequence('first')
+        for start in range(len(sequence) + 1):
+            for stop in range(start, len(sequence) + 2):
+                observed = fasta.get_subsequence('first', start, stop)
+                self.assertEqual(observed, sequence[start:stop])
+        fasta.close()
+
+    def test_bgzf(self):
+        bgzf_pathname = self.pathname + '.gz'
+        with open(self.pathname, 'rb') as fin:
+            with open(bgzf_pathname, 'wb') as fout:
+                write_bgzf(fin, fout, block_size=16)
+        self.assertTrue(is_bgzf(bgzf_pathname))
+        self.assertFalse(is_bgzf(self.pathname))
+        plain = IndexedFasta(self.pathname)
+        compressed = IndexedFasta(bgzf_pathname)
+        self.assertEqual(
+                list(plain.gen_header_sequence_pairs()),
+                list(compressed.gen_header_sequence_pairs()))
+        self.assertEqual(
+                compressed.get_subsequence('first', 5, 17),
+                plain.get_subsequence('first', 5, 17))
+        self.assertEqual(
+                compressed.read_bytes(0, len(g_test_fasta)), g_test_fasta)
+        plain.close()
+        compressed.close()
+
+    def test_irregular_lines(self):
+        lines = ['>bad', 'ACG', 'ACGTAC', 'A']
+        fin = StringIO('\n'.join(lines) + '\n')
+        self.assertRaises(FastaIndexError, list, gen_index_entries(fin))
+
+    def test_duplicate_names(self):
+        lines = ['>dup', 'ACGT', '>dup', 'ACGT']
+        fin = StringIO('\n'.join(lines) + '\n')
+        self.assertRaises(FastaIndexError, list, gen_index_entries(fin))
+
+
+def main(args):
+    for pathname in args:
+        entries = build_index(pathname)
+        with open(get_index_pathname(pathname), 'w') as fout:
+            write_index(entries, fout)
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+    parser = OptionParser()
+    parser.add_option('--test', action='store_true', dest='test', default=False)
+    options, args = parser.parse_args()
+    if options.test:
+        suite = unittest.TestLoader().loadTestsFromTestCase(TestFastaIndex)
+        unittest.TextTestRunner(verbosity=2).run(suite)
+    else:
+        main(args)
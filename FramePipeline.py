@@ -0,0 +1,157 @@
+"""
+Compute and render animation frames in a pool of processes.
+
+Each frame is a function of some state shared by all of the frames
+and of some per-frame arguments like the animation progress.
+The shared state, for example a distance matrix or a tree layout,
+is computed once and is sent once to each worker process
+instead of once per frame.
+The frames are yielded and written in order.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import multiprocessing
+import unittest
+
+import Progress
+
+class FramePipelineError(Exception): pass
+
+
+# These globals are set in each worker process by the pool initializer.
+g_frame_function = None
+g_shared = None
+
+def _init_worker(frame_function, shared):
+    global g_frame_function
+    global g_shared
+    g_frame_function = frame_function
+    g_shared = shared
+
+def _call_worker(args):
+    return g_frame_function(g_shared, *args)
+
+def get_frame_filename(frame_index, image_format):
+    """
+    This is the name expected by ffmpeg with the pattern frame-%04d.
+    @param frame_index: the index of the frame
+    @param image_format: the image extension
+    @return: a filename
+    """
+    return 'frame-%04d.%s' % (frame_index, image_format)
+
+def gen_frames(frame_function, shared, args_list, nprocesses=None):
+    """
+    The frame function must be defined at the top level of a module
+    so that it can be pickled.
+    @param frame_function: called as frame_function(shared, *args)
+    @param shared: state shared by all of the frames
+    @param args_list: a sequence of per-frame argument tuples
+    @param nprocesses: the number of processes or None for the number of cpus
+    @return: a generator of frames in the order of the arguments
+    """
+    if nprocesses == 1:
+        for args in args_list:
+            yield frame_function(shared, *args)
+        return
+    pool = multiprocessing.Pool(
+            nprocesses, _init_worker, (frame_function, shared))
+    try:
+        for frame in pool.imap(_call_worker, args_list):
+            yield frame
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def write_frames(frame_function, shared, args_list,
+        output_directory, image_format, nprocesses=None, show_progress=True):
+    """
+    Write image strings to numbered files in an existing directory.
+    @param frame_function: returns an image string
+    @param shared: state shared by all of the frames
+    @param args_list: a sequence of per-frame argument tuples
+    @param output_directory: write the image files here
+    @param image_format: the image extension
+    @param nprocesses: the number of processes or None for the number of cpus
+    @param show_progress: True to show a progress bar
+    @return: the list of image pathnames
+    """
+    args_list = list(args_list)
+    pbar = Progress.Bar(len(args_list)) if show_progress else None
+    pathnames = []
+    frames = gen_frames(frame_function, shared, args_list, nprocesses)
+    for frame_index, image_string in enumerate(frames):
+        image_filename = get_frame_filename(frame_index, image_format)
+        image_pathname = os.path.join(output_directory, image_filename)
+        with open(image_pathname, 'wb') as fout:
+            fout.write(image_string)
+        pathnames.append(image_pathname)
+        if pbar:
+            pbar.update(frame_index+1)
+    if pbar:
+        pbar.finish()
+    return pathnames
+
+def encode_animation(output_directory, image_format, animation_pathname,
+        fps=25):
+    """
+    Use ffmpeg to encode the numbered frames as an animation.
+    The animation format, for example gif or mpg,
+    is given by the extension of the animation pathname.
+    @param output_directory: the directory with the numbered image files
+    @param image_format: the image extension
+    @param animation_pathname: write the animation here
+    @param fps: frames per second
+    """
+    pattern = os.path.join(output_directory, 'frame-%04d.' + image_format)
+    cmd = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-r', str(fps), '-i', pattern, animation_pathname]
+    try:
+        p = subprocess.Popen(cmd,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as e:
+        raise FramePipelineError('failed to run ffmpeg: %s' % e)
+    out, err = p.communicate()
+    if p.returncode:
+        raise FramePipelineError('ffmpeg failed: %s' % err.strip())
+
+
+def _get_test_frame(shared, frame_index):
+    prefix, suffix = shared
+    return '%s%d%s' % (prefix, frame_index, suffix)
+
+class TestFramePipeline(unittest.TestCase):
+
+    def test_gen_frames(self):
+        shared = ('frame ', '\n')
+        args_list = [(i,) for i in range(20)]
+        expected = [_get_test_frame(shared, *args) for args in args_list]
+        for nprocesses in (1, 3):
+            observed = list(gen_frames(
+                _get_test_frame, shared, args_list, nprocesses))
+            self.assertEqual(expected, observed)
+
+    def test_write_frames(self):
+        shared = ('frame ', '\n')
+        args_list = [(i,) for i in range(12)]
+        output_directory = tempfile.mkdtemp()
+        try:
+            pathnames = write_frames(_get_test_frame, shared, args_list,
+                    output_directory, 'txt', 2, False)
+            self.assertEqual(len(pathnames), 12)
+            for i, pathname in enumerate(pathnames):
+                self.assertEqual(os.path.basename(pathname),
+                        get_frame_filename(i, 'txt'))
+                with open(pathname) as fin:
+                    self.assertEqual(fin.read(), 'frame %d\n' % i)
+        finally:
+            shutil.rmtree(output_directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
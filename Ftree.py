@@ -28,6 +28,7 @@ import numpy as np
 import scipy.linalg
 
 import MatrixUtil
+import Ctree
 
 
 # In this section we define helper functions.
@@ -160,41 +161,23 @@ def R_to_subtree_preorder(R, r):
     return arr
 
 
-def RB_to_D(R, B, vertices):
+def RB_to_D(R, B, vertices, block_size=1<<20):
     """
     Get the matrix of distances among the given vertices.
+    The distances are computed by the compiled tree representation
+    using lowest common ancestors.
     @param R: a directed topology
     @param B: branch lengths
     @param vertices: ordered vertices
+    @param block_size: the number of vertex pairs per vectorized block
     @return: distance matrix
     """
-    v_to_source = R_to_v_to_source(R)
-    # An intermediate representation is
-    # a dense map from an edge to a distance.
-    visited = set()
-    edge_to_distance = {}
-    for v in R_to_preorder(R):
-        if v in v_to_source:
-            parent = v_to_source[v]
-            excess = B[mkedge(v, parent)]
-            edge_to_distance[mkedge(v, parent)] = excess
-            for n in visited:
-                if n != parent:
-                    distance = edge_to_distance[mkedge(parent, n)] + excess
-                    edge_to_distance[mkedge(v,n)] = distance
-        visited.add(v)
-    # Convert this intermediate representation
-    # to the requested distance matrix.
-    N = len(vertices)
-    v_to_index = invseq(vertices)
-    D = np.zeros((N, N))
-    for (a, b), d in edge_to_distance.items():
-        if (a in v_to_index) and (b in v_to_index):
-            i = v_to_index[a]
-            j = v_to_index[b]
-            D[i,j] = d
-            D[j,i] = d
-    return D
+    # a missing branch length is a KeyError
+    B = dict((mkedge(a, b), B[mkedge(a, b)]) for a, b in R)
+    ctree = Ctree.from_RB(R, B, R_to_root(R))
+    v_to_index = invseq(ctree.names)
+    indices = [v_to_index[v] for v in vertices]
+    return ctree.get_distance_matrix(indices, block_size)
 
 
 # In this section we define functions on undirected trees.
@@ -305,15 +288,17 @@ def TB_to_L_block(T, B, row_vertices, col_vertices):
     """
     L_part = np.zeros((len(row_vertices), len(col_vertices)))
     v_to_degree = TB_to_v_to_degree(T, B)
-    for i, v_row in enumerate(row_vertices):
-        for j, v_col in enumerate(col_vertices):
-            if v_row == v_col:
-                L_part[i, j] = v_to_degree[v_row]
-            else:
-                edge = mkedge(v_row, v_col)
-                if edge in B:
-                    w = 1.0 / B[edge]
-                    L_part[i, j] = -w
+    row_to_index = invseq(row_vertices)
+    col_to_index = invseq(col_vertices)
+    for i, v in enumerate(row_vertices):
+        if v in col_to_index:
+            L_part[i, col_to_index[v]] = v_to_degree[v]
+    for edge, blen in B.items():
+        w = 1.0 / blen
+        a, b = edge
+        for v_row, v_col in ((a, b), (b, a)):
+            if v_row in row_to_index and v_col in col_to_index:
+                L_part[row_to_index[v_row], col_to_index[v_col]] = -w
     return L_part
 
 def TB_to_L_principal(T, B, vertices):
@@ -339,6 +324,71 @@ def TB_to_G(T, B, vertices):
     HDH = MatrixUtil.double_centered(D)
     return -0.5 * HDH
 
+def _TB_to_schur_system(T, B, vertices):
+    """
+    This is a helper function.
+    Let the subscript a denote the kept vertices
+    and let the subscript b denote the removed vertices.
+    The removed vertices induce a forest,
+    so Gaussian elimination of Lbb in postorder creates no fill
+    and the solution X of Lbb X = Lba takes time linear in the number
+    of removed vertices per kept vertex.
+    @param T: topology
+    @param B: branch lengths
+    @param vertices: ordered kept vertices
+    @return: the Schur complement, the removed vertices, and X
+    """
+    removed = sorted(set(T_to_order(T)) - set(vertices))
+    a_to_index = invseq(vertices)
+    b_to_index = invseq(removed)
+    v_to_degree = TB_to_v_to_degree(T, B)
+    # initialize the solution to the right hand side Lba
+    X = np.zeros((len(removed), len(vertices)))
+    cross_edges = []
+    for edge in T:
+        w = 1.0 / B[edge]
+        u, v = edge
+        for vb, va in ((u, v), (v, u)):
+            if vb in b_to_index and va in a_to_index:
+                i, j = b_to_index[vb], a_to_index[va]
+                X[i, j] = -w
+                cross_edges.append((j, i, w))
+    # map each removed vertex to its removed parent in a rooted order
+    ctree = Ctree.from_TB(T)
+    order = ctree.names
+    parents = ctree.parents
+    forest_parents = [-1] * len(removed)
+    forest_weights = [0.0] * len(removed)
+    postorder = []
+    for index in reversed(range(len(order))):
+        v = order[index]
+        if v not in b_to_index:
+            continue
+        i = b_to_index[v]
+        postorder.append(i)
+        p = parents[index]
+        if p >= 0 and order[p] in b_to_index:
+            forest_parents[i] = b_to_index[order[p]]
+            forest_weights[i] = 1.0 / B[mkedge(v, order[p])]
+    # eliminate in postorder and substitute back in preorder
+    d = [v_to_degree[v] for v in removed]
+    for i in postorder:
+        p = forest_parents[i]
+        if p >= 0:
+            c = forest_weights[i] / d[i]
+            d[p] -= forest_weights[i] * c
+            X[p] += c * X[i]
+    for i in reversed(postorder):
+        p = forest_parents[i]
+        if p >= 0:
+            X[i] += forest_weights[i] * X[p]
+        X[i] /= d[i]
+    # the Schur complement is Laa - Lab X where Lab is sparse
+    L_schur = TB_to_L_block(T, B, vertices, vertices)
+    for j, i, w in cross_edges:
+        L_schur[j] += w * X[i]
+    return L_schur, removed, X
+
 def TB_to_L_schur(T, B, vertices):
     """
     Get a Schur complement in the Laplacian matrix.
@@ -350,28 +400,31 @@ def TB_to_L_schur(T, B, vertices):
     The Schur complement is in the full Laplacian
     defined by all vertices in edges of T.
     Note that this should be the pseudoinverse of G.
+    The removed vertices are eliminated in postorder
+    instead of inverting their block of the Laplacian.
     @param T: topology
     @param B: branch lengths
     @param vertices: ordered vertices
     @return: a Schur complement matrix
     """
-    # define the list of removed vertices
-    removed  = sorted(set(T_to_order(T)) - set(vertices))
-    Laa = TB_to_L_block(T, B, vertices, vertices)
-    Lab = TB_to_L_block(T, B, vertices, removed)
-    Lba = TB_to_L_block(T, B, removed, vertices)
-    Lbb = TB_to_L_block(T, B, removed, removed)
-    # use the Schur complement definition directly
-    L_schur = Laa - np.dot(Lab, np.dot(np.linalg.pinv(Lbb), Lba))
+    L_schur, removed, X = _TB_to_schur_system(T, B, vertices)
     return L_schur
 
 def TB_to_harmonic_extension(T, B, leaves, internal):
+    """
+    Extend the nonconstant Schur complement eigenvectors to internal vertices.
+    @param T: topology
+    @param B: branch lengths
+    @param leaves: ordered leaves
+    @param internal: ordered internal vertices
+    @return: eigenvalues and stacked leaf and internal vertex eigenvectors
+    """
     nleaves = len(leaves)
-    Lbb = TB_to_L_block(T, B, internal, internal)
-    Lba = TB_to_L_block(T, B, internal, leaves)
-    L_schur = TB_to_L_schur(T, B, leaves)
+    L_schur, removed, X = _TB_to_schur_system(T, B, leaves)
+    b_to_index = invseq(removed)
+    X_internal = X[[b_to_index[v] for v in internal]]
     w, v1 = scipy.linalg.eigh(L_schur, eigvals=(1, nleaves-1))
-    v2 = -np.dot(np.dot(np.linalg.pinv(Lbb), Lba), v1)
+    v2 = -np.dot(X_internal, v1)
     v = np.vstack([v1, v2])
     return w, v
 
@@ -537,6 +590,23 @@ g_example_b_B = {
         mkedge(4,5) : 3}
 
 
+def _get_random_TB(nvertices, seed=0):
+    """
+    This is a helper function for testing.
+    @param nvertices: the number of vertices
+    @param seed: a seed for the random number generator
+    @return: a random topology and random branch lengths
+    """
+    rng = np.random.RandomState(seed)
+    T = set()
+    B = {}
+    for v in range(1, nvertices):
+        edge = mkedge(v, rng.randint(v))
+        T.add(edge)
+        B[edge] = rng.uniform(0.5, 2.0)
+    return T, B
+
+
 class TestFtree(unittest.TestCase):
 
     def test_leaves_a(self):
@@ -643,6 +713,52 @@ class TestFtree(unittest.TestCase):
         w_expected = [0.1707228213, 0.271592036629, 0.684669269055]
         self.assertTrue(np.allclose(w_observed, w_expected))
 
+    def test_distance_matrix_random(self):
+        T, B = _get_random_TB(60)
+        vertices = T_to_order(T)
+        # sum branch lengths along paths found by breadth first search
+        v_to_neighbors = T_to_v_to_neighbors(T)
+        expected = np.zeros((len(vertices), len(vertices)))
+        for i, source in enumerate(vertices):
+            v_to_dist = {source : 0.0}
+            shell = [source]
+            while shell:
+                next_shell = []
+                for v in shell:
+                    for adj in v_to_neighbors[v]:
+                        if adj not in v_to_dist:
+                            v_to_dist[adj] = v_to_dist[v] + B[mkedge(v, adj)]
+                            next_shell.append(adj)
+                shell = next_shell
+            expected[i] = [v_to_dist[v] for v in vertices]
+        observed = TB_to_D(T, B, vertices)
+        self.assertTrue(np.allclose(observed, expected))
+        # small blocks give the same answer
+        leaves = T_to_leaves(T)
+        observed = RB_to_D(T_to_R_canonical(T), B, leaves, 7)
+        self.assertTrue(np.allclose(observed, TB_to_D(T, B, leaves)))
+        # every branch needs a length
+        del B[iter(T).next()]
+        self.assertRaises(KeyError, TB_to_D, T, B, leaves)
+
+    def test_schur_random(self):
+        T, B = _get_random_TB(60)
+        leaves = T_to_leaves(T)
+        internal = T_to_internal_vertices(T)
+        Laa = TB_to_L_block(T, B, leaves, leaves)
+        Lab = TB_to_L_block(T, B, leaves, internal)
+        Lba = TB_to_L_block(T, B, internal, leaves)
+        Lbb = TB_to_L_block(T, B, internal, internal)
+        Lbb_pinv = np.linalg.pinv(Lbb)
+        expected = Laa - np.dot(Lab, np.dot(Lbb_pinv, Lba))
+        observed = TB_to_L_schur(T, B, leaves)
+        self.assertTrue(np.allclose(observed, expected))
+        # check the harmonic extension
+        w, v = TB_to_harmonic_extension(T, B, leaves, internal)
+        v1 = v[:len(leaves)]
+        v2_expected = -np.dot(np.dot(Lbb_pinv, Lba), v1)
+        self.assertTrue(np.allclose(v[len(leaves):], v2_expected))
+
     def test_R_to_vertex_partition(self):
         R = set([(8, 5), (8, 6), (8, 7), (6, 1), (6, 2), (7, 3), (7, 4)])
         observed = R_to_vertex_partition(R)
@@ -8,12 +8,14 @@ It is less stateful so it might be more flexible.
 import unittest
 import math
 from collections import defaultdict
+from multiprocessing.pool import ThreadPool
 
 import numpy as np
 
 import day
 import Ftree
 import FtreeIO
+import Ctree
 import LeafWeights
 from MatrixUtil import ndot
 
@@ -27,60 +29,67 @@ ALT_EDGE = 2
 # This section is for EqualDaylight layout.
 
 
-def _build_dtree(dtree, v, v_to_sinks, v_to_location, v_to_dtree_id, count):
-    """
-    @param dtree: an object that lives in the C extension
-    @param v: vertex
-    @param v_to_sinks: computed from a rooted Ftree
-    @parma v_to_location: vertex to location map
-    @param v_to_dtree_id: this is filled as the dtree is built
-    @param count: the number of nodes added so far
-    """
-    x, y = v_to_location[v]
-    v_to_dtree_id[v] = count
-    count += 1
-    dtree.begin_node(v_to_dtree_id[v])
-    dtree.set_x(x)
-    dtree.set_y(y)
-    sinks = v_to_sinks.get(v, [])
-    for sink in sorted(sinks):
-        count = _build_dtree(
-                dtree, sink, v_to_sinks, v_to_location, v_to_dtree_id, count)
-    dtree.end_node()
-    return count
-
-def equal_daylight_layout(T, B, iteration_count):
+def equal_daylight_layout_array(T, B, iteration_count, tolerance=0.0):
     """
+    The C extension does all of the rerooting and equalizing iterations
+    without holding the global interpreter lock,
+    so layouts of different trees can run concurrently in threads.
     @param T: topology
     @param B: branch lengths
+    @param iteration_count: the maximum number of equalizing iterations
+    @param tolerance: stop when no subtree turns by more than this many radians
+    @return: the ordered vertices and a numpy array of their locations
     """
     R = Ftree.T_to_R_canonical(T)
     r = Ftree.R_to_root(R)
     # create the initial equal arc layout
     v_to_location = equal_arc_layout(T, B)
-    # use sax-like events to create a parallel tree in the C extension
-    v_to_sinks = Ftree.R_to_v_to_sinks(R)
-    v_to_dtree_id = {}
+    # the extension node ids are the indices of a depth first preorder
+    ctree = Ctree.from_RB(R, B, r)
+    vertices = ctree.names
+    v_to_id = Ftree.invseq(vertices)
+    xs, ys = zip(*[v_to_location[v] for v in vertices])
     dtree = day.Day()
-    count = _build_dtree(
-            dtree, r, v_to_sinks, v_to_location, v_to_dtree_id, 0)
+    dtree.build(ctree.parents.tolist(), xs, ys)
     # repeatedly reroot and equalize
     v_to_neighbors = Ftree.T_to_v_to_neighbors(T)
-    for i in range(iteration_count):
-        for v in Ftree.T_to_inside_out(T):
-            neighbor_count = len(v_to_neighbors[v])
-            if neighbor_count > 2:
-                dtree.select_node(v_to_dtree_id[v])
-                dtree.reroot()
-                dtree.equalize()
+    ids = [v_to_id[v] for v in Ftree.T_to_inside_out(T)
+            if len(v_to_neighbors[v]) > 2]
+    dtree.equalize_all(ids, iteration_count, tolerance)
     # extract the x and y coordinates from the dtree
-    v_to_location = {}
-    for v, dtree_id in v_to_dtree_id.items():
-        dtree.select_node(dtree_id)
-        x = dtree.get_x()
-        y = dtree.get_y()
-        v_to_location[v] = (x, y)
-    return v_to_location
+    locations = np.fromstring(dtree.get_coordinates(), dtype=float)
+    return vertices, locations.reshape((len(vertices), 2))
+
+def equal_daylight_layout(T, B, iteration_count, tolerance=0.0):
+    """
+    @param T: topology
+    @param B: branch lengths
+    @param iteration_count: the maximum number of equalizing iterations
+    @param tolerance: stop when no subtree turns by more than this many radians
+    @return: a map from vertex to location
+    """
+    vertices, locations = equal_daylight_layout_array(
+            T, B, iteration_count, tolerance)
+    return dict((v, tuple(xy)) for v, xy in zip(vertices, locations.tolist()))
+
+def equal_daylight_layouts(TB_pairs, iteration_count, tolerance=0.0,
+        nthreads=None):
+    """
+    Lay out many trees, for example MCMC samples or animation frames.
+    @param TB_pairs: a sequence of (topology, branch lengths) pairs
+    @param iteration_count: the maximum number of equalizing iterations
+    @param tolerance: stop when no subtree turns by more than this many radians
+    @param nthreads: the number of threads or None for the number of cpus
+    @return: a list of maps from vertex to location
+    """
+    pool = ThreadPool(nthreads)
+    try:
+        return pool.map(
+                lambda (T, B): equal_daylight_layout(
+                    T, B, iteration_count, tolerance),
+                TB_pairs)
+    finally:
+        pool.close()
 
 
 #####################################################
@@ -62,10 +62,13 @@ class _IO_Tree:
         self.v_to_name[v] = name
     def set_root(self, v):
         """
-        This is slow, probably as a result of the design.
+        Rerooting is slow, probably as a result of the design.
+        The parser builds R away from the root it passes here,
+        so the rerooting is skipped when v has no source.
         """
-        self.R = Ftree.T_to_R_specific(Ftree.R_to_T(self.R), v)
-        self.v_to_source = Ftree.R_to_v_to_source(self.R)
+        if v in self.v_to_source:
+            self.R = Ftree.T_to_R_specific(Ftree.R_to_T(self.R), v)
+            self.v_to_source = Ftree.R_to_v_to_source(self.R)
     def finish(self):
         r = Ftree.R_to_root(self.R)
         if r in self.v_to_hanging_length:
@@ -8,46 +8,34 @@ This is a line in a UCSC variant of the Fasta format.
 """
 
 import unittest
+import tempfile
+import shutil
 import sys
 import os
 
 import Progress
-import Util
+import FastaIndex
 
 
 class KGEAError(Exception): pass
 
 
-def get_piece_index(fin, position):
+def get_paragraph_range(fin, position):
     """
+    The rows of the index file are sorted by first index.
     @param fin: an index file that is open for reading
     @param position: the query position within the chromosome
-    @return: None or the fasta piece index corresponding to the given position
+    @return: None or the byte range of the alignment in the fasta file
     """
     for line in fin:
         stripped_line = line.strip()
         if stripped_line:
-            first_index_s, last_index_s, piece_index_s = stripped_line.split()
-            first_index = int(first_index_s)
-            last_index = int(last_index_s)
-            piece_index = int(piece_index_s)
-            if first_index <= position <= last_index:
-                return piece_index
-
-def get_line_list(fin, chromosome_string, chromosome_position):
-    """
-    @param fin: a fasta file that is open for reading
-    @param chromosome_string: the name of the chromosome
-    @param chromosome_position: the query position within the chromosome
-    @return: None or lines of an alignment that include the requested position
-    """
-    for line_list in Util.gen_paragraphs(fin):
-        header_line = line_list[0]
-        p = LocationParser(header_line)
-        if p.chromosome != chromosome_string:
-            continue
-        if p.first_index <= chromosome_position <= p.last_index:
-            return line_list
+            row = [int(x) for x in stripped_line.split()]
+            first_index, last_index, start_offset, stop_offset = row
+            if position < first_index:
+                return None
+            if position <= last_index:
+                return start_offset, stop_offset
 
 def header_line_to_taxon(header_line):
     """
@@ -64,49 +52,32 @@ def header_line_to_taxon(header_line):
     taxon = split_by_underscore[1]
     return taxon
 
-def piece_index_to_filename(piece_index, original_filename):
-    """
-    @param piece_index: the index of the piece of the original file
-    @param original_filename: the name of the original fasta file
-    @return: a filename that combines the index and the input filename
-    """
-    assert piece_index < 10000
-    piece_index_string = '%04d' % piece_index
-    original_filename_segments = original_filename.split('.')
-    assert len(original_filename_segments) > 1
-    arr = original_filename_segments[:]
-    arr.insert(-1, piece_index_string)
-    return ''.join(arr)
-
-def piece_filename_to_index(piece_filename):
+def gen_location_rows(fin):
     """
-    @param piece_filename: a filename that contains the piece index
-    @return: the piece index
-    """
-    # read the piece index from the piece pathname
-    name_fragments = piece_filename.split('.')
-    assert len(name_fragments) > 2
-    piece_index_string = name_fragments[-2]
-    piece_index = int(piece_index_string)
-    return piece_index
-
-def gen_elements(piece_pathname):
-    """
-    Each yielded element is a tuple of three values.
+    Yield (row, index entries) pairs, one for each alignment.
+    Each row is a tuple of five values.
     The first value is a chromosome string.
     The second value is a first index.
-    The third value is an last index.
-    @param piece_pathname: the path to a piece of an original huge fasta file
+    The third value is a last index.
+    The fourth and fifth values are the byte range of the alignment.
+    The index entries are for the records of the alignment.
+    @param fin: the original huge fasta file opened in binary mode
     """
-    # read a bunch of alignments from the piece of the original huge fasta file
-    with open(piece_pathname) as fin:
-        for line_list in Util.gen_paragraphs(fin):
-            # We only care about the first line in each list,
-            # and each one looks something like this:
-            # >uc009xhd.1_hg18_1_1 342 0 0 chr1:247178160-247179185+
-            header_line = line_list[0]
-            p = LocationParser(header_line)
-            yield (p.chromosome, p.first_index, p.last_index)
+    row = None
+    entries = []
+    for offset, header, entry in FastaIndex.gen_index_entries(fin):
+        # each alignment starts with the human sequence
+        if header_line_to_taxon(header) == 'hg18':
+            if row is not None:
+                yield row + (entries[-1].get_stop_offset(),), entries
+            p = LocationParser(header)
+            row = (p.chromosome, p.first_index, p.last_index, offset)
+            entries = []
+        elif row is None:
+            raise KGEAError('each alignment should start with a hg18 line')
+        entries.append(entry)
+    if row is not None:
+        yield row + (entries[-1].get_stop_offset(),), entries
 
 
 class LocationParser:
@@ -156,140 +127,35 @@ class LocationParser:
 
 
 
-def gen_line_list_lists(line_list_generator, approx_flattened_nlines):
-    """
-    Yields lists of lists of stripped lines.
-    The total number of lines has approximately some specified length.
-    @param line_list_generator: yields lists of lines
-    @param approx_flattened_nlines: a target for the number of lines to yield
-    """
-    nlines = 0
-    line_list_list = []
-    for line_list in line_list_generator:
-        line_list_list.append(line_list)
-        nlines += len(line_list)
-        if nlines >= approx_flattened_nlines:
-            yield line_list_list
-            nlines = 0
-            line_list_list = []
-    if line_list_list:
-        yield line_list_list
-
-
-class Splitter:
-    
-    def __init__(self, filename, pieces_directory):
-        """
-        @param filename: the filename of the huge fasta file to split
-        @param pieces_directory: the directory where the pieces will go
-        """
-        self.target_directory = pieces_directory
-        self.filename = filename
-        self.chromosome_strings = set()
-        self.approx_lines_per_piece = 10000
-
-    def run(self, verbose=False):
-        """
-        This reads the input file and writes pieces to a directory.
-        @param verbose: True if we want to report our progress
-        """
-        # if we are reporting our progress then get the size of the file
-        if verbose:
-            nbytes_total = os.path.getsize(self.filename)
-            pbar = Progress.Bar(nbytes_total)
-            nbytes_current_approx = 0
-        # process the file, possibly updating the progress bar
-        with open(self.filename) as fin:
-            piece_index = 0
-            for line_lists in gen_line_list_lists(Util.gen_paragraphs(fin),
-                    self.approx_lines_per_piece):
-                piece_filename = piece_index_to_filename(piece_index,
-                        self.filename)
-                piece_path = os.path.join(self.target_directory, piece_filename)
-                with open(piece_path, 'w') as fout:
-                    for line_list in line_lists:
-                        print >> fout, '\n'.join(line_list)
-                        print >> fout
-                piece_index += 1
-                if verbose:
-                    nbytes = sum(len(''.join(x)) for x in line_lists)
-                    nbytes_current_approx += nbytes
-                    pbar.update(nbytes_current_approx)
-        # possibly stop the progress bar
-        if verbose:
-            pbar.finish()
-
-    def dry_run(self):
-        """
-        This just reads the input file.
-        """
-        nchunks = 0
-        nlines = 0
-        with open(self.filename) as fin:
-            for lines in Util.gen_paragraphs(fin):
-                self.process_header_line(lines[0])
-                nlines += len(lines)
-                nchunks += 1
-                if not nchunks % 10000:
-                    print 'nlines:', nlines
-                    print 'nchunks:', nchunks
-                    print
-            print 'total nlines:', nlines
-            print 'total nchunks:', nchunks
-
-    def process_header_line(self, header_line):
-        coordinate_string = header_line.split()[-1].strip()
-        chromosome_string = coordinate_string.split(':')[0]
-        if chromosome_string not in self.chromosome_strings:
-            self.chromosome_strings.add(chromosome_string)
-            print 'new chromosome string in this header line:'
-            print header_line
-            print 'all chromosome strings:'
-            for s in sorted(self.chromosome_strings):
-                print s
-            print 
-
-
 class Indexer:
     """
-    Index the fasta files.
+    Index the original huge fasta file.
 
-    This script starts from the assumption that there is a subdirectory
-    with a bunch of pieces of an original huge fasta file.
     The original fasta file was
     knownGene.exonAA.fa
-    The pieces are in the directory
-    fasta-pieces
-    and are given names like
-    knownGene.exonAA.1234.fa
-
-    The job of this script is to index
-    these fasta files by genomic coordinates.
-    The hard parts are already done;
-    in particular, the fasta header for each exon gives a chromosome name
-    and the coordinates covered by the exon within the chromosome.
-
-    This script simply makes, for each chromosome,
-    a file that has three values in each row: the first coordinate,
-    the last coordinate, and the piece index.
+    and it may have been compressed with bgzip.
+    The fasta file is read once in a streaming pass.
+    This writes a faidx style index next to the fasta file,
+    and for each chromosome it writes a file
+    that has four values in each row: the first coordinate,
+    the last coordinate, and the byte range of the alignment
+    within the uncompressed fasta file.
     Oh, it also makes a file that lists the valid chromosome names.
     """
 
-    def __init__(self, index_dir, chromosome_list_filename, pieces_dir):
+    def __init__(self, index_dir, chromosome_list_filename, fasta_pathname):
         """
         Initialize some parameters.
         @param index_dir: write index files to this directory
         @param chromosome_list_filename: write the chromosome strings here
-        @param pieces_dir: read the fasta files that are in this directory
+        @param fasta_pathname: read this fasta file
         """
         self.index_directory = index_dir
         self.chromosome_list_filename = chromosome_list_filename
-        self.pieces_directory = pieces_dir
+        self.fasta_pathname = fasta_pathname
         # check some conditions so we fail early instead of late
-        if not os.path.isdir(self.pieces_directory):
-            raise KGEAError(
-                    'missing the directory '
-                    'with fasta files: ' + self.pieces_directory)
+        if not os.path.isfile(self.fasta_pathname):
+            raise KGEAError('missing the fasta file: ' + self.fasta_pathname)
         if not os.path.isdir(self.index_directory):
             raise KGEAError(
                     'missing the directory to which the index files '
@@ -301,25 +167,33 @@ class Indexer:
         This might take a while.
         @param verbose: True if we want to write our progress to stdout
         """
-        # fill a dictionary by reading all of the fasta pieces
+        # fill a dictionary by reading the fasta file
         chromosome_string_to_rows = {}
-        piece_filenames = list(sorted(os.listdir(self.pieces_directory)))
+        all_entries = []
         if verbose:
-            print >> sys.stderr, 'creating a dictionary from the fasta pieces:'
-            pbar = Progress.Bar(len(piece_filenames))
-            nfiles_read = 0
-        for piece_filename in piece_filenames:
-            piece_index = piece_filename_to_index(piece_filename)
-            piece_pathname = os.path.join(
-                    self.pieces_directory, piece_filename)
-            for chrom_string, first_i, last_i in gen_elements(piece_pathname):
-                row = (first_i, last_i, piece_index)
+            print >> sys.stderr, 'reading the fasta file:'
+            pbar = Progress.Bar(os.path.getsize(self.fasta_pathname))
+        fin = FastaIndex.open_stream(self.fasta_pathname)
+        try:
+            for row, entries in gen_location_rows(fin):
+                chrom_string = row[0]
                 rows = chromosome_string_to_rows.get(chrom_string, [])
-                rows.append(row)
+                rows.append(row[1:])
                 chromosome_string_to_rows[chrom_string] = rows
-            if verbose:
-                nfiles_read += 1
-                pbar.update(nfiles_read)
+                all_entries.extend(entries)
+                if verbose:
+                    pbar.update(min(pbar.high, entries[-1].get_stop_offset()))
+        finally:
+            fin.close()
+        if verbose:
+            pbar.finish()
+        # write the faidx style index of the fasta file
+        fasta_index_pathname = FastaIndex.get_index_pathname(
+                self.fasta_pathname)
+        with open(fasta_index_pathname, 'w') as fout:
+            FastaIndex.write_index(all_entries, fout)
+        if verbose:
+            print >> sys.stderr, 'wrote', fasta_index_pathname
         # define the list of chromosome strings
         chromosome_strings = list(sorted(chromosome_string_to_rows))
         assert len(chromosome_strings) < 1000
@@ -338,7 +212,7 @@ class Indexer:
             index_pathname = os.path.join(self.index_directory, index_filename)
             with open(index_pathname, 'w') as fout:
                 for row in sorted(rows):
-                    print >> fout, '%d\t%d\t%d' % row
+                    print >> fout, '%d\t%d\t%d\t%d' % row
             if verbose:
                 nwritten += 1
                 pbar.update(nwritten)
@@ -346,21 +220,25 @@ class Indexer:
 
 class Finder:
 
-    def __init__(self, index_directory, chrom_list_filename, fasta_directory):
+    def __init__(self, index_directory, chrom_list_filename, fasta_pathname):
         """
         Initialize some parameters.
         @param index_directory: index files have been written to this directory
         @param chrom_list_filename: name of an existing file with chrom strings
-        @param fasta_directory: the fasta files are in this directory
+        @param fasta_pathname: the indexed fasta file
         """
         self.index_directory = index_directory
-        self.fasta_directory = fasta_directory
+        self.fasta_pathname = fasta_pathname
         self.valid_chromosome_strings = None
+        # the fasta reader is opened by the first query
+        self.fasta_reader = None
         # check some conditions so we fail early
-        if not os.path.isdir(self.fasta_directory):
+        if not os.path.isfile(self.fasta_pathname):
+            raise KGEAError('missing the fasta file: ' + self.fasta_pathname)
+        fasta_index_pathname = FastaIndex.get_index_pathname(fasta_pathname)
+        if not os.path.isfile(fasta_index_pathname):
             raise KGEAError(
-                    'missing the directory '
-                    'with fasta files: ' + self.fasta_directory)
+                    'missing the fasta index file: ' + fasta_index_pathname)
         if not os.path.isdir(self.index_directory):
             raise KGEAError(
                     'missing the directory to which the index files '
@@ -392,27 +270,44 @@ class Finder:
         # get the index pathname using the chromosome string
         index_filename = chrom_string + '.index'
         index_pathname = os.path.join(self.index_directory, index_filename)
-        # read the index file to find a piece index
+        # read the index file to find the byte range of the alignment
         if verbose:
             print 'searching the index file', index_pathname
         with open(index_pathname) as fin:
-            piece_index = get_piece_index(fin, chrom_position)
-        if not piece_index:
+            byte_range = get_paragraph_range(fin, chrom_position)
+        if byte_range is None:
             return []
-        # read the fasta piece corresponding to the index
-        piece_pathname = os.path.join(
-                self.fasta_directory, 'knownGene.exonAA.%04d.fa' % piece_index)
+        # read the alignment from the fasta file
         if verbose:
-            print 'searching the fasta file', piece_pathname
-        with open(piece_pathname) as fin:
-            line_list = get_line_list(fin, chrom_string, chrom_position)
-        if line_list is None:
+            print 'reading the fasta file', self.fasta_pathname
+        if self.fasta_reader is None:
+            self.fasta_reader = FastaIndex.open_reader(self.fasta_pathname)
+        raw = self.fasta_reader.read(*byte_range)
+        line_list = [line.strip() for line in raw.splitlines() if line.strip()]
+        if not line_list or not line_list[0].startswith('>'):
+            raise KGEAError(
+                    'the index pointed to a part of the fasta file '
+                    'that does not start with a header')
+        p = LocationParser(line_list[0])
+        if p.chromosome != chrom_string:
             raise KGEAError(
-                    'the index pointed to a fasta file '
+                    'the index pointed to an alignment '
+                    'that does not have the requested position')
+        if not (p.first_index <= chrom_position <= p.last_index):
+            raise KGEAError(
+                    'the index pointed to an alignment '
                     'that does not have the requested position')
         # return the lines of the alignment
         return line_list
 
+    def close(self):
+        """
+        Close the fasta file if a query has opened it.
+        """
+        if self.fasta_reader is not None:
+            self.fasta_reader.close()
+            self.fasta_reader = None
+
     def gen_taxon_aa_pairs(self, chrom_string, chrom_position, verbose=False):
         """
         Yield (taxon name, amino acid) pairs
@@ -477,18 +372,58 @@ class TestParser(unittest.TestCase):
         self.assertEqual(taxon, 'gasAcu1')
 
 
-class TestSplitter(unittest.TestCase):
-    pass
+g_test_alignments = """
+>uc001aaa.1_hg18_1_1 4 0 0 chr1:100-111+
+MKVL
+>uc001aaa.1_panTro2_1_1 4 0 0 chr1:100-111+
+MKIL
+
+>uc001bbb.1_hg18_1_1 3 0 0 chr2:200-208-
+QRS
+>uc001bbb.1_panTro2_1_1 3 0 0 chr2:200-208-
+QR-
+"""
 
 
 class TestIndexer(unittest.TestCase):
-    pass
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.index_directory = os.path.join(self.directory, 'index')
+        os.mkdir(self.index_directory)
+        self.fasta_pathname = os.path.join(self.directory, 'test.fa')
+        self.chrom_pathname = os.path.join(self.directory, 'chromosomes.txt')
+        with open(self.fasta_pathname, 'wb') as fout:
+            fout.write(g_test_alignments.lstrip())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_find_alignment(self):
+        Indexer(self.index_directory, self.chrom_pathname,
+                self.fasta_pathname).run()
+        finder = Finder(self.index_directory, self.chrom_pathname,
+                self.fasta_pathname)
+        self.assertEqual(finder.valid_chromosome_strings, set(['chr1', 'chr2']))
+        lines = finder.get_alignment_lines('chr1', 105)
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[3], 'MKIL')
+        self.assertEqual(finder.get_alignment_lines('chr1', 99), [])
+        self.assertEqual(finder.get_alignment_lines('chr1', 112), [])
+        observed = finder.get_column_lines('chr2', 200)
+        self.assertEqual(observed, ['hg18\tS', 'panTro2\t-'])
+        self.assertRaises(KGEAError, finder.get_alignment_lines, 'chr3', 1)
+        # the reader opened by the first query is reused
+        reader = finder.fasta_reader
+        finder.get_alignment_lines('chr1', 105)
+        self.assertTrue(finder.fasta_reader is reader)
+        finder.close()
+        self.assertTrue(finder.fasta_reader is None)
 
 
 if __name__ == '__main__':
     suite = unittest.TestSuite([
         unittest.TestLoader().loadTestsFromTestCase(TestParser),
-        unittest.TestLoader().loadTestsFromTestCase(TestSplitter),
         unittest.TestLoader().loadTestsFromTestCase(TestIndexer)])
     unittest.TextTestRunner(verbosity=2).run(suite)
 
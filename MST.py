@@ -1,9 +1,98 @@
 """
 Stuff related to spanning trees in various dimensions on various surfaces.
+
+The Kruskal functions merge components with a union-find structure
+that uses path compression and union by rank.
+The Euclidean minimum spanning tree of a point set
+is found without looking at all pairs of points.
+In two or three dimensions the candidate edges are those of the
+Delaunay triangulation, which contains the minimum spanning tree.
+Otherwise Boruvka steps find the nearest point in another component
+using k nearest neighbor queries of a KD-tree.
+Run the benchmark using
+$ python MST.py --benchmark
 """
 
 import unittest
+import argparse
 import heapq
+import time
+import sys
+
+import numpy as np
+import scipy.spatial
+
+class MSTError(Exception): pass
+
+
+class UnionFind:
+    """
+    Disjoint sets of the integers 0, 1, ..., n-1.
+    """
+
+    def __init__(self, n):
+        self.parent = range(n)
+        self.rank = [0] * n
+
+    def find(self, i):
+        """
+        @param i: an element
+        @return: the representative element of the set containing i
+        """
+        parent = self.parent
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def union(self, i, j):
+        """
+        @param i: an element
+        @param j: an element
+        @return: False if i and j were already in the same set
+        """
+        a = self.find(i)
+        b = self.find(j)
+        if a == b:
+            return False
+        if self.rank[a] < self.rank[b]:
+            a, b = b, a
+        self.parent[b] = a
+        if self.rank[a] == self.rank[b]:
+            self.rank[a] += 1
+        return True
+
+    def get_labels(self):
+        """
+        @return: an array of representative elements
+        """
+        return np.array([self.find(i) for i in range(len(self.parent))])
+
+
+def kruskal_arrays(n, rows, cols, weights):
+    """
+    Find a minimum spanning forest of a weighted graph.
+    Ties are broken by the order of the edges.
+    @param n: the number of vertices labeled 0, 1, ..., n-1
+    @param rows: an array of the first vertex of each edge
+    @param cols: an array of the second vertex of each edge
+    @param weights: an array of edge weights
+    @return: rows, cols, weights of the tree edges in order of weight
+    """
+    rows = np.asarray(rows, dtype=int)
+    cols = np.asarray(cols, dtype=int)
+    weights = np.asarray(weights, dtype=float)
+    uf = UnionFind(n)
+    chosen = []
+    for index in np.argsort(weights, kind='mergesort'):
+        if uf.union(rows[index], cols[index]):
+            chosen.append(index)
+            if len(chosen) == n - 1:
+                break
+    chosen = np.array(chosen, dtype=int)
+    return rows[chosen], cols[chosen], weights[chosen]
 
 def kruskal(V, E):
     """
@@ -27,6 +116,32 @@ def kruskal(V, E):
     17    return tree T
     @param V: a list of hashable vertices
     @param E: a list of hashable (nonnegative weight, vertex u, vertex v) triples
+    @return: the set of tree edges
+    """
+    # define an index for each vertex
+    v_to_index = dict((v, i) for i, v in enumerate(V))
+    # validate the input
+    for weight, a, b in E:
+        if (a not in v_to_index) or (b not in v_to_index):
+            raise ValueError('expected both endpoints of an edge to be valid vertices')
+    # add the edges in the order of the priority queue
+    uf = UnionFind(len(v_to_index))
+    T = set()
+    n = len(v_to_index)
+    for edge in sorted(E):
+        if len(T) == n-1:
+            break
+        weight, u, v = edge
+        if uf.union(v_to_index[u], v_to_index[v]):
+            T.add(edge)
+    if len(T) < n-1:
+        raise MSTError('the graph is not connected')
+    return T
+
+def _kruskal_sets(V, E):
+    """
+    This is the previous implementation which merges sets of vertices.
+    It is used for testing and benchmarking.
     """
     # validate the input
     for weight, a, b in E:
@@ -53,6 +168,172 @@ def kruskal(V, E):
     return T
 
 
+def _get_pairs(npoints):
+    """
+    @return: arrays of the row and column indices of all pairs
+    """
+    return np.triu_indices(npoints, 1)
+
+def _get_delaunay_pairs(points):
+    """
+    @param points: points in two or three dimensions
+    @return: arrays of the endpoints of the Delaunay edges
+    """
+    npoints, ndim = points.shape
+    simplices = scipy.spatial.Delaunay(points).simplices.astype(np.int64)
+    codes = []
+    for i in range(ndim + 1):
+        for j in range(i + 1, ndim + 1):
+            a = simplices[:, i]
+            b = simplices[:, j]
+            codes.append(np.minimum(a, b) * npoints + np.maximum(a, b))
+    codes = np.unique(np.concatenate(codes))
+    return codes // npoints, codes % npoints
+
+def _get_component_labels(parent):
+    """
+    @param parent: an array of parent pointers of a union-find forest
+    @return: the root of each element
+    """
+    labels = parent.copy()
+    while True:
+        next_labels = labels[labels]
+        if np.array_equal(next_labels, labels):
+            return labels
+        labels = next_labels
+
+def _boruvka_kdtree(points):
+    """
+    Each step adds the shortest edge leaving each component.
+    The nearest point in another component is found by querying
+    increasing numbers of nearest neighbors,
+    but only for points whose neighbors so far are all in their own component
+    and are closer than the best edge found for that component.
+    @param points: points in any number of dimensions
+    @return: arrays of the endpoints of the tree edges
+    """
+    npoints = len(points)
+    tree = scipy.spatial.cKDTree(points)
+    uf = UnionFind(npoints)
+    # the number of neighbors to query for each point
+    ks = np.minimum(np.ones(npoints, dtype=int) * 2, npoints)
+    rows = []
+    cols = []
+    while len(rows) < npoints - 1:
+        labels = _get_component_labels(np.array(uf.parent))
+        best_dist = np.empty(npoints)
+        best_dist.fill(np.inf)
+        best_pair = -np.ones((npoints, 2), dtype=int)
+        pending = np.arange(npoints)
+        while len(pending):
+            unresolved = []
+            for k in np.unique(ks[pending]):
+                indices = pending[ks[pending] == k]
+                dists, nbrs = tree.query(points[indices], k)
+                dists = dists.reshape(len(indices), k)
+                nbrs = nbrs.reshape(len(indices), k)
+                foreign = labels[nbrs] != labels[indices, np.newaxis]
+                found = np.any(foreign, axis=1)
+                first = np.argmax(foreign, axis=1)
+                fi = indices[found]
+                fj = nbrs[found, first[found]]
+                fd = dists[found, first[found]]
+                # the shortest found edge of each component
+                order = np.lexsort((fd, labels[fi]))
+                fl = labels[fi][order]
+                order = order[np.r_[True, fl[1:] != fl[:-1]][:len(fl)]]
+                fi, fj, fd = fi[order], fj[order], fd[order]
+                better = fd < best_dist[labels[fi]]
+                best_dist[labels[fi[better]]] = fd[better]
+                best_pair[labels[fi[better]], 0] = fi[better]
+                best_pair[labels[fi[better]], 1] = fj[better]
+                unresolved.append(
+                        (indices[~found], dists[~found, -1]))
+            # points that cannot beat the best edge of their component
+            # do not need more neighbors
+            next_pending = []
+            for indices, lower in unresolved:
+                keep = lower < best_dist[labels[indices]]
+                next_pending.append(indices[keep])
+            pending = np.concatenate(next_pending)
+            ks[pending] = np.minimum(2 * ks[pending], npoints)
+        roots = np.flatnonzero(best_pair[:, 0] >= 0)
+        for root in roots[np.argsort(best_dist[roots], kind='mergesort')]:
+            i, j = best_pair[root]
+            if uf.union(i, j):
+                rows.append(i)
+                cols.append(j)
+    return np.array(rows, dtype=int), np.array(cols, dtype=int)
+
+def euclidean_mst(points, method='auto'):
+    """
+    Find a minimum spanning tree of points with Euclidean edge weights.
+    The tree is also a minimum spanning tree
+    for any increasing function of the distances like squared distances.
+    @param points: an array with one point per row
+    @param method: 'auto', 'delaunay', 'kdtree', or 'dense'
+    @return: rows, cols, distances of the tree edges in order of distance
+    """
+    points = np.asarray(points, dtype=float)
+    if points.ndim == 1:
+        points = points[:, np.newaxis]
+    npoints, ndim = points.shape
+    if npoints < 2:
+        empty = np.zeros(0, dtype=int)
+        return empty, empty, np.zeros(0)
+    if method == 'auto':
+        if ndim in (2, 3) and npoints > ndim + 1:
+            method = 'delaunay'
+        else:
+            method = 'kdtree'
+    if method == 'delaunay':
+        try:
+            rows, cols = _get_delaunay_pairs(points)
+        except scipy.spatial.qhull.QhullError:
+            # degenerate point sets like collinear points
+            rows, cols = _boruvka_kdtree(points)
+    elif method == 'kdtree':
+        rows, cols = _boruvka_kdtree(points)
+    elif method == 'dense':
+        rows, cols = _get_pairs(npoints)
+    else:
+        raise MSTError('unknown method: ' + method)
+    dists = np.sqrt(np.sum((points[rows] - points[cols])**2, axis=1))
+    return kruskal_arrays(npoints, rows, cols, dists)
+
+
+def benchmark(npoints, ndim=2, seed=0):
+    """
+    Compare the previous and current implementations on a complete graph
+    like the ones built by the Steiner point scripts.
+    @param npoints: the number of random points
+    @param ndim: the number of dimensions of the points
+    @param seed: random seed
+    """
+    points = np.random.RandomState(seed).uniform(size=(npoints, ndim))
+    rows, cols = _get_pairs(npoints)
+    dists = np.sqrt(np.sum((points[rows] - points[cols])**2, axis=1))
+    V = range(npoints)
+    E = zip(dists.tolist(), rows.tolist(), cols.tolist())
+    print npoints, 'points in', ndim, 'dimensions'
+    print len(E), 'edges in the complete graph'
+    tm = time.time()
+    total = sum(w for w, a, b in _kruskal_sets(V, E))
+    print 'previous kruskal: %.3f seconds, weight %f' % (
+            time.time() - tm, total)
+    tm = time.time()
+    total = sum(w for w, a, b in kruskal(V, E))
+    print 'union-find kruskal: %.3f seconds, weight %f' % (
+            time.time() - tm, total)
+    for method in ('dense', 'kdtree', 'delaunay'):
+        if method == 'delaunay' and ndim not in (2, 3):
+            continue
+        tm = time.time()
+        total = np.sum(euclidean_mst(points, method)[2])
+        print 'euclidean mst (%s): %.3f seconds, weight %f' % (
+                method, time.time() - tm, total)
+
+
 class TestMST(unittest.TestCase):
 
     def test_kruskal(self):
@@ -83,7 +364,57 @@ class TestMST(unittest.TestCase):
             (9, 'e', 'g')
             ])
         self.assertEqual(set(T), set(E_MST))
+        self.assertEqual(_kruskal_sets(V, E), T)
+        self.assertRaises(MSTError, kruskal, V | set('h'), E)
+
+    def test_union_find(self):
+        uf = UnionFind(6)
+        self.assertTrue(uf.union(0, 1))
+        self.assertTrue(uf.union(2, 3))
+        self.assertTrue(uf.union(1, 3))
+        self.assertFalse(uf.union(0, 2))
+        labels = uf.get_labels()
+        self.assertEqual(len(set(labels[:4])), 1)
+        self.assertEqual(len(set(labels)), 3)
+
+    def test_euclidean_mst(self):
+        rs = np.random.RandomState(0)
+        for ndim in (1, 2, 3, 5):
+            points = rs.randn(80, ndim)
+            expected = np.sum(euclidean_mst(points, 'dense')[2])
+            for method in ('auto', 'kdtree'):
+                rows, cols, dists = euclidean_mst(points, method)
+                self.assertEqual(len(rows), 79)
+                self.assertTrue(np.allclose(np.sum(dists), expected))
+                # the edges span the points
+                uf = UnionFind(80)
+                for a, b in zip(rows, cols):
+                    uf.union(a, b)
+                self.assertEqual(len(set(uf.get_labels())), 1)
+
+    def test_euclidean_mst_ties(self):
+        # a grid has many equal distances and collinear points
+        x, y = np.meshgrid(range(6), range(5))
+        points = np.vstack([x.ravel(), y.ravel()]).T
+        for method in ('delaunay', 'kdtree', 'dense'):
+            dists = euclidean_mst(points, method)[2]
+            self.assertTrue(np.allclose(dists, 1))
+            self.assertEqual(len(dists), 29)
+        collinear = np.array([[0, 0], [1, 1], [3, 3], [2, 2]], dtype=float)
+        dists = euclidean_mst(collinear)[2]
+        self.assertTrue(np.allclose(dists, np.sqrt(2)))
 
 
 if __name__ == '__main__':
-    unittest.main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmark', action='store_true',
+            help='compare the previous and current implementations')
+    parser.add_argument('--npoints', type=int, default=1000,
+            help='the number of random points for the benchmark')
+    parser.add_argument('--ndim', type=int, default=2,
+            help='the number of dimensions for the benchmark')
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.npoints, args.ndim)
+    else:
+        unittest.main(argv=sys.argv[:1])
@@ -10,8 +10,11 @@ import random
 
 import numpy as np
 from scipy import linalg
+from scipy import sparse
+from scipy.sparse import linalg as splinalg
 
 import graph
+import markovsolve
 import matrixio
 from matrixio import m_to_string
 from matrixio import read_matrix
@@ -150,9 +153,16 @@ def assert_transition_matrix(M):
     """
     assert_square(M)
     n = M.shape[0]
-    if (M < 0).any():
-        raise MatrixError('each element of a transition matrix should be nonnegative')
-    if not np.allclose(np.sum(M, 1), np.ones(n)):
+    if sparse.issparse(M):
+        M = M.tocsr()
+        if (M.data < 0).any():
+            raise MatrixError('each element of a transition matrix should be nonnegative')
+        row_sums = np.asarray(M.sum(axis=1)).ravel()
+    else:
+        if (M < 0).any():
+            raise MatrixError('each element of a transition matrix should be nonnegative')
+        row_sums = np.sum(M, 1)
+    if not np.allclose(row_sums, np.ones(n)):
         raise MatrixError('rows of a transition matrix should each sum to 1.0')
 
 def row_major_to_dict(matrix, ordered_row_labels, ordered_column_labels):
@@ -327,25 +337,17 @@ def sample_pos_sym_matrix(n):
 
 def get_stationary_distribution(P):
     """
-    This uses a direct solver.
-    It does not use power iteration or an eigendecomposition.
-    @param P: a transition matrix
+    This uses the markovsolve module,
+    which picks a direct or iterative solver
+    according to the size and sparsity of the transition matrix.
+    It does not use an eigendecomposition.
+    @param P: a transition matrix, dense or scipy sparse
     @return: the equilibrium (stationary) distribution
     """
     assert_transition_matrix(P)
-    nstates = len(P)
-    b = np.zeros(nstates)
-    A = P.T - np.eye(nstates)
-    A[0] = np.ones(nstates)
-    b[0] = 1
-    v = linalg.solve(A, b, overwrite_a=True, overwrite_b=True)
-    assert_distribution(v)
-    # take extra care to clean up entries that are
-    # technically negative but negligibly tiny.
-    v = (v + np.abs(v)) / 2
-    v = v / np.sum(v)
+    v, report = markovsolve.get_stationary_distribution_from_transitions(P)
     assert_distribution(v)
-    return v 
+    return v
 
 class TestMatrixUtil(unittest.TestCase):
 
@@ -442,6 +444,16 @@ class TestMatrixUtil(unittest.TestCase):
         assert_symmetric(M)
         assert_positive(M)
 
+    def test_sparse_stationary_distribution(self):
+        np.random.seed(0)
+        n = 20
+        P = np.random.rand(n, n) * (np.random.rand(n, n) < 0.3)
+        P += np.eye(n, k=1) + np.eye(n, k=1-n)
+        P /= np.sum(P, axis=1)[:, np.newaxis]
+        expected = get_stationary_distribution(P)
+        observed = get_stationary_distribution(sparse.csr_matrix(P))
+        self.assertTrue(np.allclose(expected, observed))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -4,6 +4,9 @@ Neighbor joining related algorithms.
 
 from StringIO import StringIO
 import unittest
+import random
+
+import numpy as np
 
 import Newick
 import MatrixUtil
@@ -67,13 +70,15 @@ def get_neighbors(D):
     @param D: a row major distance matrix
     @return: the pair of neighbor indices selected by the Q criterion
     """
+    D = np.asarray(D, dtype=float)
     n = len(D)
-    D_star = [sum(D[i]) for i in range(n)]
+    D_star = D.sum(axis=1)
     # Use the Q matrix as a criterion to select the neighbors to join.
-    Q = get_Q_matrix(D)
-    q_neighbors_pairs = [(Q[i][j], (i, j)) for i in range(n) for j in range(n) if i<j]
-    q, neighbors = min(q_neighbors_pairs)
-    return neighbors
+    # Ties are broken in favor of the first pair in row major order.
+    Q = (n - 2) * D - D_star[:, np.newaxis] - D_star[np.newaxis, :]
+    Q[np.tril_indices(n)] = np.inf
+    i, j = divmod(int(np.argmin(Q)), n)
+    return i, j
 
 def do_iteration(D):
     """
@@ -168,6 +173,137 @@ def make_tree(D, ordered_states, iteration_callback=None):
             next_serial += 1
 
 
+def _get_bounded_neighbors(D, R, dmin, m):
+    """
+    Find the neighbors without evaluating every row of the Q matrix.
+    This is like the search in RapidNJ.
+    A row can contain the minimum of the Q matrix only if
+    a lower bound computed from its smallest distance and the largest
+    row sum does not exceed the Q value of a pair already seen.
+    @param D: the working distance matrix
+    @param R: the working vector of row sums
+    @param dmin: the smallest off-diagonal distance in each row
+    @param m: the number of active rows
+    @return: the pair of neighbor indices
+    """
+    lower_bounds = (m-2)*dmin[:m] - R[:m] - np.max(R[:m])
+    i = np.argmin(lower_bounds)
+    q_row = (m-2)*D[i, :m] - R[i] - R[:m]
+    q_row[i] = np.inf
+    best = np.min(q_row)
+    rows = np.flatnonzero(lower_bounds <= best)
+    Q = (m-2)*D[rows, :m] - R[rows, np.newaxis] - R[np.newaxis, :m]
+    Q[np.arange(len(rows)), rows] = np.inf
+    k, g = divmod(int(np.argmin(Q)), m)
+    f = int(rows[k])
+    return min(f, g), max(f, g)
+
+def gen_joins_fast(D, bounded=False):
+    """
+    Neighbor joining over a numpy distance matrix.
+    Row sums are updated incrementally,
+    and the working matrix shrinks in place;
+    the new vertex takes the slot of the first neighbor
+    and the last row moves into the slot of the second neighbor.
+    Each iteration is O(n^2) vectorized work,
+    so the whole algorithm is O(n^3).
+    Ties in the Q criterion may be broken differently than in make_tree.
+    Each yielded join is a (serials, branch lengths, new serial) triple.
+    The last join has three serials instead of two.
+    @param D: a distance matrix
+    @param bounded: True to skip rows of the Q matrix using a lower bound
+    """
+    D = np.array(D, dtype=float)
+    n = len(D)
+    R = D.sum(axis=1)
+    serials = range(n)
+    next_serial = n
+    if bounded:
+        dmin = D + np.diag(np.repeat(np.inf, n))
+        dmin = np.min(dmin, axis=1)
+    for m in range(n, 3, -1):
+        # select the neighbors
+        if bounded:
+            f, g = _get_bounded_neighbors(D, R, dmin, m)
+        else:
+            Q = (m-2)*D[:m, :m] - R[:m, np.newaxis] - R[np.newaxis, :m]
+            np.fill_diagonal(Q, np.inf)
+            f, g = divmod(int(np.argmin(Q)), m)
+        # get the branch lengths to the new vertex
+        d_fg = D[f, g]
+        blen_f = float(d_fg / 2.0 + (R[f] - R[g]) / (2.0*(m-2)))
+        blen_g = float(d_fg - blen_f)
+        yield (serials[f], serials[g]), (blen_f, blen_g), next_serial
+        # rows whose smallest distance was to a neighbor must be rescanned
+        if bounded:
+            stale = (D[:m, f] == dmin[:m]) | (D[:m, g] == dmin[:m])
+        # get the distances to the new vertex and update the row sums
+        d_new = (D[f, :m] + D[g, :m] - d_fg) / 2.0
+        R[:m] += d_new - D[f, :m] - D[g, :m]
+        d_new[f] = 0
+        R[f] = np.sum(d_new) - d_new[g]
+        # put the new vertex in the slot of the first neighbor
+        D[f, :m] = d_new
+        D[:m, f] = d_new
+        serials[f] = next_serial
+        next_serial += 1
+        # move the last vertex into the slot of the second neighbor
+        last = m-1
+        if g != last:
+            D[g, :m] = D[last, :m]
+            D[:m, g] = D[:m, last]
+            D[g, g] = 0
+            R[g] = R[last]
+            serials[g] = serials[last]
+        # update the smallest distance in each row
+        if bounded:
+            if g != last:
+                dmin[g] = dmin[last]
+                stale[g] = stale[last]
+            stale[f] = True
+            dmin[:last] = np.minimum(dmin[:last], D[:last, f])
+            for i in np.flatnonzero(stale[:last]):
+                row = D[i, :last].copy()
+                row[i] = np.inf
+                dmin[i] = np.min(row)
+    # join the last three vertices
+    d = D[:3, :3]
+    blens = (
+            float(d[0, 1] + d[0, 2] - d[1, 2]) / 2.0,
+            float(d[0, 1] + d[1, 2] - d[0, 2]) / 2.0,
+            float(d[0, 2] + d[1, 2] - d[0, 1]) / 2.0)
+    yield tuple(serials[:3]), blens, next_serial
+
+def make_tree_fast(D, ordered_states, bounded=False):
+    """
+    Create a newick tree from a distance matrix using neighbor joining.
+    This should give the same tree as make_tree except possibly for ties.
+    @param D: a distance matrix
+    @param ordered_states: state names ordered according to the distance matrix
+    @param bounded: True to skip rows of the Q matrix using a lower bound
+    @return: a newick tree
+    """
+    if len(ordered_states) < 3:
+        raise ValueError('the neighbor joining algorithm needs at least three nodes')
+    forest = {}
+    for serials, blens, next_serial in gen_joins_fast(D, bounded):
+        root = Newick.NewickNode()
+        root.serial_number = next_serial
+        for serial, blen in zip(serials, blens):
+            neo = forest.pop(serial, None)
+            if not neo:
+                neo = Newick.NewickNode()
+                neo.serial_number = serial
+            root.add_child(neo)
+            neo.set_parent(root)
+            neo.blen = blen
+        forest[next_serial] = root
+    tree = Newick.NewickTree(root)
+    for node in tree.gen_tips():
+        node.name = ordered_states[node.serial_number]
+    return NewickIO.parse(tree.get_newick_string(), FelTree.NewickTree)
+
+
 class IterationFunctor:
     """
     This object is called for each iteration of the neighbor joining algorithm.
@@ -260,6 +396,34 @@ class TestNeighborJoining(unittest.TestCase):
         error_message = '\n'.join(lines)
         self.failIf(error_message, error_message)
 
+    def test_fast_mito_matrix(self):
+        expected_tree = NewickIO.parse(g_mito_tree_string, FelTree.NewickTree)
+        expected = TreeComparison.get_partitions_and_branch_lengths(
+                expected_tree)
+        expected_part_to_length = dict(expected)
+        for bounded in (False, True):
+            tree = make_tree_fast(g_mito_matrix, g_mito_states, bounded)
+            observed = TreeComparison.get_partitions_and_branch_lengths(tree)
+            observed_part_to_length = dict(observed)
+            self.assertEqual(
+                    set(observed_part_to_length), set(expected_part_to_length))
+            for part, length in observed:
+                abs_delta = abs(length - expected_part_to_length[part])
+                self.failUnless(abs_delta < .00001)
+
+    def test_fast_random_matrices(self):
+        rng = random.Random(1)
+        for n in (4, 7, 20, 40):
+            states = ['t%d' % i for i in range(n)]
+            X = np.array([[rng.random() for j in range(3)] for i in range(n)])
+            D = np.array([[np.sum(np.abs(x - y)) for y in X] for x in X])
+            expected = TreeComparison.get_partitions(
+                    make_tree(D.tolist(), states))
+            for bounded in (False, True):
+                observed = TreeComparison.get_partitions(
+                        make_tree_fast(D, states, bounded))
+                self.assertEqual(observed, expected)
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestNeighborJoining)
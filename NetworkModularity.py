@@ -2,8 +2,26 @@
 Implement the Newman and Girvan calculation of network modularity.
 This objective function defines how well a given partition of a graph
 represents its underlying connectivity.
+
+The dense functions evaluate a given partition.
+The sparse functions find a good partition of a large graph
+using the multilevel method of Blondel et al. (Louvain).
+The state of a partition keeps the total degree of each community,
+so the change of modularity caused by moving one node
+costs time proportional to the degree of the node.
+Run the scaling benchmark using
+$ python NetworkModularity.py --benchmark
 """
 
+import unittest
+import argparse
+import time
+import sys
+
+import numpy as np
+import scipy.sparse
+
+
 def get_eric_modularity(A, cluster_indices):
     """
     @param A: an affinity matrix defining a graph
@@ -63,7 +81,7 @@ def get_modularity_other_b2(A, cluster_indices):
     # define the number of nodes in the graph and the number of clusters
     n = len(cluster_indices)
     nclusters = max(cluster_indices) + 1
-    girvan_e = numpy.zeros((nclusters, nclusters))
+    girvan_e = np.zeros((nclusters, nclusters))
     volume = 0
     for i in range(n):
         for j in range(n):
@@ -93,7 +111,7 @@ def get_modularity_other_b(A, cluster_indices):
     # define the number of nodes in the graph and the number of clusters
     n = len(cluster_indices)
     nclusters = max(cluster_indices) + 1
-    girvan_e = numpy.zeros((nclusters, nclusters))
+    girvan_e = np.zeros((nclusters, nclusters))
     volume = 0
     for i in range(n):
         for j in range(n):
@@ -147,14 +165,326 @@ def get_modularity_other_a(A, cluster_indices):
         modularity += within/volume - ((within+between) / volume)**2
     return modularity
 
+def get_sparse_modularity(A, cluster_indices):
+    """
+    This gives the same value as get_modularity_other_c.
+    @param A: a sparse or dense symmetric affinity matrix
+    @param cluster_indices: a conformant vector of cluster indices
+    @return: the modularity of the partition
+    """
+    A = scipy.sparse.coo_matrix(A)
+    labels = np.asarray(cluster_indices)
+    degrees = np.bincount(A.row, A.data, minlength=A.shape[0])
+    volume = degrees.sum()
+    within = A.data[labels[A.row] == labels[A.col]].sum()
+    cluster_degrees = np.bincount(labels, degrees)
+    return within / volume - np.sum((cluster_degrees / volume)**2)
+
+
+class ModularityState:
+    """
+    A partition of the nodes of a sparse graph into communities.
+    For each community this keeps the sum of the node degrees
+    and the sum of the weights of the within-community entries of A.
+    The weights of the entries are counted in both directions
+    and self loops are counted once,
+    as in the dense definitions of modularity.
+    """
+
+    def __init__(self, A, cluster_indices=None):
+        """
+        @param A: a sparse or dense symmetric affinity matrix
+        @param cluster_indices: None to put each node in its own community
+        """
+        A = scipy.sparse.csr_matrix(A, dtype=float)
+        n = A.shape[0]
+        # use lists because the node moves are scalar operations
+        self.indptr = A.indptr.tolist()
+        self.indices = A.indices.tolist()
+        self.data = A.data.tolist()
+        self.loops = A.diagonal().tolist()
+        self.degrees = np.asarray(A.sum(axis=1)).ravel().tolist()
+        self.volume = sum(self.degrees)
+        if not self.volume:
+            raise ValueError('the graph has no edges')
+        if cluster_indices is None:
+            cluster_indices = range(n)
+        self.labels = list(cluster_indices)
+        ncommunities = max(self.labels) + 1
+        self.community_degrees = [0.0] * ncommunities
+        self.community_within = [0.0] * ncommunities
+        for i, a in enumerate(self.labels):
+            self.community_degrees[a] += self.degrees[i]
+            for j, weight in self.gen_neighbors(i):
+                if self.labels[j] == a:
+                    self.community_within[a] += weight
+            self.community_within[a] += self.loops[i]
+
+    def gen_neighbors(self, i):
+        """
+        @param i: a node
+        @return: (neighbor, weight) pairs not including a self loop
+        """
+        for offset in range(self.indptr[i], self.indptr[i+1]):
+            j = self.indices[offset]
+            if j != i:
+                yield j, self.data[offset]
+
+    def get_modularity(self):
+        """
+        @return: the modularity of the partition
+        """
+        volume = self.volume
+        return sum(within / volume - (degree / volume)**2
+                for within, degree in zip(
+                    self.community_within, self.community_degrees))
+
+    def get_community_weights(self, i):
+        """
+        @param i: a node
+        @return: a map from each neighboring community to its link weight
+        """
+        weights = {}
+        labels = self.labels
+        for offset in range(self.indptr[i], self.indptr[i+1]):
+            j = self.indices[offset]
+            if j != i:
+                b = labels[j]
+                weights[b] = weights.get(b, 0.0) + self.data[offset]
+        return weights
+
+    def get_move_gain(self, i, b, weights):
+        """
+        Get the change of modularity caused by moving a node.
+        @param i: a node
+        @param b: the community to which the node would move
+        @param weights: the community weights of the node
+        @return: the change of modularity
+        """
+        a = self.labels[i]
+        if a == b:
+            return 0.0
+        k = self.degrees[i]
+        volume = self.volume
+        link_change = weights.get(b, 0.0) - weights.get(a, 0.0)
+        degree_change = self.community_degrees[b] - self.community_degrees[a] + k
+        return 2 * link_change / volume - 2 * k * degree_change / volume**2
+
+    def move(self, i, b, weights):
+        """
+        @param i: a node
+        @param b: the community to which the node moves
+        @param weights: the community weights of the node
+        """
+        a = self.labels[i]
+        if a == b:
+            return
+        k = self.degrees[i]
+        loop = self.loops[i]
+        self.community_degrees[a] -= k
+        self.community_degrees[b] += k
+        self.community_within[a] -= 2 * weights.get(a, 0.0) + loop
+        self.community_within[b] += 2 * weights.get(b, 0.0) + loop
+        self.labels[i] = b
+
+    def get_best_move(self, i):
+        """
+        Ties are broken in favor of staying and then of the smallest index.
+        @param i: a node
+        @return: the best community for the node, its gain, and the weights
+        """
+        weights = self.get_community_weights(i)
+        best_b = self.labels[i]
+        best_gain = 0.0
+        for b in sorted(weights):
+            gain = self.get_move_gain(i, b, weights)
+            if gain > best_gain:
+                best_b, best_gain = b, gain
+        return best_b, best_gain, weights
+
+    def get_compact_labels(self):
+        """
+        @return: community indices renumbered from zero in order of appearance
+        """
+        labels = np.array(self.labels)
+        unique, first, inverse = np.unique(
+                labels, return_index=True, return_inverse=True)
+        rank = np.empty(len(unique), dtype=int)
+        rank[np.argsort(first, kind='mergesort')] = np.arange(len(unique))
+        return rank[inverse]
+
+
+def local_moving(state, rs, tol=1e-10, maxpasses=None):
+    """
+    Move single nodes to neighboring communities while modularity improves.
+    Each pass visits the nodes in an order from the random state.
+    @param state: a ModularityState which is modified
+    @param rs: a numpy RandomState
+    @param tol: stop when a pass improves modularity by at most this much
+    @param maxpasses: None or the largest number of passes
+    @return: True if any node moved
+    """
+    n = len(state.labels)
+    moved = False
+    npasses = 0
+    while maxpasses is None or npasses < maxpasses:
+        npasses += 1
+        improvement = 0.0
+        for i in rs.permutation(n).tolist():
+            b, gain, weights = state.get_best_move(i)
+            if gain > 0:
+                state.move(i, b, weights)
+                improvement += gain
+                moved = True
+        if improvement <= tol:
+            break
+    return moved
+
+def aggregate(A, labels):
+    """
+    Build the graph whose nodes are the communities.
+    The self loop of each community node has the within-community weight.
+    @param A: a sparse symmetric affinity matrix
+    @param labels: community indices from zero without gaps
+    @return: a sparse affinity matrix of the communities
+    """
+    n = A.shape[0]
+    ncommunities = max(labels) + 1
+    P = scipy.sparse.csr_matrix(
+            (np.ones(n), (np.arange(n), labels)), shape=(n, ncommunities))
+    return (P.T * A * P).tocsr()
+
+def louvain(A, seed=0, tol=1e-10, maxlevels=None):
+    """
+    Find a partition of high modularity by the Louvain method.
+    Each level moves single nodes until no move improves modularity
+    and then merges each community into a node of a smaller graph.
+    The result is deterministic given the seed.
+    @param A: a sparse or dense symmetric affinity matrix
+    @param seed: the seed of the random order of the nodes
+    @param tol: the smallest modularity improvement of a pass of moves
+    @param maxlevels: None or the largest number of levels
+    @return: community indices from zero and the modularity
+    """
+    rs = np.random.RandomState(seed)
+    A = scipy.sparse.csr_matrix(A, dtype=float)
+    membership = np.arange(A.shape[0])
+    nlevels = 0
+    while maxlevels is None or nlevels < maxlevels:
+        nlevels += 1
+        state = ModularityState(A)
+        if not local_moving(state, rs, tol):
+            break
+        labels = state.get_compact_labels()
+        membership = labels[membership]
+        A = aggregate(A, labels)
+    return membership, ModularityState(A).get_modularity()
+
+
+def _get_planted_partition(n, ncommunities, degree_in, degree_out, rs):
+    """
+    @return: a random sparse symmetric affinity matrix and its communities
+    """
+    labels = rs.randint(ncommunities, size=n)
+    members = [np.flatnonzero(labels == a) for a in range(ncommunities)]
+    rows = []
+    cols = []
+    for a, nodes in enumerate(members):
+        m = len(nodes) * degree_in // 2
+        rows.append(rs.choice(nodes, m))
+        cols.append(rs.choice(nodes, m))
+    m = n * degree_out // 2
+    rows.append(rs.randint(n, size=m))
+    cols.append(rs.randint(n, size=m))
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    keep = rows != cols
+    rows, cols = rows[keep], cols[keep]
+    A = scipy.sparse.coo_matrix(
+            (np.ones(len(rows)), (rows, cols)), shape=(n, n))
+    return (A + A.T).tocsr(), labels
+
+def benchmark(sizes, seed=0):
+    """
+    Time the Louvain method on planted partition graphs.
+    @param sizes: the numbers of nodes
+    @param seed: random seed
+    """
+    rs = np.random.RandomState(seed)
+    print 'n', 'edges', 'seconds', 'communities', 'modularity', 'planted'
+    for n in sizes:
+        A, planted = _get_planted_partition(n, max(2, n // 100), 12, 4, rs)
+        tm = time.time()
+        labels, modularity = louvain(A, seed)
+        elapsed = time.time() - tm
+        row = [n, A.nnz // 2, '%.3f' % elapsed, max(labels) + 1,
+                '%.4f' % modularity,
+                '%.4f' % get_sparse_modularity(A, planted)]
+        print '\t'.join(str(x) for x in row)
+
+
+class TestNetworkModularity(unittest.TestCase):
+
+    def test_symmetric_example(self):
+        A = np.array(g_symmetric_example)
+        for labels in ([0, 0, 0, 1, 1, 1], [1, 1, 1, 0, 0, 0]):
+            self.assertTrue(np.allclose(
+                get_sparse_modularity(A, labels), 5.0 / 14.0))
+        labels, modularity = louvain(A)
+        self.assertEqual(labels.tolist(), [0, 0, 0, 1, 1, 1])
+        self.assertTrue(np.allclose(modularity, 5.0 / 14.0))
+
+    def test_oracle(self):
+        """
+        Compare the sparse state to the dense implementations.
+        """
+        rs = np.random.RandomState(0)
+        n = 20
+        A, planted = _get_planted_partition(n, 3, 4, 2, rs)
+        A = A + scipy.sparse.diags(rs.randint(0, 2, size=n).astype(float))
+        dense = A.toarray().tolist()
+        labels = rs.randint(4, size=n).tolist()
+        state = ModularityState(A, labels)
+        for iteration in range(50):
+            expected = get_eric_modularity(dense, state.labels)
+            self.assertTrue(np.allclose(
+                expected, get_modularity_other_c(dense, state.labels)))
+            self.assertTrue(np.allclose(
+                expected, get_sparse_modularity(A, state.labels)))
+            self.assertTrue(np.allclose(expected, state.get_modularity()))
+            # check the predicted change of a random move
+            i = rs.randint(n)
+            b = rs.randint(4)
+            weights = state.get_community_weights(i)
+            gain = state.get_move_gain(i, b, weights)
+            state.move(i, b, weights)
+            self.assertTrue(np.allclose(
+                expected + gain, state.get_modularity()))
+
+    def test_louvain(self):
+        rs = np.random.RandomState(1)
+        A, planted = _get_planted_partition(300, 5, 16, 2, rs)
+        labels, modularity = louvain(A, seed=2)
+        self.assertTrue(np.allclose(
+            modularity, get_sparse_modularity(A, labels)))
+        self.assertTrue(modularity >= get_sparse_modularity(A, planted) - 1e-9)
+        # the communities match the planted communities
+        self.assertEqual(len(set(zip(labels, planted))), 5)
+        # the same seed gives the same partition
+        again, again_modularity = louvain(A, seed=2)
+        self.assertEqual(labels.tolist(), again.tolist())
+
+
+g_symmetric_example = [
+        [0, 1, 1, 0, 0, 0],
+        [1, 0, 1, 0, 0, 0],
+        [1, 1, 0, 1, 0, 0],
+        [0, 0, 1, 0, 1, 1],
+        [0, 0, 0, 1, 0, 1],
+        [0, 0, 0, 1, 1, 0]]
+
 def main():
-    A = [
-            [0, 1, 1, 0, 0, 0],
-            [1, 0, 1, 0, 0, 0],
-            [1, 1, 0, 1, 0, 0],
-            [0, 0, 1, 0, 1, 1],
-            [0, 0, 0, 1, 0, 1],
-            [0, 0, 0, 1, 1, 0]]
+    A = g_symmetric_example
     cluster = [0, 0, 0, 1, 1, 1]
     print 'testing the symmetric example'
     Q = get_eric_modularity(A, cluster)
@@ -162,4 +492,12 @@ def main():
     print 'calculated by hand:', 5.0 / 14.0
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmark', action='store_true',
+            help='time the Louvain method on graphs of increasing size')
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark([1000, 2000, 5000, 10000, 20000])
+    else:
+        main()
+        unittest.main(argv=sys.argv[:1])
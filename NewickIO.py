@@ -6,7 +6,9 @@ It is closely related to the Newick module
 which imports many of these functions.
 """
 
+from StringIO import StringIO
 import unittest
+import re
 
 # This is a rooted version of the tree on page 573 of Inferring Phylogenies by Joseph Felsenstein.
 rooted_example_tree = "(((((((A:4, B:4):6.125, C:5.1):8, D:6):3, E:21):10, ((F:4, G:12):14, H:8):13):13, ((I:5, J:2):30, (K:11, L:11):2):17):4, M:56);"
@@ -30,20 +32,15 @@ itol_archaea_tree = """
 class NewickSyntaxError(Exception):
     pass
 
-def _lex_newick_raw(s):
-    """
-    Split a newick string into punctuation and non-punctuation.
-    """
-    punctuation = tuple('():,;[]') 
-    symbol = ''
-    for c in s:
-        if c in punctuation:
-            yield symbol
-            yield c
-            symbol = ''
-        else:
-            symbol += c
-    yield symbol
+# Symbols that cannot be internal node names.
+g_newick_punctuation = frozenset(':;(),')
+
+# Punctuation symbols and whitespace-stripped runs of non-punctuation.
+g_newick_token_pattern = re.compile(
+        r'[():,;\[\]]|[^():,;\[\]\s](?:[^():,;\[\]]*[^():,;\[\]\s])?')
+
+# Symbols that affect the splitting of a stream into trees.
+g_newick_boundary_pattern = re.compile(r'[\[\];]')
 
 def _lex_newick(s):
     """
@@ -53,22 +50,25 @@ def _lex_newick(s):
     Note that this method allows whitespace inside node names
     but not leading or terminal whitespace.
     Also this function removes bracketed symbols.
+    @return: a list of symbols
     """
+    raw_symbols = g_newick_token_pattern.findall(s)
+    if '[' not in s and ']' not in s:
+        return raw_symbols
+    symbols = []
     bracket_depth = 0
-    for symbol in _lex_newick_raw(s):
-        symbol = symbol.strip()
-        if not symbol:
-            continue
+    for symbol in raw_symbols:
         if symbol == '[':
             bracket_depth += 1
         elif symbol == ']':
             bracket_depth -= 1
         elif bracket_depth == 0:
-            yield symbol
+            symbols.append(symbol)
         if bracket_depth < 0:
             raise NewickSyntaxError('unmatched bracket')
     if bracket_depth != 0:
         raise NewickSyntaxError('unbalanced brackets')
+    return symbols
 
 
 # In this experimental section we use a new API.
@@ -104,6 +104,10 @@ def _pnh(tree, symbols, index):
     """
     This uses the simplified API.
     Parse Newick Helper.
+    The subtree is parsed iteratively using an explicit stack
+    of open internal nodes, so deep trees do not hit the recursion limit.
+    The user tree sees the same sequence of calls
+    as it would from a recursive descent parser.
     @param tree: the object provided by the user
     @param symbols: the output of the newick lexer
     @param index: the current position in the symbol list
@@ -112,57 +116,63 @@ def _pnh(tree, symbols, index):
     if symbols[-1] != ';':
         raise NewickSyntaxError(
                 'the newick symbol list should end with a semicolon')
-    if index >= len(symbols):
-        raise NewickSyntaxError('premature string termination')
-    root = tree.create_root()
-    if symbols[index] == ',':
-        # Hitting this symbol when we expect a new node means that
-        # an unnamed node with no branch length was found.
-        return (root, index)
-    elif symbols[index] == ')':
-        # Hitting this symbol when we expect a new node means that
-        # an unnamed node with no branch length was found
-        # and that the list terminates.
-        return (root, index)
-    elif symbols[index] == ':':
-        # Hitting this symbol when we expect a new node means that
-        # an unnamed node with a branch length was found.
-        next_index = _pnh_blen(tree, symbols, index, root)
-        return (root, next_index)
-    elif symbols[index] == '(':
-        # Hitting this symbol when we expect a new node means that
-        # one or more child nodes must be created
-        # in addition to the root node.
-        index += 1
-        while True:
-            child, index = _pnh(tree, symbols, index)
-            tree.add_child(root, child)
-            if symbols[index] == ',':
+    nsymbols = len(symbols)
+    stack = []
+    while True:
+        # Start a new node.
+        if index >= nsymbols:
+            raise NewickSyntaxError('premature string termination')
+        node = tree.create_root()
+        symbol = symbols[index]
+        if symbol == '(':
+            # Hitting this symbol when we expect a new node means that
+            # one or more child nodes must be created
+            # in addition to this node.
+            stack.append(node)
+            index += 1
+            continue
+        elif symbol == ',' or symbol == ')':
+            # Hitting either symbol when we expect a new node means that
+            # an unnamed node with no branch length was found.
+            pass
+        elif symbol == ':':
+            # Hitting this symbol when we expect a new node means that
+            # an unnamed node with a branch length was found.
+            index = _pnh_blen(tree, symbols, index, node)
+        elif symbol == ';':
+            raise NewickSyntaxError('found the ";" terminator prematurely')
+        else:
+            # Hitting an unrecognized symbol means that
+            # we are starting a named node.
+            tree.set_name(node, symbol)
+            if symbols[index+1] == ':':
+                index = _pnh_blen(tree, symbols, index+1, node)
+            else:
+                index += 1
+        # The node is complete, so attach it to its parent
+        # and close each internal node whose child list terminates.
+        while stack:
+            parent = stack[-1]
+            tree.add_child(parent, node)
+            symbol = symbols[index]
+            if symbol == ',':
                 index += 1
-            elif symbols[index] == ')':
-                if symbols[index+1] not in list(':;(),'):
-                    tree.set_name(root, symbols[index+1])
+                break
+            elif symbol == ')':
+                node = stack.pop()
+                if symbols[index+1] not in g_newick_punctuation:
+                    tree.set_name(node, symbols[index+1])
                     index += 1
                 if symbols[index+1] == ':':
-                    next_index = _pnh_blen(tree, symbols, index+1, root)
+                    index = _pnh_blen(tree, symbols, index+1, node)
                 else:
-                    next_index = index+1
-                return (root, next_index)
+                    index += 1
             else:
                 raise NewickSyntaxError(
                         'found "%s" instead of '
-                        'a comma or a closing parenthesis' % symbols[index])
-    elif symbols[index] == ';':
-        raise NewickSyntaxError('found the ";" terminator prematurely')
-    else:
-        # Hitting an unrecognized symbol means that
-        # we are starting a named node.
-        tree.set_name(root, symbols[index])
-        if symbols[index+1] == ':':
-            next_index = _pnh_blen(tree, symbols, index+1, root)
+                        'a comma or a closing parenthesis' % symbol)
         else:
-            next_index = index+1
-        return (root, next_index)
+            return (node, index)
 
 def parse_simple(s, tree):
     """
@@ -175,7 +185,7 @@ def parse_simple(s, tree):
     """
     if not s:
         raise NewickSyntaxError('empty tree string')
-    symbols = list(_lex_newick(s))
+    symbols = _lex_newick(s)
     if symbols.count('(') != symbols.count(')'):
         raise NewickSyntaxError('parenthesis mismatch')
     if not symbols[-1] == ';':
@@ -227,6 +237,62 @@ def parse(s, tree_factory):
     return parse_simple(s, _T_wrapper(tree_factory())).tree
 
 
+def gen_newick_strings(fin, chunk_size=1<<16):
+    """
+    Yield the newick strings of a stream that has many trees.
+    Each yielded string ends with its semicolon.
+    Semicolons within bracketed comments do not end a tree.
+    Only one tree at a time is held in memory.
+    @param fin: an open file or any iterable of strings
+    @param chunk_size: the number of characters to read at a time
+    """
+    if hasattr(fin, 'read'):
+        chunks = iter(lambda: fin.read(chunk_size), '')
+    else:
+        chunks = fin
+    bracket_depth = 0
+    pieces = []
+    for chunk in chunks:
+        begin = 0
+        for m in g_newick_boundary_pattern.finditer(chunk):
+            c = m.group()
+            if c == '[':
+                bracket_depth += 1
+            elif c == ']':
+                bracket_depth -= 1
+                if bracket_depth < 0:
+                    raise NewickSyntaxError('unmatched bracket')
+            elif not bracket_depth:
+                pieces.append(chunk[begin:m.end()])
+                begin = m.end()
+                yield ''.join(pieces).strip()
+                pieces = []
+        pieces.append(chunk[begin:])
+    remainder = ''.join(pieces).strip()
+    if remainder:
+        raise NewickSyntaxError(
+                'the last newick string should end with a semicolon')
+
+def gen_parse_simple(fin, tree_maker):
+    """
+    Parse each tree of a stream that has many trees.
+    @param fin: an open file or any iterable of strings
+    @param tree_maker: a callable that returns a new tree for the new API
+    """
+    for s in gen_newick_strings(fin):
+        yield parse_simple(s, tree_maker())
+
+def gen_parse(fin, tree_factory):
+    """
+    Parse each tree of a stream that has many trees.
+    This is like the old parse function.
+    @param fin: an open file or any iterable of strings
+    @param tree_factory: a callable that returns a tree given a root
+    """
+    for s in gen_newick_strings(fin):
+        yield parse(s, tree_factory)
+
+
 # Remaining functions.
 
 def _get_name_string(node):
@@ -444,6 +510,37 @@ class TestNewick(unittest.TestCase):
         observed_b = get_narrow_newick_string(tree, 5)
         self.assertEquals(observed_a, observed_b)
 
+    def test_deep_caterpillar(self):
+        if not self.TreeFactory:
+            return
+        n = 5000
+        tree_string = '(' * (n-1) + 'x0' + ''.join(
+                ', x%d)' % i for i in range(1, n)) + ';'
+        parse(tree_string, self.TreeFactory)
+
+    def test_gen_parse(self):
+        if not self.TreeFactory:
+            return
+        tree_strings = [
+                '((a, b), c)[comment; with a semicolon];',
+                '(a, (b, c));',
+                'a;']
+        fin = StringIO('\n'.join(tree_strings) + '\n')
+        trees = list(gen_parse(fin, self.TreeFactory))
+        self.assertEqual(len(trees), 3)
+        observed = [get_newick_string(tree) for tree in trees]
+        expected = ['((a, b), c);', '(a, (b, c));', 'a;']
+        self.assertEqual(observed, expected)
+
+    def test_gen_newick_strings(self):
+        chunks = ['(a, b', ');(c', ', [x;y]d);', '\n']
+        observed = list(gen_newick_strings(chunks))
+        expected = ['(a, b);', '(c, [x;y]d);']
+        self.assertEqual(observed, expected)
+        bad_chunks = ['(a, b);', '(c, d)']
+        self.assertRaises(NewickSyntaxError, list,
+                gen_newick_strings(bad_chunks))
+
     def test_printing_without_branch_lengths(self):
         if not self.TreeFactory:
             return
@@ -7,15 +7,23 @@ Assume a Markov process with a known rate matrix.
 import unittest
 import math
 import random
+from collections import OrderedDict
 
 import numpy as np
 from numpy import linalg
+import scipy.linalg
 import scipy.stats
 
 import Util
 import RateMatrix
 import MatrixUtil
 
+# the default number of matrix powers or column stacks to keep
+g_default_cache_size = 64
+
+# the neglected probability of the conditional number of jumps
+g_jump_count_tol = 1e-12
+
 
 def sample_endpoint_conditioned_path(
         initial_state, final_state, path_length, P):
@@ -70,20 +78,192 @@ def sample_endpoint_conditioned_path(
 class MatrixPowerCache:
     """
     Get various powers of a matrix with caching for speed.
+    At most cache_size powers are kept,
+    and the least recently used power is evicted first.
+    A power is computed from the previous power if it is cached,
+    and otherwise by repeated squaring.
     """
-    def __init__(self, matrix):
-        self.matrix_powers = []
-        self.matrix_powers.append(np.eye(matrix.shape[0], matrix.shape[1]))
-        self.matrix_powers.append(matrix)
+    def __init__(self, matrix, cache_size=g_default_cache_size):
+        """
+        @param matrix: a square numpy array
+        @param cache_size: the maximum number of cached powers
+        """
+        self.matrix = matrix
+        self.identity = np.eye(matrix.shape[0], matrix.shape[1])
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        # the matrix raised to the powers 1, 2, 4, 8, ...
+        self.squares = [matrix]
+
+    def _get_known_power(self, power):
+        if power == 0:
+            return self.identity
+        elif power == 1:
+            return self.matrix
+        return self.cache.get(power)
+
+    def _get_uncached_power(self, power):
+        previous = self._get_known_power(power - 1)
+        if previous is not None:
+            return np.dot(previous, self.matrix)
+        result = self.identity
+        k = 0
+        while power:
+            if len(self.squares) <= k:
+                last = self.squares[-1]
+                self.squares.append(np.dot(last, last))
+            if power & 1:
+                result = np.dot(result, self.squares[k])
+            power >>= 1
+            k += 1
+        return result
 
     def get_power(self, power):
-        while len(self.matrix_powers) <= power:
-            matrix = self.matrix_powers[1]
-            last_matrix = self.matrix_powers[-1]
-            new_matrix = np.dot(matrix, last_matrix)
-            self.matrix_powers.append(new_matrix)
-        return self.matrix_powers[power]
+        M = self._get_known_power(power)
+        if power < 2:
+            return M
+        if M is None:
+            M = self._get_uncached_power(power)
+        else:
+            del self.cache[power]
+        self.cache[power] = M
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return M
+
+
+class UniformizationSampler:
+    """
+    Sample many endpoint conditioned paths of a continuous time process.
+    Follow the uniformization explanation in a manuscript
+    by Stone and Hobolth.
+    The paths are sampled in batches for a rate matrix and a path length.
+    For each final state b the columns R^m[:, b] of the powers
+    of the uniformized transition matrix R are computed
+    by matrix vector products and are kept in a bounded cache.
+    These columns give the conditional distribution of the number of jumps
+    for each initial state,
+    and they weight the virtual state draws of all paths at once.
+    """
 
+    def __init__(self, Q, path_length, cache_size=g_default_cache_size):
+        """
+        @param Q: a rate matrix as a numpy array
+        @param path_length: the length or time of each path
+        @param cache_size: the maximum number of cached final states
+        """
+        Q = np.asarray(Q, dtype=float)
+        self.nstates = len(Q)
+        self.path_length = path_length
+        self.max_rate = max(np.max(-np.diag(Q)), 1e-300)
+        self.R = np.eye(self.nstates) + Q / self.max_rate
+        self.P = scipy.linalg.expm(Q * path_length)
+        self.cache_size = cache_size
+        self.final_state_to_columns = OrderedDict()
+        self.poisson_pmf = np.zeros(0)
+
+    def _get_columns(self, final_state, njumps):
+        """
+        @param final_state: the final state index b
+        @param njumps: the least number of jumps to support
+        @return: an array whose row m is R^m[:, b] for m up to njumps
+        """
+        C = self.final_state_to_columns.pop(final_state, None)
+        if C is None:
+            C = np.zeros((1, self.nstates))
+            C[0, final_state] = 1
+        if len(C) <= njumps:
+            rows = [C[-1]]
+            for m in range(len(C), njumps+1):
+                rows.append(np.dot(self.R, rows[-1]))
+            C = np.vstack([C] + rows[1:])
+        self.final_state_to_columns[final_state] = C
+        while len(self.final_state_to_columns) > self.cache_size:
+            self.final_state_to_columns.popitem(last=False)
+        return C
+
+    def _get_poisson_pmf(self, njumps):
+        if len(self.poisson_pmf) <= njumps:
+            self.poisson_pmf = scipy.stats.poisson.pmf(
+                    np.arange(njumps+1), self.max_rate * self.path_length)
+        return self.poisson_pmf[:njumps+1]
+
+    def get_jump_count_distribution(self, initial_state, final_state):
+        """
+        Get the distribution of the number of uniformized jumps.
+        This includes virtual jumps from a state to itself.
+        @param initial_state: the initial state index
+        @param final_state: the final state index
+        @return: a numpy array of probabilities of 0, 1, 2, ... jumps
+        """
+        Pab = self.P[initial_state, final_state]
+        if Pab <= 0:
+            raise ValueError('the final state is unreachable')
+        mean = self.max_rate * self.path_length
+        njumps = int(mean + 10*math.sqrt(mean) + 10)
+        while True:
+            C = self._get_columns(final_state, njumps)
+            weights = self._get_poisson_pmf(njumps) * C[:, initial_state]
+            total = np.sum(weights)
+            if total >= Pab * (1 - g_jump_count_tol):
+                break
+            if self._get_poisson_pmf(njumps)[-1] == 0:
+                break
+            njumps *= 2
+        return weights / total
+
+    def sample_paths(self, initial_state, final_state, npaths):
+        """
+        @param initial_state: the initial state index
+        @param final_state: the final state index
+        @param npaths: the number of paths to sample
+        @return: a list of npaths lists of (time, state) events
+        """
+        # draw the numbers of jumps including virtual jumps
+        cdf = np.cumsum(self.get_jump_count_distribution(
+            initial_state, final_state))
+        counts = np.searchsorted(cdf, np.random.rand(npaths) * cdf[-1])
+        max_count = np.max(counts) if npaths else 0
+        C = self._get_columns(final_state, max_count)
+        # draw the states after the jumps in all paths at once
+        states = np.empty((npaths, max_count+1), dtype=int)
+        states[:, 0] = initial_state
+        for i in range(1, max_count+1):
+            active = np.flatnonzero(counts >= i)
+            weights = self.R[states[active, i-1]] * C[counts[active] - i]
+            cumulative = np.cumsum(weights, axis=1)
+            u = np.random.rand(len(active)) * cumulative[:, -1]
+            choices = np.sum(cumulative <= u[:, np.newaxis], axis=1)
+            states[active, i] = np.minimum(choices, self.nstates - 1)
+        # draw the jump times and keep the jumps that change the state
+        used = np.arange(max_count) < counts[:, np.newaxis]
+        times = np.random.rand(npaths, max_count) * self.path_length
+        times[~used] = np.inf
+        times.sort(axis=1)
+        keep = (states[:, 1:] != states[:, :-1]) & used
+        paths = []
+        for k in range(npaths):
+            mask = keep[k]
+            paths.append(zip(times[k, mask].tolist(),
+                states[k, 1:][mask].tolist()))
+        return paths
+
+    def sample_site_paths(self, initial_states, final_states):
+        """
+        Sample one path for each site of an alignment.
+        The sites with the same endpoints are sampled together.
+        @param initial_states: the initial state index of each site
+        @param final_states: the final state index of each site
+        @return: a list of lists of (time, state) events, one per site
+        """
+        pair_to_sites = {}
+        for site, pair in enumerate(zip(initial_states, final_states)):
+            pair_to_sites.setdefault(pair, []).append(site)
+        site_paths = [None] * len(initial_states)
+        for (a, b), sites in pair_to_sites.items():
+            for site, path in zip(sites, self.sample_paths(a, b, len(sites))):
+                site_paths[site] = path
+        return site_paths
 
 
 def get_discrete_path_sample(initial_state, terminal_state, states, path_length, transition_matrix):
@@ -497,6 +677,80 @@ class TestNewerPathSampler(unittest.TestCase):
         expected = [0, 2, 2, 2]
         self.assertEqual(observed, expected)
 
+    def test_matrix_power_cache(self):
+        np.random.seed(0)
+        P = np.random.rand(5, 5)
+        P /= np.sum(P, axis=1)[:, np.newaxis]
+        cache = MatrixPowerCache(P, 3)
+        for power in (0, 1, 7, 2, 3, 4, 20, 5, 7, 13):
+            expected = linalg.matrix_power(P, power)
+            self.assertTrue(np.allclose(cache.get_power(power), expected))
+            self.assertTrue(len(cache.cache) <= 3)
+
+    def test_jump_count_distribution(self):
+        Q = _get_hky_rate_matrix()
+        sampler = UniformizationSampler(Q, 2.0)
+        a, b = 0, 1
+        observed = sampler.get_jump_count_distribution(a, b)
+        self.assertAlmostEqual(np.sum(observed), 1)
+        mu = sampler.max_rate * 2.0
+        for n in range(10):
+            pmf = scipy.stats.poisson.pmf(n, mu)
+            expected = pmf * linalg.matrix_power(sampler.R, n)[a, b]
+            self.assertAlmostEqual(observed[n], expected / sampler.P[a, b])
+
+    def test_batch_uniformization(self):
+        """
+        Compare batched uniformization to modified rejection sampling.
+        """
+        np.random.seed(0)
+        random.seed(0)
+        states = 'ACGT'
+        Q = _get_hky_rate_matrix()
+        rate_matrix = dict(((a, b), Q[i, j])
+                for i, a in enumerate(states) for j, b in enumerate(states))
+        path_length = 2
+        sampler = UniformizationSampler(Q, path_length)
+        paths = sampler.sample_paths(0, 1, 1000)
+        for path in paths:
+            self.assertEqual(path[-1][1], 1)
+            times = [t for t, state in path]
+            self.assertEqual(times, sorted(times))
+            self.assertTrue(0 <= times[0] and times[-1] <= path_length)
+            path_states = [0] + [state for t, state in path]
+            for x, y in zip(path_states[:-1], path_states[1:]):
+                self.assertNotEqual(x, y)
+        nielsen_paths = []
+        while len(nielsen_paths) < 200:
+            events = get_nielsen_sample(
+                    'A', 'C', states, path_length, rate_matrix)
+            if events is not None:
+                nielsen_paths.append(events)
+        # compare the numbers of changes and the times of the first changes
+        for f in (len, lambda events: events[0][0]):
+            t, p = scipy.stats.mannwhitneyu(
+                    [f(x) for x in paths], [f(x) for x in nielsen_paths])
+            self.failIf(p < .001, p)
+
+    def test_site_paths(self):
+        np.random.seed(0)
+        sampler = UniformizationSampler(_get_hky_rate_matrix(), 0.1)
+        initial_states = [0, 1, 2, 0, 3, 0]
+        final_states = [0, 1, 2, 1, 3, 0]
+        paths = sampler.sample_site_paths(initial_states, final_states)
+        self.assertEqual(len(paths), len(initial_states))
+        for a, b, path in zip(initial_states, final_states, paths):
+            self.assertEqual(path[-1][1] if path else a, b)
+
+
+def _get_hky_rate_matrix():
+    distribution = {'A':.2,'C':.3,'G':.3,'T':.2}
+    rate_matrix_object = RateMatrix.get_unscaled_hky85_rate_matrix(
+            distribution, 2)
+    rate_matrix_object.normalize()
+    rate_matrix = rate_matrix_object.get_dictionary_rate_matrix()
+    return np.array([[rate_matrix[(a, b)] for b in 'ACGT'] for a in 'ACGT'])
+
 
 if __name__ == '__main__':
     unittest.main()
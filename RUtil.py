@@ -7,6 +7,19 @@ For example
 options( tikzMetricsDictionary='/home/username/.tikzMetricsDictionary' )
 Otherwise it takes a few seconds to generate a temporary dictionary
 every time you want to make a tikz.
+
+By default each call starts a new R process.
+After start_pool is called, the same functions instead send their scripts
+over pipes to long-lived R worker processes,
+so R starts and loads its libraries once per worker instead of once per call.
+Tables made by get_table_string are sent to the workers
+as binary columns instead of as text.
+The web servers start the pool when they are launched:
+run.py takes a --r-workers option,
+and wsgi.py calls start_pool_from_environment,
+which reads the number of workers from the RUTIL_WORKERS
+environment variable and the R libraries to preload
+from the comma separated RUTIL_LIBRARIES variable.
 """
 
 from StringIO import StringIO
@@ -15,6 +28,13 @@ import os
 import re
 import unittest
 import subprocess
+import select
+import struct
+import fcntl
+import threading
+import atexit
+import Queue
+import time
 
 import Util
 
@@ -84,6 +104,12 @@ class RTableError(Exception):
     """
     pass
 
+class RTimeoutError(RError):
+    """
+    This is an R worker taking too long to run a script.
+    """
+    pass
+
 # pillaged from Carbone.py
 def is_valid_header(h):
     return re.match(g_header_pattern, h)
@@ -111,6 +137,10 @@ def run(pathname, rlocations=g_rlocations):
     @param rlocations: place to look for R
     @return: (returncode, r_stdout, r_stderr)
     """
+    pool = get_pool(rlocations)
+    if pool is not None:
+        with open(pathname) as fin:
+            return pool.evaluate(fin.read())
     proc = None
     for rlocation in rlocations:
         # Note that we do not use --vanilla because we need ~/.Rprofile
@@ -159,7 +189,11 @@ def run_with_table_verbose(table, user_data, callback):
     script_content = callback(user_data, f_temp_table)
     f_temp_script = Util.create_tmp_file(script_content)
     # Call R.
-    retcode, r_out, r_err = run(f_temp_script)
+    pool = get_pool()
+    if pool is not None:
+        retcode, r_out, r_err = pool.evaluate(script_content)
+    else:
+        retcode, r_out, r_err = run(f_temp_script)
     # To facilitate debugging, only delete temporary files if R was successful.
     if not retcode:
         # Delete the temporary data table file.
@@ -211,6 +245,12 @@ def run_plotter(table, user_script_content, device_name,
     @param keep_intermediate: a flag to keep the intermediate files
     @return: returncode, r_stdout, r_stderr, image_data
     """
+    pool = get_pool()
+    if pool is not None and not keep_intermediate:
+        retcode, r_out, r_err, image_data_list = pool.run_plotter(
+                table, [user_script_content], device_name, width, height)
+        image_data = image_data_list[0] if image_data_list else None
+        return retcode, r_out, r_err, image_data
     temp_table_name = Util.create_tmp_file(table, suffix='.table')
     temp_plot_name = Util.get_tmp_filename()
     s = StringIO()
@@ -251,6 +291,9 @@ def run_plotter_multiple_scripts(table, scripts, device_name,
     @return: returncode, r_stdout, r_stderr, image_data
     """
     #TODO: reorganize the code to combine this with run_plotter
+    pool = get_pool()
+    if pool is not None:
+        return pool.run_plotter(table, scripts, device_name, width, height)
     temp_table_name = Util.create_tmp_file(table)
     temp_plot_names = [Util.get_tmp_filename() for x in scripts]
     s = StringIO()
@@ -289,6 +332,12 @@ def run_plotter_no_table(user_script_content, device_name,
     @param height: optional height passed to tikz
     @return: returncode, r_stdout, r_stderr, image_data
     """
+    pool = get_pool()
+    if pool is not None:
+        retcode, r_out, r_err, image_data_list = pool.run_plotter(
+                None, [user_script_content], device_name, width, height)
+        image_data = image_data_list[0] if image_data_list else None
+        return retcode, r_out, r_err, image_data
     temp_plot_name = Util.get_tmp_filename()
     s = StringIO()
     print >> s, _get_device_specific_call(temp_plot_name, device_name,
@@ -311,11 +360,435 @@ def run_plotter_no_table(user_script_content, device_name,
         os.unlink(temp_plot_name)
     return retcode, r_out, r_err, image_data
 
+# seconds to wait for a new R worker to load its libraries
+g_startup_timeout = 60
+
+# A worker evaluates this script using R -f.
+# The whole script is one expression,
+# so R has read all of it before it reports that it is ready.
+# Each request is a script and an optional table,
+# and each response is a status and the captured output.
+g_worker_script = r"""
+local({
+    requests <- file("stdin", open="rb")
+    responses <- file(Sys.getenv("RUTIL_RESPONSE_PATH"), open="wb")
+    read.int <- function() {
+        readBin(requests, "integer", n=1, size=4, endian="little")
+    }
+    read.string <- function() {
+        n <- read.int()
+        if (n) rawToChar(readBin(requests, "raw", n=n)) else ""
+    }
+    write.int <- function(x) {
+        writeBin(as.integer(x), responses, size=4, endian="little")
+    }
+    write.string <- function(x) {
+        bytes <- charToRaw(x)
+        write.int(length(bytes))
+        writeBin(bytes, responses)
+    }
+    read.columns <- function() {
+        ncols <- read.int()
+        nrows <- read.int()
+        columns <- list()
+        for (j in seq_len(ncols)) {
+            header <- read.string()
+            if (read.string() == "d") {
+                column <- readBin(requests, "double",
+                    n=nrows, size=8, endian="little")
+            } else {
+                lengths <- readBin(requests, "integer",
+                    n=nrows, size=4, endian="little")
+                blob <- readBin(requests, "raw", n=sum(lengths))
+                ends <- cumsum(lengths)
+                column <- character(nrows)
+                for (i in which(lengths > 0)) {
+                    column[i] <- rawToChar(blob[(ends[i]-lengths[i]+1):ends[i]])
+                }
+                column <- type.convert(column,
+                    as.is=!isTRUE(getOption("stringsAsFactors")))
+            }
+            columns[[header]] <- column
+        }
+        function() data.frame(columns, check.names=FALSE,
+            stringsAsFactors=FALSE)
+    }
+    read.text.table <- function() {
+        text <- read.string()
+        function() {
+            con <- textConnection(text)
+            on.exit(close(con))
+            read.table(con)
+        }
+    }
+    evaluate <- function(code, make.table) {
+        env <- new.env(parent=globalenv())
+        output <- character(0)
+        con <- textConnection("output", "w", local=TRUE)
+        sink(con)
+        sink(con, type="message")
+        status <- 0L
+        tryCatch(withCallingHandlers({
+            if (!is.null(make.table)) {
+                assign("my.table", make.table(), envir=env)
+            }
+            for (e in parse(text=code)) {
+                result <- withVisible(eval(e, env))
+                if (result$visible) print(result$value)
+            }
+        }, warning=function(w) {
+            message("Warning message:\n", conditionMessage(w))
+            invokeRestart("muffleWarning")
+        }), error=function(e) {
+            status <<- 1L
+            message("Error: ", conditionMessage(e))
+        })
+        sink(type="message")
+        sink()
+        close(con)
+        graphics.off()
+        list(status=status, output=paste(c(output, ""), collapse="\n"))
+    }
+    for (library.name in strsplit(Sys.getenv("RUTIL_LIBRARIES"), ",")[[1]]) {
+        suppressWarnings(suppressMessages(
+            require(library.name, character.only=TRUE)))
+    }
+    write.int(0)
+    flush(responses)
+    repeat {
+        n <- read.int()
+        if (!length(n)) break
+        code <- if (n) rawToChar(readBin(requests, "raw", n=n)) else ""
+        table.kind <- read.int()
+        make.table <- NULL
+        if (table.kind == 1) make.table <- read.text.table()
+        if (table.kind == 2) make.table <- read.columns()
+        result <- evaluate(code, make.table)
+        write.int(result$status)
+        write.string(result$output)
+        flush(responses)
+    }
+})
+"""
+
+# R workers are started one at a time
+# so that no worker inherits the pipes of another.
+g_spawn_lock = threading.Lock()
+
+# the pool used by the module functions or None for a process per call
+g_pool = None
+
+def _pack_int(n):
+    return struct.pack('<i', n)
+
+def _pack_string(s):
+    return _pack_int(len(s)) + s
+
+def _set_cloexec(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC)
+
+
+class RWorker:
+    """
+    A long-lived R process that evaluates scripts sent through a pipe.
+    Responses come back through a separate pipe,
+    so output that bypasses the R console cannot corrupt them.
+    Libraries loaded by one script stay loaded for the next,
+    but each script runs in a new environment.
+    """
+
+    def __init__(self, rlocations=g_rlocations, libraries=()):
+        """
+        @param rlocations: place to look for R
+        @param libraries: names of R libraries to load when the worker starts
+        """
+        self.proc = None
+        self.ncalls = 0
+        script_name = Util.create_tmp_file(g_worker_script, suffix='.R')
+        devnull = open(os.devnull, 'w')
+        try:
+            with g_spawn_lock:
+                read_fd, write_fd = os.pipe()
+                _set_cloexec(read_fd)
+                env = dict(os.environ)
+                env['RUTIL_RESPONSE_PATH'] = '/dev/fd/%d' % write_fd
+                env['RUTIL_LIBRARIES'] = ','.join(libraries)
+                for rlocation in rlocations:
+                    cmd = [
+                            rlocation,
+                            '--no-save', '--no-restore', '--silent', '--slave',
+                            '-f', script_name]
+                    try:
+                        self.proc = subprocess.Popen(cmd,
+                                stdin=subprocess.PIPE,
+                                stdout=devnull, stderr=devnull, env=env)
+                    except OSError as e:
+                        continue
+                    _set_cloexec(self.proc.stdin.fileno())
+                    break
+                os.close(write_fd)
+            self.response_fd = read_fd
+            if self.proc is None:
+                os.close(read_fd)
+                raise RExecError('could not find R')
+            self._read_int(time.time() + g_startup_timeout)
+        finally:
+            devnull.close()
+            os.unlink(script_name)
+
+    def is_alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def kill(self):
+        if self.proc is None:
+            return
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        self.proc.stdin.close()
+        os.close(self.response_fd)
+        self.proc = None
+
+    def _read(self, nbytes, deadline):
+        chunks = []
+        while nbytes:
+            if deadline is not None:
+                remaining = deadline - time.time()
+                ready = remaining > 0 and select.select(
+                        [self.response_fd], [], [], remaining)[0]
+                if not ready:
+                    self.kill()
+                    raise RTimeoutError('the R worker timed out')
+            chunk = os.read(self.response_fd, min(nbytes, 1<<16))
+            if not chunk:
+                self.kill()
+                raise RError('the R worker exited unexpectedly')
+            chunks.append(chunk)
+            nbytes -= len(chunk)
+        return ''.join(chunks)
+
+    def _read_int(self, deadline):
+        return struct.unpack('<i', self._read(4, deadline))[0]
+
+    def evaluate(self, code, table=None, timeout=None):
+        """
+        Evaluate a script, printing the visible values like R CMD BATCH.
+        A timeout kills the worker.
+        @param code: the R script
+        @param table: None or a table string to read into my.table
+        @param timeout: None or the number of seconds to wait for R
+        @return: (returncode, r_stdout, r_stderr)
+        """
+        arr = [_pack_string(code)]
+        if table is None:
+            arr.append(_pack_int(0))
+        elif isinstance(table, TableString):
+            arr.extend([_pack_int(2), table.get_columns_message()])
+        else:
+            arr.extend([_pack_int(1), _pack_string(table)])
+        try:
+            self.proc.stdin.write(''.join(arr))
+            self.proc.stdin.flush()
+        except IOError as e:
+            self.kill()
+            raise RError('the R worker exited unexpectedly')
+        deadline = None if timeout is None else time.time() + timeout
+        returncode = self._read_int(deadline)
+        output = self._read(self._read_int(deadline), deadline)
+        self.ncalls += 1
+        # like R CMD BATCH in the run function the output is on stderr
+        return returncode, '', output
+
+
+class RWorkerPool:
+    """
+    A fixed number of R workers shared by threads.
+    A worker that dies or times out is replaced by a new one.
+    """
+
+    def __init__(self, nworkers=1, timeout=None, libraries=(),
+            max_calls=None, rlocations=g_rlocations):
+        """
+        @param nworkers: the number of R processes
+        @param timeout: None or the number of seconds allowed for each call
+        @param libraries: names of R libraries to load in each worker
+        @param max_calls: None or the number of calls before a worker restarts
+        @param rlocations: place to look for R
+        """
+        self.timeout = timeout
+        self.libraries = tuple(libraries)
+        self.max_calls = max_calls
+        self.rlocations = rlocations
+        self.idle = Queue.Queue()
+        self.nworkers = nworkers
+        try:
+            for i in range(nworkers):
+                self.idle.put(RWorker(rlocations, self.libraries))
+        except:
+            self.close()
+            raise
+
+    def evaluate(self, code, table=None):
+        """
+        @param code: the R script
+        @param table: None or a table string to read into my.table
+        @return: (returncode, r_stdout, r_stderr)
+        """
+        worker = self.idle.get()
+        try:
+            if self.max_calls and worker.ncalls >= self.max_calls:
+                worker.kill()
+            if not worker.is_alive():
+                worker = RWorker(self.rlocations, self.libraries)
+            return worker.evaluate(code, table, self.timeout)
+        finally:
+            self.idle.put(worker)
+
+    def run_plotter(self, table, scripts, device_name, width, height):
+        """
+        Evaluate one plotting script per image, each with its own device.
+        @param table: None or a table string to read into my.table
+        @param scripts: user scripts without header or footer
+        @param device_name: an R device function name
+        @param width: optional width passed to tikz
+        @param height: optional height passed to tikz
+        @return: returncode, r_stdout, r_stderr, image_data_list
+        """
+        temp_plot_names = [Util.get_tmp_filename() for x in scripts]
+        s = StringIO()
+        if device_name == 'tikz':
+            print >> s, 'require(tikzDevice)'
+        for plot_name, script in zip(temp_plot_names, scripts):
+            print >> s, _get_device_specific_call(plot_name, device_name,
+                    width, height)
+            print >> s, script
+            print >> s, 'dev.off()'
+        retcode, r_out, r_err = self.evaluate(s.getvalue(), table)
+        image_data_list = []
+        try:
+            if not retcode:
+                for temp_plot_name in temp_plot_names:
+                    with open(temp_plot_name, 'rb') as fin:
+                        image_data_list.append(fin.read())
+        except IOError as e:
+            raise RError(
+                    'could not open the plot image file '
+                    'that R was supposed to write')
+        finally:
+            for temp_plot_name in temp_plot_names:
+                if os.path.exists(temp_plot_name):
+                    os.unlink(temp_plot_name)
+        return retcode, r_out, r_err, image_data_list
+
+    def close(self):
+        """
+        Kill the idle workers.
+        """
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except Queue.Empty:
+                break
+            worker.kill()
+
+def start_pool(nworkers=1, timeout=None, libraries=(),
+        max_calls=None, rlocations=g_rlocations):
+    """
+    Make the module functions use a pool of R workers.
+    @param nworkers: the number of R processes
+    @param timeout: None or the number of seconds allowed for each call
+    @param libraries: names of R libraries to load in each worker
+    @param max_calls: None or the number of calls before a worker restarts
+    @param rlocations: place to look for R
+    @return: the pool
+    """
+    global g_pool
+    stop_pool()
+    g_pool = RWorkerPool(nworkers, timeout, libraries, max_calls, rlocations)
+    return g_pool
+
+def start_pool_from_environment(environ=os.environ):
+    """
+    Start a pool if the RUTIL_WORKERS environment variable is positive.
+    @param environ: a dictionary of environment variables
+    @return: the pool or None
+    """
+    nworkers = int(environ.get('RUTIL_WORKERS', '0') or 0)
+    if nworkers < 1:
+        return None
+    names = environ.get('RUTIL_LIBRARIES', '').split(',')
+    libraries = [x.strip() for x in names if x.strip()]
+    return start_pool(nworkers, libraries=libraries)
+
+def stop_pool():
+    """
+    Make the module functions start a new R process for each call.
+    """
+    global g_pool
+    if g_pool is not None:
+        g_pool.close()
+        g_pool = None
+
+def get_pool(rlocations=g_rlocations):
+    """
+    @param rlocations: place to look for R
+    @return: the pool of R workers or None
+    """
+    if g_pool is not None and g_pool.rlocations == rlocations:
+        return g_pool
+    return None
+
+atexit.register(stop_pool)
+
+
+class TableString(str):
+    """
+    The text of an R table that remembers its rows and column headers.
+    It can be used anywhere the text is used,
+    and R workers receive the columns in binary form instead of the text.
+    """
+
+    def set_columns(self, M, column_headers, force_float):
+        """
+        @param M: a row major matrix
+        @param column_headers: the labels of the data columns
+        @param force_float: True if the values are floats
+        """
+        self.M = M
+        self.column_headers = list(column_headers)
+        self.force_float = force_float
+        return self
+
+    def get_columns_message(self):
+        """
+        Each column is sent as a header and a type code followed by
+        little endian doubles or by lengths and bytes of strings.
+        @return: the binary form of the table
+        """
+        nrows = len(self.M)
+        arr = [_pack_int(len(self.column_headers)), _pack_int(nrows)]
+        for j, header in enumerate(self.column_headers):
+            arr.append(_pack_string(header))
+            column = [row[j] for row in self.M]
+            if self.force_float:
+                arr.append(_pack_string('d'))
+                arr.append(struct.pack(
+                    '<%dd' % nrows, *[float(value) for value in column]))
+            else:
+                values = [str(value) for value in column]
+                arr.append(_pack_string('s'))
+                arr.append(struct.pack(
+                    '<%di' % nrows, *[len(value) for value in values]))
+                arr.append(''.join(values))
+        return ''.join(arr)
+
 def get_table_string(M, column_headers, force_float=True):
     """
     Convert a row major rate matrix to a string representing an R table.
     @param M: a row major matrix
     @param column_headers: the labels of the data columns
+    @return: a TableString
     """
     if len(set(len(row) for row in M)) != 1:
         raise ValueError('all rows should have the same length')
@@ -336,7 +809,8 @@ def get_table_string(M, column_headers, force_float=True):
         else:
             R_row = [str(value) for value in row]
         lines.append('\t'.join([str(i+1)] + R_row))
-    return '\n'.join(lines)
+    text = TableString('\n'.join(lines))
+    return text.set_columns(M, column_headers, force_float)
 
 def float_to_R(value):
     """
@@ -459,6 +933,48 @@ class TestRUtil(unittest.TestCase):
 
     def test_exec_error(self):
         self.assertRaises(RExecError, run, 'whatever.R', 'bad_r_location')
+        self.assertRaises(RExecError, RWorkerPool, 1, None, (), None,
+                ['bad_r_location'])
+
+    def test_table_string(self):
+        M = [[1.5, float('inf')], [2, 3]]
+        table = get_table_string(M, ['x', 'y'])
+        self.assertEqual(table, '\tx\ty\n1\t1.5\tInf\n2\t2\t3')
+        message = table.get_columns_message()
+        self.assertEqual(struct.unpack('<ii', message[:8]), (2, 2))
+        self.assertEqual(message[-21:-16], _pack_string('d'))
+        self.assertEqual(struct.unpack('<2d', message[-16:]), (float('inf'), 3.0))
+        table = get_table_string([['a', 1], ['bc', 2]], ['x', 'y'], False)
+        expected = ''.join([
+            _pack_string('y'), _pack_string('s'),
+            struct.pack('<2i', 1, 1), '12'])
+        self.assertTrue(table.get_columns_message().endswith(expected))
+
+    def test_pool(self):
+        try:
+            pool = RWorkerPool(1, timeout=10, max_calls=3)
+        except RExecError as e:
+            self.skipTest('R was not found')
+        try:
+            retcode, r_out, r_err = pool.evaluate('x <- 1 + 1\nx')
+            self.assertEqual((retcode, r_err), (0, '[1] 2\n'))
+            # each script runs in a new environment
+            retcode, r_out, r_err = pool.evaluate('x')
+            self.assertEqual(retcode, 1)
+            table = get_table_string([[1, 2], [3, 4], [5, 6]], ['a', 'b'])
+            for t in (table, str(table)):
+                retcode, r_out, r_err = pool.evaluate(
+                        'sum(my.table$b)', t)
+                self.assertEqual((retcode, r_err), (0, '[1] 12\n'))
+        finally:
+            pool.close()
+
+    def test_pool_from_environment(self):
+        self.assertEqual(start_pool_from_environment({}), None)
+        self.assertEqual(g_pool, None)
+        environ = {'RUTIL_WORKERS' : '0', 'RUTIL_LIBRARIES' : 'MASS'}
+        self.assertEqual(start_pool_from_environment(environ), None)
+        self.assertEqual(g_pool, None)
 
 
 if __name__ == '__main__':
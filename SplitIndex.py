@@ -0,0 +1,417 @@
+"""
+Encode the splits of trees on a common leaf set as integer bitmasks.
+
+Each leaf name is assigned a bit position.
+A split is encoded by the bitmask of the side
+that does not include the leaf at bit position zero,
+so each split has exactly one encoding and can be hashed cheaply.
+This makes it possible to compare large collections of trees,
+for example the trees sampled by an MCMC run,
+with a single traversal per tree.
+The trees can be FelTree or Newick tree objects.
+"""
+
+import unittest
+
+import numpy as np
+from scipy import sparse
+
+import FelTree
+import NewickIO
+import Ctree
+import TreeComparison
+import Xtree
+
+
+class SplitIndexError(Exception): pass
+
+
+def _popcount(mask):
+    return bin(mask).count('1')
+
+
+class SplitIndex:
+    """
+    A map between leaf names and bit positions.
+    """
+
+    def __init__(self, names):
+        """
+        @param names: a collection of distinct leaf names
+        """
+        self.names = list(sorted(names))
+        if len(set(self.names)) != len(self.names):
+            raise SplitIndexError('the leaf names are not distinct')
+        self.name_to_bit = dict((name, 1 << i) for i, name in enumerate(self.names))
+        self.full_mask = (1 << len(self.names)) - 1
+
+    def get_names(self):
+        return self.names
+
+    def get_canonical(self, mask):
+        """
+        @param mask: the bitmask of either side of a split
+        @return: the bitmask of the side that does not include the first leaf
+        """
+        if mask & 1:
+            return mask ^ self.full_mask
+        return mask
+
+    def is_trivial(self, mask):
+        """
+        @param mask: a canonical split bitmask
+        @return: True if one side of the split has fewer than two leaves
+        """
+        k = _popcount(mask)
+        return min(k, len(self.names) - k) < 2
+
+    def encode(self, names):
+        """
+        @param names: the leaf names on either side of a split
+        @return: a canonical split bitmask
+        """
+        mask = 0
+        try:
+            for name in names:
+                mask |= self.name_to_bit[name]
+        except KeyError, e:
+            raise SplitIndexError('unknown leaf name: %s' % e)
+        return self.get_canonical(mask)
+
+    def encode_partition(self, part):
+        """
+        @param part: a frozenset of two frozensets of leaf names
+        @return: a canonical split bitmask
+        """
+        a, b = part
+        mask = self.encode(a)
+        if mask ^ self.encode(b) not in (0, self.full_mask):
+            raise SplitIndexError('the partition does not cover the leaves')
+        return mask
+
+    def encode_partitions(self, parts):
+        """
+        This converts the split sets of the TreeComparison and Xtree modules.
+        @param parts: a collection of frozensets of two frozensets of leaf names
+        @return: a frozenset of canonical split bitmasks
+        """
+        return frozenset(self.encode_partition(part) for part in parts)
+
+    def decode(self, mask):
+        """
+        @param mask: a canonical split bitmask
+        @return: a frozenset of two frozensets of leaf names
+        """
+        a = frozenset(name for i, name in enumerate(self.names) if mask & (1 << i))
+        b = frozenset(self.names) - a
+        return frozenset([a, b])
+
+    def get_split_lengths(self, tree):
+        """
+        Get the splits defined by the branches of a tree in one traversal.
+        Branches of zero length do not define splits.
+        Branches without a length define splits of length zero.
+        The lengths of branches that define the same split are added,
+        as happens at a root of degree two.
+        @param tree: a tree object whose tips are named by the leaf names
+        @return: a dict mapping each canonical split bitmask to a branch length
+        """
+        tip_ids = set(id(tip) for tip in tree.gen_tips())
+        id_to_mask = {}
+        d = {}
+        all_leaves = 0
+        for node in tree.postorder():
+            if id(node) in tip_ids:
+                mask = self.name_to_bit.get(node.get_name())
+                if mask is None:
+                    raise SplitIndexError('unknown leaf name: %s' % node.get_name())
+                all_leaves |= mask
+            else:
+                mask = 0
+            for child in node.gen_children():
+                mask |= id_to_mask.pop(id(child))
+            id_to_mask[id(node)] = mask
+            if node.get_parent() is None:
+                continue
+            blen = node.get_branch_length()
+            if blen is None:
+                blen = 0.0
+            elif blen <= 0:
+                continue
+            key = self.get_canonical(mask)
+            if key in (0, self.full_mask):
+                continue
+            d[key] = d.get(key, 0.0) + blen
+        if all_leaves != self.full_mask:
+            raise SplitIndexError('the tree does not have every leaf')
+        return d
+
+    def get_ctree_split_lengths(self, ctree):
+        """
+        This is like get_split_lengths but for a compiled tree.
+        @param ctree: a compiled tree whose tips are named by the leaf names
+        @return: a dict mapping each canonical split bitmask to a branch length
+        """
+        masks = [0] * ctree.get_nvertices()
+        all_leaves = 0
+        for v in ctree.get_tips():
+            mask = self.name_to_bit.get(ctree.names[v])
+            if mask is None:
+                raise SplitIndexError('unknown leaf name: %s' % ctree.names[v])
+            masks[v] = mask
+            all_leaves |= mask
+        if all_leaves != self.full_mask:
+            raise SplitIndexError('the tree does not have every leaf')
+        parents = ctree.parents.tolist()
+        blens = ctree.blens.tolist()
+        d = {}
+        for v in range(len(parents) - 1, 0, -1):
+            mask = masks[v]
+            masks[parents[v]] |= mask
+            blen = blens[v]
+            if blen != blen:
+                blen = 0.0
+            elif blen <= 0:
+                continue
+            key = self.get_canonical(mask)
+            if key in (0, self.full_mask):
+                continue
+            d[key] = d.get(key, 0.0) + blen
+        return d
+
+    def get_nontrivial_splits(self, tree):
+        """
+        @param tree: a tree object whose tips are named by the leaf names
+        @return: a frozenset of canonical nontrivial split bitmasks
+        """
+        return frozenset(mask for mask in self.get_split_lengths(tree)
+                if not self.is_trivial(mask))
+
+    def get_newick_string(self, masks):
+        """
+        Build a tree topology from compatible splits.
+        The tree is drawn with the first leaf next to the root.
+        @param masks: a collection of pairwise compatible canonical split bitmasks
+        @return: a newick string
+        """
+        # map the mask of each current top level subtree to its newick string
+        components = dict((1 << i, name) for i, name in enumerate(self.names))
+        for mask in sorted(set(masks), key=_popcount):
+            if self.is_trivial(mask):
+                continue
+            members = [m for m in components if m & mask == m]
+            if sum(_popcount(m) for m in members) != _popcount(mask):
+                raise SplitIndexError('the splits are not compatible')
+            substrings = [components.pop(m) for m in sorted(members)]
+            components[mask] = '(' + ', '.join(substrings) + ')'
+        substrings = [components[m] for m in sorted(components)]
+        return '(' + ', '.join(substrings) + ');'
+
+
+def get_split_index(tree):
+    """
+    @param tree: a tree object
+    @return: a split index of the tip names of the tree
+    """
+    return SplitIndex(tip.get_name() for tip in tree.gen_tips())
+
+def get_rf_distance(splits_a, splits_b):
+    """
+    @param splits_a: the nontrivial split bitmasks of the first tree
+    @param splits_b: the nontrivial split bitmasks of the second tree
+    @return: the Robinson-Foulds distance
+    """
+    return 0.5 * len(splits_a ^ splits_b)
+
+def get_weighted_rf_distance(lengths_a, lengths_b):
+    """
+    This is the sum over all splits of the branch length differences,
+    where a split missing from a tree has length zero.
+    @param lengths_a: a map from split bitmasks to branch lengths of the first tree
+    @param lengths_b: a map from split bitmasks to branch lengths of the second tree
+    @return: the branch length weighted Robinson-Foulds distance
+    """
+    total = 0.0
+    for mask, blen in lengths_a.iteritems():
+        total += abs(blen - lengths_b.get(mask, 0.0))
+    for mask, blen in lengths_b.iteritems():
+        if mask not in lengths_a:
+            total += blen
+    return total
+
+def _get_incidence_matrix(split_sets):
+    """
+    @param split_sets: a sequence of split bitmask sets, one per tree
+    @return: a sparse tree by split incidence matrix
+    """
+    mask_to_column = {}
+    rows, cols = [], []
+    for i, splits in enumerate(split_sets):
+        for mask in splits:
+            rows.append(i)
+            cols.append(mask_to_column.setdefault(mask, len(mask_to_column)))
+    values = np.ones(len(rows))
+    shape = (len(split_sets), len(mask_to_column))
+    return sparse.csr_matrix((values, (rows, cols)), shape=shape)
+
+def get_rf_distance_matrix(split_sets):
+    """
+    The number of splits shared by each pair of trees
+    is a product of a sparse tree by split incidence matrix with its transpose.
+    @param split_sets: a sequence of nontrivial split bitmask sets, one per tree
+    @return: a symmetric numpy array of Robinson-Foulds distances
+    """
+    split_sets = list(split_sets)
+    M = _get_incidence_matrix(split_sets)
+    shared = (M * M.T).toarray()
+    sizes = np.array([len(s) for s in split_sets], dtype=float)
+    return 0.5 * (sizes[:, np.newaxis] + sizes[np.newaxis, :] - 2*shared)
+
+def get_weighted_rf_distance_matrix(split_length_dicts):
+    """
+    @param split_length_dicts: a sequence of maps from split bitmasks to branch lengths
+    @return: a symmetric numpy array of weighted Robinson-Foulds distances
+    """
+    split_length_dicts = list(split_length_dicts)
+    n = len(split_length_dicts)
+    D = np.zeros((n, n))
+    for i in range(n):
+        for j in range(i):
+            d = get_weighted_rf_distance(split_length_dicts[i], split_length_dicts[j])
+            D[i, j] = D[j, i] = d
+    return D
+
+def get_split_frequencies(split_sets):
+    """
+    @param split_sets: a sequence of split bitmask sets, one per tree
+    @return: a map from each split bitmask to the number of trees that have it
+    """
+    counts = {}
+    for splits in split_sets:
+        for mask in splits:
+            counts[mask] = counts.get(mask, 0) + 1
+    return counts
+
+def get_majority_rule_splits(split_sets, threshold=0.5):
+    """
+    Splits in more than half of the trees are pairwise compatible.
+    @param split_sets: a sequence of split bitmask sets, one per tree
+    @param threshold: splits in more than this proportion of trees are kept
+    @return: a frozenset of split bitmasks
+    """
+    if threshold < 0.5:
+        raise SplitIndexError('splits in fewer than half of the trees may be incompatible')
+    split_sets = list(split_sets)
+    ntrees = len(split_sets)
+    counts = get_split_frequencies(split_sets)
+    return frozenset(mask for mask, count in counts.iteritems()
+            if count > threshold * ntrees)
+
+def get_majority_rule_consensus(split_index, trees, threshold=0.5):
+    """
+    @param split_index: a split index of the leaf names of the trees
+    @param trees: a sequence of tree objects
+    @param threshold: splits in more than this proportion of trees are kept
+    @return: the newick string of the consensus topology
+    """
+    split_sets = [split_index.get_nontrivial_splits(tree) for tree in trees]
+    masks = get_majority_rule_splits(split_sets, threshold)
+    return split_index.get_newick_string(masks)
+
+
+class TestSplitIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tree_strings = [
+                '((A:1, B:1):1, C:1, (D:1, E:1):1);',
+                '((A:1, B:1):1, D:1, (C:1, E:1):1);',
+                '((A:1, D:1):1, C:1, (B:1, E:1):1);',
+                '((A:1, D:1):1, (C:1, B:1, E:1):1);',
+                '((A:1, B:2):3, (C:1, (D:1, E:1):0):4);']
+        self.trees = [NewickIO.parse(s, FelTree.NewickTree)
+                for s in self.tree_strings]
+
+    def test_encode_decode(self):
+        split_index = SplitIndex('ABCDE')
+        mask = split_index.encode('AB')
+        self.assertEqual(mask, split_index.encode('CDE'))
+        self.assertEqual(mask, split_index.encode_partition(
+            frozenset([frozenset('AB'), frozenset('CDE')])))
+        self.assertEqual(split_index.decode(mask),
+            frozenset([frozenset('AB'), frozenset('CDE')]))
+        self.assertRaises(SplitIndexError, split_index.encode, 'AX')
+
+    def test_nontrivial_splits(self):
+        split_index = get_split_index(self.trees[0])
+        for tree in self.trees:
+            expected = TreeComparison.get_nontrivial_partitions(tree)
+            observed = split_index.get_nontrivial_splits(tree)
+            self.assertEqual(expected, set(split_index.decode(m) for m in observed))
+            self.assertEqual(observed, split_index.encode_partitions(expected))
+
+    def test_rf_distance_matrix(self):
+        split_index = get_split_index(self.trees[0])
+        split_sets = [split_index.get_nontrivial_splits(t) for t in self.trees]
+        D = get_rf_distance_matrix(split_sets)
+        for i, a in enumerate(self.trees):
+            for j, b in enumerate(self.trees):
+                expected = Xtree.splits_to_rf_distance(
+                        TreeComparison.get_nontrivial_partitions(a),
+                        TreeComparison.get_nontrivial_partitions(b))
+                self.assertEqual(D[i, j], expected)
+                self.assertEqual(get_rf_distance(split_sets[i], split_sets[j]), expected)
+
+    def test_weighted_rf_distance_matrix(self):
+        split_index = get_split_index(self.trees[0])
+        dicts = [split_index.get_split_lengths(t) for t in self.trees]
+        for tree, d in zip(self.trees, dicts):
+            ctree = Ctree.from_tree(tree)
+            self.assertEqual(split_index.get_ctree_split_lengths(ctree), d)
+        D = get_weighted_rf_distance_matrix(dicts)
+        # the degree two root joins two branches of the last tree
+        self.assertEqual(dicts[4][split_index.encode('AB')], 7)
+        self.assertEqual(D[0, 0], 0)
+        # the first two trees differ by one split on each side
+        self.assertEqual(D[0, 1], 2)
+        self.assertEqual(D[0, 4], 8)
+        self.assertEqual(D[4, 0], 8)
+
+    def test_missing_branch_lengths(self):
+        split_index = get_split_index(self.trees[0])
+        tree = NewickIO.parse('((A, B), C, (D:2, E):1);', FelTree.NewickTree)
+        d = split_index.get_split_lengths(tree)
+        self.assertEqual(d, {
+            split_index.encode('AB'): 0.0,
+            split_index.encode('DE'): 1.0,
+            split_index.encode('A'): 0.0,
+            split_index.encode('B'): 0.0,
+            split_index.encode('C'): 0.0,
+            split_index.encode('D'): 2.0,
+            split_index.encode('E'): 0.0})
+        self.assertEqual(split_index.get_ctree_split_lengths(
+            Ctree.from_tree(tree)), d)
+        self.assertEqual(split_index.get_nontrivial_splits(tree),
+                split_index.get_nontrivial_splits(self.trees[0]))
+        lengths = split_index.get_split_lengths(self.trees[0])
+        self.assertEqual(get_weighted_rf_distance(d, lengths), 6)
+        # a missing length does not replace a length of the same split
+        tree = NewickIO.parse('((A, B):3, (C, (D, E)));', FelTree.NewickTree)
+        d = split_index.get_split_lengths(tree)
+        self.assertEqual(d[split_index.encode('AB')], 3)
+
+    def test_majority_rule_consensus(self):
+        trees = self.trees[:2] + [self.trees[0]]
+        split_index = get_split_index(self.trees[0])
+        newick_string = get_majority_rule_consensus(split_index, trees)
+        tree = NewickIO.parse(newick_string, FelTree.NewickTree)
+        self.assertEqual(split_index.get_nontrivial_splits(tree),
+                split_index.get_nontrivial_splits(self.trees[0]))
+        split_sets = [split_index.get_nontrivial_splits(t) for t in trees]
+        counts = get_split_frequencies(split_sets)
+        self.assertEqual(counts[split_index.encode('AB')], 3)
+        self.assertEqual(counts[split_index.encode('DE')], 2)
+        self.assertEqual(counts[split_index.encode('CE')], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
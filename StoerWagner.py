@@ -1,11 +1,28 @@
 """
 A polynomial min cut algorithm.
+
+Each phase of the Stoer-Wagner algorithm adds vertices one at a time
+in order of their total edge weight to the vertices already added.
+For dense graphs these keys are a numpy array
+in which the added vertices are masked,
+so each step of a phase is a vectorized argmax and update.
+For sparse graphs the keys are in a priority queue with lazy updates.
+Both versions also contract the edges whose endpoints are known
+to be at least as well connected as the best cut found so far,
+so a phase usually removes many vertices instead of one.
+Run the scaling benchmark using
+$ python StoerWagner.py --benchmark
 """
 
 from StringIO import StringIO
 import unittest
+import argparse
+import heapq
+import time
+import sys
 
 import numpy as np
+import scipy.sparse
 
 import MatrixUtil
 
@@ -28,6 +45,194 @@ def stoer_wagner_min_cut(weight_matrix):
     @param weight_matrix: non-negative symmetric weighted adjacency matrix
     @return: the set of indices belonging to one of the two clusters
     """
+    return stoer_wagner(weight_matrix)[0]
+
+def _contract_dense(w, members, pairs):
+    """
+    Merge pairs of vertices of a dense graph.
+    Each merge adds a row and a column to those of the other vertex
+    and moves the last vertex into the vacated place,
+    so the matrix shrinks without being copied.
+    @param w: a weighted adjacency matrix which is modified
+    @param members: the original indices represented by each vertex
+    @param pairs: pairs of vertices to merge
+    @return: the contracted matrix and its list of members
+    """
+    m = len(w)
+    parent = {}
+    # the current place of each vertex and the vertex at each place
+    place = range(m)
+    vertex = range(m)
+    for a, b in pairs:
+        while a in parent:
+            a = parent[a]
+        while b in parent:
+            b = parent[b]
+        if a == b:
+            continue
+        i, j = place[a], place[b]
+        w[i] += w[j]
+        w[:, i] += w[:, j]
+        w[i, i] = 0
+        members[i].extend(members[j])
+        last = m - 1
+        if j != last:
+            w[j] = w[last]
+            w[:, j] = w[:, last]
+            w[j, j] = 0
+            members[j] = members[last]
+            moved = vertex[last]
+            place[moved] = j
+            vertex[j] = moved
+        del members[last]
+        m = last
+        w = w[:m, :m]
+        parent[b] = a
+    return w, members
+
+def stoer_wagner(weight_matrix):
+    """
+    Find a min cut of a dense graph.
+    Following Nagamochi and Ibaraki, the key of a vertex just after
+    an edge to it is scanned is a lower bound of the edge connectivity
+    of the endpoints of the edge, so each phase also contracts the edges
+    whose keys reach the weight of the best cut found so far.
+    @param weight_matrix: non-negative symmetric weighted adjacency matrix
+    @return: the set of indices of one side of the cut, and the cut weight
+    """
+    w = np.array(weight_matrix, dtype=float)
+    MatrixUtil.assert_symmetric(w)
+    MatrixUtil.assert_nonnegative(w)
+    MatrixUtil.assert_hollow(w)
+    if len(w) < 2:
+        return None, None
+    members = [[i] for i in range(len(w))]
+    # start with the cut around a vertex of least weighted degree
+    degrees = np.sum(w, axis=1)
+    v = np.argmin(degrees)
+    min_cut, min_cut_weight = set([v]), degrees[v]
+    # reduce the number of remaining vertices by at least one each phase
+    while len(w) > 1:
+        keys = w[0].copy()
+        keys[0] = -np.inf
+        pairs = [(0, u) for u in np.flatnonzero(keys >= min_cut_weight)]
+        s = 0
+        for step in range(len(w) - 1):
+            t = np.argmax(keys)
+            cut_weight = keys[t]
+            # the added vertices stay at -inf
+            row = w[t]
+            keys += row
+            keys[t] = -np.inf
+            hits = np.flatnonzero(keys >= min_cut_weight)
+            if len(hits):
+                pairs.extend((t, u) for u in hits if row[u])
+            if step < len(w) - 2:
+                s = t
+        # the cut between the last two added vertices is a possible min cut
+        if cut_weight < min_cut_weight:
+            min_cut, min_cut_weight = set(members[t]), cut_weight
+        # combine the last two added vertices and the contractible pairs
+        pairs.append((s, t))
+        w, members = _contract_dense(w, members, pairs)
+    return min_cut, min_cut_weight
+
+def _contract(adjacency, members, pairs):
+    """
+    Merge pairs of vertices of a sparse graph in place.
+    @param adjacency: the neighbor weights of each vertex
+    @param members: the original indices represented by each vertex
+    @param pairs: pairs of vertices to merge
+    """
+    parent = {}
+    for a, b in pairs:
+        while a in parent:
+            a = parent[a]
+        while b in parent:
+            b = parent[b]
+        if a == b:
+            continue
+        if len(adjacency[a]) < len(adjacency[b]):
+            a, b = b, a
+        # merge b into a
+        for u, weight in adjacency.pop(b).iteritems():
+            del adjacency[u][b]
+            if u != a:
+                adjacency[a][u] = adjacency[a].get(u, 0) + weight
+                adjacency[u][a] = adjacency[u].get(a, 0) + weight
+        members[a].extend(members.pop(b))
+        parent[b] = a
+
+def stoer_wagner_sparse(A):
+    """
+    Find a min cut of a sparse graph.
+    Each phase uses a priority queue of keys with lazy updates,
+    so it takes O(m log n) time for a graph with m edges.
+    Following Nagamochi and Ibaraki, the key of a vertex just after
+    an edge to it is scanned is a lower bound of the edge connectivity
+    of the endpoints of the edge, so each phase also contracts the edges
+    whose keys reach the weight of the best cut found so far.
+    @param A: non-negative symmetric weighted adjacency scipy sparse matrix
+    @return: the set of indices of one side of the cut, and the cut weight
+    """
+    A = scipy.sparse.coo_matrix(A)
+    n = A.shape[0]
+    if A.shape != (n, n):
+        raise MatrixUtil.MatrixError('the matrix is not square')
+    if np.any(A.data < 0):
+        raise MatrixUtil.MatrixError('the matrix has a negative element')
+    if abs(A - A.T).sum():
+        raise MatrixUtil.MatrixError('the matrix is not symmetric')
+    if n < 2:
+        return None, None
+    # the neighbor weights of each remaining vertex
+    adjacency = dict((i, {}) for i in range(n))
+    for i, j, weight in zip(A.row.tolist(), A.col.tolist(), A.data.tolist()):
+        if i != j:
+            adjacency[i][j] = adjacency[i].get(j, 0) + weight
+    members = dict((i, [i]) for i in range(n))
+    # start with the cut around a vertex of least weighted degree
+    min_cut_weight, v = min(
+            (sum(nbrs.itervalues()), v) for v, nbrs in adjacency.iteritems())
+    min_cut = set([v])
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+    while len(adjacency) > 1:
+        keys = dict.fromkeys(adjacency, 0.0)
+        # the queue has the vertices with positive keys
+        heap = []
+        added = []
+        pairs = []
+        while keys:
+            if heap:
+                neg_key, v = heappop(heap)
+                if v not in keys or -neg_key != keys[v]:
+                    # this entry is stale
+                    continue
+            else:
+                # the remaining vertices are not adjacent to the added ones
+                v = next(iter(keys))
+            cut_weight = keys.pop(v)
+            added.append(v)
+            for u, weight in adjacency[v].iteritems():
+                if u in keys:
+                    key = keys[u] + weight
+                    keys[u] = key
+                    heappush(heap, (-key, u))
+                    if key >= min_cut_weight:
+                        pairs.append((v, u))
+        s, t = added[-2:]
+        if cut_weight < min_cut_weight:
+            min_cut, min_cut_weight = set(members[t]), cut_weight
+        pairs.append((s, t))
+        _contract(adjacency, members, pairs)
+    return min_cut, min_cut_weight
+
+def _stoer_wagner_min_cut_lists(weight_matrix):
+    """
+    This is the previous implementation which rebuilds lists of keys.
+    It is used for testing and benchmarking.
+    """
     w = weight_matrix.copy()
     n = w.shape[0]
     MatrixUtil.assert_symmetric(w)
@@ -69,6 +274,55 @@ def stoer_wagner_min_cut(weight_matrix):
     return min_cut
 
 
+def _get_cut_weight(w, cut):
+    other = sorted(set(range(len(w))) - cut)
+    return np.sum(w[np.ix_(sorted(cut), other)])
+
+def _get_random_sparse_graph(n, degree, rs):
+    """
+    @return: a random connected sparse symmetric weight matrix
+    """
+    rows = np.concatenate([np.arange(n), rs.randint(n, size=n*degree)])
+    cols = np.concatenate([
+        (np.arange(n) + 1) % n, rs.randint(n, size=n*degree)])
+    keep = rows != cols
+    rows, cols = rows[keep], cols[keep]
+    weights = rs.randint(1, 10, size=len(rows)).astype(float)
+    A = scipy.sparse.coo_matrix((weights, (rows, cols)), shape=(n, n))
+    return (A + A.T).tocsr()
+
+def benchmark(sizes, degree=4, seed=0):
+    """
+    Time the previous, dense, and sparse implementations
+    on random sparse graphs of increasing size.
+    @param sizes: the numbers of vertices
+    @param degree: the number of random edges per vertex
+    @param seed: random seed
+    """
+    rs = np.random.RandomState(seed)
+    print 'n', 'previous', 'dense', 'sparse', 'weight'
+    for n in sizes:
+        A = _get_random_sparse_graph(n, degree, rs)
+        w = A.toarray()
+        row = [n]
+        if n <= 200:
+            tm = time.time()
+            _stoer_wagner_min_cut_lists(w)
+            row.append('%.3f' % (time.time() - tm))
+        else:
+            row.append('-')
+        tm = time.time()
+        cut, weight = stoer_wagner(w)
+        row.append('%.3f' % (time.time() - tm))
+        tm = time.time()
+        cut, sparse_weight = stoer_wagner_sparse(A)
+        row.append('%.3f' % (time.time() - tm))
+        if sparse_weight != weight:
+            raise ValueError('the dense and sparse cut weights differ')
+        row.append(weight)
+        print '\t'.join(str(x) for x in row)
+
+
 class TestStoerWagner(unittest.TestCase):
 
     def test_stoer_wagner_example(self):
@@ -83,7 +337,53 @@ class TestStoerWagner(unittest.TestCase):
             for j in set(range(n)) - cut:
                 weight += w[i, j]
         self.assertEqual(weight, 4)
+        for f in (stoer_wagner, stoer_wagner_sparse):
+            cut, weight = f(scipy.sparse.csr_matrix(w) if
+                    f is stoer_wagner_sparse else w)
+            self.assertTrue(cut in expected_cuts)
+            self.assertEqual(weight, 4)
+
+    def test_brute_force(self):
+        rs = np.random.RandomState(0)
+        n = 8
+        for i in range(10):
+            X = rs.randint(0, 4, size=(n, n)).astype(float)
+            w = np.triu(X, 1) + np.triu(X, 1).T
+            expected = min(_get_cut_weight(w, set(
+                j for j in range(n) if (k >> j) & 1))
+                for k in range(1, 2**(n-1)))
+            for cut, weight in (
+                    stoer_wagner(w),
+                    stoer_wagner_sparse(scipy.sparse.csr_matrix(w))):
+                self.assertEqual(weight, expected)
+                self.assertEqual(_get_cut_weight(w, cut), expected)
+
+    def test_previous_implementation(self):
+        rs = np.random.RandomState(1)
+        for n in (2, 5, 30):
+            A = _get_random_sparse_graph(n, 2, rs)
+            w = A.toarray()
+            expected = _get_cut_weight(w, _stoer_wagner_min_cut_lists(w))
+            self.assertEqual(stoer_wagner(w)[1], expected)
+            self.assertEqual(stoer_wagner_sparse(A)[1], expected)
+
+    def test_disconnected(self):
+        w = np.zeros((4, 4))
+        w[0, 1] = w[1, 0] = 1
+        w[2, 3] = w[3, 2] = 2
+        for cut, weight in (
+                stoer_wagner(w),
+                stoer_wagner_sparse(scipy.sparse.csr_matrix(w))):
+            self.assertEqual(weight, 0)
+            self.assertEqual(_get_cut_weight(w, cut), 0)
 
 
 if __name__ == '__main__':
-    unittest.main()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmark', action='store_true',
+            help='time the implementations on graphs of increasing size')
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark([50, 100, 200, 500, 1000, 2000, 3000])
+    else:
+        unittest.main(argv=sys.argv[:1])
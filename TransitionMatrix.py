@@ -8,6 +8,7 @@ import numpy as np
 
 import Util
 import DiscreteEndpoint
+import markovsolve
 
 
 class TransitionObject:
@@ -136,18 +137,8 @@ def get_stationary_distribution(transition_matrix):
         raise ValueError('expected a square transition matrix')
     if not np.allclose(np.sum(T, 1), np.ones(ncols)):
         raise ValueError('expected a right stochastic transition matrix')
-    # We want a left eigenvector of T.
-    # Numpy's eig gives only the right eigenvectors,
-    # so use the transpose of T.
-    w, VT = np.linalg.eig(T.T)
-    # We want the eigenvector that corresponds to the eigenvalue of 1.
-    # No eigenvalue should be greater than 1.
-    best_w, best_v = max((x, v) for x, v in zip(w, VT.T))
-    # The eigenvector might have tiny imaginary parts, so remove them.
-    best_v = np.array([abs(x) for x in best_v])
-    # Force the elements of the dominant eigenvector to sum to one.
-    best_v /= np.sum(best_v)
-    return best_v.tolist()
+    v, report = markovsolve.get_stationary_distribution_from_transitions(T)
+    return v.tolist()
 
 def get_uniform_transition_matrix(prandom, nstates, ntransitions=1):
     """
@@ -189,9 +189,14 @@ def xyz_to_tikz_lines(T, B, pitch, v_to_xyz,
         tikz_lines.append(line)
     return tikz_lines
 
-def get_tikz_lines(newick, eigenvector_index, yaw, pitch):
+def get_projection(newick, eigenvector_index):
     """
+    Compute the parts of a projection that do not depend on the view.
+    These are the layout and the harmonically extended valuations,
+    so an animation can compute them once and reuse them for each frame.
+    @param newick: a newick tree string with branch lengths
     @param eigenvector_index: 1 is Fiedler
+    @return: T, B, leaves, internal, v_to_location, v_to_val
     """
     tree = Newick.parse(newick, SpatialTree.SpatialTree) 
     # change the node names and get the new tree string
@@ -216,11 +221,33 @@ def get_tikz_lines(newick, eigenvector_index, yaw, pitch):
     index_to_val = V[:, eigenvector_index-1]
     v_to_val = dict(
             (vertices[i], g_z_scale*val) for i, val in enumerate(index_to_val))
+    return T, B, leaves, internal, v_to_location, v_to_val
+
+def get_projection_view(projection, yaw):
+    """
+    The projection itself is not modified.
+    @param projection: the output of get_projection
+    @param yaw: an angle; rotate the tree layout around its center
+    @return: T, B, v_to_xyz, and the sorted intersection vertices
+    """
+    T, B, leaves, internal, v_to_location, v_to_val = projection
+    T = set(T)
+    B = dict(B)
     # get the coordinates
     v_to_xyz = get_v_to_xyz(yaw, v_to_location, v_to_val)
     # add intersection vertices
     add_intersection_vertices(T, B, v_to_xyz)
-    intersection_vertices = sorted(v for v in v_to_xyz if v not in vertices)
+    intersection_vertices = sorted(v for v in v_to_xyz if v not in v_to_val)
+    return T, B, v_to_xyz, intersection_vertices
+
+def get_tikz_lines(newick, eigenvector_index, yaw, pitch):
+    """
+    @param eigenvector_index: 1 is Fiedler
+    """
+    projection = get_projection(newick, eigenvector_index)
+    T, B, leaves, internal, v_to_location, v_to_val = projection
+    T, B, v_to_xyz, intersection_vertices = get_projection_view(
+            projection, yaw)
     # get lines of the tikz file
     return xyz_to_tikz_lines(T, B, pitch, v_to_xyz,
             leaves, internal, intersection_vertices)
@@ -334,35 +361,20 @@ def draw_cairo_frame(ctx, scale, newick, eigenvector_index, yaw, pitch):
     """
     @param eigenvector_index: 1 is Fiedler
     """
-    tree = Newick.parse(newick, SpatialTree.SpatialTree) 
-    # change the node names and get the new tree string
-    for node in tree.preorder():
-        node.name = 'n' + str(id(node))
-    newick = NewickIO.get_newick_string(tree)
-    # do the layout
-    layout = FastDaylightLayout.StraightBranchLayout() 
-    layout.do_layout(tree) 
-    tree.fit((g_xy_scale, g_xy_scale))
-    name_to_location = dict((
-        x.name, tree._layout_to_display(x.location)) for x in tree.preorder())
-    T, B, N = FtreeIO.newick_to_TBN(newick)
-    # get some vertices
-    leaves = Ftree.T_to_leaves(T)
-    internal = Ftree.T_to_internal_vertices(T)
-    vertices = leaves + internal
-    # get the locations
-    v_to_location = dict((v, name_to_location[N[v]]) for v in vertices)
-    # get the valuations
-    w, V = Ftree.TB_to_harmonic_extension(T, B, leaves, internal)
-    index_to_val = V[:, eigenvector_index-1]
-    v_to_val = dict(
-            (vertices[i], g_z_scale*val) for i, val in enumerate(index_to_val))
-    # get the coordinates
-    v_to_xyz = get_v_to_xyz(yaw, v_to_location, v_to_val)
-    # add intersection vertices
-    add_intersection_vertices(T, B, v_to_xyz)
-    intersection_vertices = sorted(v for v in v_to_xyz if v not in vertices)
-    # FIXME everything above is the same as in get_tikz_lines
+    projection = get_projection(newick, eigenvector_index)
+    draw_cairo_projection(ctx, scale, projection, yaw, pitch)
+
+def draw_cairo_projection(ctx, scale, projection, yaw, pitch):
+    """
+    @param ctx: cairo context
+    @param scale: more scaling
+    @param projection: the output of get_projection
+    @param yaw: an angle; rotate the tree layout around its center
+    @param pitch: an angle; worm eye vs bird eye view of the tree
+    """
+    T, B, leaves, internal, v_to_location, v_to_val = projection
+    T, B, v_to_xyz, intersection_vertices = get_projection_view(
+            projection, yaw)
     for v in v_to_xyz:
         v_to_xyz[v] *= scale
     xyz_to_cairo(ctx, T, B, pitch, v_to_xyz,
@@ -0,0 +1,701 @@
+"""
+A shared likelihood engine for the codon models of the mle-recessive scripts.
+
+The models are from Yang and Nielsen 2008,
+with a mutational exchangeability given by either HKY or GTR
+and with a few models of dominance or recessivity of selection.
+The theta-independent arrays are precomputed once per data set.
+The functions of theta are algopy aware,
+so they accept either plain ndarrays or algopy UTPM objects.
+The engine evaluates a function of theta together with its
+derivatives in a single forward mode algopy pass
+and remembers the results for the last few values of theta,
+because the optimizers ask for the value, the gradient, and the hessian
+at the same point in separate calls.
+"""
+
+import unittest
+import math
+from collections import OrderedDict
+
+import numpy
+import algopy
+
+import expmgrad
+import kimfix
+import kimrecessive
+import npcodon
+import yangdata
+
+# the number of recently evaluated parameter vectors to remember
+g_cache_size = 4
+
+# hessian approximations of the spectral engine
+g_hessian_methods = ('gauss-newton', 'bfgs')
+
+# the number of free exchangeability parameters of each mutation model
+g_mutexch_nparams = {
+        'hky' : 1,
+        'gtr' : 5,
+        }
+
+# the number of free parameters of each model of dominance
+g_disease_nparams = {
+        'genic' : 0,
+        'recessive' : 0,
+        'dominant' : 0,
+        'unconstrained' : 1,
+        'kacser' : 2,
+        }
+
+# This interpolation table of the Kimura integral is built on first use
+# unless a table is provided through set_denom_table.
+# The build takes a few seconds, and only some dominance models use it.
+g_denom_table = None
+g_denom_table_filename = None
+
+# the models of dominance whose plain array evaluations use the table
+g_table_diseases = ('recessive', 'dominant')
+
+class CodonLikeError(Exception): pass
+
+
+##########################################################################
+# theta-independent arrays
+
+class CodonData:
+    """
+    Arrays that depend on the genetic code and the data but not on theta.
+    """
+
+    def __init__(self, code, stop, raw_subs_counts):
+        """
+        @param code: the genetic code from npcodon
+        @param stop: the stop codons from npcodon
+        @param raw_subs_counts: substitution counts including stop codons
+        """
+        all_codons = npcodon.enum_codons(stop)
+        self.codons = all_codons[:-len(stop)]
+        ncodons = len(self.codons)
+        #
+        # precompute arrays according to properties of DNA
+        # and the genetic code
+        self.ts, self.tv = npcodon.get_ts_tv(self.codons)
+        self.gtr = npcodon.get_gtr(self.codons)
+        self.syn, self.nonsyn = npcodon.get_syn_nonsyn(code, self.codons)
+        self.compo = npcodon.get_compo(self.codons)
+        self.asym_compo = npcodon.get_asym_compo(self.codons)
+        self.ham = npcodon.get_hamming(self.codons)
+        self.neighbor_mask = self.ts + self.tv
+        self.quad_x = kimfix.g_quad_x
+        self.quad_w = kimfix.g_quad_w
+        #
+        # summarize the data
+        self.raw_codon_counts = (
+                numpy.sum(raw_subs_counts, axis=0) +
+                numpy.sum(raw_subs_counts, axis=1))
+        self.codon_counts = self.raw_codon_counts[:ncodons]
+        self.subs_counts = raw_subs_counts[:ncodons, :ncodons]
+        self.v = self.codon_counts / float(numpy.sum(self.codon_counts))
+        self.log_counts = numpy.log(self.codon_counts)
+        self.mu_empirical = npcodon.get_lb_expected_subs(
+                self.ham, self.subs_counts)
+        self.lb_neg_ll = npcodon.get_lb_neg_ll(self.subs_counts)
+
+def read_codon_data(args):
+    """
+    Read the data files named on the command line and print a summary.
+    @param args: directly parsed from the command line
+    @return: a CodonData object
+    """
+    if args.mtdna or getattr(args, 'force_mtcode', False):
+        code = npcodon.g_code_mito
+        stop = npcodon.g_stop_mito
+    else:
+        code = npcodon.g_code
+        stop = npcodon.g_stop
+    raw_subs_counts = yangdata.get_subs_counts_from_data_files(args)
+    data = CodonData(code, stop, raw_subs_counts)
+    for a, b in zip(data.codons, data.raw_codon_counts):
+        print a, ':', b
+    print 'raw codon total:', numpy.sum(data.raw_codon_counts)
+    print 'raw codon counts:', data.raw_codon_counts
+    print 'non-stop codon total:', numpy.sum(data.codon_counts)
+    return data
+
+
+##########################################################################
+# fixation functions
+
+def set_denom_table(table):
+    global g_denom_table
+    g_denom_table = table
+
+def set_denom_table_filename(filename):
+    """
+    @param filename: an npz file in which to save and reuse the table
+    """
+    global g_denom_table_filename
+    g_denom_table_filename = filename
+
+def get_denom_table():
+    global g_denom_table
+    if g_denom_table is None:
+        g_denom_table = kimfix.get_table(g_denom_table_filename)
+    return g_denom_table
+
+def is_plain_array(*args):
+    """
+    Check whether the arguments carry no Taylor information.
+    @return: True if the arguments are plain numbers or float ndarrays
+    """
+    for x in args:
+        if not isinstance(x, (float, int, numpy.ndarray)):
+            return False
+        if isinstance(x, numpy.ndarray) and x.dtype == object:
+            return False
+    return True
+
+def get_fixation_fquad_masked(S, D, x, w, mask):
+    """
+    Compute fixation factors of neighboring codon pairs.
+    Plain arrays use the interpolation table.
+    Algopy arrays sum over the quadrature points,
+    so that each step is vectorized over all codon pairs.
+    The entries of codon pairs that are not neighbors are zero.
+    @param S: array of selection differences
+    @param D: array of dominance values
+    @param x: precomputed roots for quadrature
+    @param w: precomputed weights for quadrature
+    @param mask: only compute entries of neighboring codon pairs
+    """
+    # zero selection gives an integral of one for the masked entries
+    C = 0.5 * S * mask
+    if is_plain_array(C, D):
+        return mask / get_denom_table()(C, D)
+    denom = algopy.zeros_like(C)
+    for xk, wk in zip(x, w):
+        denom = denom + wk * algopy.exp(-2*C*xk*(D*(1-xk) + 1))
+    return (1. / denom) * mask
+
+def get_fixation_knudsen(S):
+    """
+    This is +gwF = 1/2.
+    """
+    return 1. / kimrecessive.denom_knudsen(0.5*S)
+
+def get_fixation_genic(S):
+    return 1. / kimrecessive.denom_genic_a(0.5*S)
+
+def get_fixation_recessive_disease(S):
+    if is_plain_array(S):
+        return kimfix.get_fixation(S, numpy.sign(S), get_denom_table())
+    sign_S = algopy.sign(S)
+    H = algopy.zeros_like(S)
+    for i in range(H.shape[0]):
+        for j in range(H.shape[1]):
+            H[i, j] = 1. / kimrecessive.denom_piecewise(
+                    0.5*S[i, j], sign_S[i, j])
+    return H
+
+def get_fixation_dominant_disease(S):
+    if is_plain_array(S):
+        return kimfix.get_fixation(S, -numpy.sign(S), get_denom_table())
+    sign_S = algopy.sign(S)
+    H = algopy.zeros_like(S)
+    for i in range(H.shape[0]):
+        for j in range(H.shape[1]):
+            H[i, j] = 1. / kimrecessive.denom_piecewise(
+                    0.5*S[i, j], -sign_S[i, j])
+    return H
+
+def get_fixation_unconstrained_fquad(S, d, x, w, codon_neighbor_mask):
+    """
+    In this function name, fquad means "fixed quadrature."
+    The S ndarray with ndim=2 depends on free parameters.
+    The d parameter is itself a free parameter.
+    @param S: array of selection differences
+    @param d: parameter that controls dominance vs. recessivity
+    @param x: precomputed roots for quadrature
+    @param w: precomputed weights for quadrature
+    @param codon_neighbor_mask: only compute entries of neighboring codon pairs
+    """
+    D = d * algopy.sign(S)
+    return get_fixation_fquad_masked(S, D, x, w, codon_neighbor_mask)
+
+def get_fixation_unconstrained_kb_fquad(
+        S, d, log_kb, x, w, codon_neighbor_mask):
+    """
+    This uses the Kacser and Burns effect instead of the sign function.
+    """
+    D = d * algopy.tanh(algopy.exp(log_kb)*S)
+    return get_fixation_fquad_masked(S, D, x, w, codon_neighbor_mask)
+
+
+##########################################################################
+# algopy stuff involving parameters
+
+def get_selection_F(log_counts, compo, log_nt_weights):
+    """
+    The F and S notation is from Yang and Nielsen 2008.
+    Note that three of the four log nt weights are free parameters.
+    @param log_counts: logs of empirical codon counts
+    @param compo: codon composition as defined in the get_compo function
+    @param log_nt_weights: un-normalized log mutation process probabilities
+    @return: a log selection for each codon, up to an additive constant
+    """
+    return log_counts - algopy.dot(compo, log_nt_weights)
+
+def get_selection_S(F):
+    """
+    The F and S notation is from Yang and Nielsen 2008.
+    @param F: a selection value for each codon, up to an additive constant
+    @return: selection differences F_j - F_i, also known as S_ij
+    """
+    e = algopy.ones_like(F)
+    return algopy.outer(e, F) - algopy.outer(F, e)
+
+def get_Q_prefix(
+        ts, tv, syn, nonsyn,
+        log_mu, log_kappa, log_omega):
+    """
+    Compute a chunk of a hadamard decomposition of the pre-Q matrix.
+    By hadamard decomposition I mean the factoring of a matrix
+    into the entrywise product of two matrices.
+    By pre-Q matrix I mean the rate matrix before the row sums
+    have been subtracted from the diagonal.
+    This chunk does not depend on mutation process
+    stationary distribution parameters,
+    and it does not depend on recessivity parameters.
+    """
+    mu = algopy.exp(log_mu)
+    kappa = algopy.exp(log_kappa)
+    omega = algopy.exp(log_omega)
+    return mu * (kappa * ts + tv) * (omega * nonsyn + syn)
+
+def get_Q_prefix_gtr(
+        gtr, syn, nonsyn,
+        log_mu, log_gtr_exch, log_omega):
+    """
+    This is like get_Q_prefix but with GTR mutational exchangeabilities.
+    @param log_gtr_exch: logs of the six exchangeabilities
+    """
+    mu = algopy.exp(log_mu)
+    gtr_exch = algopy.exp(log_gtr_exch)
+    omega = algopy.exp(log_omega)
+    return mu * algopy.dot(gtr, gtr_exch) * (omega * nonsyn + syn)
+
+def get_Q(pre_Q_prefix, pre_Q_suffix):
+    """
+    @param pre_Q_prefix: component of hadamard decomposition of pre_Q
+    @param pre_Q_suffix: component of hadamard decomposition of pre_Q
+    @return: rate matrix
+    """
+    pre_Q = pre_Q_prefix * pre_Q_suffix
+    return pre_Q - algopy.diag(algopy.sum(pre_Q, axis=1))
+
+def get_log_likelihood(P, v, subs_counts):
+    """
+    The stationary distribution of P is empirically derived.
+    It is proportional to the codon counts by construction.
+    @param P: a transition matrix using codon counts and free parameters
+    @param v: stationary distribution proportional to observed codon counts
+    @param subs_counts: observed substitution counts
+    """
+    return algopy.sum(algopy.log(P.T * v) * subs_counts)
+
+
+class CodonModel:
+    """
+    A codon model with mutation, selection, and dominance parameters.
+    The unconstrained parameter vector theta consists of
+    the log of a scaling parameter,
+    the logs of the mutational exchangeabilities relative to one of them,
+    the log of the nonsynonymous vs. synonymous ratio,
+    the dominance parameters if any,
+    and the logs of three of the four mutational nucleotide weights
+    relative to the fourth.
+    """
+
+    def __init__(self, data, mutexch, disease):
+        """
+        @param data: a CodonData object
+        @param mutexch: 'hky' or 'gtr'
+        @param disease: the model of dominance of selection
+        """
+        if mutexch not in g_mutexch_nparams:
+            raise CodonLikeError('unknown mutation model: ' + mutexch)
+        if disease not in g_disease_nparams:
+            raise CodonLikeError('unknown dominance model: ' + disease)
+        self.data = data
+        self.mutexch = mutexch
+        self.disease = disease
+
+    def get_nparams(self):
+        nexch = g_mutexch_nparams[self.mutexch]
+        return 1 + nexch + 1 + g_disease_nparams[self.disease] + 3
+
+    def get_initial_theta(
+            self, log_kappa=1.0, log_omega=-3.0, d=1.6, log_kb=0.0):
+        """
+        Get plausible parameter values.
+        The scaling parameter is chosen so that the expected number
+        of substitutions matches the empirical lower bound.
+        @param log_kappa: the log transition vs. transversion ratio for HKY
+        @param log_omega: the log nonsynonymous vs. synonymous ratio
+        @param d: the dominance parameter if any
+        @param log_kb: the log Kacser and Burns parameter if any
+        @return: an ndarray
+        """
+        theta = [0.0]
+        if self.mutexch == 'hky':
+            theta.append(log_kappa)
+        else:
+            theta.extend([0.0] * g_mutexch_nparams[self.mutexch])
+        theta.append(log_omega)
+        theta.extend([d, log_kb][:g_disease_nparams[self.disease]])
+        theta.extend([0.0] * 3)
+        theta = numpy.array(theta, dtype=float)
+        Q = self.get_Q(theta)
+        mu_implied = -numpy.dot(numpy.diag(Q), self.data.v)
+        theta[0] = math.log(self.data.mu_empirical) - math.log(mu_implied)
+        return theta
+
+    def get_pre_Q_prefix(self, theta):
+        """
+        @param theta: unconstrained vector of free variables
+        @return: the part of pre_Q that does not depend on selection
+        """
+        data = self.data
+        nexch = g_mutexch_nparams[self.mutexch]
+        log_mu = theta[0]
+        log_omega = theta[1 + nexch]
+        if self.mutexch == 'hky':
+            return get_Q_prefix(
+                    data.ts, data.tv, data.syn, data.nonsyn,
+                    log_mu, theta[1], log_omega)
+        log_gtr_exch = algopy.zeros(6, dtype=theta)
+        for i in range(nexch):
+            log_gtr_exch[i] = theta[1 + i]
+        log_gtr_exch[5] = 0
+        return get_Q_prefix_gtr(
+                data.gtr, data.syn, data.nonsyn,
+                log_mu, log_gtr_exch, log_omega)
+
+    def get_fixation(self, S, disease_params):
+        data = self.data
+        if self.disease == 'genic':
+            return get_fixation_genic(S)
+        elif self.disease == 'recessive':
+            return get_fixation_recessive_disease(S)
+        elif self.disease == 'dominant':
+            return get_fixation_dominant_disease(S)
+        elif self.disease == 'unconstrained':
+            d, = disease_params
+            return get_fixation_unconstrained_fquad(
+                    S, d, data.quad_x, data.quad_w, data.neighbor_mask)
+        else:
+            d, log_kb = disease_params
+            return get_fixation_unconstrained_kb_fquad(
+                    S, d, log_kb,
+                    data.quad_x, data.quad_w, data.neighbor_mask)
+
+    def get_Q(self, theta):
+        """
+        @param theta: unconstrained vector of free variables
+        @return: rate matrix
+        """
+        data = self.data
+        k = 2 + g_mutexch_nparams[self.mutexch]
+        ndisease = g_disease_nparams[self.disease]
+        disease_params = [theta[k + i] for i in range(ndisease)]
+        k += ndisease
+        log_nt_weights = algopy.zeros(4, dtype=theta)
+        log_nt_weights[0] = theta[k]
+        log_nt_weights[1] = theta[k+1]
+        log_nt_weights[2] = theta[k+2]
+        log_nt_weights[3] = 0
+        F = get_selection_F(data.log_counts, data.compo, log_nt_weights)
+        S = get_selection_S(F)
+        pre_Q_suffix = algopy.exp(
+                algopy.dot(data.asym_compo, log_nt_weights))
+        pre_Q_suffix = pre_Q_suffix * self.get_fixation(S, disease_params)
+        return get_Q(self.get_pre_Q_prefix(theta), pre_Q_suffix)
+
+    def get_neg_ll(self, theta):
+        """
+        @param theta: unconstrained vector of free variables
+        @return: negative log likelihood
+        """
+        P = algopy.expm(self.get_Q(theta))
+        return -get_log_likelihood(P, self.data.v, self.data.subs_counts)
+
+
+##########################################################################
+# derivatives and memoization
+
+def eval_grad(f, theta, *args):
+    """
+    Compute the gradient of f in the forward mode of automatic differentiation.
+    """
+    theta = algopy.UTPM.init_jacobian(theta)
+    retval = f(theta, *args)
+    return algopy.UTPM.extract_jacobian(retval)
+
+def eval_hess(f, theta, *args):
+    """
+    Compute the hessian of f in the forward mode of automatic differentiation.
+    """
+    theta = algopy.UTPM.init_hessian(theta)
+    retval = f(theta, *args)
+    return algopy.UTPM.extract_hessian(len(theta), retval)
+
+def eval_f_grad_hess(f, theta, order):
+    """
+    Compute the value and derivatives of f in one forward mode pass.
+    The hessian pass propagates Taylor polynomials along directions
+    that include each coordinate axis,
+    so the gradient is recovered from the first order coefficients.
+    @param f: an algopy aware scalar function of theta
+    @param theta: a point as a plain ndarray
+    @param order: 0 for the value, 1 to add the gradient, 2 to add the hessian
+    @return: a tuple with order+1 entries
+    """
+    if order == 0:
+        return (float(f(theta)),)
+    elif order == 1:
+        x = algopy.UTPM.init_jacobian(theta)
+        y = f(x)
+        return float(y.data[0, 0]), algopy.UTPM.extract_jacobian(y)
+    elif order == 2:
+        x = algopy.UTPM.init_hessian(theta)
+        y = f(x)
+        directions = x.data[1]
+        grad = numpy.linalg.lstsq(directions, y.data[1])[0]
+        hess = algopy.UTPM.extract_hessian(len(theta), y)
+        return float(y.data[0, 0]), grad, hess
+    else:
+        raise CodonLikeError('expected order 0, 1, or 2')
+
+class LikelihoodEngine:
+    """
+    Memoize an algopy aware function of theta and its derivatives.
+    A request for a derivative evaluates all derivatives
+    up to the order of the engine at once,
+    so a gradient request followed by a hessian request at the same
+    point costs a single forward mode pass.
+    A request for only the value is evaluated without Taylor information.
+    At most cache_size points are remembered,
+    and the least recently used point is forgotten first.
+    """
+
+    def __init__(self, f, order=1, cache_size=g_cache_size):
+        """
+        @param f: an algopy aware scalar function of theta
+        @param order: the highest derivative order computed together
+        @param cache_size: the maximum number of remembered points
+        """
+        self.f = f
+        self.order = order
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        # the number of evaluations of f of each order
+        self.nevals = [0, 0, 0]
+
+    def _get_entry(self, theta, order):
+        theta = numpy.array(theta, dtype=float)
+        key = theta.tostring()
+        entry = self.cache.pop(key, None)
+        if entry is None or len(entry) <= order:
+            if order:
+                order = max(order, self.order)
+            entry = self._evaluate(theta, order)
+            self.nevals[order] += 1
+        self.cache[key] = entry
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return entry
+
+    def _evaluate(self, theta, order):
+        return eval_f_grad_hess(self.f, theta, order)
+
+    def value(self, theta, *args):
+        """
+        The extra args are ignored so that this works with scipy optimizers.
+        """
+        return self._get_entry(theta, 0)[0]
+
+    def grad(self, theta, *args):
+        return self._get_entry(theta, 1)[1]
+
+    def hess(self, theta, *args):
+        return self._get_entry(theta, 2)[2]
+
+
+class SpectralEngine(LikelihoodEngine):
+    """
+    Memoize the negative log likelihood of a codon model and its derivatives.
+    The gradient uses the adjoint of the Frechet derivative of expm
+    from the expmgrad module,
+    which uses the eigendecomposition of the symmetrized rate matrix
+    when the model is reversible with respect to the codon distribution.
+    Algopy is used only for the jacobian of the rate matrix,
+    so no Taylor arithmetic passes through the matrix exponential.
+    The hessian is either the Gauss-Newton approximation
+    or a BFGS approximation built from the sequence of gradients
+    starting from the Gauss-Newton matrix at the first hessian request.
+    """
+
+    def __init__(self, model, hessian='gauss-newton',
+            order=1, cache_size=g_cache_size):
+        """
+        @param model: a CodonModel
+        @param hessian: 'gauss-newton' or 'bfgs'
+        @param order: the highest derivative order computed together
+        @param cache_size: the maximum number of remembered points
+        """
+        if hessian not in g_hessian_methods:
+            raise CodonLikeError('unknown hessian method: ' + hessian)
+        LikelihoodEngine.__init__(self, model.get_neg_ll, order, cache_size)
+        self.model = model
+        self.hessian = hessian
+        self.bfgs_hess = None
+        self.bfgs_point = None
+
+    def _update_bfgs(self, theta, grad):
+        if self.bfgs_point is not None:
+            s = theta - self.bfgs_point[0]
+            y = grad - self.bfgs_point[1]
+            sy = numpy.dot(s, y)
+            if self.bfgs_hess is not None and (
+                    sy > 1e-12 * numpy.linalg.norm(s) * numpy.linalg.norm(y)):
+                Bs = numpy.dot(self.bfgs_hess, s)
+                self.bfgs_hess = self.bfgs_hess + (
+                        numpy.outer(y, y) / sy -
+                        numpy.outer(Bs, Bs) / numpy.dot(s, Bs))
+        self.bfgs_point = (theta, grad)
+
+    def _evaluate(self, theta, order):
+        if order == 0:
+            return (float(self.f(theta)),)
+        data = self.model.data
+        N = data.subs_counts
+        y = self.model.get_Q(algopy.UTPM.init_jacobian(theta))
+        Q = y.data[0, 0]
+        dQ = y.data[1]
+        expm_object = expmgrad.get_expm(Q, data.v)
+        P = expm_object.P
+        value = -numpy.sum(N * numpy.log(P.T * data.v))
+        # the gradient of the negative log likelihood with respect to P
+        G = -N.T / P
+        grad = expmgrad.get_gradient(expm_object, G, dQ)
+        self._update_bfgs(theta, grad)
+        if order == 1:
+            return value, grad
+        if self.hessian == 'bfgs' and self.bfgs_hess is not None:
+            hess = self.bfgs_hess.copy()
+        else:
+            J = expmgrad.get_jacobian(expm_object, dQ)
+            J = J.reshape(len(theta), -1)
+            weights = (N.T / (P*P)).ravel()
+            hess = numpy.dot(J * weights, J.T)
+            if self.hessian == 'bfgs':
+                # start the updates from the gauss-newton matrix
+                self.bfgs_hess = hess.copy()
+        return value, grad, hess
+
+
+class TestCodonLike(unittest.TestCase):
+
+    def _get_data(self):
+        ncodons = len(npcodon.enum_codons(npcodon.g_stop))
+        raw_subs_counts = numpy.random.RandomState(0).randint(
+                1, 10, size=(ncodons, ncodons))
+        return CodonData(npcodon.g_code, npcodon.g_stop, raw_subs_counts)
+
+    def test_fixation_reversibility(self):
+        """
+        Check reversibility of h functions with respect to F.
+        """
+        F = numpy.array([1.2, 2.3, 0, -1.1])
+        S = get_selection_S(F)
+        for h in (
+                get_fixation_genic,
+                get_fixation_recessive_disease,
+                get_fixation_dominant_disease,
+                get_fixation_knudsen,
+                ):
+            fixation = h(S)
+            log_ratio = numpy.log(fixation / fixation.T)
+            self.assertTrue(numpy.allclose(S, log_ratio))
+
+    def test_detailed_balance(self):
+        """
+        The empirical codon distribution is stationary for each model.
+        """
+        data = self._get_data()
+        for mutexch in ('hky', 'gtr'):
+            for disease in g_disease_nparams:
+                model = CodonModel(data, mutexch, disease)
+                theta = model.get_initial_theta()
+                theta[-3:] = [0.1, -0.2, 0.3]
+                self.assertEqual(len(theta), model.get_nparams())
+                Q = model.get_Q(theta)
+                self.assertTrue(numpy.allclose(numpy.sum(Q, axis=1), 0))
+                VQ = data.v[:, numpy.newaxis] * Q
+                self.assertTrue(numpy.allclose(VQ, VQ.T))
+
+    def test_engine(self):
+        A = numpy.array([[2.0, 0.5, 0.0], [0.5, 1.0, 0.2], [0.0, 0.2, 3.0]])
+        b = numpy.array([1.0, -2.0, 0.5])
+        def f(theta):
+            return algopy.dot(theta, algopy.dot(A, theta)) + algopy.sum(
+                    algopy.exp(b * theta))
+        engine = LikelihoodEngine(f, order=2)
+        theta = numpy.array([0.3, -0.1, 0.2])
+        g = engine.grad(theta)
+        h = engine.hess(theta)
+        y = engine.value(theta)
+        self.assertEqual(engine.nevals, [0, 0, 1])
+        self.assertTrue(numpy.allclose(y, f(theta)))
+        self.assertTrue(numpy.allclose(
+            g, 2*numpy.dot(A, theta) + b*numpy.exp(b*theta)))
+        self.assertTrue(numpy.allclose(
+            h, 2*A + numpy.diag(b*b*numpy.exp(b*theta))))
+        # the cache forgets the least recently used point
+        for i in range(g_cache_size):
+            engine.value(theta + i + 1)
+        engine.value(theta)
+        self.assertEqual(engine.nevals, [g_cache_size + 1, 0, 1])
+        # a first order engine computes the hessian only on request
+        engine = LikelihoodEngine(f, order=1)
+        self.assertTrue(numpy.allclose(engine.grad(theta), g))
+        self.assertTrue(numpy.allclose(engine.value(theta), y))
+        self.assertEqual(engine.nevals, [0, 1, 0])
+        self.assertTrue(numpy.allclose(engine.hess(theta), h))
+        self.assertTrue(numpy.allclose(engine.grad(theta), g))
+        self.assertEqual(engine.nevals, [0, 1, 1])
+
+    def test_spectral_engine(self):
+        data = self._get_data()
+        for disease in ('genic', 'unconstrained'):
+            model = CodonModel(data, 'hky', disease)
+            theta = model.get_initial_theta()
+            theta[-3:] = [0.1, -0.2, 0.3]
+            expected_grad = eval_grad(model.get_neg_ll, theta)
+            engine = SpectralEngine(model)
+            self.assertTrue(numpy.allclose(engine.grad(theta), expected_grad))
+            # the Gauss-Newton approximation is positive semidefinite
+            H = engine.hess(theta)
+            self.assertTrue(numpy.allclose(H, H.T))
+            self.assertTrue(numpy.min(numpy.linalg.eigvalsh(H)) > -1e-8)
+            # the BFGS approximation starts from the Gauss-Newton matrix
+            engine = SpectralEngine(model, hessian='bfgs')
+            self.assertTrue(numpy.allclose(engine.hess(theta), H))
+            engine.grad(theta + 0.01)
+            B = engine.hess(theta + 0.01)
+            self.assertTrue(numpy.allclose(B, B.T))
+            self.assertFalse(numpy.allclose(B, H))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -96,7 +96,8 @@ def alg34(A, E, k):
     elif k == 1:
         return E
     else:
-        return np.dot(alg34(k-1), A) + np.dot(np.linalg.matrix_power(A, k-1), E)
+        return np.dot(alg34(A, E, k-1), A) + np.dot(
+                np.linalg.matrix_power(A, k-1), E)
 
 def alg612(A, E, m):
     """
@@ -231,8 +232,8 @@ def alg64(A, E):
             Lu, Lv = alg612(A, E, m)
             return alg64_26_27(U, V, Lu, Lv)
     s = int(math.ceil(math.log(linalg.norm(A, 1) / table61_l[13], 2)))
-    A /= 2**s
-    E /= 2**s
+    A = A / 2**s
+    E = E / 2**s
     A2 = np.linalg.matrix_power(A, 2)
     A4 = np.linalg.matrix_power(A2, 2)
     A6 = np.dot(A2, A4)
@@ -242,7 +243,7 @@ def alg64(A, E):
     W1 = b13*A6 + b11*A4 + b9*A2
     I = np.eye(n)
     W2 = b7*A6 + b5*A4 + b3*A2 + b1*I
-    Z1 = b12*A1 + b10*A4 + b8*A2
+    Z1 = b12*A6 + b10*A4 + b8*A2
     Z2 = b6*A6 + b4*A4 + b2*A2 + b0*I
     W = np.dot(A6, W1) + W2
     U = np.dot(A, W)
@@ -251,7 +252,7 @@ def alg64(A, E):
     Lw2 = b7*M6 + b5*M4 + b3*M2
     Lz1 = b12*M6 + b10*M4 + b8*M2
     Lz2 = b6*M6 + b4*M4 + b2*M2
-    Lw = np.dot(A6, Lz1) + np.dot(M6, W1) + Lw2
+    Lw = np.dot(A6, Lw1) + np.dot(M6, W1) + Lw2
     Lu = np.dot(A, Lw) + np.dot(E, W)
     Lv = np.dot(A6, Lz1) + np.dot(M6, Z1) + Lz2
     R, L = alg64_26_27(U, V, Lu, Lv)
@@ -0,0 +1,234 @@
+"""
+Derivatives of functions of the exponential of a rate matrix.
+
+The derivative of a scalar function f(P) of P = expm(Q)
+with respect to the entries of Q is the adjoint of the Frechet derivative
+of the matrix exponential applied to the gradient of f with respect to P.
+Given that matrix, the derivative with respect to each parameter
+of Q is an entrywise inner product with the derivative of Q,
+so a gradient costs a constant number of O(n^3) matrix operations
+regardless of the number of parameters.
+When Q is reversible with respect to a known distribution,
+the Frechet derivative and its adjoint use the eigendecomposition
+of the symmetrized rate matrix.
+Otherwise they use the scaling and squaring algorithm in expmfrechet.
+"""
+
+import unittest
+
+import numpy as np
+import scipy.linalg
+
+import expmfrechet
+
+# the relative tolerance for detailed balance
+g_reversibility_rtol = 1e-8
+
+# use a series for divided differences of nearly equal eigenvalues
+g_divided_difference_tol = 1e-3
+
+class ExpmGradError(Exception): pass
+
+
+def is_reversible(Q, v, rtol=g_reversibility_rtol):
+    """
+    @param Q: rate matrix
+    @param v: a positive distribution
+    @param rtol: relative tolerance for detailed balance
+    @return: True if Q is reversible with respect to v
+    """
+    VQ = v[:, np.newaxis] * Q
+    return np.allclose(VQ, VQ.T, rtol=rtol, atol=rtol*np.max(np.abs(VQ)))
+
+def get_exp_divided_differences(w):
+    """
+    The matrix of (exp(a) - exp(b)) / (a - b) for pairs of eigenvalues.
+    Nearly equal pairs use exp((a+b)/2) * sinh(d/2) / (d/2)
+    expanded as a series in the difference d.
+    @param w: eigenvalues
+    @return: a symmetric matrix
+    """
+    a = w[:, np.newaxis]
+    b = w[np.newaxis, :]
+    d = a - b
+    near = np.abs(d) < g_divided_difference_tol
+    d_safe = np.where(near, 1.0, d)
+    ew = np.exp(w)
+    far_values = (ew[:, np.newaxis] - ew[np.newaxis, :]) / d_safe
+    near_values = np.exp(0.5*(a + b)) * (1 + d*d/24.0)
+    return np.where(near, near_values, far_values)
+
+
+class SpectralExpm:
+    """
+    The exponential of a reversible rate matrix and its Frechet derivative.
+    With D the diagonal matrix of the stationary distribution,
+    the symmetric matrix D^(1/2) Q D^(-1/2) has the eigendecomposition
+    U diag(w) U^T, and the Frechet derivative in the direction E is
+    D^(-1/2) U ((U^T D^(1/2) E D^(-1/2) U) * F) U^T D^(1/2)
+    where F is the matrix of divided differences of exp at w.
+    """
+
+    def __init__(self, Q, v):
+        """
+        @param Q: a rate matrix reversible with respect to v
+        @param v: the stationary distribution of Q
+        """
+        r = np.sqrt(v)
+        S = r[:, np.newaxis] * Q / r
+        w, U = np.linalg.eigh(0.5 * (S + S.T))
+        # left is D^(-1/2) U and right is U^T D^(1/2)
+        self.left = U / r[:, np.newaxis]
+        self.right = U.T * r
+        self.F = get_exp_divided_differences(w)
+        self.P = np.dot(self.left * np.exp(w), self.right)
+
+    def frechet(self, E):
+        """
+        @param E: direction of the change of Q
+        @return: the corresponding change of expm(Q)
+        """
+        X = np.dot(self.right, np.dot(E, self.left)) * self.F
+        return np.dot(self.left, np.dot(X, self.right))
+
+    def adjoint(self, G):
+        """
+        @param G: gradient of a scalar function with respect to expm(Q)
+        @return: gradient of the scalar function with respect to Q
+        """
+        X = np.dot(self.left.T, np.dot(G, self.right.T)) * self.F
+        return np.dot(self.right.T, np.dot(X, self.left.T))
+
+
+class FrechetExpm:
+    """
+    The exponential of a general square matrix and its Frechet derivative.
+    The adjoint of the Frechet derivative at Q
+    is the Frechet derivative at the transpose of Q.
+    """
+
+    def __init__(self, Q):
+        """
+        @param Q: a square matrix
+        """
+        self.Q = Q
+        self.P = scipy.linalg.expm(Q)
+
+    def frechet(self, E):
+        return expmfrechet.alg64(self.Q, E)[1]
+
+    def adjoint(self, G):
+        return expmfrechet.alg64(self.Q.T, G)[1]
+
+
+def get_expm(Q, v=None):
+    """
+    Use the spectral method when Q is reversible with respect to v.
+    @param Q: rate matrix
+    @param v: a candidate stationary distribution or None
+    @return: a SpectralExpm or a FrechetExpm
+    """
+    if v is not None and is_reversible(Q, v):
+        return SpectralExpm(Q, v)
+    return FrechetExpm(Q)
+
+def get_gradient(expm_object, G, dQ):
+    """
+    @param expm_object: a SpectralExpm or a FrechetExpm
+    @param G: gradient of a scalar function with respect to expm(Q)
+    @param dQ: derivatives of Q with respect to each parameter
+    @return: gradient of the scalar function with respect to the parameters
+    """
+    W = expm_object.adjoint(G)
+    return np.array([np.sum(W * E) for E in dQ])
+
+def get_jacobian(expm_object, dQ):
+    """
+    @param expm_object: a SpectralExpm or a FrechetExpm
+    @param dQ: derivatives of Q with respect to each parameter
+    @return: derivatives of expm(Q) with respect to each parameter
+    """
+    return np.array([expm_object.frechet(E) for E in dQ])
+
+
+def _get_test_rate_matrix(n, seed):
+    """
+    @return: a dense reversible rate matrix and its stationary distribution
+    """
+    rs = np.random.RandomState(seed)
+    v = rs.uniform(0.5, 2.0, size=n)
+    v /= np.sum(v)
+    X = rs.exponential(size=(n, n))
+    pre_Q = (X + X.T) * v
+    Q = pre_Q - np.diag(np.sum(pre_Q, axis=1))
+    return Q, v
+
+class TestExpmGrad(unittest.TestCase):
+
+    def test_divided_differences(self):
+        w = np.array([-3.0, -1.0, -1.0 + 1e-9, -1.0 + 1e-4, 0.0])
+        F = get_exp_divided_differences(w)
+        for i, a in enumerate(w):
+            for j, b in enumerate(w):
+                if a == b:
+                    expected = np.exp(a)
+                else:
+                    expected = np.expm1(a - b) * np.exp(b) / (a - b)
+                self.assertTrue(np.allclose(F[i, j], expected, rtol=1e-12))
+
+    def test_spectral_frechet(self):
+        Q, v = _get_test_rate_matrix(7, 0)
+        E = np.random.RandomState(1).randn(7, 7)
+        spectral = SpectralExpm(Q, v)
+        R, L = expmfrechet.alg64(Q, E)
+        self.assertTrue(np.allclose(spectral.P, scipy.linalg.expm(Q)))
+        self.assertTrue(np.allclose(spectral.frechet(E), L))
+
+    def test_adjoint(self):
+        """
+        Check that <G, L(Q, E)> = <L*(Q, G), E> for both methods.
+        """
+        Q, v = _get_test_rate_matrix(6, 2)
+        rs = np.random.RandomState(3)
+        G = rs.randn(6, 6)
+        E = rs.randn(6, 6)
+        for expm_object in (SpectralExpm(Q, v), FrechetExpm(Q)):
+            lhs = np.sum(G * expm_object.frechet(E))
+            rhs = np.sum(expm_object.adjoint(G) * E)
+            self.assertTrue(np.allclose(lhs, rhs))
+
+    def test_gradient(self):
+        """
+        Compare to finite differences of a log likelihood.
+        """
+        n = 5
+        rs = np.random.RandomState(4)
+        N = rs.randint(1, 20, size=(n, n))
+        Q0, v = _get_test_rate_matrix(n, 5)
+        # the parameters scale the symmetric exchangeabilities
+        dQ = []
+        for k in range(3):
+            X = rs.exponential(size=(n, n))
+            E = (X + X.T) * v
+            dQ.append(E - np.diag(np.sum(E, axis=1)))
+        def f(theta):
+            Q = Q0 + sum(t * E for t, E in zip(theta, dQ))
+            return np.sum(N * np.log(scipy.linalg.expm(Q)))
+        theta = np.array([0.1, 0.2, 0.3])
+        Q = Q0 + sum(t * E for t, E in zip(theta, dQ))
+        eps = 1e-6
+        expected = [(f(theta + eps*e) - f(theta - eps*e)) / (2*eps)
+                for e in np.eye(3)]
+        self.assertTrue(get_expm(Q, v).__class__ is SpectralExpm)
+        self.assertTrue(get_expm(Q).__class__ is FrechetExpm)
+        for expm_object in (get_expm(Q, v), get_expm(Q)):
+            G = N / expm_object.P
+            observed = get_gradient(expm_object, G, dQ)
+            self.assertTrue(np.allclose(observed, expected, rtol=1e-6))
+            J = get_jacobian(expm_object, dQ)
+            self.assertTrue(np.allclose(
+                observed, [np.sum(G * X) for X in J]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -196,6 +196,7 @@ Day_tp_dealloc(DayObject *self)
   int i;
   for (i=0; i<node_count; i++)
   {
+    free(nodes[i]->neighbors);
     free(nodes[i]);
   }
   free(nodes);
@@ -426,38 +427,52 @@ Day_reroot(DayObject *self, PyObject *unused)
   return result;
 }
 
-/* custom method: equalize daylight at the root */
-static PyObject *
-Day_equalize(DayObject *self, PyObject *unused)
+/*
+ * Equalize daylight among the subtrees of the root.
+ * This function does not use the Python API so it can run without the GIL.
+ * @param root: the root of the tree
+ * @param pmax_rotation: the largest absolute subtree rotation is written here, or NULL
+ * @return: one of the EQUALIZE_* status codes
+ */
+#define EQUALIZE_OK 0
+#define EQUALIZE_TOO_FEW_NEIGHBORS 1
+#define EQUALIZE_OCCLUDED 2
+#define EQUALIZE_NO_MEMORY 3
+int equalize_root(Node *root, double *pmax_rotation)
 {
-  /* do some basic error checking */
-  if (!self->root)
+  if (pmax_rotation)
   {
-    PyErr_SetString(PyExc_RuntimeError, "no root node was found");
-    return NULL;
+    *pmax_rotation = 0;
   }
-  if (self->root->nneighbors < 2)
+  if (root->nneighbors < 2)
   {
-    PyErr_SetString(PyExc_RuntimeError, "equalization requires at least two neighbors");
-    return NULL;
+    return EQUALIZE_TOO_FEW_NEIGHBORS;
   }
   /* utility variables */
   int i;
   int j;
+  long nneighbors = root->nneighbors;
   /* get the list of nodes in each subtree */
-  Node ***node_lists = (Node ***) malloc(self->root->nneighbors * sizeof(Node **));
-  long *node_list_lengths = malloc(self->root->nneighbors * sizeof(int));
-  for (i=0; i<self->root->nneighbors; i++)
+  Node ***node_lists = (Node ***) calloc(nneighbors, sizeof(Node **));
+  long *node_list_lengths = (long *) calloc(nneighbors, sizeof(long));
+  Interval *intervals = (Interval *) malloc(nneighbors * sizeof(Interval));
+  if (!node_lists || !node_list_lengths || !intervals)
   {
-    Node *neighbor = self->root->neighbors[i];
+    free(node_lists);
+    free(node_list_lengths);
+    free(intervals);
+    return EQUALIZE_NO_MEMORY;
+  }
+  for (i=0; i<nneighbors; i++)
+  {
+    Node *neighbor = root->neighbors[i];
     get_preorder_nodes(neighbor, &node_lists[i], &node_list_lengths[i]);
   }
   /* get the center x and y values */
-  double cx = self->root->x;
-  double cy = self->root->y;
+  double cx = root->x;
+  double cy = root->y;
   /* get the intervals in each subtree */
-  Interval *intervals = (Interval *) malloc(self->root->nneighbors * sizeof(Interval));
-  for (i=0; i<self->root->nneighbors; i++)
+  for (i=0; i<nneighbors; i++)
   {
     /* get the angle from the tree root to the subtree root */
     Node *subtree_root = node_lists[i][0];
@@ -485,21 +500,31 @@ Day_equalize(DayObject *self, PyObject *unused)
   }
   /* get the amount of total daylight */
   double total_occlusion = 0;
-  for (i=0; i<self->root->nneighbors; i++)
+  for (i=0; i<nneighbors; i++)
   {
     total_occlusion += norm(intervals[i].high - intervals[i].low);
   }
   /* rotate the subtrees if they can be spread out so they do not overlap */
   if (total_occlusion < 2*M_PI)
   {
-    double daylight_per_subtree = (2*M_PI - total_occlusion) / self->root->nneighbors;
+    double daylight_per_subtree = (2*M_PI - total_occlusion) / nneighbors;
     double observed_cumulative_angle = 0;
     double expected_cumulative_angle = 0;
-    for (i=0; i<self->root->nneighbors; i++)
+    for (i=0; i<nneighbors; i++)
     {
       double theta = expected_cumulative_angle - observed_cumulative_angle;
       if (theta)
       {
+        /* record the size of the rotation as an angle in [0, pi] */
+        double magnitude = norm(theta);
+        if (magnitude > M_PI)
+        {
+          magnitude = 2*M_PI - magnitude;
+        }
+        if (pmax_rotation && *pmax_rotation < magnitude)
+        {
+          *pmax_rotation = magnitude;
+        }
         double ct = cos(theta);
         double st = sin(theta);
         for (j=0; j<node_list_lengths[i]; j++)
@@ -512,7 +537,7 @@ Day_equalize(DayObject *self, PyObject *unused)
         }
       }
       double current_high = intervals[i].high;
-      double next_low = intervals[(i+1) % self->root->nneighbors].low;
+      double next_low = intervals[(i+1) % nneighbors].low;
       observed_cumulative_angle += norm(next_low - current_high);
       expected_cumulative_angle += daylight_per_subtree;
     }
@@ -521,21 +546,353 @@ Day_equalize(DayObject *self, PyObject *unused)
   free(intervals);
   /* free the node lists and their lengths */
   free(node_list_lengths);
-  for (i=0; i<self->root->nneighbors; i++)
+  for (i=0; i<nneighbors; i++)
   {
     free(node_lists[i]);
   }
   free(node_lists);
-  /* if the total occlusion is too much then report it, otherwise return None */
   if (total_occlusion < 2*M_PI)
   {
-    PyObject *result = Py_None;
-    Py_INCREF(result);
-    return result;
+    return EQUALIZE_OK;
   } else {
+    return EQUALIZE_OCCLUDED;
+  }
+}
+
+/*
+ * Set a Python exception for a failed equalization.
+ * @param status: an EQUALIZE_* status code
+ */
+void set_equalize_error(int status)
+{
+  if (status == EQUALIZE_TOO_FEW_NEIGHBORS)
+  {
+    PyErr_SetString(PyExc_RuntimeError, "equalization requires at least two neighbors");
+  } else if (status == EQUALIZE_OCCLUDED) {
     PyErr_SetString(PyExc_RuntimeError, "subtrees span at least 360 degrees");
+  } else {
+    PyErr_NoMemory();
+  }
+}
+
+/* custom method: equalize daylight at the root */
+static PyObject *
+Day_equalize(DayObject *self, PyObject *unused)
+{
+  if (!self->root)
+  {
+    PyErr_SetString(PyExc_RuntimeError, "no root node was found");
+    return NULL;
+  }
+  int status = equalize_root(self->root, NULL);
+  if (status != EQUALIZE_OK)
+  {
+    set_equalize_error(status);
+    return NULL;
+  }
+  PyObject *result = Py_None;
+  Py_INCREF(result);
+  return result;
+}
+
+/*
+ * Compare node pointers by node id for sorting and searching.
+ */
+int compare_node_ids(const void *pa, const void *pb)
+{
+  long a = (*(Node **) pa)->id;
+  long b = (*(Node **) pb)->id;
+  return (a > b) - (a < b);
+}
+
+/*
+ * Get the nodes of the tree sorted by id.
+ * @param root: the root of the tree
+ * @param pnodes: a pointer to an array of node pointers to be allocated
+ * @param pcount: a pointer to the length of the array
+ */
+void get_nodes_by_id(Node *root, Node ***pnodes, long *pcount)
+{
+  get_preorder_nodes(root, pnodes, pcount);
+  if (*pcount)
+  {
+    qsort(*pnodes, *pcount, sizeof(Node *), compare_node_ids);
+  }
+}
+
+/*
+ * Find a node by id in an array sorted by id.
+ * @return: the node or NULL
+ */
+Node *find_node_by_id(Node **sorted_nodes, long count, long id)
+{
+  Node key;
+  Node *pkey = &key;
+  key.id = id;
+  Node **found = (Node **) bsearch(
+      &pkey, sorted_nodes, count, sizeof(Node *), compare_node_ids);
+  return found ? *found : NULL;
+}
+
+/* custom method: repeatedly reroot and equalize until the layout converges */
+static PyObject *
+Day_equalize_all(DayObject *self, PyObject *args)
+{
+  PyObject *id_sequence = NULL;
+  long max_iterations = 0;
+  double tolerance = 0;
+  int ok = PyArg_ParseTuple(args, "Old", &id_sequence, &max_iterations, &tolerance);
+  if (!ok)
+  {
     return NULL;
   }
+  if (!self->root)
+  {
+    PyErr_SetString(PyExc_RuntimeError, "no root node was found");
+    return NULL;
+  }
+  PyObject *fast = PySequence_Fast(id_sequence, "expected a sequence of node ids");
+  if (!fast)
+  {
+    return NULL;
+  }
+  /* map the ids to nodes while the GIL is held */
+  long node_count = 0;
+  Node **sorted_nodes = NULL;
+  get_nodes_by_id(self->root, &sorted_nodes, &node_count);
+  Py_ssize_t nselected = PySequence_Fast_GET_SIZE(fast);
+  Node **selected = (Node **) malloc((nselected + 1) * sizeof(Node *));
+  if (!selected)
+  {
+    free(sorted_nodes);
+    Py_DECREF(fast);
+    return PyErr_NoMemory();
+  }
+  Py_ssize_t i;
+  for (i=0; i<nselected; i++)
+  {
+    long id = PyInt_AsLong(PySequence_Fast_GET_ITEM(fast, i));
+    if (id == -1 && PyErr_Occurred())
+    {
+      free(selected);
+      free(sorted_nodes);
+      Py_DECREF(fast);
+      return NULL;
+    }
+    selected[i] = find_node_by_id(sorted_nodes, node_count, id);
+    if (!selected[i])
+    {
+      free(selected);
+      free(sorted_nodes);
+      Py_DECREF(fast);
+      PyErr_SetString(PyExc_ValueError, "no node with the given id was found");
+      return NULL;
+    }
+  }
+  free(sorted_nodes);
+  Py_DECREF(fast);
+  /* run the layout iterations without the GIL */
+  int status = EQUALIZE_OK;
+  long iteration = 0;
+  Node *root = self->root;
+  Py_BEGIN_ALLOW_THREADS
+  while (iteration < max_iterations && status == EQUALIZE_OK)
+  {
+    double max_rotation = 0;
+    for (i=0; i<nselected; i++)
+    {
+      double rotation = 0;
+      reroot(selected[i]);
+      root = selected[i];
+      status = equalize_root(root, &rotation);
+      if (status != EQUALIZE_OK)
+      {
+        break;
+      }
+      if (max_rotation < rotation)
+      {
+        max_rotation = rotation;
+      }
+    }
+    iteration++;
+    if (max_rotation <= tolerance)
+    {
+      break;
+    }
+  }
+  Py_END_ALLOW_THREADS
+  self->root = root;
+  self->cursor = NULL;
+  free(selected);
+  if (status != EQUALIZE_OK)
+  {
+    set_equalize_error(status);
+    return NULL;
+  }
+  return PyInt_FromLong(iteration);
+}
+
+/* custom method: build the whole tree from a parent index sequence */
+static PyObject *
+Day_build(DayObject *self, PyObject *args)
+{
+  PyObject *parent_sequence = NULL;
+  PyObject *x_sequence = NULL;
+  PyObject *y_sequence = NULL;
+  int ok = PyArg_ParseTuple(args, "OOO", &parent_sequence, &x_sequence, &y_sequence);
+  if (!ok)
+  {
+    return NULL;
+  }
+  if (self->root)
+  {
+    PyErr_SetString(PyExc_RuntimeError, "the tree has already been created");
+    return NULL;
+  }
+  PyObject *parents = PySequence_Fast(parent_sequence, "expected a sequence of parent indices");
+  PyObject *xs = PySequence_Fast(x_sequence, "expected a sequence of x coordinates");
+  PyObject *ys = PySequence_Fast(y_sequence, "expected a sequence of y coordinates");
+  if (!parents || !xs || !ys)
+  {
+    Py_XDECREF(parents);
+    Py_XDECREF(xs);
+    Py_XDECREF(ys);
+    return NULL;
+  }
+  Py_ssize_t n = PySequence_Fast_GET_SIZE(parents);
+  if (!n || PySequence_Fast_GET_SIZE(xs) != n || PySequence_Fast_GET_SIZE(ys) != n)
+  {
+    Py_DECREF(parents);
+    Py_DECREF(xs);
+    Py_DECREF(ys);
+    PyErr_SetString(PyExc_ValueError, "expected nonempty sequences of equal length");
+    return NULL;
+  }
+  /* check the parent indices and count the neighbors of each node */
+  long *parent_indices = (long *) malloc(n * sizeof(long));
+  long *neighbor_counts = (long *) calloc(n, sizeof(long));
+  Node **nodes = (Node **) calloc(n, sizeof(Node *));
+  int failed = (!parent_indices || !neighbor_counts || !nodes);
+  if (failed)
+  {
+    PyErr_NoMemory();
+  }
+  Py_ssize_t i;
+  for (i=0; i<n && !failed; i++)
+  {
+    long p = PyInt_AsLong(PySequence_Fast_GET_ITEM(parents, i));
+    if (p == -1 && PyErr_Occurred())
+    {
+      failed = 1;
+    } else if ((i == 0 && p != -1) || (i > 0 && (p < 0 || p >= i))) {
+      PyErr_SetString(PyExc_ValueError,
+          "the first node should be the root and each parent should precede its children");
+      failed = 1;
+    } else {
+      parent_indices[i] = p;
+      if (p >= 0)
+      {
+        neighbor_counts[i]++;
+        neighbor_counts[p]++;
+      }
+    }
+  }
+  /* create the nodes with their coordinates */
+  for (i=0; i<n && !failed; i++)
+  {
+    Node *node = (Node *) malloc(sizeof(Node));
+    if (!node)
+    {
+      PyErr_NoMemory();
+      failed = 1;
+      break;
+    }
+    nodes[i] = node;
+    node->id = i;
+    node->blen = 0.0;
+    node->nneighbors = 0;
+    node->parent = NULL;
+    node->neighbors = (Node **) malloc((neighbor_counts[i] + 1) * sizeof(Node *));
+    node->x = PyFloat_AsDouble(PySequence_Fast_GET_ITEM(xs, i));
+    node->y = PyFloat_AsDouble(PySequence_Fast_GET_ITEM(ys, i));
+    if (!node->neighbors)
+    {
+      PyErr_NoMemory();
+      failed = 1;
+    } else if (PyErr_Occurred()) {
+      failed = 1;
+    }
+  }
+  /* link each node to its parent */
+  if (!failed)
+  {
+    for (i=1; i<n; i++)
+    {
+      Node *node = nodes[i];
+      Node *parent = nodes[parent_indices[i]];
+      node->parent = parent;
+      node->neighbors[node->nneighbors++] = parent;
+      parent->neighbors[parent->nneighbors++] = node;
+    }
+    self->root = nodes[0];
+    self->cursor = NULL;
+  } else {
+    for (i=0; i<n; i++)
+    {
+      if (nodes && nodes[i])
+      {
+        free(nodes[i]->neighbors);
+        free(nodes[i]);
+      }
+    }
+  }
+  free(parent_indices);
+  free(neighbor_counts);
+  free(nodes);
+  Py_DECREF(parents);
+  Py_DECREF(xs);
+  Py_DECREF(ys);
+  if (failed)
+  {
+    return NULL;
+  }
+  return PyInt_FromLong(n);
+}
+
+/* custom method: get all coordinates ordered by node id */
+static PyObject *
+Day_get_coordinates(DayObject *self, PyObject *unused)
+{
+  if (!self->root)
+  {
+    PyErr_SetString(PyExc_RuntimeError, "no root node was found");
+    return NULL;
+  }
+  long count = 0;
+  Node **nodes = NULL;
+  get_nodes_by_id(self->root, &nodes, &count);
+  long i;
+  for (i=0; i<count; i++)
+  {
+    if (nodes[i]->id != i)
+    {
+      free(nodes);
+      PyErr_SetString(PyExc_ValueError, "the node ids should be 0, 1, ..., n-1");
+      return NULL;
+    }
+  }
+  PyObject *result = PyString_FromStringAndSize(NULL, 2 * count * sizeof(double));
+  if (result)
+  {
+    double *xy = (double *) PyString_AS_STRING(result);
+    for (i=0; i<count; i++)
+    {
+      xy[2*i] = nodes[i]->x;
+      xy[2*i+1] = nodes[i]->y;
+    }
+  }
+  free(nodes);
+  return result;
 }
 
 /* custom method: get the number of nodes in the tree */
@@ -594,6 +951,9 @@ static PyMethodDef Name_methods[] = {
   {"end_node", (PyCFunction)Day_end_node, METH_NOARGS, "Move the node cursor to the parent of the current node." },
   {"reroot", (PyCFunction)Day_reroot, METH_NOARGS, "Reroot the tree at the current node." },
   {"equalize", (PyCFunction)Day_equalize, METH_NOARGS, "Redistribute daylight equally among gaps between root subtrees." },
+  {"equalize_all", (PyCFunction)Day_equalize_all, METH_VARARGS, "Reroot and equalize at the nodes with the given ids for at most the given number of iterations, stopping when no subtree rotates by more than the given tolerance in radians.  The GIL is released.  Return the number of iterations." },
+  {"build", (PyCFunction)Day_build, METH_VARARGS, "Build the tree from a preorder sequence of parent indices, where the root has parent -1, and sequences of x and y coordinates.  The node ids are the indices." },
+  {"get_coordinates", (PyCFunction)Day_get_coordinates, METH_NOARGS, "Get a string of native doubles x0, y0, x1, y1, ... ordered by node id." },
   {"get_node_count", (PyCFunction)Day_get_node_count, METH_NOARGS, "Get the number of nodes in the tree." },
   {"get_subtree_count", (PyCFunction)Day_get_subtree_count, METH_NOARGS, "Get the number of subtrees of the current node." },
   {"get_root_id", (PyCFunction)Day_get_root_id, METH_NOARGS, "Get the id of the root node." },
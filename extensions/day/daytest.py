@@ -1,7 +1,27 @@
 import unittest
+import math
+import struct
 
 import day
 
+
+def build_star_of_pairs(tree):
+    """
+    Build a tree whose three root subtrees each have two leaves.
+    The initial layout crowds all subtrees to one side.
+    @param tree: an empty day tree
+    @return: the preorder parent indices and coordinates
+    """
+    parents = [-1, 0, 1, 1, 0, 4, 4, 0, 7, 7]
+    xs, ys = [0.0], [0.0]
+    for i in range(1, len(parents)):
+        theta = 0.1 * i
+        r = 1.0 if parents[i] == 0 else 2.0
+        xs.append(r * math.cos(theta))
+        ys.append(r * math.sin(theta))
+    tree.build(parents, xs, ys)
+    return parents, xs, ys
+
 class TestDay(unittest.TestCase):
 
     def test_pre_creation(self):
@@ -120,6 +140,44 @@ class TestDay(unittest.TestCase):
         self.assertEquals(tree.get_root_id(), 12)
 
 
+    def test_build(self):
+        tree = day.Day()
+        parents, xs, ys = build_star_of_pairs(tree)
+        self.assertEquals(tree.get_node_count(), len(parents))
+        tree.select_node(0)
+        self.assertEquals(tree.get_subtree_count(), 3)
+        tree.select_node(5)
+        self.assertEquals(tree.get_x(), xs[5])
+        self.assertRaises(RuntimeError, tree.build, parents, xs, ys)
+        self.assertRaises(ValueError, day.Day().build, [-1, 2, 0], xs[:3], ys[:3])
+        self.assertRaises(ValueError, day.Day().build, [-1, 0], xs, ys)
+
+    def test_equalize_all(self):
+        ids = [0, 1, 4, 7]
+        # equalize one node at a time
+        expected_tree = day.Day()
+        parents, xs, ys = build_star_of_pairs(expected_tree)
+        for iteration in range(2):
+            for id in ids:
+                expected_tree.select_node(id)
+                expected_tree.reroot()
+                expected_tree.equalize()
+        expected = []
+        for id in range(len(parents)):
+            expected_tree.select_node(id)
+            expected.extend([expected_tree.get_x(), expected_tree.get_y()])
+        # equalize within the extension
+        tree = day.Day()
+        build_star_of_pairs(tree)
+        self.assertEquals(tree.equalize_all(ids, 2, 0.0), 2)
+        s = tree.get_coordinates()
+        observed = struct.unpack('%dd' % (2*len(parents)), s)
+        for a, b in zip(expected, observed):
+            self.assertAlmostEqual(a, b)
+        # a converged layout stops early
+        self.assertEquals(tree.equalize_all(ids, 100, 1e-6) < 100, True)
+        self.assertRaises(ValueError, tree.equalize_all, [42], 1, 0.0)
+
 
 if __name__ == '__main__':
         suite = unittest.TestLoader().loadTestsFromTestCase(TestDay)
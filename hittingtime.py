@@ -1,12 +1,17 @@
 """
 Utility functions for finite Markov chains.
+
+The transition matrices can be dense numpy arrays
+or scipy sparse matrices.
+The linear systems are solved by the markovsolve module.
 """
 
 import unittest
 
 import numpy as np
-from scipy import linalg
+from scipy import sparse
 
+import markovsolve
 import MatrixUtil
 
 
@@ -16,6 +21,16 @@ def inverse_permutation(p):
         p_inv[j] = i
     return np.array(p_inv)
 
+def _get_fundamental_solve(Q, B):
+    """
+    Solve (I - Q) X = B.
+    @param Q: transitions among transient states, dense or sparse
+    @param B: a dense right hand side
+    @return: the dense solution X
+    """
+    X, report = markovsolve.solve_fundamental(Q, B)
+    return X
+
 def get_conditional_transition_matrix(P, plain, forbid, target):
     """
     Get a conditional transition matrix.
@@ -34,7 +49,7 @@ def get_conditional_transition_matrix(P, plain, forbid, target):
     special = np.hstack((forbid, target))
     states = np.hstack((plain, special))
     # check that the index sequences match the size of P
-    if sorted(states) != range(len(P)):
+    if sorted(states) != range(P.shape[0]):
         raise ValueError('P is not conformant with the index sequences')
     # Q is the part of the transition matrix that gives
     # transition probabilities from transient to transient states.
@@ -44,10 +59,12 @@ def get_conditional_transition_matrix(P, plain, forbid, target):
     # transition probabilities from transient to absorbing states.
     # In general it is not row stochastic.
     R = P[plain, :][:, special]
+    if sparse.issparse(R):
+        R = R.toarray()
     # Note that Q and R completely define an absorbing process,
     # because there are no transitions away from absorbing states.
     # Each row of B is a probability distribution.
-    B = linalg.solve(np.eye(len(plain)) - Q, R)
+    B = _get_fundamental_solve(Q, R)
     # Use the distributions in B to compute weights
     # to apply to the transitions.
     c = np.hstack((np.zeros_like(forbid), np.ones_like(target)))
@@ -56,7 +73,12 @@ def get_conditional_transition_matrix(P, plain, forbid, target):
     # on hitting a target state before hitting a forbidden state.
     # Permute the weights to conform to the original matrix indices.
     # Rescale rows to restore row-stochasticity.
-    H = P * w[inverse_permutation(states)]
+    w = w[inverse_permutation(states)]
+    if sparse.issparse(P):
+        H = P.tocsr().multiply(w[np.newaxis, :]).tocsr()
+        v = np.asarray(H.sum(axis=1)).ravel()
+        return sparse.diags(1 / v).dot(H).tocsr()
+    H = P * w
     v = np.sum(H, axis=1)
     H /= v[:, np.newaxis]
     return H
@@ -78,12 +100,12 @@ def get_absorption_time(P, plain, absorbing):
     # define some state lists
     states = np.hstack((plain, absorbing))
     # check that the index sequences match the size of P
-    if sorted(states) != range(len(P)):
+    if sorted(states) != range(P.shape[0]):
         raise ValueError('P is not conformant with the index sequences')
     # compute the time to absorption
     Q = P[plain, :][:, plain]
-    c = np.ones_like(plain)
-    tplain = linalg.solve(np.eye(len(plain)) - Q, c)
+    c = np.ones(len(plain))
+    tplain = _get_fundamental_solve(Q, c)
     t = np.hstack((tplain, np.zeros_like(absorbing)))
     return t[inverse_permutation(states)]
 
@@ -104,15 +126,14 @@ def get_absorption_variance(P, plain, absorbing):
     # define some state lists
     states = np.hstack((plain, absorbing))
     # check that the index sequences match the size of P
-    if sorted(states) != range(len(P)):
+    if sorted(states) != range(P.shape[0]):
         raise ValueError('P is not conformant with the index sequences')
     # compute the time to absorption
     Q = P[plain, :][:, plain]
-    c = np.ones_like(plain)
-    I = np.eye(len(plain))
-    t = linalg.solve(I - Q, c)
+    c = np.ones(len(plain))
+    t = _get_fundamental_solve(Q, c)
     # compute the variance
-    vplain = 2*linalg.solve(I - Q, t) - t*(t+1)
+    vplain = 2*_get_fundamental_solve(Q, t) - t*(t+1)
     v = np.hstack((vplain, np.zeros_like(absorbing)))
     return v[inverse_permutation(states)]
 
@@ -121,6 +142,28 @@ class TestHittingTime(unittest.TestCase):
         pass
     def test_absorption_time(self):
         pass
+    def test_sparse_absorption(self):
+        # a random walk on a path absorbed at both ends
+        n = 12
+        P = np.zeros((n, n))
+        P[0, 0] = 1
+        P[-1, -1] = 1
+        for i in range(1, n-1):
+            P[i, i-1] = 0.3
+            P[i, i] = 0.3
+            P[i, i+1] = 0.4
+        plain = range(1, n-1)
+        absorbing = [0, n-1]
+        S = sparse.csr_matrix(P)
+        for f in (get_absorption_time, get_absorption_variance):
+            self.assertTrue(np.allclose(
+                f(P, plain, absorbing), f(S, plain, absorbing)))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            H = get_conditional_transition_matrix(P, plain, [0], [n-1])
+            H_sparse = get_conditional_transition_matrix(
+                    S, plain, [0], [n-1])
+        # the row of the forbidden state is undefined
+        self.assertTrue(np.allclose(H[1:], H_sparse.toarray()[1:]))
 
 if __name__ == '__main__':
     unittest.main()
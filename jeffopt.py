@@ -85,7 +85,7 @@ def fmax_jeff(
             else:
                 nowhood = lasthood
             if not inc:
-                return nowhood, X
+                return X, nowhood
             X[i] += inc
             plushood = f(X, *args)
             X[i] -= 2*inc
@@ -112,18 +112,47 @@ class LogitWrap:
     def __call__(self, X, *args):
         return self.f(special.logit(X), *args)
 
+class BoxWrap:
+    """
+    Map the unit cube to a box.
+    """
+    def __init__(self, f, lows, highs):
+        self.f = f
+        self.lows = lows
+        self.highs = highs
+    def to_box(self, X):
+        return self.lows + (self.highs - self.lows) * X
+    def to_cube(self, X):
+        return (X - self.lows) / (self.highs - self.lows)
+    def __call__(self, X, *args):
+        return self.f(self.to_box(X), *args)
+
 def fmin_jeff(
         f, X_guess, args=(),
         abstol=g_abstol, incfrac=g_incfrac, stepfrac=g_stepfrac):
-    X, lhood = fmax_jeff(NegWrap(f), X_guess, args)
+    X, lhood = fmax_jeff(NegWrap(f), X_guess, args,
+            abstol, incfrac, stepfrac)
     return X, -lhood
 
 def fmin_jeff_unconstrained(
         f, X_guess, args=(),
         abstol=g_abstol, incfrac=g_incfrac, stepfrac=g_stepfrac):
-    X, lhood = fmin_jeff(LogitWrap(f), special.expit(X_guess), args)
+    X, lhood = fmin_jeff(LogitWrap(f), special.expit(X_guess), args,
+            abstol, incfrac, stepfrac)
     return special.logit(X), lhood
 
+def fmin_jeff_box(
+        f, X_guess, lows, highs, args=(),
+        abstol=g_abstol, incfrac=g_incfrac, stepfrac=g_stepfrac):
+    """
+    @param lows: lower bounds of the parameters
+    @param highs: upper bounds of the parameters
+    """
+    wrapped = BoxWrap(f, np.asarray(lows), np.asarray(highs))
+    X, lhood = fmin_jeff(wrapped, wrapped.to_cube(X_guess), args,
+            abstol, incfrac, stepfrac)
+    return wrapped.to_box(X), lhood
+
 def _ftest(X):
     # This is an upward curving parabola with min at f(0.5) = 0.
     x = X[0]
@@ -144,3 +173,9 @@ class TestOpt(unittest.TestCase):
         print X_guess
         print fmin_jeff(_ftest, X_guess)
 
+    def test_fmin_jeff_box(self):
+        X_guess = np.array([1.2])
+        X, value = fmin_jeff_box(_ftest, X_guess, [-1.0], [3.0])
+        self.assertTrue(np.allclose(X, [0.5], atol=1e-2))
+        self.assertTrue(abs(value) < 1e-4)
+
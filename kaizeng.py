@@ -9,14 +9,18 @@ import math
 import numpy as np
 import scipy
 from scipy import linalg
+from scipy import sparse
 from scipy import integrate
 from scipy import special
 
 import StatsUtil
 import MatrixUtil
+import markovsolve
 import bernoulli
-import wfengine
+from wfbackend import wfengine
+import wfsparse
 import wrightfisher
+import multinomstate
 import Util
 
 def params_to_mutation_fitness(N, params):
@@ -60,6 +64,26 @@ def gen_states(N, k):
             state[j] = N-h
             yield state
 
+def _add_fixed_state_rows(P, N, k, mutation, rank_index):
+    """
+    Each row is for a population in which an allele is fixed.
+    Mutation from the fixed allele gives a state with a single mutant.
+    @param P: the transition matrix to modify in-place
+    @param N: haploid population size
+    @param k: number of alleles e.g. 4 for A,C,G,T
+    @param mutation: k by k matrix of per-generation mutation probabilities
+    @param rank_index: a multinomstate rank index of the states
+    """
+    pairs = [(i, j) for i in range(k) for j in range(k) if i != j]
+    sources, sinks = zip(*pairs)
+    npairs = len(pairs)
+    mutant_states = np.zeros((npairs, k), dtype=int)
+    mutant_states[range(npairs), sources] = N-1
+    mutant_states[range(npairs), sinks] = 1
+    mutant_indices = multinomstate.get_indices(mutant_states, rank_index)
+    P[sources, mutant_indices] = mutation[sources, sinks]
+    P[range(k), range(k)] = np.diag(mutation)
+
 def get_transition_matrix_slow(N_diploid, k, mutation, fit):
     """
     Mutation probabilities are away from a fixed state.
@@ -70,28 +94,23 @@ def get_transition_matrix_slow(N_diploid, k, mutation, fit):
     @return: a transition matrix
     """
     N = N_diploid * 2
-    states = [tuple(s) for s in gen_states(N,k)]
+    states = np.array(list(gen_states(N, k)))
     nstates = len(states)
-    s_to_i = dict((s, i) for i, s in enumerate(states))
+    rank_index = multinomstate.get_rank_index(states)
     P = np.zeros((nstates, nstates))
     # Add rows corresponding to transitions from population states
     # for which an allele is currently fixed in the population.
-    for i in range(k):
-        P[i, i] = mutation[i, i]
-        for j in range(k):
-            if i == j:
-                continue
-            state = [0]*k
-            state[i] = N-1
-            state[j] = 1
-            P[i, s_to_i[tuple(state)]] = mutation[i, j]
+    _add_fixed_state_rows(P, N, k, mutation, rank_index)
     # Add rows corresponding to transitions from polymorphic population states.
     for i, j in combinations(range(k), 2):
+        # get the indices of the dimorphic states of alleles i and j
+        dimorphic_states = np.zeros((N-1, k), dtype=int)
+        dimorphic_states[:, i] = np.arange(1, N)
+        dimorphic_states[:, j] = N - dimorphic_states[:, i]
+        dimorphic_indices = multinomstate.get_indices(
+                dimorphic_states, rank_index)
         for h in range(1, N):
-            state = [0]*k
-            state[i] = h
-            state[j] = N-h
-            index = s_to_i[tuple(state)]
+            index = dimorphic_indices[h-1]
             # Compute each child probability of having allele j.
             #pi, pj = wrightfisher.genic_diallelic(fit[i], fit[j], h, N-h)
             #s = fit[i] - fit[j]
@@ -102,10 +121,7 @@ def get_transition_matrix_slow(N_diploid, k, mutation, fit):
             P[index, j] = math.exp(StatsUtil.binomial_log_pmf(0, N, pi))
             # Add entries corresponding to transitions to polymorphic states.
             for hsink in range(1, N):
-                sink_state = [0]*k
-                sink_state[i] = hsink
-                sink_state[j] = N-hsink
-                sink_index = s_to_i[tuple(sink_state)]
+                sink_index = dimorphic_indices[hsink-1]
                 logp = StatsUtil.binomial_log_pmf(hsink, N, pi)
                 P[index, sink_index] = math.exp(logp)
     return P
@@ -120,21 +136,13 @@ def get_transition_matrix(N_diploid, k, mutation, fit):
     @return: a transition matrix
     """
     N = N_diploid * 2
-    states = [tuple(s) for s in gen_states(N,k)]
+    states = np.array(list(gen_states(N, k)))
     nstates = len(states)
-    s_to_i = dict((s, i) for i, s in enumerate(states))
+    rank_index = multinomstate.get_rank_index(states)
     P = np.zeros((nstates, nstates))
     # Add rows corresponding to transitions from population states
     # for which an allele is currently fixed in the population.
-    for i in range(k):
-        P[i, i] = mutation[i, i]
-        for j in range(k):
-            if i == j:
-                continue
-            state = [0]*k
-            state[i] = N-1
-            state[j] = 1
-            P[i, s_to_i[tuple(state)]] = mutation[i, j]
+    _add_fixed_state_rows(P, N, k, mutation, rank_index)
     # Define transition matrices within a single diallelic subspace.
     for bi, (i, j) in enumerate(combinations(range(k), 2)):
         s = 1 - fit[j] / fit[i]
@@ -154,6 +162,48 @@ def get_transition_matrix(N_diploid, k, mutation, fit):
         P[ibegin:iend, ibegin:iend] = pblock[1:-1, 1:-1]
     return P
 
+def get_transition_matrix_sparse(N_diploid, k, mutation, fit,
+        log_threshold=wfsparse.g_default_log_threshold):
+    """
+    This is like get_transition_matrix but with truncated sparse blocks.
+    @param N_diploid: diploid population size
+    @param k: number of alleles e.g. 4 for A,C,G,T
+    @param mutation: k by k matrix of per-generation mutation probabilities
+    @param fit: sequence of k fitness values
+    @param log_threshold: drop transitions with smaller log probability
+    @return: a sparse csr transition matrix
+    """
+    N = N_diploid * 2
+    states = np.array(list(gen_states(N, k)))
+    nstates = len(states)
+    rank_index = multinomstate.get_rank_index(states)
+    # Add rows corresponding to transitions from population states
+    # for which an allele is currently fixed in the population.
+    P_fixed = sparse.lil_matrix((k, nstates))
+    _add_fixed_state_rows(P_fixed, N, k, mutation, rank_index)
+    P_fixed = P_fixed.tocoo()
+    rows = [P_fixed.row]
+    cols = [P_fixed.col]
+    vals = [P_fixed.data]
+    # Define transition matrices within a single diallelic subspace.
+    for bi, (i, j) in enumerate(combinations(range(k), 2)):
+        s = 1 - fit[j] / fit[i]
+        pblock = wfsparse.create_genic_diallelic(
+                N_diploid, s, log_threshold).tocoo()
+        ibegin = k + (N-1)*bi
+        # The first index of pblock corresponds to fixation of j,
+        # and the last index of pblock corresponds to fixation of i.
+        # The first and last rows of pblock are ignored.
+        mask = (pblock.row > 0) & (pblock.row < N)
+        r = pblock.row[mask]
+        c = pblock.col[mask]
+        rows.append(ibegin + r - 1)
+        cols.append(np.where(c == N, i, np.where(c == 0, j, ibegin + c - 1)))
+        vals.append(pblock.data[mask])
+    return sparse.csr_matrix(
+            (np.hstack(vals), (np.hstack(rows), np.hstack(cols))),
+            shape=(nstates, nstates))
+
 def get_stationary_distribution_tricky(N_diploid, k, mutation, fit):
     """
     This uses a decomposition that is too clever.
@@ -195,7 +245,7 @@ def get_stationary_distribution_tricky(N_diploid, k, mutation, fit):
         B = np.zeros((N_diploid*2+1+2, 2))
         B[0,0] = 1
         B[-1,-1] = 1
-        X = linalg.solve(A.T, B)
+        X, report = markovsolve.solve(A.T, B)
         solves.append(X)
     # Compute the fixation probabilities from the block solutions.
     F = np.zeros((k, k))
@@ -483,6 +533,21 @@ class TestTransitionMatrix(unittest.TestCase):
         P_slow = get_transition_matrix_slow(N_diploid, k, mutation, fitness)
         P_fast = get_transition_matrix(N_diploid, k, mutation, fitness)
         self.assertTrue(np.allclose(P_slow, P_fast))
+    def test_sparse_transition_matrix(self):
+        N_diploid = 10
+        k = 4
+        mutation, fitness = get_test_mutation_fitness()
+        P = get_transition_matrix(N_diploid, k, mutation, fitness)
+        P_sparse = get_transition_matrix_sparse(
+                N_diploid, k, mutation, fitness, -700)
+        self.assertTrue(np.allclose(P, P_sparse.toarray()))
+        # the truncated chain has nearly the same stationary distribution
+        P_sparse = get_transition_matrix_sparse(
+                N_diploid, k, mutation, fitness, -20)
+        self.assertTrue(P_sparse.nnz < np.count_nonzero(P))
+        v = MatrixUtil.get_stationary_distribution(P)
+        v_sparse = MatrixUtil.get_stationary_distribution(P_sparse)
+        self.assertTrue(np.allclose(v, v_sparse))
     def test_tricky_distribution(self):
         N_diploid = 5
         k = 4
@@ -0,0 +1,281 @@
+"""
+Vectorized Kimura fixation integrals with an interpolation table.
+
+The fixation probability of a mutant with selection c and dominance d
+is proportional to the reciprocal of the Kimura integral
+D(c, d) = integral from 0 to 1 of exp(-2*c*d*x*(1-x) - 2*c*x) dx
+which is the denominator in the kimrecessive module.
+The functions in this module act elementwise on arrays of c and d
+which are broadcast against each other like the arguments of a ufunc.
+The exact evaluation uses fixed order Gaussian quadrature
+vectorized over all of the (c, d) pairs at once.
+A table of log D on a rectangular grid of (c, d)
+is refined until its bicubic spline has a controlled relative error
+at the midpoints of the grid, and it can be saved to a file
+so that later runs do not have to rebuild it.
+Values outside the rectangle of the table are evaluated exactly.
+"""
+
+import os
+import unittest
+
+import numpy as np
+import scipy.special
+import scipy.integrate
+from scipy import interpolate
+
+g_quad_npoints = 101
+
+g_default_c_bounds = (-20.0, 20.0)
+g_default_d_bounds = (-2.0, 2.0)
+g_default_rtol = 1e-8
+
+# evaluate the exact integrand for at most this many pairs at a time
+g_chunk_size = 4096
+
+class KimfixError(Exception): pass
+
+
+def precompute_quadrature(a, b, npoints):
+    """
+    This is the same as the kimrecessive function,
+    but it does not need algopy.
+    @param a: definite integral lower bound
+    @param b: definite integral upper bound
+    @param npoints: during quadrature evaluate the function at this many points
+    @return: roots, weights
+    """
+    x_raw, w_raw = scipy.special.orthogonal.p_roots(npoints)
+    c = (b - a) / 2.
+    x = c * (x_raw + 1) + a
+    w = c * w_raw
+    return np.real(x), w
+
+g_quad_x, g_quad_w = precompute_quadrature(0.0, 1.0, g_quad_npoints)
+
+def denom_fixed_quad(c, d, x=g_quad_x, w=g_quad_w):
+    """
+    Evaluate the Kimura integral elementwise by Gaussian quadrature.
+    @param c: array of selection values
+    @param d: array of dominance values broadcastable with c
+    @param x: quadrature points in the interval [0, 1]
+    @param w: corresponding nonneg quadrature weights summing to 1
+    @return: an array with the broadcast shape of c and d
+    """
+    c, d = np.broadcast_arrays(
+            np.asarray(c, dtype=float), np.asarray(d, dtype=float))
+    c_flat = c.ravel()
+    d_flat = d.ravel()
+    out = np.empty(c_flat.shape)
+    for i in range(0, len(out), g_chunk_size):
+        cc = c_flat[i:i+g_chunk_size, np.newaxis]
+        dd = d_flat[i:i+g_chunk_size, np.newaxis]
+        out[i:i+g_chunk_size] = np.dot(
+                np.exp(-2*cc*x*(dd*(1-x) + 1)), w)
+    return out.reshape(c.shape)
+
+
+class DenomTable:
+    """
+    An interpolation table of the Kimura integral.
+    """
+
+    def __init__(self, cs, ds, log_denoms, rtol):
+        """
+        @param cs: increasing grid of selection values
+        @param ds: increasing grid of dominance values
+        @param log_denoms: logs of the integral at the grid points
+        @param rtol: the relative error of the table at the grid midpoints
+        """
+        self.cs = cs
+        self.ds = ds
+        self.log_denoms = log_denoms
+        self.rtol = rtol
+        self.spline = interpolate.RectBivariateSpline(cs, ds, log_denoms)
+
+    def get_bounds(self):
+        return (self.cs[0], self.cs[-1]), (self.ds[0], self.ds[-1])
+
+    def __call__(self, c, d):
+        """
+        Evaluate the Kimura integral elementwise.
+        @param c: array of selection values
+        @param d: array of dominance values broadcastable with c
+        @return: an array with the broadcast shape of c and d
+        """
+        c, d = np.broadcast_arrays(
+                np.asarray(c, dtype=float), np.asarray(d, dtype=float))
+        inside = (self.cs[0] <= c) & (c <= self.cs[-1])
+        inside &= (self.ds[0] <= d) & (d <= self.ds[-1])
+        out = np.empty(c.shape)
+        out[inside] = np.exp(self.spline.ev(c[inside], d[inside]))
+        outside = ~inside
+        if np.any(outside):
+            out[outside] = denom_fixed_quad(c[outside], d[outside])
+        return out
+
+    def save(self, filename):
+        """
+        @param filename: write the table to this npz file
+        """
+        with open(filename, 'wb') as fout:
+            np.savez(fout,
+                    cs=self.cs, ds=self.ds,
+                    log_denoms=self.log_denoms, rtol=self.rtol)
+
+
+def _get_midpoints(v):
+    return 0.5 * (v[:-1] + v[1:])
+
+def _get_max_relative_error(spline, cs, ds):
+    C, D = np.meshgrid(cs, ds, indexing='ij')
+    exact = denom_fixed_quad(C, D)
+    approx = np.exp(spline.ev(C.ravel(), D.ravel())).reshape(C.shape)
+    return np.max(np.abs(approx - exact) / exact)
+
+def build_table(
+        c_bounds=g_default_c_bounds, d_bounds=g_default_d_bounds,
+        rtol=g_default_rtol, nc=65, nd=17, max_npoints=1e6):
+    """
+    Refine the grid in each direction until the spline is accurate.
+    The error in the c direction is checked at the c midpoints,
+    the error in the d direction is checked at the d midpoints,
+    and the error in both directions is checked at the cell centers.
+    @param c_bounds: the low and high selection values of the table
+    @param d_bounds: the low and high dominance values of the table
+    @param rtol: the largest allowed relative error
+    @param nc: the initial number of selection grid values
+    @param nd: the initial number of dominance grid values
+    @param max_npoints: give up if the grid needs more points than this
+    @return: a DenomTable
+    """
+    while True:
+        if nc * nd > max_npoints:
+            raise KimfixError('the table grid is too large for the tolerance')
+        cs = np.linspace(c_bounds[0], c_bounds[1], nc)
+        ds = np.linspace(d_bounds[0], d_bounds[1], nd)
+        C, D = np.meshgrid(cs, ds, indexing='ij')
+        log_denoms = np.log(denom_fixed_quad(C, D))
+        spline = interpolate.RectBivariateSpline(cs, ds, log_denoms)
+        c_error = _get_max_relative_error(spline, _get_midpoints(cs), ds)
+        d_error = _get_max_relative_error(spline, cs, _get_midpoints(ds))
+        if c_error <= rtol and d_error <= rtol:
+            center_error = _get_max_relative_error(
+                    spline, _get_midpoints(cs), _get_midpoints(ds))
+            if center_error <= rtol:
+                return DenomTable(cs, ds, log_denoms, rtol)
+            c_error = d_error = center_error
+        if c_error > rtol:
+            nc = 2*nc - 1
+        if d_error > rtol:
+            nd = 2*nd - 1
+
+def load_table(filename):
+    """
+    @param filename: an npz file written by DenomTable.save
+    @return: a DenomTable
+    """
+    data = np.load(filename)
+    return DenomTable(
+            data['cs'], data['ds'], data['log_denoms'], float(data['rtol']))
+
+def get_table(filename=None,
+        c_bounds=g_default_c_bounds, d_bounds=g_default_d_bounds,
+        rtol=g_default_rtol):
+    """
+    Load a saved table if it is compatible, or build and save a new one.
+    @param filename: an npz filename or None to not use the disk
+    @param c_bounds: the low and high selection values of the table
+    @param d_bounds: the low and high dominance values of the table
+    @param rtol: the largest allowed relative error
+    @return: a DenomTable
+    """
+    if filename is not None and os.path.exists(filename):
+        table = load_table(filename)
+        bounds = (tuple(c_bounds), tuple(d_bounds))
+        if table.get_bounds() == bounds and table.rtol <= rtol:
+            return table
+    table = build_table(c_bounds, d_bounds, rtol)
+    if filename is not None:
+        table.save(filename)
+    return table
+
+def get_fixation(S, D, table=None):
+    """
+    This is the fixation function used by the mle-recessive script.
+    @param S: array of selection differences
+    @param D: array of dominance values broadcastable with S
+    @param table: a DenomTable or None for exact evaluation
+    @return: fixation probabilities up to a constant factor
+    """
+    if table is None:
+        return 1. / denom_fixed_quad(0.5*S, D)
+    return 1. / table(0.5*S, D)
+
+
+def _denom_adaptive_quad(c, d):
+    """
+    This is like kimrecessive.denom_quad.
+    """
+    f = lambda x: np.exp(-2*c*d*x*(1-x) - 2*c*x)
+    return scipy.integrate.quad(f, 0., 1., epsabs=0, epsrel=1e-13)[0]
+
+class TestKimfix(unittest.TestCase):
+
+    def test_fixed_quad(self):
+        cs = np.array([-15.0, -1.23, -0.01, 0.0, 0.01, 1.23, 15.0])
+        ds = np.array([-1.5, -1.0, -0.123, 0.0, 0.5, 1.0, 1.9])
+        observed = denom_fixed_quad(cs[:, np.newaxis], ds)
+        for i, c in enumerate(cs):
+            for j, d in enumerate(ds):
+                expected = _denom_adaptive_quad(c, d)
+                self.assertTrue(np.allclose(observed[i, j], expected,
+                    rtol=1e-12, atol=0))
+
+    def test_genic(self):
+        c = np.array([-3.0, -0.5, 0.25, 2.0])
+        expected = (1 - np.exp(-2*c)) / (2*c)
+        self.assertTrue(np.allclose(denom_fixed_quad(c, 0), expected))
+
+    def test_table(self):
+        rtol = 1e-7
+        table = build_table((-5.0, 5.0), (-1.0, 1.0), rtol)
+        np.random.seed(0)
+        c = np.random.uniform(-6, 6, size=(20, 30))
+        d = np.random.uniform(-1.2, 1.2, size=(20, 30))
+        expected = denom_fixed_quad(c, d)
+        observed = table(c, d)
+        self.assertEqual(observed.shape, c.shape)
+        self.assertTrue(np.max(np.abs(observed - expected) / expected) < rtol)
+        # the exact values are used outside the table
+        outside = (np.abs(c) > 5) | (np.abs(d) > 1)
+        self.assertTrue(np.array_equal(observed[outside], expected[outside]))
+
+    def test_persistence(self):
+        import tempfile
+        fd, filename = tempfile.mkstemp(suffix='.npz')
+        os.close(fd)
+        os.remove(filename)
+        try:
+            bounds = ((-2.0, 2.0), (-1.0, 1.0))
+            a = get_table(filename, bounds[0], bounds[1], 1e-6)
+            self.assertTrue(os.path.exists(filename))
+            b = get_table(filename, bounds[0], bounds[1], 1e-6)
+            self.assertEqual(b.get_bounds(), bounds)
+            self.assertTrue(np.array_equal(a.log_denoms, b.log_denoms))
+        finally:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    def test_fixation_reversibility(self):
+        """
+        Fixation ratios are exponentials of the selection differences.
+        """
+        F = np.array([1.2, 2.3, 0, -1.1])
+        S = F[np.newaxis, :] - F[:, np.newaxis]
+        H = get_fixation(S, 0)
+        self.assertTrue(np.allclose(np.log(H / H.T), S))
+
+
+if __name__ == '__main__':
+    unittest.main()
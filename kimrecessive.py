@@ -17,6 +17,7 @@ import algopy
 import algopy.special
 
 import kimengine
+import kimfix
 
 
 
@@ -322,6 +323,21 @@ class Test_KimuraRecessive(testing.TestCase):
             testing.assert_allclose(x, y)
             testing.assert_allclose(x, w)
 
+    def test_kimfix(self):
+        x, w = precompute_quadrature(0.0, 1.0, 101)
+        table = kimfix.build_table((-10.0, 10.0), (-1.5, 1.5), 1e-8)
+        cs = numpy.array([-12.0, -3.21, -0.123, 0.01, 1.23, 4.56, 12.0])
+        ds = numpy.array([-1.0, -0.5, -0.01, 0.0, 0.321, 0.9, 1.0])
+        C, D = numpy.meshgrid(cs, ds)
+        expected_quad = [denom_quad(c, d) for c, d in zip(C.flat, D.flat)]
+        expected_fixed = [denom_fixed_quad(c, d, x, w)
+                for c, d in zip(C.flat, D.flat)]
+        observed_exact = kimfix.denom_fixed_quad(C, D).ravel()
+        observed_table = table(C, D).ravel()
+        testing.assert_allclose(observed_exact, expected_fixed, rtol=1e-12)
+        testing.assert_allclose(observed_exact, expected_quad, rtol=1e-8)
+        testing.assert_allclose(observed_table, expected_quad, rtol=1e-7)
+
 if __name__ == '__main__':
     testing.run_module_suite()
 
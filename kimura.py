@@ -34,7 +34,7 @@ from scipy import linalg
 from scipy import special
 
 import MatrixUtil
-import wfengine
+from wfbackend import wfengine
 
 def erfi(x):
     """
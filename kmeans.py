@@ -2,20 +2,33 @@
 Use the standard k-means clustering algorithm.
 
 Use an example from the clusterSim R package.
+Restarts from k-means++ seeds can run in a pool of processes,
+and a mini-batch variant is available for very large point clouds.
 """
 
 import unittest
 import random
 import textwrap
 import collections
+import multiprocessing
 
 import numpy as np
 
-import iterutils
 import MatrixUtil
 import Util
 import Form
 
+# stop when the relative decrease of the wcss is less than this
+g_rtol = 1e-4
+
+# defaults for mini-batch k-means
+g_batch_size = 1000
+g_minibatch_maxiter = 1000
+g_minibatch_patience = 10
+
+# assign labels to at most this many points at a time
+g_chunk_size = 10000
+
 g_data_ratio = textwrap.dedent("""
          v_1       v_2       v_3       v_4       v_5
          1   4.790679  5.078952  8.485110 10.430934 13.293767
@@ -117,21 +130,26 @@ class InitStrategy(Form.RadioGroup):
                     Form.RadioItem('init_cluster',
                         'use centroids of a random partition'),
                     Form.RadioItem('init_range',
-                        'choose centers uniformly in the observed range')])
+                        'choose centers uniformly in the observed range'),
+                    Form.RadioItem('init_kmeanspp',
+                        'use k-means++ seeding')])
 
     def add_argument(self, parser):
         """
         Add an argument to the argparse parser.
         """
         return parser.add_argument('--kmeans_init', default='init_choice',
-                choices=['init_choice', 'init_cluster', 'init_range'],
+                choices=[
+                    'init_choice', 'init_cluster',
+                    'init_range', 'init_kmeanspp'],
                 help='cluster center initialization')
 
     def string_to_function(self, kmeans_init):
         d = {
                 'init_cluster' : gen_random_centers_via_clusters,
                 'init_choice' : gen_random_centers_via_choice,
-                'init_range' : gen_random_centers_via_range}
+                'init_range' : gen_random_centers_via_range,
+                'init_kmeanspp' : gen_kmeanspp_centers}
         return d[kmeans_init]
 
 
@@ -165,6 +183,33 @@ def gen_random_centers_via_clusters(points, nclusters):
         labels[index] = label
     return get_centers(points, labels)
 
+def gen_kmeanspp_centers(points, nclusters, rs=None):
+    """
+    Return an array of guesses for initial clusters.
+    Each center after the first is an observed point chosen with probability
+    proportional to its squared distance to the nearest chosen center.
+    @param points: points in euclidean space
+    @param nclusters: the number of clusters
+    @param rs: a numpy RandomState or None to use the global state
+    """
+    if rs is None:
+        rs = np.random
+    npoints = len(points)
+    centers = np.empty((nclusters, points.shape[1]))
+    centers[0] = points[rs.randint(npoints)]
+    d2 = np.sum((points - centers[0])**2, axis=1)
+    for i in range(1, nclusters):
+        total = np.sum(d2)
+        if total > 0:
+            cumulative = np.cumsum(d2)
+            index = np.searchsorted(cumulative, rs.uniform() * total, 'right')
+            index = min(index, npoints - 1)
+        else:
+            index = rs.randint(npoints)
+        centers[i] = points[index]
+        d2 = np.minimum(d2, np.sum((points - centers[i])**2, axis=1))
+    return centers
+
 def get_point_center_sqdists(points, centers):
     """
     Inputs and outputs are numpy arrays.
@@ -174,8 +219,6 @@ def get_point_center_sqdists(points, centers):
     """
     MatrixUtil.assert_2d(points)
     MatrixUtil.assert_2d(centers)
-    npoints = len(points)
-    ncenters = len(centers)
     # get the dot products of points with themselves
     pself = np.sum(points*points, axis=1)
     # get the dot products of centers with themselves
@@ -183,10 +226,7 @@ def get_point_center_sqdists(points, centers):
     # get the matrix product of points and centers
     prod = np.dot(points, centers.T)
     # get the matrix of squared distances
-    sqdists = (
-        np.outer(pself, np.ones(ncenters)) +
-        np.outer(np.ones(npoints), cself) -
-        2*prod)
+    sqdists = pself[:, np.newaxis] + cself - 2*prod
     return sqdists
 
 def get_centers(points, labels):
@@ -201,13 +241,12 @@ def get_centers(points, labels):
         raise ValueError('array incompatibility')
     ncoords = len(points[0])
     nclusters = max(labels) + 1
-    sums = [np.zeros(ncoords) for i in range(nclusters)]
-    counts = [0]*nclusters
-    for point, label in zip(points, labels):
-        sums[label] += point
-        counts[label] += 1
-    M = np.array([s/c for s, c in zip(sums, counts)])
-    return M
+    counts = np.bincount(labels, minlength=nclusters)
+    sums = np.empty((nclusters, ncoords))
+    for j in range(ncoords):
+        sums[:, j] = np.bincount(
+                labels, weights=points[:, j], minlength=nclusters)
+    return sums / counts[:, np.newaxis]
 
 def get_labels_without_cluster_removal(sqdists):
     """
@@ -226,10 +265,19 @@ def get_labels(sqdists):
     @param sqdists: for each point, the squared distance to each center
     @return: for each point, the label of the nearest cluster
     """
-    labels = np.argmin(sqdists, axis=1)
-    new_to_old = list(iterutils.unique_everseen(labels))
-    old_to_new = dict((old, new) for new, old in enumerate(new_to_old))
-    return np.array([old_to_new[old] for old in labels])
+    return relabel(np.argmin(sqdists, axis=1))
+
+def relabel(labels):
+    """
+    Number the labels consecutively in order of first appearance.
+    @param labels: nonnegative integer labels
+    @return: the new labels
+    """
+    old_labels, first_indices, inverse = np.unique(
+            labels, return_index=True, return_inverse=True)
+    old_to_new = np.empty(len(old_labels), dtype=int)
+    old_to_new[np.argsort(first_indices)] = np.arange(len(old_labels))
+    return old_to_new[inverse]
 
 def get_wcss(sqdists, labels):
     """
@@ -242,23 +290,35 @@ def get_wcss(sqdists, labels):
     MatrixUtil.assert_1d(labels)
     if len(sqdists) != len(labels):
         raise ValueError('array incompatibility')
-    return sum(row[label] for row, label in zip(sqdists, labels))
+    return np.sum(sqdists[np.arange(len(labels)), labels])
 
-def lloyd(points, labels):
+def lloyd(points, labels, rtol=0, maxiter=None):
     """
     This is the standard algorithm for kmeans clustering.
+    By default it stops only when the labels stop changing.
     @param points: points in euclidean space
     @param labels: initial cluster labels
+    @param rtol: also stop when the wcss decreases by less than this fraction
+    @param maxiter: also stop after this many iterations
     @return: within cluster sum of squares, and labels
     """
+    prev_wcss = None
+    niterations = 0
     while True:
         centers = get_centers(points, labels)
         sqdists = get_point_center_sqdists(points, centers)
+        wcss = get_wcss(sqdists, labels)
         next_labels = get_labels(sqdists)
         if np.array_equal(next_labels, labels):
-            wcss = get_wcss(sqdists, labels)
             return wcss, labels
+        if rtol and prev_wcss is not None:
+            if prev_wcss - wcss <= rtol * wcss:
+                return wcss, labels
+        if maxiter is not None and niterations >= maxiter:
+            return wcss, labels
+        prev_wcss = wcss
         labels = next_labels
+        niterations += 1
 
 def lloyd_with_restarts(points, nclusters, nrestarts, init_strategy):
     """
@@ -283,6 +343,192 @@ def lloyd_with_restarts(points, nclusters, nrestarts, init_strategy):
             best_labels = labels
     return best_wcss, best_labels
 
+def get_labels_chunked(points, centers):
+    """
+    Assign each point to its nearest center without making
+    the whole matrix of squared distances at once.
+    @param points: points in euclidean space
+    @param centers: cluster centers
+    @return: for each point, the index of the nearest center
+    """
+    labels = np.empty(len(points), dtype=int)
+    for i in range(0, len(points), g_chunk_size):
+        sqdists = get_point_center_sqdists(points[i:i+g_chunk_size], centers)
+        labels[i:i+g_chunk_size] = np.argmin(sqdists, axis=1)
+    return labels
+
+def lloyd_kmeanspp(points, nclusters, rs, rtol=g_rtol):
+    """
+    Run the standard algorithm from k-means++ seeds.
+    @param points: points in euclidean space
+    @param nclusters: the number of clusters
+    @param rs: a numpy RandomState
+    @param rtol: stop when the wcss decreases by less than this fraction
+    @return: within cluster sum of squares, and labels
+    """
+    centers = gen_kmeanspp_centers(points, nclusters, rs)
+    labels = get_labels(get_point_center_sqdists(points, centers))
+    return lloyd(points, labels, rtol)
+
+def minibatch(points, nclusters, rs,
+        batch_size=g_batch_size, rtol=g_rtol,
+        maxiter=g_minibatch_maxiter, patience=g_minibatch_patience):
+    """
+    This is the mini-batch k-means algorithm of Sculley (2010).
+    Each center moves toward the mean of its batch points
+    with a step size that decreases with the number of points it has seen.
+    The run stops when a smoothed average of the batch wcss per point
+    has changed by less than rtol for patience consecutive batches.
+    The returned wcss is that of the final partition of all of the points.
+    @param points: points in euclidean space
+    @param nclusters: the number of clusters
+    @param rs: a numpy RandomState
+    @param batch_size: the number of points sampled per iteration
+    @param rtol: relative change of the smoothed batch wcss
+    @param maxiter: the maximum number of batches
+    @param patience: the number of consecutive small changes for stopping
+    @return: within cluster sum of squares, and labels
+    """
+    npoints, ncoords = points.shape
+    batch_size = min(batch_size, npoints)
+    # seed with k-means++ on a sample of the points
+    init_size = min(npoints, max(3*batch_size, nclusters))
+    sample = points[rs.choice(npoints, init_size, replace=False)]
+    centers = gen_kmeanspp_centers(sample, nclusters, rs)
+    counts = np.zeros(nclusters)
+    alpha = min(1.0, 2.0 * batch_size / (npoints + 1))
+    ewa = None
+    nsmall = 0
+    for i in range(maxiter):
+        batch = points[rs.randint(npoints, size=batch_size)]
+        sqdists = get_point_center_sqdists(batch, centers)
+        nearest = np.argmin(sqdists, axis=1)
+        batch_wcss = get_wcss(sqdists, nearest) / batch_size
+        batch_counts = np.bincount(nearest, minlength=nclusters)
+        batch_sums = np.empty((nclusters, ncoords))
+        for j in range(ncoords):
+            batch_sums[:, j] = np.bincount(
+                    nearest, weights=batch[:, j], minlength=nclusters)
+        counts += batch_counts
+        seen = batch_counts > 0
+        centers[seen] += (
+                batch_sums[seen] -
+                batch_counts[seen, np.newaxis] * centers[seen]
+                ) / counts[seen, np.newaxis]
+        if ewa is None:
+            ewa = batch_wcss
+            continue
+        next_ewa = (1 - alpha) * ewa + alpha * batch_wcss
+        if abs(ewa - next_ewa) <= rtol * next_ewa:
+            nsmall += 1
+        else:
+            nsmall = 0
+        ewa = next_ewa
+        if nsmall >= patience:
+            break
+    labels = relabel(get_labels_chunked(points, centers))
+    centers = get_centers(points, labels)
+    wcss = 0
+    for i in range(0, npoints, g_chunk_size):
+        chunk = points[i:i+g_chunk_size]
+        chunk_labels = labels[i:i+g_chunk_size]
+        wcss += np.sum((chunk - centers[chunk_labels])**2)
+    return wcss, labels
+
+
+# This global is set in each worker process by the pool initializer.
+g_points = None
+
+def _init_worker(points):
+    global g_points
+    g_points = points
+
+def _run_restart(args):
+    nclusters, seed, batch_size, rtol = args
+    rs = np.random.RandomState(seed)
+    if batch_size:
+        wcss, labels = minibatch(g_points, nclusters, rs, batch_size, rtol)
+    else:
+        wcss, labels = lloyd_kmeanspp(g_points, nclusters, rs, rtol)
+    return nclusters, wcss, labels
+
+def _gen_restart_results(points, args_list, nprocesses):
+    if nprocesses == 1:
+        _init_worker(points)
+        for args in args_list:
+            yield _run_restart(args)
+        return
+    pool = multiprocessing.Pool(nprocesses, _init_worker, (points,))
+    try:
+        for result in pool.imap(_run_restart, args_list):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def _get_best_by_k(points, ks, nrestarts, seed, batch_size, rtol, nprocesses):
+    """
+    @return: a map from the number of clusters to the best (wcss, labels)
+    """
+    seeds = np.random.RandomState(seed).randint(
+            2**31 - 1, size=(len(ks), nrestarts))
+    args_list = []
+    for k, k_seeds in zip(ks, seeds):
+        for k_seed in k_seeds:
+            args_list.append((k, k_seed, batch_size, rtol))
+    best = {}
+    for k, wcss, labels in _gen_restart_results(
+            points, args_list, nprocesses):
+        if k not in best or wcss < best[k][0]:
+            best[k] = (wcss, labels)
+    return best
+
+def kmeans_with_restarts(points, nclusters, nrestarts,
+        seed=None, batch_size=None, rtol=g_rtol, nprocesses=None):
+    """
+    Run restarts from k-means++ seeds in a pool of processes.
+    The result depends on the seed but not on the number of processes.
+    @param points: points in euclidean space
+    @param nclusters: the number of clusters
+    @param nrestarts: the number of random restarts
+    @param seed: random seed
+    @param batch_size: None for the standard algorithm or a mini-batch size
+    @param rtol: stop when the wcss decreases by less than this fraction
+    @param nprocesses: the number of processes or None for the number of cpus
+    @return: within cluster sum of squares, labels
+    """
+    best = _get_best_by_k(points, [nclusters], nrestarts,
+            seed, batch_size, rtol, nprocesses)
+    return best[nclusters]
+
+def get_calinski_sweep(points, ks, nrestarts,
+        seed=None, batch_size=None, rtol=g_rtol, nprocesses=None):
+    """
+    Cluster the points for each number of clusters in one pool of processes.
+    The calinski index uses the number of clusters that are not empty.
+    @param points: points in euclidean space
+    @param ks: a sequence of numbers of clusters
+    @param nrestarts: the number of random restarts for each k
+    @param seed: random seed
+    @param batch_size: None for the standard algorithm or a mini-batch size
+    @param rtol: stop when the wcss decreases by less than this fraction
+    @param nprocesses: the number of processes or None for the number of cpus
+    @return: a list of (k, wcss, calinski, labels) rows in the order of ks
+    """
+    ks = list(ks)
+    best = _get_best_by_k(points, ks, nrestarts,
+            seed, batch_size, rtol, nprocesses)
+    allmeandist = get_allmeandist(points)
+    n = len(points)
+    rows = []
+    for k in ks:
+        wcss, labels = best[k]
+        k_unique = np.max(labels) + 1
+        calinski = get_calinski_index(allmeandist - wcss, wcss, k_unique, n)
+        rows.append((k, wcss, calinski, labels))
+    return rows
+
 def get_allmeandist(points):
     """
     Use this to find the bgss argument for the calinski index.
@@ -399,5 +645,59 @@ class TestCalinski(unittest.TestCase):
         self.assertEqual(fcal_observed, fcal_expected)
 
 
+def _get_test_blobs(npoints_per_blob, rs):
+    """
+    @return: points in four well separated blobs and their true labels
+    """
+    means = np.array([[0, 0], [10, 0], [0, 10], [10, 10]], dtype=float)
+    labels = rs.permutation(np.repeat(np.arange(4), npoints_per_blob))
+    points = means[labels] + rs.randn(len(labels), 2)
+    return points, labels
+
+class TestKMeans(unittest.TestCase):
+
+    def test_vectorized(self):
+        rs = np.random.RandomState(0)
+        points = rs.randn(50, 3)
+        labels = rs.randint(0, 4, size=50)
+        centers = get_centers(points, labels)
+        for k in range(4):
+            expected = np.mean(points[labels == k], axis=0)
+            self.assertTrue(np.allclose(centers[k], expected))
+        sqdists = get_point_center_sqdists(points, centers)
+        expected_wcss = sum(sqdists[i, k] for i, k in enumerate(labels))
+        self.assertTrue(np.allclose(get_wcss(sqdists, labels), expected_wcss))
+        self.assertEqual(list(relabel(np.array([5, 2, 5, 7, 2]))),
+                [0, 1, 0, 2, 1])
+
+    def test_kmeanspp(self):
+        rs = np.random.RandomState(1)
+        points, labels = _get_test_blobs(30, rs)
+        centers = gen_kmeanspp_centers(points, 4, rs)
+        sqdists = get_point_center_sqdists(points, centers)
+        self.assertEqual(len(set(get_labels(sqdists))), 4)
+
+    def test_restarts(self):
+        points, expected = _get_test_blobs(200, np.random.RandomState(2))
+        expected = relabel(expected)
+        for batch_size in (None, 100):
+            results = [kmeans_with_restarts(points, 4, 3,
+                seed=3, batch_size=batch_size, nprocesses=nprocesses)
+                for nprocesses in (1, 2)]
+            self.assertEqual(results[0][0], results[1][0])
+            for wcss, labels in results:
+                self.assertTrue(np.array_equal(labels, expected))
+
+    def test_calinski_sweep(self):
+        points, labels = _get_test_blobs(50, np.random.RandomState(4))
+        rows = get_calinski_sweep(points, range(2, 7), 3, seed=5)
+        self.assertEqual([row[0] for row in rows], range(2, 7))
+        best_k = max(rows, key=lambda row: row[2])[0]
+        self.assertEqual(best_k, 4)
+        for k, wcss, calinski, labels in rows:
+            expected = get_calinski_index_naive(points, labels)
+            self.assertTrue(np.allclose(calinski, expected))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -4,11 +4,26 @@ Utilities for LaTeX.
 This will probably work only for texlive.
 Also it requires ghostscript or imagemagick to make a png file.
 It seems like the png files made by ghostscript are not so great.
+
+Compiled pdf and png files are kept in a per-user disk cache
+whose keys are hashes of the LaTeX text, the output format,
+and the versions of the programs that made the file.
+When the cache is larger than its size limit
+the least recently used files are removed.
+If the mylatexformat package is installed then each preamble
+is compiled once into a format file which is kept in the same cache,
+so later documents with the same preamble do not load their packages again.
 """
 
 import unittest
 import subprocess
 import os
+import hashlib
+import tempfile
+import stat
+import shutil
+import threading
+from multiprocessing.pool import ThreadPool
 
 import Util
 
@@ -18,9 +33,34 @@ LATEXFORMAT_PNG = 'png'
 
 g_latexformats = {LATEXFORMAT_TEX, LATEXFORMAT_PDF, LATEXFORMAT_PNG}
 
+g_pdflatex = '/usr/bin/pdflatex'
+
+# the default location and size limit of the render cache
+# The cache is private to the user because its files are returned as
+# responses and its format files are loaded by pdflatex.
+g_cache_dirname = os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+        'latexutil')
+g_cache_max_bytes = 256 * 1024 * 1024
+
+# the render cache or None to compile every time
+g_cache = None
+g_cache_lock = threading.Lock()
+g_cache_disabled = False
+
+# first lines of the version output of each program
+g_tool_versions = {}
+
+# maps a file name to True if kpsewhich finds it
+g_installed_filenames = {}
+
+# format names of preambles that could not be compiled into a format
+g_failed_formats = set()
+
 
 class CheckPackageError(Exception): pass
 class LatexPackageError(Exception): pass
+class RenderCacheError(Exception): pass
 
 
 def assert_latexformat(latexformat):
@@ -62,6 +102,20 @@ def options_to_string(*args, **kwargs):
         return ''
 
 def _check_installed_files(filenames):
+    """
+    The answers are remembered for the lifetime of the process.
+    @param filenames: a collection of requested filenames
+    @return: the subset of installed filenames
+    """
+    requested_set = set(filenames)
+    unknown_set = requested_set - set(g_installed_filenames)
+    if unknown_set:
+        installed_set = _query_installed_files(unknown_set)
+        for name in unknown_set:
+            g_installed_filenames[name] = name in installed_set
+    return set(name for name in requested_set if g_installed_filenames[name])
+
+def _query_installed_files(filenames):
     """
     @param filenames: a collection of requested filenames
     @return: the subset of installed filenames
@@ -128,100 +182,379 @@ def sanitize(text):
             arr.append(c)
     return ''.join(arr)
 
-def _create_temp_pdf_file(latex_text, output_format='pdf'):
+class RenderCache:
+    """
+    A directory of files named by the hashes of their contents.
+    The modification time of a file is its most recent use.
+    """
+
+    def __init__(self, dirname, max_bytes):
+        """
+        The directory is created if necessary with permissions
+        only for its owner, and an existing directory must be
+        a real directory owned by the user and private to the user.
+        @param dirname: the cache directory
+        @param max_bytes: the size limit of the directory
+        """
+        self.dirname = dirname
+        self.max_bytes = max_bytes
+        if not os.path.lexists(dirname):
+            try:
+                os.makedirs(dirname, 0700)
+            except OSError as e:
+                if not os.path.lexists(dirname):
+                    raise
+        check_private_directory(dirname)
+
+    def get_path(self, key, suffix='.bin'):
+        return os.path.join(self.dirname, key + suffix)
+
+    def touch(self, key, suffix='.bin'):
+        """
+        @return: True if the file exists
+        """
+        try:
+            os.utime(self.get_path(key, suffix), None)
+            return True
+        except OSError as e:
+            return False
+
+    def get(self, key):
+        """
+        @param key: a hex digest
+        @return: the cached contents or None
+        """
+        if not self.touch(key):
+            return None
+        try:
+            with open(self.get_path(key), 'rb') as fin:
+                return fin.read()
+        except IOError as e:
+            return None
+
+    def put_file(self, key, source_pathname, suffix='.bin'):
+        """
+        Move a file into the cache.
+        @param key: a hex digest
+        @param source_pathname: the file to move
+        @param suffix: the extension of the cached file
+        """
+        fd, temp_pathname = tempfile.mkstemp(dir=self.dirname, suffix='.tmp')
+        os.close(fd)
+        shutil.move(source_pathname, temp_pathname)
+        os.rename(temp_pathname, self.get_path(key, suffix))
+        self.evict()
+
+    def put(self, key, data):
+        """
+        @param key: a hex digest
+        @param data: the contents to cache
+        """
+        fd, temp_pathname = tempfile.mkstemp(dir=self.dirname, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as fout:
+            fout.write(data)
+        os.rename(temp_pathname, self.get_path(key))
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used files until the cache is small enough.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.dirname):
+            if name.endswith('.tmp'):
+                continue
+            pathname = os.path.join(self.dirname, name)
+            try:
+                info = os.stat(pathname)
+            except OSError as e:
+                continue
+            entries.append((info.st_mtime, name, info.st_size))
+            total += info.st_size
+        for mtime, name, size in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(os.path.join(self.dirname, name))
+            except OSError as e:
+                pass
+            total -= size
+
+def check_private_directory(dirname):
+    """
+    @param dirname: a directory that only the current user should control
+    """
+    info = os.lstat(dirname)
+    if not stat.S_ISDIR(info.st_mode):
+        raise RenderCacheError('not a directory: ' + dirname)
+    if info.st_uid != os.getuid():
+        raise RenderCacheError(
+                'the cache directory belongs to another user: ' + dirname)
+    if info.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise RenderCacheError(
+                'the cache directory is accessible to other users: ' + dirname)
+
+def get_cache():
+    """
+    The default cache is created when it is first needed.
+    @return: the render cache or None
+    """
+    global g_cache
+    with g_cache_lock:
+        if g_cache is None and not g_cache_disabled:
+            g_cache = RenderCache(g_cache_dirname, g_cache_max_bytes)
+        return g_cache
+
+def set_cache(cache):
+    """
+    @param cache: a RenderCache or None to compile every time
+    """
+    global g_cache
+    global g_cache_disabled
+    with g_cache_lock:
+        g_cache = cache
+        g_cache_disabled = cache is None
+
+def get_tool_version(args):
+    """
+    @param args: a command that prints the version of a program
+    @return: the first line of the output or 'missing'
+    """
+    key = tuple(args)
+    if key not in g_tool_versions:
+        try:
+            proc = subprocess.Popen(args,
+                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            proc_stdout, proc_stderr = proc.communicate()
+            lines = (proc_stdout or proc_stderr).splitlines()
+            g_tool_versions[key] = lines[0] if lines else ''
+        except OSError as e:
+            g_tool_versions[key] = 'missing'
+    return g_tool_versions[key]
+
+def get_render_key(latex_text, render_format, tools):
+    """
+    @param latex_text: contents of a LaTeX file
+    @param render_format: the name of the output format
+    @param tools: the version commands of the programs used for rendering
+    @return: a hex digest
+    """
+    h = hashlib.sha1()
+    for args in tools:
+        h.update(get_tool_version(args) + '\0')
+    h.update(render_format + '\0')
+    h.update(latex_text)
+    return h.hexdigest()
+
+def _get_cached_contents(latex_text, render_format, tools, render):
+    """
+    @param latex_text: contents of a LaTeX file
+    @param render_format: the name of the output format
+    @param tools: the version commands of the programs used for rendering
+    @param render: a function that renders the LaTeX text
+    @return: the rendered contents
+    """
+    cache = get_cache()
+    if cache is None:
+        return render(latex_text)
+    key = get_render_key(latex_text, render_format, tools)
+    contents = cache.get(key)
+    if contents is None:
+        contents = render(latex_text)
+        cache.put(key, contents)
+    return contents
+
+g_pdflatex_tool = (g_pdflatex, '--version')
+g_convert_tool = ('convert', '-version')
+g_gs_tool = ('gs', '--version')
+
+def _get_preamble(latex_text):
+    """
+    @param latex_text: contents of a LaTeX file
+    @return: the text before the document environment or None
+    """
+    index = latex_text.find('\\begin{document}')
+    if index < 0:
+        return None
+    return latex_text[:index]
+
+def _get_preamble_format(latex_text):
+    """
+    Find or make a format file of the preamble using mylatexformat.
+    @param latex_text: contents of a LaTeX file
+    @return: None or the directory and name of a format
+    """
+    cache = get_cache()
+    preamble = _get_preamble(latex_text)
+    if cache is None or preamble is None:
+        return None
+    name = 'fmt' + get_render_key(preamble, 'fmt', [g_pdflatex_tool])
+    if name in g_failed_formats:
+        return None
+    if cache.touch(name, '.fmt'):
+        return cache.dirname, name
+    try:
+        if not _check_installed_files(['mylatexformat.ltx']):
+            g_failed_formats.add(name)
+            return None
+    except (OSError, CheckPackageError) as e:
+        g_failed_formats.add(name)
+        return None
+    dirname = tempfile.mkdtemp(prefix='webtex')
+    try:
+        pathname = os.path.join(dirname, 'preamble.tex')
+        with open(pathname, 'w') as fout:
+            fout.write(preamble + '\\begin{document}\n\\end{document}\n')
+        args = [
+                g_pdflatex, '-ini',
+                '-output-directory=' + dirname,
+                '-interaction=nonstopmode',
+                '-halt-on-error',
+                '-jobname=' + name,
+                '&pdflatex', 'mylatexformat.ltx', pathname]
+        proc = subprocess.Popen(args, cwd=dirname,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        proc.communicate()
+        format_pathname = os.path.join(dirname, name + '.fmt')
+        if proc.returncode or not os.path.exists(format_pathname):
+            g_failed_formats.add(name)
+            return None
+        cache.put_file(name, format_pathname, '.fmt')
+        return cache.dirname, name
+    finally:
+        shutil.rmtree(dirname, ignore_errors=True)
+
+def _create_temp_pdf_file(latex_text, dirname, output_format='pdf'):
     """
     The returned path name base does not yet have the pdf or dvi extension.
     @param latex_text: contents of a LaTeX file
+    @param dirname: a temporary directory for the files
     @param output_format: either pdf or dvi
     @return: the base of the path name of a temporary pdf file
     """
-    # write a named temporary latex file
-    pathname = Util.create_tmp_file(latex_text, prefix='webtex')
+    # write a latex file in the temporary directory
+    pathname = os.path.join(dirname, 'webtex')
+    with open(pathname + '.tex', 'w') as fout:
+        fout.write(latex_text)
     # convert the file to a pdf
     args = [
-            '/usr/bin/pdflatex',
-            '-output-directory=/tmp',
+            g_pdflatex,
+            '-output-directory=' + dirname,
             '-interaction=nonstopmode',
             '-output-format=%s' % output_format,
-            '-halt-on-error',
-            pathname]
-    # 
-    proc = subprocess.Popen(args,
+            '-halt-on-error']
+    # use the precompiled preamble if possible
+    preamble_format = _get_preamble_format(latex_text)
+    if preamble_format is not None:
+        format_dirname, format_name = preamble_format
+        env = dict(os.environ)
+        env['TEXFORMATS'] = format_dirname + ':'
+        format_args = args + ['-fmt=' + format_name, pathname + '.tex']
+        proc = subprocess.Popen(format_args, env=env,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        proc_stdout, proc_stderr = proc.communicate()
+        if not proc.returncode:
+            return pathname
+        # do not use this format again
+        g_failed_formats.add(format_name)
+    proc = subprocess.Popen(args + [pathname + '.tex'],
             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     proc_stdout, proc_stderr = proc.communicate()
     return pathname
 
 def get_png_contents_imagemagick(latex_text):
     """
-    This involves lots of temporary files.
     pdflatex foo.tex
     convert -density 300 foo.pdf foo.png
+    @param latex_text: contents of a LaTeX file
+    @return: contents of a png file
     """
-    # make the pdf file
-    pathname = _create_temp_pdf_file(latex_text)
-    # make the png file
-    cmd = [
-        'convert',
-        #'-density', '100',
-        pathname + '.pdf',
-        pathname + '.png']
-    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    proc_stdout, proc_stderr = proc.communicate()
-    if proc.returncode:
-        raise ValueError(proc_stderr)
-    # read the png file
-    with open(pathname + '.png', 'rb') as fin:
-        image_data = fin.read()
-    return image_data
+    return _get_cached_contents(latex_text, 'png-imagemagick',
+            [g_pdflatex_tool, g_convert_tool], _render_png_imagemagick)
+
+def _render_png_imagemagick(latex_text):
+    dirname = tempfile.mkdtemp(prefix='webtex')
+    try:
+        # make the pdf file
+        pathname = _create_temp_pdf_file(latex_text, dirname)
+        # make the png file
+        cmd = [
+            'convert',
+            #'-density', '100',
+            pathname + '.pdf',
+            pathname + '.png']
+        proc = subprocess.Popen(cmd,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        proc_stdout, proc_stderr = proc.communicate()
+        if proc.returncode:
+            raise ValueError(proc_stderr)
+        # read the png file
+        with open(pathname + '.png', 'rb') as fin:
+            image_data = fin.read()
+        return image_data
+    finally:
+        shutil.rmtree(dirname, ignore_errors=True)
 
 def get_png_contents_ghostscript(latex_text):
     """
     This seemed to give ugly looking png files for some reason.
-    It involves using temporary files.
     @param latex_text: contents of a LaTeX file
     @return: contents of a png file
     """
-    # create the pdf file
-    pathname = _create_temp_pdf_file(latex_text)
-    # create the png file
-    png_pathname = pathname + '.png'
-    input_arg = pathname + '.pdf'
-    output_arg = '-sOutputFile=' + png_pathname
-    # sDEVICE used to be pngggray
-    # sDEVICE used to be png16m
-    args = [
-            'gs', '-dUseCropBox', '-r144',
-            '-dSAFER', '-dBATCH', '-dNOPAUSE', '-sDEVICE=pngalpha',
-            output_arg, input_arg]
-    p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    p.wait()
-    p_output = p.stdout.read()
-    p_error = p.stderr.read()
-    # read the png file
+    return _get_cached_contents(latex_text, 'png-ghostscript',
+            [g_pdflatex_tool, g_gs_tool], _render_png_ghostscript)
+
+def _render_png_ghostscript(latex_text):
+    dirname = tempfile.mkdtemp(prefix='webtex')
     try:
-        fin = open(png_pathname, 'rb')
-        png_contents = fin.read()
-        fin.close()
-    except IOError as e:
-        raise ValueError('failed to create a png file')
-    return png_contents
+        # create the pdf file
+        pathname = _create_temp_pdf_file(latex_text, dirname)
+        # create the png file
+        png_pathname = pathname + '.png'
+        input_arg = pathname + '.pdf'
+        output_arg = '-sOutputFile=' + png_pathname
+        # sDEVICE used to be pngggray
+        # sDEVICE used to be png16m
+        args = [
+                'gs', '-dUseCropBox', '-r144',
+                '-dSAFER', '-dBATCH', '-dNOPAUSE', '-sDEVICE=pngalpha',
+                output_arg, input_arg]
+        p = subprocess.Popen(args,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        p_output, p_error = p.communicate()
+        # read the png file
+        try:
+            with open(png_pathname, 'rb') as fin:
+                png_contents = fin.read()
+        except IOError as e:
+            raise ValueError('failed to create a png file')
+        return png_contents
+    finally:
+        shutil.rmtree(dirname, ignore_errors=True)
 
 def get_pdf_contents(latex_text):
     """
-    This involves using temporary files.
     @param latex_text: contents of a LaTeX file
     @return: contents of a pdf file
     """
-    # create the pdf file
-    pdf_pathname = _create_temp_pdf_file(latex_text) + '.pdf'
-    # read the pdf file
+    return _get_cached_contents(latex_text, 'pdf',
+            [g_pdflatex_tool], _render_pdf)
+
+def _render_pdf(latex_text):
+    dirname = tempfile.mkdtemp(prefix='webtex')
     try:
-        fin = open(pdf_pathname, 'rb')
-        pdf_contents = fin.read()
-        fin.close()
-    except IOError as e:
-        raise ValueError('failed to create a pdf file')
-    return pdf_contents
+        # create the pdf file
+        pdf_pathname = _create_temp_pdf_file(latex_text, dirname) + '.pdf'
+        # read the pdf file
+        try:
+            with open(pdf_pathname, 'rb') as fin:
+                pdf_contents = fin.read()
+        except IOError as e:
+            raise ValueError('failed to create a pdf file')
+        return pdf_contents
+    finally:
+        shutil.rmtree(dirname, ignore_errors=True)
 
 def latex_text_to_response(latex_text, latexformat):
     """
@@ -237,6 +570,32 @@ def latex_text_to_response(latex_text, latexformat):
     elif latexformat == LATEXFORMAT_PNG:
         return get_png_contents_ghostscript(latex_text)
 
+def latex_texts_to_responses(latex_texts, latexformat, nthreads=None):
+    """
+    Compile independent documents concurrently.
+    Each distinct document is compiled once.
+    @param latex_texts: the texts of latex files
+    @param latexformat: one of three possible formats
+    @param nthreads: the number of concurrent compilations or None
+    @return: a response for each latex text
+    """
+    assert_latexformat(latexformat)
+    unique_texts = sorted(set(latex_texts))
+    if latexformat == LATEXFORMAT_TEX or len(unique_texts) < 2:
+        responses = [latex_text_to_response(t, latexformat)
+                for t in unique_texts]
+    else:
+        pool = ThreadPool(nthreads)
+        try:
+            responses = pool.map(
+                    lambda t: latex_text_to_response(t, latexformat),
+                    unique_texts)
+        finally:
+            pool.close()
+            pool.join()
+    text_to_response = dict(zip(unique_texts, responses))
+    return [text_to_response[t] for t in latex_texts]
+
 def get_response(
         requested_documentclass, document_body, latexformat,
         packages=(), preamble=''):
@@ -248,6 +607,39 @@ def get_response(
     @param preamble: color definitions, for example
     @return: a response suitable to return from the get_response interface
     """
+    latex_text = get_latex_text(requested_documentclass, document_body,
+            latexformat, packages, preamble)
+    # respond using the requested format
+    return latex_text_to_response(latex_text, latexformat)
+
+def get_responses(
+        requested_documentclass, document_bodies, latexformat,
+        packages=(), preamble='', nthreads=None):
+    """
+    This is like get_response but for multiple documents.
+    @param requested_documentclass: the documentclass
+    @param document_bodies: the texts inside the document environments
+    @param latexformat: one of three latex output formats
+    @param packages: a collection of requested packages
+    @param preamble: color definitions, for example
+    @param nthreads: the number of concurrent compilations or None
+    @return: a response for each document body
+    """
+    latex_texts = [get_latex_text(requested_documentclass, body,
+        latexformat, packages, preamble) for body in document_bodies]
+    return latex_texts_to_responses(latex_texts, latexformat, nthreads)
+
+def get_latex_text(
+        requested_documentclass, document_body, latexformat,
+        packages=(), preamble=''):
+    """
+    @param requested_documentclass: the documentclass
+    @param document_body: the text inside a document environment
+    @param latexformat: one of three latex output formats
+    @param packages: a collection of requested packages
+    @param preamble: color definitions, for example
+    @return: the text of a latex file
+    """
     # check the requested format
     assert_latexformat(latexformat)
     # get the subset of installed class and package names
@@ -286,9 +678,7 @@ def get_response(
         '\\begin{document}',
         document_body,
         '\\end{document}']
-    latex_text = '\n'.join(c for c in chunks if c)
-    # respond using the requested format
-    return latex_text_to_response(latex_text, latexformat)
+    return '\n'.join(c for c in chunks if c)
 
 def get_centered_figure_response(
         figure_body, latexformat, figure_caption, figure_label,
@@ -356,6 +746,77 @@ class TestLatexUtil(unittest.TestCase):
         expected = ''
         self.assertEqual(observed, expected)
 
+    def test_render_cache(self):
+        dirname = tempfile.mkdtemp()
+        try:
+            cache = RenderCache(dirname, 250)
+            self.assertEqual(cache.get('a'), None)
+            cache.put('a', 'x'*100)
+            cache.put('b', 'y'*100)
+            self.assertEqual(cache.get('a'), 'x'*100)
+            # use a and then add c so that b is the least recently used
+            os.utime(cache.get_path('b'), (0, 0))
+            cache.put('c', 'z'*100)
+            self.assertEqual(cache.get('b'), None)
+            self.assertEqual(cache.get('a'), 'x'*100)
+            self.assertEqual(cache.get('c'), 'z'*100)
+        finally:
+            shutil.rmtree(dirname)
+
+    def test_private_cache_directory(self):
+        parent = tempfile.mkdtemp()
+        try:
+            dirname = os.path.join(parent, 'cache')
+            RenderCache(dirname, 1000)
+            mode = os.stat(dirname).st_mode
+            self.assertFalse(mode & (stat.S_IRWXG | stat.S_IRWXO))
+            # a directory that others can write is rejected
+            os.chmod(dirname, 0777)
+            self.assertRaises(RenderCacheError, RenderCache, dirname, 1000)
+            # a symbolic link is rejected
+            os.chmod(dirname, 0700)
+            link = os.path.join(parent, 'link')
+            os.symlink(dirname, link)
+            self.assertRaises(RenderCacheError, RenderCache, link, 1000)
+        finally:
+            shutil.rmtree(parent)
+
+    def test_cached_contents(self):
+        global g_cache
+        global g_cache_disabled
+        dirname = tempfile.mkdtemp()
+        old_cache = g_cache
+        old_disabled = g_cache_disabled
+        try:
+            set_cache(RenderCache(dirname, 1000))
+            calls = []
+            def render(latex_text):
+                calls.append(latex_text)
+                return latex_text.upper()
+            tools = [('no-such-latex-tool', '--version')]
+            for i in range(3):
+                for text in ('foo', 'bar'):
+                    observed = _get_cached_contents(text, 'pdf', tools, render)
+                    self.assertEqual(observed, text.upper())
+            self.assertEqual(calls, ['foo', 'bar'])
+            # the key depends on the output format
+            a = get_render_key('foo', 'pdf', tools)
+            b = get_render_key('foo', 'png-ghostscript', tools)
+            self.assertNotEqual(a, b)
+            # without a cache each render calls the function
+            set_cache(None)
+            _get_cached_contents('foo', 'pdf', tools, render)
+            self.assertEqual(len(calls), 3)
+        finally:
+            g_cache = old_cache
+            g_cache_disabled = old_disabled
+            shutil.rmtree(dirname)
+
+    def test_latex_texts_to_responses(self):
+        texts = ['a', 'b', 'a']
+        observed = latex_texts_to_responses(texts, LATEXFORMAT_TEX)
+        self.assertEqual(observed, texts)
+
 
 if __name__ == '__main__':
     unittest.main()
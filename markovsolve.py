@@ -0,0 +1,411 @@
+"""
+Solve the linear systems of finite Markov chains.
+
+The matrices can be dense numpy arrays or scipy sparse matrices.
+The stationary distribution of a chain is found
+from its generator, which is P - I for a transition matrix P
+or the rate matrix Q itself for a continuous time chain.
+The absorption computations solve systems like (I - Q) X = B.
+Each solver returns its solution together with a report
+that records the method and the residual of the solution.
+The 'auto' method picks a solver according to the size and sparsity:
+a dense direct solve for small or dense matrices,
+a sparse direct LU solve for sparse matrices with a narrow band,
+and Jacobi preconditioned gmres for other sparse matrices,
+falling back to bicgstab and then to accelerated power iteration
+for a stationary distribution.
+An iterative solve that does not reach its tolerance
+raises a MarkovSolveError instead of returning an inaccurate solution.
+The fill of a sparse LU factorization of a chain on a Hamming graph
+makes it slower than a dense solve,
+and an incomplete LU preconditioner is similarly expensive to build,
+whereas the diagonal of a generator is a cheap and effective preconditioner.
+"""
+
+import unittest
+
+import numpy as np
+from scipy import linalg
+from scipy import sparse
+from scipy.sparse import linalg as splinalg
+
+# dense matrices with at most this many states are solved directly
+g_max_dense_states = 2000
+
+# larger dense matrices with a greater fraction of nonzeros stay dense
+g_max_sparse_density = 0.1
+
+# sparse matrices use a direct LU solve when
+# the number of states times the squared bandwidth is at most this much
+g_max_direct_work = 1e8
+
+g_default_tol = 1e-10
+
+g_default_maxiter = 1000
+
+g_methods = ('auto', 'dense', 'splu', 'gmres', 'bicgstab', 'power')
+
+class MarkovSolveError(Exception): pass
+
+
+class SolverReport:
+    """
+    Describe how a solution was found.
+    """
+
+    def __init__(self, method, residual, niterations=None):
+        """
+        @param method: the name of the method that found the solution
+        @param residual: the max norm of the residual of the solution
+        @param niterations: the number of iterations or None if direct
+        """
+        self.method = method
+        self.residual = residual
+        self.niterations = niterations
+
+    def __str__(self):
+        s = '%s residual: %g' % (self.method, self.residual)
+        if self.niterations is not None:
+            s += ' iterations: %d' % self.niterations
+        return s
+
+
+def _to_array(X):
+    if sparse.issparse(X):
+        return X.toarray()
+    return np.asarray(X)
+
+def _choose_method(A):
+    """
+    @param A: a dense or sparse square matrix
+    @return: a method name other than auto
+    """
+    n = A.shape[0]
+    if not sparse.issparse(A):
+        if n <= g_max_dense_states:
+            return 'dense'
+        if np.count_nonzero(A) > g_max_sparse_density * n * n:
+            return 'dense'
+    rows, cols = A.nonzero()
+    bandwidth = np.max(np.abs(rows - cols)) if len(rows) else 0
+    if n * float(bandwidth)**2 <= g_max_direct_work:
+        return 'splu'
+    return 'gmres'
+
+def _get_preconditioner(A):
+    """
+    @param A: a sparse square matrix
+    @return: a Jacobi linear operator or None
+    """
+    d = A.diagonal()
+    if not np.all(d):
+        return None
+    return splinalg.LinearOperator(A.shape, lambda x: x / d)
+
+def _solve_iterative(A, B, method, tol, maxiter):
+    """
+    Solve each column with a preconditioned Krylov method.
+    @param A: a sparse square matrix
+    @param B: a dense two dimensional right hand side
+    @param method: gmres or bicgstab
+    @param tol: the relative tolerance
+    @param maxiter: the maximum number of iterations per column
+    @return: the solution, the total number of iterations, and True if
+        the solver reported convergence for every column
+    """
+    A = sparse.csr_matrix(A)
+    M = _get_preconditioner(A)
+    solver = splinalg.gmres if method == 'gmres' else splinalg.bicgstab
+    X = np.empty(B.shape)
+    counter = [0]
+    def callback(xk):
+        counter[0] += 1
+    converged = True
+    for j in range(B.shape[1]):
+        X[:, j], info = solver(A, B[:, j],
+                tol=tol, maxiter=maxiter, M=M, callback=callback)
+        converged = converged and not info
+    return X, counter[0], converged
+
+def solve(A, B, method='auto', tol=g_default_tol, maxiter=g_default_maxiter):
+    """
+    Solve the nonsingular linear system A X = B.
+    @param A: a dense or sparse square matrix
+    @param B: a dense one or two dimensional right hand side
+    @param method: one of the names in g_methods other than power
+    @param tol: the relative residual tolerance of the iterative methods
+    @param maxiter: the maximum number of iterations of the iterative methods
+    @return: the dense solution with the shape of B, and a report
+    """
+    B = _to_array(B).astype(float)
+    B2 = np.reshape(B, (B.shape[0], -1))
+    if method not in g_methods or method == 'power':
+        raise MarkovSolveError('unknown linear solver method: ' + method)
+    if method == 'auto':
+        method = _choose_method(A)
+    niterations = None
+    if method == 'dense':
+        X = linalg.solve(_to_array(A), B2)
+    elif method == 'splu':
+        X = splinalg.splu(sparse.csc_matrix(A)).solve(B2)
+    else:
+        candidates = [method]
+        # an automatic iterative solve may fall back to another method
+        if method == 'gmres':
+            candidates.append('bicgstab')
+        for method in candidates:
+            X, niterations, converged = _solve_iterative(
+                    A, B2, method, tol, maxiter)
+            relative_residual = _get_relative_residual(A, X, B2)
+            converged = converged or relative_residual <= tol
+            if converged:
+                break
+        if not converged:
+            raise MarkovSolveError(
+                    '%s did not converge: relative residual %g '
+                    'after %d iterations' % (
+                        method, relative_residual, niterations))
+    report = SolverReport(method, _get_residual(A, X, B2), niterations)
+    return np.reshape(X, B.shape), report
+
+def _get_residual(A, X, B):
+    return np.max(np.abs(A.dot(X) - B)) if B.size else 0.0
+
+def _get_relative_residual(A, X, B):
+    scale = max(np.max(np.abs(B)), 1e-300) if B.size else 1.0
+    return _get_residual(A, X, B) / scale
+
+def solve_fundamental(Q, B, method='auto',
+        tol=g_default_tol, maxiter=g_default_maxiter):
+    """
+    Solve (I - Q) X = B for an absorbing chain.
+    @param Q: transitions among transient states, dense or sparse
+    @param B: a dense one or two dimensional right hand side
+    @param method: one of the names in g_methods other than power
+    @param tol: the relative residual tolerance of the iterative methods
+    @param maxiter: the maximum number of iterations of the iterative methods
+    @return: the dense solution with the shape of B, and a report
+    """
+    n = Q.shape[0]
+    if sparse.issparse(Q):
+        A = (sparse.identity(n) - Q).tocsr()
+    else:
+        A = np.eye(n) - Q
+    return solve(A, B, method, tol, maxiter)
+
+def _get_stationary_residual(G, v):
+    return np.max(np.abs(G.T.dot(v)))
+
+def _clean_distribution(v):
+    """
+    Remove negligible negative entries and normalize.
+    """
+    v = np.real(v)
+    v = (v + np.abs(v)) / 2
+    return v / np.sum(v)
+
+def _stationary_dense(G):
+    """
+    Replace the first balance equation by the normalization.
+    """
+    n = G.shape[0]
+    b = np.zeros(n)
+    b[0] = 1
+    A = _to_array(G).T.copy()
+    A[0] = np.ones(n)
+    return linalg.solve(A, b, overwrite_a=True, overwrite_b=True)
+
+def _stationary_sparse(G, method, tol, maxiter):
+    """
+    Fix the first entry and solve the remaining balance equations.
+    The reduced system is nonsingular for an irreducible chain
+    and unlike the normalization row it keeps the sparsity of the generator.
+    """
+    GT = sparse.csr_matrix(G.T)
+    A = GT[1:, 1:]
+    b = -_to_array(GT[1:, 0].todense()).ravel()
+    converged = True
+    if method == 'splu':
+        x = splinalg.splu(A.tocsc()).solve(b)
+        niterations = None
+    else:
+        X, niterations, converged = _solve_iterative(
+                A, b[:, np.newaxis], method, tol, maxiter)
+        x = X[:, 0]
+    return np.hstack(([1.0], x)), niterations, converged
+
+def _stationary_power(G, tol, maxiter, period=10):
+    """
+    Power iteration on the uniformized chain with Aitken extrapolation.
+    Every few steps the last three iterates are extrapolated
+    and the extrapolation is kept if it has a smaller residual.
+    """
+    n = G.shape[0]
+    GT = sparse.csr_matrix(G.T) if sparse.issparse(G) else _to_array(G).T
+    # every state keeps some probability, so the chain is aperiodic
+    rate = 1.01 * max(np.max(-G.diagonal()), 1e-300)
+    v = np.ones(n) / n
+    history = []
+    for i in range(maxiter):
+        v = v + GT.dot(v) / rate
+        v /= np.sum(v)
+        history = (history + [v])[-3:]
+        if len(history) == 3 and not (i+1) % period:
+            x0, x1, x2 = history
+            den = x2 - 2*x1 + x0
+            safe = np.abs(den) > 1e-300
+            w = x2.copy()
+            w[safe] -= (x2[safe] - x1[safe])**2 / den[safe]
+            w = _clean_distribution(w)
+            if _get_stationary_residual(G, w) < _get_stationary_residual(G, v):
+                v = w
+        if _get_stationary_residual(G, v) <= tol:
+            break
+    return v, i+1
+
+def get_stationary_distribution(G, method='auto',
+        tol=g_default_tol, maxiter=g_default_maxiter):
+    """
+    Find the stationary distribution of an irreducible chain.
+    @param G: a generator like P - I or a rate matrix, dense or sparse
+    @param method: one of the names in g_methods
+    @param tol: the residual tolerance of the iterative methods
+    @param maxiter: the maximum number of iterations of the iterative methods
+    @return: the stationary distribution and a report
+    """
+    if method not in g_methods:
+        raise MarkovSolveError('unknown stationary solver method: ' + method)
+    automatic = (method == 'auto')
+    if automatic:
+        method = _choose_method(G)
+    niterations = None
+    if method == 'dense':
+        v = _stationary_dense(G)
+    elif method == 'splu':
+        v, niterations, converged = _stationary_sparse(
+                G, method, tol, maxiter)
+    else:
+        candidates = [method]
+        if automatic:
+            candidates.extend(['bicgstab', 'power'])
+        for method in candidates:
+            if method == 'power':
+                v, niterations = _stationary_power(G, tol, maxiter)
+                converged = False
+            else:
+                v, niterations, converged = _stationary_sparse(
+                        G, method, tol, maxiter)
+            v = _clean_distribution(v)
+            residual = _get_stationary_residual(G, v)
+            converged = converged or residual <= tol
+            if converged:
+                break
+        if not converged:
+            raise MarkovSolveError(
+                    '%s did not converge: residual %g '
+                    'after %d iterations' % (method, residual, niterations))
+    v = _clean_distribution(v)
+    report = SolverReport(method, _get_stationary_residual(G, v), niterations)
+    return v, report
+
+def get_stationary_distribution_from_transitions(P, method='auto',
+        tol=g_default_tol, maxiter=g_default_maxiter):
+    """
+    @param P: a right stochastic matrix, dense or sparse
+    @param method: one of the names in g_methods
+    @param tol: the residual tolerance of the iterative methods
+    @param maxiter: the maximum number of iterations of the iterative methods
+    @return: the stationary distribution and a report
+    """
+    n = P.shape[0]
+    if sparse.issparse(P):
+        G = (P - sparse.identity(n)).tocsr()
+    else:
+        G = np.asarray(P) - np.eye(n)
+    return get_stationary_distribution(G, method, tol, maxiter)
+
+
+def _get_sparse_test_chain(nresidues, nsites):
+    """
+    A Hamming graph random walk with site dependent residue preferences.
+    """
+    np.random.seed(0)
+    weights = np.random.rand(nsites, nresidues) + 0.5
+    nstates = nresidues**nsites
+    states = np.arange(nstates)
+    digits = [(states // nresidues**i) % nresidues for i in range(nsites)]
+    rows, cols, rates = [], [], []
+    for i in range(nsites):
+        for b in range(nresidues):
+            sinks = states + (b - digits[i]) * nresidues**i
+            mask = digits[i] != b
+            rows.append(states[mask])
+            cols.append(sinks[mask])
+            rates.append(weights[i, b] * np.ones(np.sum(mask)))
+    rows, cols, rates = [np.hstack(x) for x in (rows, cols, rates)]
+    Q = sparse.csr_matrix((rates, (rows, cols)), shape=(nstates, nstates))
+    Q = Q - sparse.diags(np.asarray(Q.sum(axis=1)).ravel())
+    # the stationary distribution is a product over sites
+    distn = np.ones(1)
+    for i in reversed(range(nsites)):
+        distn = np.kron(distn, weights[i] / np.sum(weights[i]))
+    return Q.tocsr(), distn
+
+class TestMarkovSolve(unittest.TestCase):
+
+    def test_stationary_methods(self):
+        Q, expected = _get_sparse_test_chain(4, 5)
+        for method in g_methods:
+            A = Q.toarray() if method == 'dense' else Q
+            v, report = get_stationary_distribution(A, method)
+            self.assertTrue(np.allclose(v, expected), method)
+            self.assertTrue(report.residual < 1e-8, str(report))
+
+    def test_transition_matrix(self):
+        P = np.array([
+            [0.9, 0.1, 0.0],
+            [0.2, 0.7, 0.1],
+            [0.0, 0.5, 0.5]])
+        v, report = get_stationary_distribution_from_transitions(P)
+        self.assertTrue(np.allclose(np.dot(v, P), v))
+        w, report = get_stationary_distribution_from_transitions(
+                sparse.csr_matrix(P), 'bicgstab')
+        self.assertTrue(np.allclose(v, w))
+
+    def test_periodic_power_iteration(self):
+        P = np.array([[0.0, 1.0], [1.0, 0.0]])
+        v, report = get_stationary_distribution_from_transitions(P, 'power')
+        self.assertTrue(np.allclose(v, [0.5, 0.5]))
+
+    def test_solve_fundamental(self):
+        np.random.seed(0)
+        n = 50
+        Q = sparse.rand(n, n, density=0.1, random_state=0).tocsr()
+        Q = sparse.diags(0.9 / np.asarray(Q.sum(axis=1) + 1).ravel()).dot(Q)
+        B = np.random.rand(n, 2)
+        expected = linalg.solve(np.eye(n) - Q.toarray(), B)
+        for method in ('auto', 'dense', 'splu', 'gmres', 'bicgstab'):
+            X, report = solve_fundamental(Q, B, method)
+            self.assertTrue(np.allclose(X, expected), method)
+        x, report = solve_fundamental(Q.toarray(), B[:, 0])
+        self.assertEqual(x.shape, (n,))
+        self.assertEqual(report.method, 'dense')
+
+    def test_no_convergence(self):
+        A, distn = _get_sparse_test_chain(4, 3)
+        self.assertRaises(MarkovSolveError,
+                get_stationary_distribution, A, 'gmres', 1e-30, 1)
+        Q = 0.5 * sparse.csr_matrix(A + sparse.identity(A.shape[0]))
+        B = np.ones(A.shape[0])
+        self.assertRaises(MarkovSolveError,
+                solve_fundamental, Q, B, 'bicgstab', 1e-30, 1)
+
+    def test_unknown_method(self):
+        P = np.eye(2)
+        self.assertRaises(MarkovSolveError, solve, P, np.ones(2), 'power')
+        self.assertRaises(MarkovSolveError,
+                get_stationary_distribution, P, 'eig')
+
+
+if __name__ == '__main__':
+    unittest.main()
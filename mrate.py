@@ -14,9 +14,11 @@ import itertools
 import numpy as np
 import scipy
 from scipy import linalg
+from scipy import sparse
 
 import bernoulli
 import graph
+import markovsolve
 import MatrixUtil
 from MatrixUtil import ndot
 import StatsUtil
@@ -220,19 +222,12 @@ def expm_diff_spectral(R, t):
     Use the spectral representation.
     @return: entrywise derivative of transition matrix at time t
     """
-    n = len(R)
     v = R_to_distn(R)
     S = symmetrized(R)
     w, U = np.linalg.eigh(S)
-    P_diff = np.zeros_like(R)
-    for i in range(n):
-        for j in range(n):
-            for k in range(n):
-                a = (v[j] / v[i])**0.5
-                b = U[i, k] * U[j, k]
-                c = w[k] * math.exp(t * w[k])
-                P_diff[i, j] += a * b * c
-    return P_diff
+    r = np.sqrt(v)
+    P_diff = np.dot(U * (w * np.exp(t * w)), U.T)
+    return P_diff * r / r[:, np.newaxis]
 
 def _R_to_eigenpair(R):
     n = len(R)
@@ -327,31 +322,26 @@ def R_to_distn_nonspectral(R):
 
 def P_to_distn(R):
     """
-    @param P: transition matrix
+    @param P: transition matrix, dense or scipy sparse
     @return: stationary distribution
     """
-    n = len(R)
-    Wl, Vl = scipy.linalg.eig(R, left=True, right=False)
-    val_vec_pairs = [(abs(Wl[i]), Vl[:,i]) for i in range(n)]
-    dummy, pi_eigenvector = max(val_vec_pairs)
-    total = np.sum(pi_eigenvector)
-    pi_arr = np.array([v/total for v in pi_eigenvector])
-    return pi_arr
+    if not sparse.issparse(R):
+        R = np.asarray(R)
+    v, report = markovsolve.get_stationary_distribution_from_transitions(R)
+    return v
 
 def R_to_distn(R):
     """
-    This seems to have a problem when eigenvalues are not distinct.
-    The problem is that it tries to compare the eigenvectors.
-    @param R: rate matrix
+    This uses the markovsolve module,
+    which picks a direct or iterative solver
+    according to the size and sparsity of the rate matrix.
+    @param R: rate matrix, dense or scipy sparse
     @return: stationary distribution
     """
-    n = len(R)
-    Wl, Vl = scipy.linalg.eig(R, left=True, right=False)
-    val_vec_pairs = [(abs(Wl[i]), Vl[:,i]) for i in range(n)]
-    dummy, pi_eigenvector = min(val_vec_pairs)
-    total = np.sum(pi_eigenvector)
-    pi_arr = np.array([v/total for v in pi_eigenvector])
-    return pi_arr
+    if not sparse.issparse(R):
+        R = np.asarray(R)
+    v, report = markovsolve.get_stationary_distribution(R)
+    return v
 
 def Q_to_expected_rate(Q):
     """
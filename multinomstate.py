@@ -71,7 +71,8 @@ def get_sorted_states(N, k):
 def get_inverse_map(M):
     """
     The input M[i,j] is count of allele j for pop state index i.
-    The output T[(i,j,...)] maps allele count tuple to pop state index
+    The output T[(i,j,...)] maps allele count tuple to pop state index.
+    This uses (N+1)^k memory, so see get_rank_index for large spaces.
     @param M: multinomial state map
     @return: T
     """
@@ -83,6 +84,127 @@ def get_inverse_map(M):
         T[tuple(state)] = i
     return T
 
+def _get_binomial_table(n, r):
+    """
+    @param n: the largest number of things
+    @param r: the largest number of chosen things
+    @return: B where B[i, j] is the binomial coefficient i choose j
+    """
+    B = np.zeros((n+1, r+1), dtype=np.int64)
+    B[:, 0] = 1
+    for i in range(1, n+1):
+        B[i, 1:] = B[i-1, 1:] + B[i-1, :-1]
+    return B
+
+def get_ranks(M):
+    """
+    Rank the states in the combinatorial number system.
+    The rank of a state is its index in the gen_states ordering,
+    but the ranks are computed by arithmetic on the counts.
+    @param M: M[i,j] is count of allele j for pop state index i
+    @return: a one dimensional integer array of ranks
+    """
+    M = np.asarray(M, dtype=np.int64)
+    nstates, k = M.shape
+    if not nstates:
+        return np.zeros(0, dtype=np.int64)
+    N = np.sum(M[0])
+    if np.any(M < 0) or np.any(np.sum(M, axis=1) != N):
+        raise ValueError('expected nonnegative counts with a common sum')
+    B = _get_binomial_table(N+k, k)
+    ranks = np.zeros(nstates, dtype=np.int64)
+    remaining = np.ones(nstates, dtype=np.int64) * N
+    for p in range(k-1):
+        m = k - p - 1
+        # count the states with the same prefix and a smaller count at p
+        ranks += B[remaining + m, m] - B[remaining - M[:, p] + m, m]
+        remaining -= M[:, p]
+    return ranks
+
+def get_unranked_states(ranks, N, k):
+    """
+    This is the inverse of get_ranks.
+    @param ranks: a sequence of ranks
+    @param N: population size
+    @param k: number of bins
+    @return: M where M[i,j] is count of allele j for the state of rank i
+    """
+    ranks = np.array(ranks, dtype=np.int64)
+    if np.any(ranks < 0) or np.any(ranks >= get_nstates(N, k)):
+        raise ValueError('each rank should be less than the number of states')
+    B = _get_binomial_table(N+k, k)
+    M = np.zeros((len(ranks), k), dtype=int)
+    remaining = np.ones(len(ranks), dtype=np.int64) * N
+    for p in range(k-1):
+        m = k - p - 1
+        # find the largest count at p whose preceding states fit in the rank
+        totals = B[remaining + m, m]
+        tails = B[m : N+m+1, m]
+        t = np.searchsorted(tails, totals - ranks)
+        M[:, p] = remaining - t
+        ranks -= totals - tails[t]
+        remaining = t
+    M[:, k-1] = remaining
+    return M
+
+def get_rank_index(M):
+    """
+    This is an alternative to get_inverse_map.
+    It uses memory proportional to the number of states
+    instead of proportional to (N+1)^k,
+    and the states can be any subset of the multinomial states.
+    @param M: M[i,j] is count of allele j for pop state index i
+    @return: the sorted state ranks and the corresponding state indices
+    """
+    ranks = get_ranks(M)
+    order = np.argsort(ranks)
+    return ranks[order], order
+
+def get_indices(M, rank_index):
+    """
+    Map allele count arrays to state indices.
+    @param M: M[i,j] is count of allele j for query i
+    @param rank_index: the output of get_rank_index
+    @return: a one dimensional array of state indices
+    """
+    sorted_ranks, order = rank_index
+    ranks = get_ranks(M)
+    positions = np.searchsorted(sorted_ranks, ranks)
+    positions = np.minimum(positions, len(sorted_ranks) - 1)
+    if np.any(sorted_ranks[positions] != ranks):
+        raise ValueError('a state is not in the index')
+    return order[positions]
+
+def gen_single_moves(k):
+    """
+    Yield the moves of a single individual from one bin to another.
+    These are single mutations or single migrations.
+    @param k: number of bins
+    @return: a generator of (source bin, sink bin, count change) triples
+    """
+    for a in range(k):
+        for b in range(k):
+            if a != b:
+                delta = np.zeros(k, dtype=int)
+                delta[a] = -1
+                delta[b] = 1
+                yield a, b, delta
+
+def get_move_indices(M, rank_index, delta):
+    """
+    Find the state reached from each state by a change of counts.
+    @param M: M[i,j] is count of allele j for pop state index i
+    @param rank_index: the output of get_rank_index
+    @param delta: the change of counts, summing to zero
+    @return: the index of each sink state or -1 if the move is impossible
+    """
+    S = M + delta
+    feasible = np.all(S >= 0, axis=1)
+    sinks = -1 * np.ones(len(M), dtype=int)
+    if np.any(feasible):
+        sinks[feasible] = get_indices(S[feasible], rank_index)
+    return sinks
+
 class TestMultinomialState(unittest.TestCase):
     def test_numpy_indexing(self):
         cube = np.array([[[1, 2], [3, 4]], [[5, 6], [7, 8]]])
@@ -119,6 +241,40 @@ class TestMultinomialState(unittest.TestCase):
         self.assertEqual(T[0, 3], 1)
         self.assertEqual(T[2, 1], 2)
         self.assertEqual(T[1, 2], 3)
+    def test_ranks(self):
+        for N, k in ((3, 2), (5, 3), (4, 4), (0, 3), (6, 1)):
+            M = np.array(list(gen_states(N, k)))
+            nstates = get_nstates(N, k)
+            self.assertEqual(get_ranks(M).tolist(), range(nstates))
+            observed = get_unranked_states(range(nstates), N, k)
+            self.assertTrue(np.array_equal(M, observed))
+    def test_rank_index(self):
+        N = 6
+        k = 4
+        M = get_sorted_states(N, k)
+        T = get_inverse_map(M)
+        rank_index = get_rank_index(M)
+        np.random.seed(0)
+        Q = M[np.random.permutation(len(M))]
+        expected = [T[tuple(state)] for state in Q]
+        self.assertEqual(get_indices(Q, rank_index).tolist(), expected)
+        self.assertRaises(ValueError, get_indices, [[N, 0, 0, 1]], rank_index)
+    def test_single_moves(self):
+        N = 5
+        k = 3
+        M = get_sorted_states(N, k)
+        T = get_inverse_map(M)
+        rank_index = get_rank_index(M)
+        nmoves = 0
+        for a, b, delta in gen_single_moves(k):
+            sinks = get_move_indices(M, rank_index, delta)
+            for state, sink in zip(M, sinks):
+                if state[a]:
+                    self.assertEqual(sink, T[tuple(state + delta)])
+                else:
+                    self.assertEqual(sink, -1)
+            nmoves += 1
+        self.assertEqual(nmoves, k*(k-1))
 
 if __name__ == '__main__':
     unittest.main()
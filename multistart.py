@@ -0,0 +1,454 @@
+"""
+Run local optimizations from many starting points in a pool of processes.
+
+Likelihood surfaces like those of the codon recessivity models
+can have several local optima,
+so a single local optimization from a single guess may not find the best one.
+This module spreads the starting points over a box of parameter values
+using a Latin hypercube or a Sobol sequence,
+runs one local optimization per starting point in a pool of processes,
+and groups the converged points into distinct optima.
+The objective function is built once in each worker process
+by a factory function, so expensive precomputation like
+reading data files is not repeated for each start.
+The run can stop early when the best value has been reached
+by a given number of starts.
+"""
+
+import time
+import multiprocessing
+import unittest
+
+import numpy as np
+import scipy.optimize
+
+import jeffopt
+
+g_methods = ('simplex', 'bfgs', 'ncg', 'l-bfgs-b', 'jeff')
+g_samplers = ('lhs', 'sobol')
+g_transforms = ('logit', 'box')
+
+# converged points are the same optimum if they are this close
+g_xtol = 1e-2
+g_ftol = 1e-6
+
+# The Joe and Kuo primitive polynomials and initial direction numbers
+# for the Sobol dimensions after the first,
+# as (degree, coefficients, initial direction numbers).
+g_sobol_directions = [
+        (1, 0, (1,)),
+        (2, 1, (1, 3)),
+        (3, 1, (1, 3, 1)),
+        (3, 2, (1, 1, 1)),
+        (4, 1, (1, 1, 3, 3)),
+        (4, 4, (1, 3, 5, 13)),
+        (5, 2, (1, 1, 5, 5, 17)),
+        (5, 4, (1, 1, 5, 5, 5)),
+        (5, 7, (1, 1, 7, 11, 19)),
+        (5, 11, (1, 1, 5, 1, 1)),
+        (5, 13, (1, 1, 1, 3, 11)),
+        (5, 14, (1, 3, 5, 5, 31)),
+        (6, 1, (1, 3, 3, 9, 7, 49)),
+        (6, 13, (1, 1, 1, 15, 21, 21)),
+        (6, 16, (1, 3, 1, 13, 27, 49)),
+        (6, 19, (1, 1, 1, 15, 7, 5)),
+        (6, 22, (1, 3, 1, 15, 13, 25)),
+        (6, 25, (1, 1, 5, 5, 19, 61)),
+        (7, 1, (1, 3, 7, 11, 23, 15, 103)),
+        (7, 4, (1, 3, 7, 13, 13, 15, 69)),
+        ]
+
+g_sobol_nbits = 30
+
+class MultiStartError(Exception): pass
+
+
+def get_latin_hypercube(nstarts, ndim, rs):
+    """
+    Each coordinate has exactly one point in each of nstarts equal bins.
+    @param nstarts: the number of points
+    @param ndim: the number of dimensions
+    @param rs: a numpy RandomState
+    @return: an array of points in the open unit cube
+    """
+    U = (np.arange(nstarts)[:, np.newaxis] +
+            rs.uniform(size=(nstarts, ndim))) / nstarts
+    for j in range(ndim):
+        U[:, j] = U[rs.permutation(nstarts), j]
+    return U
+
+def _get_sobol_direction_numbers(ndim):
+    if ndim > len(g_sobol_directions) + 1:
+        raise MultiStartError(
+                'sobol points are available '
+                'for at most %d dimensions' % (len(g_sobol_directions) + 1))
+    nbits = g_sobol_nbits
+    V = np.zeros((ndim, nbits), dtype=np.int64)
+    V[0] = [1 << (nbits - 1 - k) for k in range(nbits)]
+    for j in range(1, ndim):
+        s, a, m = g_sobol_directions[j-1]
+        v = [m[k] << (nbits - 1 - k) for k in range(s)]
+        for k in range(s, nbits):
+            x = v[k-s] ^ (v[k-s] >> s)
+            for i in range(1, s):
+                if (a >> (s - 1 - i)) & 1:
+                    x ^= v[k-i]
+            v.append(x)
+        V[j] = v
+    return V
+
+def get_sobol(nstarts, ndim, skip=1):
+    """
+    Generate Sobol points in gray code order.
+    By default the first point, which is the origin, is skipped.
+    @param nstarts: the number of points
+    @param ndim: the number of dimensions
+    @param skip: the number of leading points to skip
+    @return: an array of points in the unit cube
+    """
+    V = _get_sobol_direction_numbers(ndim)
+    points = np.empty((nstarts, ndim))
+    x = np.zeros(ndim, dtype=np.int64)
+    for i in range(skip + nstarts):
+        if i >= skip:
+            points[i - skip] = x
+        # flip the direction number of the lowest zero bit of i
+        c = 0
+        while (i >> c) & 1:
+            c += 1
+        x ^= V[:, c]
+    return points / float(1 << g_sobol_nbits)
+
+def get_starting_points(nstarts, lows, highs, sampler='lhs', seed=None):
+    """
+    @param nstarts: the number of points
+    @param lows: lower bounds of the box
+    @param highs: upper bounds of the box
+    @param sampler: 'lhs' or 'sobol'
+    @param seed: random seed for the Latin hypercube
+    @return: an array of points in the box
+    """
+    ndim = len(lows)
+    if sampler == 'lhs':
+        U = get_latin_hypercube(nstarts, ndim, np.random.RandomState(seed))
+    elif sampler == 'sobol':
+        U = get_sobol(nstarts, ndim)
+    else:
+        raise MultiStartError('unknown sampler: ' + sampler)
+    return lows + (highs - lows) * U
+
+
+def local_minimize(f, fprime, fhess, x0, method, lows, highs, transform):
+    """
+    @param f: objective function
+    @param fprime: gradient of the objective function or None
+    @param fhess: hessian of the objective function or None
+    @param x0: the starting point
+    @param method: the name of the local optimization
+    @param lows: lower bounds of the box
+    @param highs: upper bounds of the box
+    @param transform: 'logit' for unbounded or 'box' for bounded parameters
+    @return: the converged point and its objective function value
+    """
+    if transform == 'box' and method not in ('l-bfgs-b', 'jeff'):
+        raise MultiStartError(
+                'the %s method does not respect the bounds' % method)
+    if method == 'simplex':
+        results = scipy.optimize.fmin(f, x0, full_output=True, disp=False)
+    elif method == 'bfgs':
+        results = scipy.optimize.fmin_bfgs(
+                f, x0, fprime=fprime, full_output=True, disp=False)
+    elif method == 'ncg':
+        if fprime is None:
+            raise MultiStartError('the ncg method needs a gradient')
+        results = scipy.optimize.fmin_ncg(
+                f, x0, fprime=fprime, fhess=fhess,
+                full_output=True, disp=False)
+    elif method == 'l-bfgs-b':
+        bounds = zip(lows, highs) if transform == 'box' else None
+        results = scipy.optimize.fmin_l_bfgs_b(
+                f, x0, fprime=fprime, approx_grad=(fprime is None),
+                bounds=bounds)
+    elif method == 'jeff':
+        if transform == 'box':
+            results = jeffopt.fmin_jeff_box(f, x0, lows, highs)
+        else:
+            results = jeffopt.fmin_jeff_unconstrained(f, x0)
+    else:
+        raise MultiStartError('unknown method: ' + method)
+    return np.asarray(results[0], dtype=float), float(results[1])
+
+
+class StartResult:
+    """
+    The outcome of one local optimization.
+    """
+    def __init__(self, start_index, x0, x, value, elapsed, error=None):
+        """
+        @param start_index: the index of the starting point
+        @param x0: the starting point
+        @param x: the converged point or None on error
+        @param value: the objective function value at x
+        @param elapsed: seconds spent on this start
+        @param error: None or the message of the exception of a failed start
+        """
+        self.start_index = start_index
+        self.x0 = x0
+        self.x = x
+        self.value = value
+        self.elapsed = elapsed
+        self.error = error
+
+
+class Optimum:
+    """
+    A group of starts that converged to the same point.
+    """
+    def __init__(self, start):
+        self.starts = [start]
+        self.x = start.x
+        self.value = start.value
+
+    def get_count(self):
+        return len(self.starts)
+
+
+class MultiStartResult:
+    """
+    The starts and the distinct optima ranked from best to worst.
+    """
+    def __init__(self, starts, optima, maximize, stopped_early):
+        self.starts = starts
+        self.optima = optima
+        self.maximize = maximize
+        self.stopped_early = stopped_early
+
+    def get_best(self):
+        """
+        @return: the best Optimum
+        """
+        if not self.optima:
+            raise MultiStartError('no start converged')
+        return self.optima[0]
+
+    def get_table_lines(self):
+        """
+        One tab separated line per start, ranked by the optimum it reached.
+        @return: a header line followed by one line per start
+        """
+        lines = ['\t'.join((
+            'rank', 'start', 'value', 'seconds', 'x'))]
+        for rank, optimum in enumerate(self.optima):
+            for start in optimum.starts:
+                lines.append('\t'.join((
+                    str(rank + 1), str(start.start_index),
+                    repr(start.value), '%.3f' % start.elapsed,
+                    ' '.join(repr(v) for v in start.x))))
+        for start in self.starts:
+            if start.error is not None:
+                lines.append('\t'.join((
+                    '-', str(start.start_index), 'nan',
+                    '%.3f' % start.elapsed, start.error)))
+        return lines
+
+
+def _is_same_optimum(a, b, widths, xtol, ftol):
+    if abs(a.value - b.value) > ftol * (1 + abs(a.value)):
+        return False
+    return np.max(np.abs(a.x - b.x) / widths) <= xtol
+
+def get_optima(starts, widths, maximize=False, xtol=g_xtol, ftol=g_ftol):
+    """
+    Group the converged starts into distinct optima.
+    @param starts: a sequence of StartResult objects
+    @param widths: the widths of the box for scaling the distances
+    @param maximize: True if larger objective function values are better
+    @param xtol: scaled coordinate tolerance
+    @param ftol: relative objective function value tolerance
+    @return: a list of Optimum objects ranked from best to worst
+    """
+    sign = -1 if maximize else 1
+    converged = [s for s in starts if s.error is None]
+    converged.sort(key=lambda s: (sign * s.value, s.start_index))
+    optima = []
+    for start in converged:
+        for optimum in optima:
+            if _is_same_optimum(optimum, start, widths, xtol, ftol):
+                optimum.starts.append(start)
+                break
+        else:
+            optima.append(Optimum(start))
+    return optima
+
+
+# These globals are set in each worker process by the pool initializer.
+g_objective = None
+g_options = None
+
+def _init_worker(factory, factory_args, options):
+    global g_objective
+    global g_options
+    g_objective = factory(*factory_args)
+    g_options = options
+
+def _run_start(args):
+    start_index, x0 = args
+    f, fprime, fhess = g_objective
+    method, lows, highs, transform, maximize = g_options
+    if maximize:
+        f = jeffopt.NegWrap(f)
+        fprime = jeffopt.NegWrap(fprime) if fprime else None
+        fhess = jeffopt.NegWrap(fhess) if fhess else None
+    tm = time.time()
+    try:
+        x, value = local_minimize(
+                f, fprime, fhess, x0, method, lows, highs, transform)
+    except MultiStartError:
+        raise
+    except Exception as e:
+        return StartResult(start_index, x0, None, np.nan,
+                time.time() - tm, '%s: %s' % (e.__class__.__name__, e))
+    if not np.isfinite(value):
+        return StartResult(start_index, x0, None, np.nan,
+                time.time() - tm, 'the objective value is not finite')
+    if maximize:
+        value = -value
+    return StartResult(start_index, x0, x, value, time.time() - tm)
+
+def _gen_start_results(factory, factory_args, options, args_list, nprocesses):
+    if nprocesses == 1:
+        _init_worker(factory, factory_args, options)
+        for args in args_list:
+            yield _run_start(args)
+        return
+    pool = multiprocessing.Pool(
+            nprocesses, _init_worker, (factory, factory_args, options))
+    try:
+        for result in pool.imap_unordered(_run_start, args_list):
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+def multistart(factory, factory_args, lows, highs, nstarts,
+        method='simplex', sampler='lhs', transform='logit',
+        maximize=False, nrepeats=None, seed=None, nprocesses=None,
+        xtol=g_xtol, ftol=g_ftol):
+    """
+    The factory must be defined at the top level of a module
+    so that it can be pickled.
+    It returns a triple (f, fprime, fhess) where the derivatives may be None.
+    The starting points are drawn from the box given by the bounds.
+    With the logit transform the parameters are otherwise unbounded,
+    and with the box transform the local optimization stays in the box.
+    @param factory: called as factory(*factory_args) once per process
+    @param factory_args: picklable arguments of the factory
+    @param lows: lower bounds of the box
+    @param highs: upper bounds of the box
+    @param nstarts: the number of starting points
+    @param method: the name of the local optimization
+    @param sampler: 'lhs' or 'sobol'
+    @param transform: 'logit' or 'box'
+    @param maximize: True to maximize instead of minimize
+    @param nrepeats: stop when this many starts reach the best value
+    @param seed: random seed for the Latin hypercube
+    @param nprocesses: the number of processes or None for the number of cpus
+    @param xtol: scaled coordinate tolerance for grouping optima
+    @param ftol: relative objective function value tolerance for grouping
+    @return: a MultiStartResult
+    """
+    if method not in g_methods:
+        raise MultiStartError('unknown method: ' + method)
+    if transform not in g_transforms:
+        raise MultiStartError('unknown transform: ' + transform)
+    lows = np.asarray(lows, dtype=float)
+    highs = np.asarray(highs, dtype=float)
+    if lows.shape != highs.shape or np.any(highs <= lows):
+        raise MultiStartError('each upper bound must exceed its lower bound')
+    widths = highs - lows
+    X0 = get_starting_points(nstarts, lows, highs, sampler, seed)
+    args_list = list(enumerate(X0))
+    options = (method, lows, highs, transform, maximize)
+    starts = []
+    optima = []
+    stopped_early = False
+    results = _gen_start_results(
+            factory, factory_args, options, args_list, nprocesses)
+    for start in results:
+        starts.append(start)
+        optima = get_optima(starts, widths, maximize, xtol, ftol)
+        if nrepeats and optima and optima[0].get_count() >= nrepeats:
+            stopped_early = len(starts) < nstarts
+            results.close()
+            break
+    starts.sort(key=lambda s: s.start_index)
+    return MultiStartResult(starts, optima, maximize, stopped_early)
+
+
+def _get_test_objective(depth):
+    """
+    This has a local minimum at -1 and a deeper global minimum near +2.
+    """
+    def f(X):
+        x = X[0]
+        return (x + 1)**2 * (x - 2)**2 - depth * x + np.sum(X[1:]**2)
+    return f, None, None
+
+class TestMultiStart(unittest.TestCase):
+
+    def test_latin_hypercube(self):
+        U = get_latin_hypercube(10, 3, np.random.RandomState(0))
+        for j in range(3):
+            bins = np.sort(np.floor(U[:, j] * 10).astype(int))
+            self.assertTrue(np.array_equal(bins, np.arange(10)))
+
+    def test_sobol(self):
+        ndim = len(g_sobol_directions) + 1
+        U = get_sobol(256, ndim, skip=0)
+        self.assertTrue(np.array_equal(U[0], np.zeros(ndim)))
+        for j in range(ndim):
+            bins = np.sort(np.floor(U[:, j] * 256).astype(int))
+            self.assertTrue(np.array_equal(bins, np.arange(256)))
+        # the first two dimensions put one point in each square
+        cells = set(tuple(row) for row in np.floor(U[:16, :2] * 4))
+        self.assertEqual(len(cells), 16)
+        self.assertRaises(MultiStartError, get_sobol, 4, ndim + 1)
+
+    def test_multistart(self):
+        for nprocesses in (1, 2):
+            result = multistart(_get_test_objective, (1.0,),
+                    [-3.0, -1.0], [3.0, 1.0], 8, seed=0,
+                    nprocesses=nprocesses)
+            self.assertEqual(len(result.starts), 8)
+            self.assertEqual(len(result.optima), 2)
+            best = result.get_best()
+            self.assertTrue(best.x[0] > 1.5)
+            self.assertTrue(best.value < result.optima[1].value)
+            self.assertEqual(
+                    sum(o.get_count() for o in result.optima), 8)
+            self.assertEqual(len(result.get_table_lines()), 9)
+
+    def test_maximize_box(self):
+        result = multistart(_get_test_objective, (-1.0,),
+                [-3.0, -1.0], [0.0, 1.0], 6, method='jeff',
+                sampler='sobol', transform='box', nprocesses=1)
+        optimum = result.get_best()
+        self.assertTrue(np.all(optimum.x >= [-3.0, -1.0]))
+        self.assertTrue(np.all(optimum.x <= [0.0, 1.0]))
+        result = multistart(_get_test_objective, (1.0,),
+                [-3.0, -1.0], [3.0, 1.0], 6, method='l-bfgs-b',
+                maximize=True, transform='box', nprocesses=1)
+        self.assertTrue(np.allclose(np.abs(result.get_best().x), [3, 1]))
+
+    def test_early_stopping(self):
+        result = multistart(_get_test_objective, (1.0,),
+                [1.0, -1.0], [3.0, 1.0], 20, nrepeats=3, seed=0,
+                nprocesses=1)
+        self.assertTrue(result.stopped_early)
+        self.assertEqual(len(result.starts), 3)
+        self.assertEqual(result.get_best().get_count(), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -335,6 +335,8 @@ if __name__ == '__main__':
     parser.add_argument('--port', type=int, default=8080,
             help='should be at least 1024 unless you have root access')
     parser.add_argument('--mkdocs', action='store_true', help='build docs')
+    parser.add_argument('--r-workers', type=int, default=0,
+            help='keep this many R processes running between requests')
     args = parser.parse_args()
     if g_current_directory == g_script_directory:
         raise ValueError('Run this script from a temporary "live" directory.')
@@ -362,6 +364,10 @@ if __name__ == '__main__':
     sys.path.remove(g_script_directory)
     sys.path.append(os.path.abspath(g_live_code))
     gadgets = list(reversed(sorted(gen_gadgets())))
+    if args.r_workers > 0:
+        # use the same RUtil module as the gadgets in the live directory
+        import RUtil
+        RUtil.start_pool(args.r_workers)
     cherrypy.config.update({
         'server.socket_host': args.host,
         'server.socket_port': args.port})
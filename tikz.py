@@ -122,19 +122,52 @@ def get_response(
     # immediately return the tikzpicture if requested
     if tikzformat == TIKZFORMAT_TIKZ:
         return tikzpicture
-    # If tikz libraries are requested then add these to the preamble
-    # before handing off to latex.
+    # delegate to latexutil
+    requested_packages = set(packages) | set(['tikz'])
+    return latexutil.get_response(
+            'standalone', tikzpicture, tikzformat,
+            requested_packages, _get_preamble(preamble, tikzlibraries))
+
+def get_responses(
+        tikzpictures, tikzformat, packages=(), preamble='', tikzlibraries=(),
+        nthreads=None):
+    """
+    Independent pictures are compiled concurrently.
+    @param tikzpictures: complete tikzpicture environments
+    @param tikzformat: one of four tikz output formats
+    @param packages: a collection of requested packages
+    @param preamble: color definitions, for example
+    @param tikzlibraries: a collection of requested tikz libraries
+    @param nthreads: the number of concurrent compilations or None
+    @return: a response for each tikzpicture
+    """
+    # check the requested format
+    assert_tikzformat(tikzformat)
+    # immediately return the tikzpictures if requested
+    if tikzformat == TIKZFORMAT_TIKZ:
+        return list(tikzpictures)
+    # delegate to latexutil
+    requested_packages = set(packages) | set(['tikz'])
+    return latexutil.get_responses(
+            'standalone', tikzpictures, tikzformat,
+            requested_packages, _get_preamble(preamble, tikzlibraries),
+            nthreads)
+
+def _get_preamble(preamble, tikzlibraries):
+    """
+    If tikz libraries are requested then add these to the preamble
+    before handing off to latex.
+    @param preamble: color definitions, for example
+    @param tikzlibraries: a collection of requested tikz libraries
+    @return: the preamble with the tikz libraries
+    """
     tikzlibraries_lines = []
     for name in tikzlibraries:
         line = r'\usetikzlibrary{%s}' % name
         tikzlibraries_lines.append(line)
     if tikzlibraries_lines:
         preamble += '\n' + '\n'.join(tikzlibraries_lines)
-    # delegate to latexutil
-    requested_packages = set(packages) | set(['tikz'])
-    return latexutil.get_response(
-            'standalone', tikzpicture, tikzformat,
-            requested_packages, preamble)
+    return preamble
 
 def get_figure_response(
         tikzpicture, tikzformat, figure_caption, figure_label,
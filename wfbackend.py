@@ -0,0 +1,19 @@
+"""
+Choose the compiled Wright-Fisher extension modules or their fallbacks.
+
+Modules and scripts import the extensions through this module,
+so the fallback to the pure numpy implementations in wfnumpy
+is decided in one place:
+from wfbackend import wfengine
+from wfbackend import wfcompens
+"""
+
+try:
+    import wfengine
+except ImportError:
+    import wfnumpy as wfengine
+
+try:
+    import wfcompens
+except ImportError:
+    import wfnumpy as wfcompens
@@ -10,17 +10,26 @@ The implementation is in Cython for speed
 and uses python numpy arrays for speed and convenience.
 For compilation instructions see
 http://docs.cython.org/src/reference/compilation.html
+The selection loop is split across OpenMP threads,
+so the extension must be compiled and linked with -fopenmp.
 For example:
 $ cython -a wfcompens.pyx
 $ gcc -shared -pthread -fPIC -fwrapv -O2 -Wall -fno-strict-aliasing \
-      -I/usr/include/python2.7 -o wfcompens.so wfcompens.c
+      -fopenmp -I/usr/include/python2.7 -o wfcompens.so wfcompens.c
+The wfnumpy module has pure numpy versions of these functions.
 """
 
 import numpy as np
 cimport numpy as np
 cimport cython
+cimport openmp
+from cython.parallel cimport prange
 from libc.math cimport log
 
+# The rate matrices are built with numpy array operations,
+# so the extension shares them with the pure numpy module.
+from wfnumpy import create_mutation, create_recomb
+
 np.import_array()
 
 cdef int AB_type = 0
@@ -30,105 +39,44 @@ cdef int ab_type = 3
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-def create_mutation(
-        np.ndarray[np.int_t, ndim=2] M,
-        np.ndarray[np.int_t, ndim=4] T,
-        ):
-    """
-    The scaling of the resulting rate matrix is strange.
-    Every rate is an integer, but in double precision float format.
-    @param M: M[i,j] is the count of allele j in state index i
-    @param T: T[AA, Ab, aB, ab] is the state index for the given allele counts
-    @return: mutation rate matrix
-    """
-    cdef int i
-    cdef int AB, Ab, aB, ab
-    cdef int nstates = M.shape[0]
-    cdef np.ndarray[np.float64_t, ndim=2] R = np.zeros((nstates, nstates))
-    for i in range(nstates):
-        # meticulously unpack the allele counts from the corresponding state
-        AB = M[i, 0]
-        Ab = M[i, 1]
-        aB = M[i, 2]
-        ab = M[i, 3]
-        #
-        if AB > 0:
-            R[i, T[AB-1, Ab+1, aB,   ab  ]] = AB
-            R[i, T[AB-1, Ab,   aB+1, ab  ]] = AB
-        if Ab > 0:
-            R[i, T[AB+1, Ab-1, aB,   ab  ]] = Ab
-            R[i, T[AB,   Ab-1, aB,   ab+1]] = Ab
-        if aB > 0:
-            R[i, T[AB+1, Ab,   aB-1, ab  ]] = aB
-            R[i, T[AB,   Ab,   aB-1, ab+1]] = aB
-        if ab > 0:
-            R[i, T[AB,   Ab+1, aB,   ab-1]] = ab
-            R[i, T[AB,   Ab,   aB+1, ab-1]] = ab
-        R[i, i] = -2*(AB + Ab + aB + ab)
-    return R
-
-@cython.boundscheck(False)
-@cython.wraparound(False)
-def create_recomb(
+def create_selection(
+        double s,
         np.ndarray[np.int_t, ndim=2] M,
-        np.ndarray[np.int_t, ndim=4] T,
+        int nthreads=0,
         ):
     """
-    The scaling of the resulting rate matrix is strange.
-    Every rate is an integer, but in double precision float format.
+    The states are split among threads.
+    @param s: selection against the Ab and aB haplotypes
     @param M: M[i,j] is the count of allele j in state index i
-    @param T: T[AA, Ab, aB, ab] is the state index for the given allele counts
-    @return: recombination rate matrix
+    @param nthreads: the number of threads or 0 for all of them
+    @return: log probability per haplotype per state
     """
-    cdef int i
-    cdef int AB, Ab, aB, ab
-    cdef int AB_ab, Ab_aB
-    cdef int nstates = M.shape[0]
-    cdef np.ndarray[np.float64_t, ndim=2] R = np.zeros((nstates, nstates))
-    for i in range(nstates):
-        # meticulously unpack the allele counts from the corresponding state
-        AB = M[i, 0]
-        Ab = M[i, 1]
-        aB = M[i, 2]
-        ab = M[i, 3]
-        #
-        AB_ab = AB * ab
-        Ab_aB = Ab * aB
-        #
-        if AB_ab > 0:
-            R[i, T[AB-1, Ab+1, aB+1, ab-1]] = AB_ab
-        if Ab_aB > 0:
-            R[i, T[AB+1, Ab-1, aB-1, ab+1]] = Ab_aB
-        R[i, i] = -(AB_ab + Ab_aB)
-    return R
-
-@cython.boundscheck(False)
-@cython.wraparound(False)
-def create_selection(
-        double s,
-        np.ndarray[np.int_t, ndim=2] M,
-        ):
     if s >= 1:
         raise ValueError(
                 'selection s must be less than 1 '
                 'but observed: %s' % s)
-    #
     cdef double AB, Ab, aB, ab
-    #
     cdef int nstates = M.shape[0]
     cdef int k = M.shape[1]
+    cdef int i
     cdef double neg_logp
     cdef np.ndarray[np.float64_t, ndim=2] L = np.empty((nstates, k))
-    for i in range(nstates):
-        AB = M[i, 0]
-        Ab = M[i, 1]
-        aB = M[i, 2]
-        ab = M[i, 3]
+    # Get views that can be used without the interpreter lock.
+    cdef double[:, :] L_view = L
+    cdef np.int_t[:, :] M_view = M
+    if nthreads < 1:
+        nthreads = openmp.omp_get_max_threads()
+    for i in prange(nstates, nogil=True, schedule='static',
+            num_threads=nthreads):
+        AB = M_view[i, 0]
+        Ab = M_view[i, 1]
+        aB = M_view[i, 2]
+        ab = M_view[i, 3]
         neg_logp = -log(AB + ab + (1-s)*(Ab + aB))
-        L[i, 0] = neg_logp + log(AB)
-        L[i, 1] = neg_logp + log(Ab*(1-s))
-        L[i, 2] = neg_logp + log(aB*(1-s))
-        L[i, 3] = neg_logp + log(ab)
+        L_view[i, 0] = neg_logp + log(AB)
+        L_view[i, 1] = neg_logp + log(Ab*(1-s))
+        L_view[i, 2] = neg_logp + log(aB*(1-s))
+        L_view[i, 3] = neg_logp + log(ab)
     return L
 
 
@@ -199,27 +147,34 @@ def multiple_recombination(
     cdef int i
     cdef int index_0, index_1
     cdef int t0, t1
-    for i in range(nsamples):
-        index_0 = sampled_individuals[i*2]
-        index_1 = sampled_individuals[i*2 + 1]
-        t0 = mutable_state[index_0]
-        t1 = mutable_state[index_1]
-        if (t0 == AB_type and t1 == ab_type) or (
-                t0 == ab_type and t1 == AB_type):
-            mutable_state[index_0] = aB_type
-            mutable_state[index_1] = Ab_type
-            mutable_counts[AB_type] -= 1
-            mutable_counts[ab_type] -= 1
-            mutable_counts[Ab_type] += 1
-            mutable_counts[aB_type] += 1
-        elif (t0 == Ab_type and t1 == aB_type) or (
-                t0 == aB_type and t1 == Ab_type):
-            mutable_state[index_0] = AB_type
-            mutable_state[index_1] = ab_type
-            mutable_counts[AB_type] += 1
-            mutable_counts[ab_type] += 1
-            mutable_counts[Ab_type] -= 1
-            mutable_counts[aB_type] -= 1
+    # Get views that can be used without the interpreter lock.
+    # The pairs are sampled with replacement and may share individuals,
+    # so the recombinations are applied in order by a single thread.
+    cdef np.int_t[:] state = mutable_state
+    cdef np.int_t[:] counts = mutable_counts
+    cdef np.int_t[:] samples = sampled_individuals
+    with nogil:
+        for i in range(nsamples):
+            index_0 = samples[i*2]
+            index_1 = samples[i*2 + 1]
+            t0 = state[index_0]
+            t1 = state[index_1]
+            if (t0 == AB_type and t1 == ab_type) or (
+                    t0 == ab_type and t1 == AB_type):
+                state[index_0] = aB_type
+                state[index_1] = Ab_type
+                counts[AB_type] -= 1
+                counts[ab_type] -= 1
+                counts[Ab_type] += 1
+                counts[aB_type] += 1
+            elif (t0 == Ab_type and t1 == aB_type) or (
+                    t0 == aB_type and t1 == Ab_type):
+                state[index_0] = AB_type
+                state[index_1] = ab_type
+                counts[AB_type] += 1
+                counts[ab_type] += 1
+                counts[Ab_type] -= 1
+                counts[aB_type] -= 1
     return None
 
 @cython.boundscheck(False)
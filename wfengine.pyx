@@ -12,10 +12,14 @@ The implementation is in Cython for speed
 and uses python numpy arrays for speed and convenience.
 For compilation instructions see
 http://docs.cython.org/src/reference/compilation.html
+The expensive loops release the interpreter lock
+and are split across OpenMP threads,
+so the extension must be compiled and linked with -fopenmp.
 For example:
 $ cython -a wfengine.pyx
 $ gcc -shared -pthread -fPIC -fwrapv -O2 -Wall -fno-strict-aliasing \
-      -I/usr/include/python2.7 -o wfengine.so wfengine.c
+      -fopenmp -I/usr/include/python2.7 -o wfengine.so wfengine.c
+The wfnumpy module has pure numpy versions of these functions.
 """
 
 # TODO generalize the diallelic transition matrix creation functions
@@ -24,12 +28,23 @@ import math
 import numpy as np
 cimport numpy as np
 cimport cython
+cimport openmp
+from cython.parallel cimport prange
 from libc.math cimport log, exp
 
 np.import_array()
 
 cdef double g_math_neg_inf = float('-inf')
 
+cdef int _get_nthreads(int nthreads):
+    """
+    @param nthreads: a requested number of threads or 0 for all of them
+    @return: a positive number of threads
+    """
+    if nthreads < 1:
+        return openmp.omp_get_max_threads()
+    return nthreads
+
 def binomial_coefficient(n, k):
     """
     Modified from a function by Andrew Dalke.
@@ -191,6 +206,7 @@ cdef get_log_fact_array(int N):
 def expand_multinomials(
         int N,
         np.ndarray[np.float64_t, ndim=2] log_distns,
+        int nthreads=0,
         ):
     """
     Each row of distns is a distribution over k bins.
@@ -198,12 +214,14 @@ def expand_multinomials(
     is a multinomial distribution over the ways to put N things into k bins.
     The returned array has the same number of columns as the distn array,
     and the entries are logarithms of probabilities.
+    The compositions are split among threads.
     @param N: integer population size
     @param log_distns: numpy 2d array with ndistns rows and k columns
+    @param nthreads: the number of threads or 0 for all of them
     @return: numpy 2d array with ndistns rows and choose(N+k-1,N) columns
     """
-    cdef int i, j, k, index
-    cdef int ndistns, ncolsout
+    cdef int i, j, k, index, c
+    cdef int ndistns, ncols_out
     cdef double accum, log_multinomial_coeff
     # initialize
     ndistns = log_distns.shape[0]
@@ -214,42 +232,58 @@ def expand_multinomials(
     cdef np.ndarray[np.float64_t, ndim=2] M = np.zeros((ndistns, ncols_out))
     # Precompute some logarithms of factorials up to N.
     cdef np.ndarray[np.float64_t, ndim=1] log_fact = get_log_fact_array(N)
-    # Make the array.
     cdef np.ndarray[np.int_t, ndim=2] compos
     compos = np.array(list(gen_population_compositions(N, k)))
-    for i in range(ncols_out):
+    # Get views that can be used without the interpreter lock.
+    cdef double[:, :] M_view = M
+    cdef double[:, :] L_view = log_distns
+    cdef double[:] f_view = log_fact
+    cdef np.int_t[:, :] c_view = compos
+    cdef int nt = _get_nthreads(nthreads)
+    # Make the array.
+    for i in prange(ncols_out, nogil=True, schedule='static',
+            num_threads=nt):
         # define the log of multinomial coefficient for this composition
-        log_multinomial_coeff = log_fact[N]
+        log_multinomial_coeff = f_view[N]
         for index in range(k):
-            log_multinomial_coeff -= log_fact[compos[i, index]]
+            log_multinomial_coeff = (
+                    log_multinomial_coeff - f_view[c_view[i, index]])
         for j in range(ndistns):
             # Compute the log multinomial probability.
             accum = log_multinomial_coeff
             for index in range(k):
-                if compos[i, index]:
-                    accum += compos[i, index] * log_distns[j, index]
-            M[j, i] = accum
+                c = c_view[i, index]
+                if c:
+                    accum = accum + c * L_view[j, index]
+            M_view[j, i] = accum
     # Return the array.
     return M
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
-cdef mvhyperg(
-        np.ndarray[np.int_t, ndim=1] s_large,
-        np.ndarray[np.int_t, ndim=1] s_small,
-        np.ndarray[np.float64_t, ndim=1] log_fact,
-        ):
+cdef double mvhyperg(
+        np.int_t[:, :] M_large,
+        int j,
+        np.int_t[:, :] M_small,
+        int i,
+        double[:] log_fact,
+        ) nogil:
     """
     Multivariate hypergeometric log likelihood.
     This is named similarly to the fortran function in flib.
+    @param M_large: the large states
+    @param j: the index of the large state
+    @param M_small: the small states
+    @param i: the index of the small state
+    @param log_fact: precomputed logarithm of factorial values
     @return: log likelihood
     """
     # get the number of bins
-    cdef int k = s_large.shape[0]
-    cdef int i
+    cdef int k = M_large.shape[1]
+    cdef int index
     # check for impossible selections
-    for i in range(k):
-        if s_small[i] > s_large[i]:
+    for index in range(k):
+        if M_small[i, index] > M_large[j, index]:
             return g_math_neg_inf
     # get the number of balls
     cdef int N = 0
@@ -257,9 +291,9 @@ cdef mvhyperg(
     cdef int v_N, v_n
     cdef double log_num = 0
     cdef double log_den = 0
-    for i in range(k):
-        v_N = s_large[i]
-        v_n = s_small[i]
+    for index in range(k):
+        v_N = M_large[j, index]
+        v_n = M_small[i, index]
         N += v_N
         n += v_n
         log_num += log_fact[v_N] - log_fact[v_n] - log_fact[v_N - v_n]
@@ -272,11 +306,14 @@ def reduce_hypergeometric(
         np.ndarray[np.int_t, ndim=2] M_large,
         np.ndarray[np.int_t, ndim=2] M_small,
         np.ndarray[np.float64_t, ndim=1] w_large,
+        int nthreads=0,
         ):
     """
+    The small states are split among threads.
     @param M_large: states defined by N balls in k bins
     @param M_small: states defined by n balls in k bins
     @param w_large: weight per large state
+    @param nthreads: the number of threads or 0 for all of them
     @return: weight per small state
     """
     # nstates_large is the number of larger samples
@@ -290,13 +327,23 @@ def reduce_hypergeometric(
     cdef int N = M_large[0].sum()
     cdef int n = M_small[0].sum()
     cdef int i, j
-    cdef double loglik
+    cdef double accum
     cdef np.ndarray[np.float64_t, ndim=1] w_small = np.zeros(nstates_small)
     cdef np.ndarray[np.float64_t, ndim=1] log_fact = get_log_fact_array(N)
-    for i in range(nstates_small):
+    # Get views that can be used without the interpreter lock.
+    cdef np.int_t[:, :] large_view = M_large
+    cdef np.int_t[:, :] small_view = M_small
+    cdef double[:] w_large_view = w_large
+    cdef double[:] w_small_view = w_small
+    cdef double[:] f_view = log_fact
+    cdef int nt = _get_nthreads(nthreads)
+    for i in prange(nstates_small, nogil=True, schedule='dynamic',
+            num_threads=nt):
+        accum = 0
         for j in range(nstates_large):
-            loglik = mvhyperg(M_large[j], M_small[i], log_fact)
-            w_small[i] += w_large[j] * exp(loglik)
+            accum = accum + w_large_view[j] * exp(
+                    mvhyperg(large_view, j, small_view, i, f_view))
+        w_small_view[i] = accum
     return w_small
 
 @cython.cdivision(True)
@@ -474,25 +521,38 @@ def create_genic(
         np.ndarray[np.float64_t, ndim=1] lmcs,
         np.ndarray[np.float64_t, ndim=2] lps,
         np.ndarray[np.int_t, ndim=2] M,
+        int nthreads=0,
         ):
     """
     This is a more flexible way to create a multinomial transition matrix.
     It is also fast.
     The output may have -inf but it should not have nan.
+    The rows are split among threads.
     @param lmcs: log multinomial count per state
     @param lps: log probability per haplotype per state
     @param M: allele count per haplotype per state
+    @param nthreads: the number of threads or 0 for all of them
     @return: entrywise log of transition matrix
     """
     cdef int nstates = M.shape[0]
     cdef int k = M.shape[1]
-    cdef int i, j, index
+    cdef int i, j, index, c
+    cdef double accum
     cdef np.ndarray[np.float64_t, ndim=2] L = np.zeros((nstates, nstates))
-    for i in range(nstates):
+    # Get views that can be used without the interpreter lock.
+    cdef double[:, :] L_view = L
+    cdef double[:] lmcs_view = lmcs
+    cdef double[:, :] lps_view = lps
+    cdef np.int_t[:, :] M_view = M
+    cdef int nt = _get_nthreads(nthreads)
+    for i in prange(nstates, nogil=True, schedule='static',
+            num_threads=nt):
         for j in range(nstates):
-            L[i, j] = lmcs[j]
+            accum = lmcs_view[j]
             for index in range(k):
-                if M[j, index]:
-                    L[i, j] += M[j, index] * lps[i, index]
+                c = M_view[j, index]
+                if c:
+                    accum = accum + c * lps_view[i, index]
+            L_view[i, j] = accum
     return L
 
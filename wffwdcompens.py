@@ -26,7 +26,7 @@ import random
 
 import numpy as np
 
-import wfcompens
+from wfbackend import wfcompens
 
 
 AB_type = 0
@@ -0,0 +1,349 @@
+"""
+Pure numpy fallbacks for the wfengine and wfcompens extension modules.
+
+The functions have the same names and arguments as the Cython functions,
+so the wfbackend module uses this one when the extensions
+have not been built.
+The nthreads arguments are accepted for compatibility and ignored;
+the loops over states are replaced by numpy array operations.
+"""
+
+import unittest
+import math
+
+import numpy as np
+from scipy import special
+
+import multinomstate
+import Util
+
+AB_type, Ab_type, aB_type, ab_type = range(4)
+
+
+###########################################################################
+# This section mirrors wfengine.
+
+def binomial_coefficient(n, k):
+    return Util.choose(n, k)
+
+def invert_binomial_coefficient(n_choose_k, k):
+    """
+    This is a plain python function and works with large integers.
+    It extracts n given n_choose_k and k.
+    """
+    if k < 1:
+        raise ValueError('k should be at least 1')
+    n_low = (math.factorial(k) * n_choose_k)**(1.0 / k)
+    n_high = n_low + k
+    for n in range(int(math.floor(n_low)), int(math.ceil(n_high)) + 1):
+        if binomial_coefficient(n, k) == n_choose_k:
+            return n
+    raise ValueError('failed to invert binomial coefficient')
+
+def gen_population_compositions(N, k):
+    """
+    Yield (N+k-1 choose N) compositions of length k.
+    """
+    return multinomstate.gen_states(N, k)
+
+def get_lmcs(M):
+    """
+    Logs of multinomial coefficients.
+    @param M: M[i,j] is count of bin j in state i
+    @return: a one dimensional array of log multinomial coefficients
+    """
+    N = np.sum(M[0])
+    return special.gammaln(N+1) - np.sum(special.gammaln(M+1), axis=1)
+
+def _get_log_multinomial_kernel(log_distns, M):
+    """
+    Compute the sum over bins of count times log probability.
+    A zero count contributes zero even if the log probability is -inf.
+    @param log_distns: log probabilities with one row per distribution
+    @param M: counts with one row per state
+    @return: an array with one row per distribution and one column per state
+    """
+    neg_inf = np.isneginf(log_distns)
+    K = np.dot(np.where(neg_inf, 0, log_distns), M.T)
+    impossible = np.dot(neg_inf.astype(int), (M > 0).T.astype(int)) > 0
+    K[impossible] = -np.inf
+    return K
+
+def expand_multinomials(N, log_distns, nthreads=0):
+    """
+    Each row of distns is a distribution over k bins.
+    Each row of the returned array
+    is a multinomial distribution over the ways to put N things into k bins.
+    The entries are logarithms of probabilities.
+    @param N: integer population size
+    @param log_distns: numpy 2d array with ndistns rows and k columns
+    @param nthreads: ignored
+    @return: numpy 2d array with ndistns rows and choose(N+k-1,N) columns
+    """
+    ndistns, k = log_distns.shape
+    compos = np.array(list(gen_population_compositions(N, k)))
+    return get_lmcs(compos) + _get_log_multinomial_kernel(log_distns, compos)
+
+def expand_multinomials_slow(N, log_distns):
+    return expand_multinomials(N, log_distns)
+
+def create_genic(lmcs, lps, M, nthreads=0):
+    """
+    This is a more flexible way to create a multinomial transition matrix.
+    @param lmcs: log multinomial count per state
+    @param lps: log probability per haplotype per state
+    @param M: allele count per haplotype per state
+    @param nthreads: ignored
+    @return: entrywise log of transition matrix
+    """
+    return lmcs + _get_log_multinomial_kernel(lps, M)
+
+def reduce_hypergeometric(M_large, M_small, w_large, nthreads=0):
+    """
+    @param M_large: states defined by N balls in k bins
+    @param M_small: states defined by n balls in k bins
+    @param w_large: weight per large state
+    @param nthreads: ignored
+    @return: weight per small state
+    """
+    N = np.sum(M_large[0])
+    n = np.sum(M_small[0])
+    k = M_large.shape[1]
+    # accumulate the log numerator one bin at a time
+    L = np.zeros((len(M_small), len(M_large)))
+    for index in range(k):
+        a = M_large[np.newaxis, :, index]
+        b = M_small[:, np.newaxis, index]
+        with np.errstate(invalid='ignore'):
+            L += (special.gammaln(a+1) - special.gammaln(b+1)
+                    - special.gammaln(a-b+1))
+        L[b > a] = -np.inf
+    L -= special.gammaln(N+1) - special.gammaln(n+1) - special.gammaln(N-n+1)
+    return np.dot(np.exp(L), w_large)
+
+def _create_diallelic(N, p):
+    """
+    @param N: haploid population size
+    @param p: child allele probability for each of the N+1 parent states
+    @return: entrywise logarithms of a transition matrix
+    """
+    j = np.arange(N+1)
+    log_coeffs = special.gammaln(N+1) - special.gammaln(j+1) - special.gammaln(
+            N-j+1)
+    p = p[:, np.newaxis]
+    return log_coeffs + special.xlogy(j, p) + special.xlog1py(N-j, -p)
+
+def _get_parent_counts(N_diploid):
+    N = N_diploid * 2
+    k = np.arange(N+1, dtype=float)
+    return N, k, N-k
+
+def create_genic_diallelic(N_diploid, s):
+    """
+    Create a Wright-Fisher transition matrix.
+    Use genic selection with two alleles and a diploid population.
+    @param N_diploid: diploid population size
+    @param s: an additive selection value that is positive by convention
+    @return: entrywise logarithms of a transition matrix
+    """
+    return create_diallelic_recessive(N_diploid, s, 0.5)
+
+def create_genic_diallelic_ohta(N_diploid, s):
+    N, k, r = _get_parent_counts(N_diploid)
+    p = k / N
+    delta = (0.5 * s) * p * (1 - p) / (1 + s*p)
+    return _create_diallelic(N, p + delta)
+
+def create_diallelic_recessive(N_diploid, s, h):
+    N, k, r = _get_parent_counts(N_diploid)
+    f00 = 1.0
+    f11 = 1.0 - s
+    f01 = h * f00 + (1-h) * f11
+    aa = f00*k*k
+    ab = f01*k*r
+    bb = f11*r*r
+    return _create_diallelic(N, (aa + ab) / (aa + 2*ab + bb))
+
+def create_diallelic_chen(N_diploid, fAA, faA, faa):
+    N, k, r = _get_parent_counts(N_diploid)
+    AA = fAA*k*k
+    aA = faA*k*r
+    aa = faa*r*r
+    return _create_diallelic(N, (AA + aA) / (AA + 2*aA + aa))
+
+
+###########################################################################
+# This section mirrors wfcompens.
+
+def create_mutation(M, T):
+    """
+    The scaling of the resulting rate matrix is strange.
+    Every rate is an integer, but in double precision float format.
+    @param M: M[i,j] is the count of allele j in state index i
+    @param T: a rank index of the states from multinomstate.get_rank_index
+    @return: mutation rate matrix
+    """
+    nstates = M.shape[0]
+    R = np.zeros((nstates, nstates))
+    rows = np.arange(nstates)
+    for a, b, delta in multinomstate.gen_single_moves(4):
+        # a mutation changes the haplotype at exactly one of the two loci
+        if a ^ b == 3:
+            continue
+        sinks = multinomstate.get_move_indices(M, T, delta)
+        mask = sinks >= 0
+        R[rows[mask], sinks[mask]] = M[mask, a]
+    R[rows, rows] = -2*np.sum(M, axis=1)
+    return R
+
+def create_recomb(M, T):
+    """
+    The scaling of the resulting rate matrix is strange.
+    Every rate is an integer, but in double precision float format.
+    @param M: M[i,j] is the count of allele j in state index i
+    @param T: a rank index of the states from multinomstate.get_rank_index
+    @return: recombination rate matrix
+    """
+    nstates = M.shape[0]
+    R = np.zeros((nstates, nstates))
+    rows = np.arange(nstates)
+    AB_ab = M[:, AB_type] * M[:, ab_type]
+    Ab_aB = M[:, Ab_type] * M[:, aB_type]
+    for delta, rates in (
+            ((-1, 1, 1, -1), AB_ab),
+            ((1, -1, -1, 1), Ab_aB)):
+        sinks = multinomstate.get_move_indices(M, T, np.array(delta))
+        mask = sinks >= 0
+        R[rows[mask], sinks[mask]] = rates[mask]
+    R[rows, rows] = -(AB_ab + Ab_aB)
+    return R
+
+def create_selection(s, M):
+    """
+    @param s: selection against the Ab and aB haplotypes
+    @param M: M[i,j] is the count of allele j in state index i
+    @return: log probability per haplotype per state
+    """
+    if s >= 1:
+        raise ValueError(
+                'selection s must be less than 1 '
+                'but observed: %s' % s)
+    weights = M * np.array([1.0, 1-s, 1-s, 1.0])
+    with np.errstate(divide='ignore'):
+        return np.log(weights) - np.log(np.sum(weights, axis=1))[:, np.newaxis]
+
+def multiple_mutation(
+        mutable_state, mutable_counts, sampled_individuals, sampled_loci):
+    """
+    All of the random sampling has already occurred.
+    The haplotype type is a two bit number with one bit per locus.
+    """
+    for index, locus in zip(sampled_individuals, sampled_loci):
+        old_type = mutable_state[index]
+        new_type = old_type ^ (1 if locus else 2)
+        mutable_state[index] = new_type
+        mutable_counts[old_type] -= 1
+        mutable_counts[new_type] += 1
+
+def multiple_recombination(
+        mutable_state, mutable_counts, sampled_individuals):
+    """
+    All of the random sampling has already occurred.
+    @param sampled_individuals: should be of even length
+    """
+    for i in range(len(sampled_individuals) // 2):
+        index_0 = sampled_individuals[i*2]
+        index_1 = sampled_individuals[i*2 + 1]
+        types = set((mutable_state[index_0], mutable_state[index_1]))
+        if types == set((AB_type, ab_type)):
+            mutable_state[index_0] = aB_type
+            mutable_state[index_1] = Ab_type
+            mutable_counts += [-1, 1, 1, -1]
+        elif types == set((Ab_type, aB_type)):
+            mutable_state[index_0] = AB_type
+            mutable_state[index_1] = ab_type
+            mutable_counts += [1, -1, -1, 1]
+
+def expand_counts(mutable_state, counts):
+    mutable_state[:np.sum(counts)] = np.repeat(np.arange(len(counts)), counts)
+
+def reselection(probs_out, fitnesses_in, counts_in):
+    """
+    Use haploid selection.
+    @param probs_out: iid child haplotype probabilities to be computed
+    @param fitnesses_in: relative fitnesses of haplotypes
+    @param counts_in: allele counts of the parent generation
+    """
+    x = fitnesses_in * counts_in
+    probs_out[:] = x / np.sum(x)
+
+
+class TestWFNumpy(unittest.TestCase):
+
+    def test_expand_multinomials(self):
+        N_diploid = 3
+        s = 0.03
+        P = create_genic_diallelic(N_diploid, s)
+        self.assertTrue(np.allclose(np.sum(np.exp(P), axis=1), 1))
+        # the first bin of each composition counts the preferred allele
+        N, k, r = _get_parent_counts(N_diploid)
+        aa = k*k
+        ab = 0.5*(2.0 - s)*k*r
+        bb = (1.0 - s)*r*r
+        p = (aa + ab) / (aa + 2*ab + bb)
+        with np.errstate(divide='ignore'):
+            log_distns = np.log(np.vstack((p, 1-p)).T)
+        Q = expand_multinomials(N, log_distns)
+        self.assertTrue(np.allclose(np.exp(P), np.exp(Q)))
+
+    def test_create_genic(self):
+        N = 5
+        k = 4
+        M = multinomstate.get_sorted_states(N, k)
+        lmcs = get_lmcs(M)
+        lps = create_selection(0.1, M)
+        L = create_genic(lmcs, lps, M)
+        self.assertTrue(np.allclose(np.sum(np.exp(L), axis=1), 1))
+        # compare to the expansion with columns in gen_states order
+        ranks = multinomstate.get_ranks(M)
+        expected = expand_multinomials(N, lps)[:, ranks]
+        self.assertTrue(np.allclose(np.exp(expected), np.exp(L)))
+
+    def test_reduce_hypergeometric(self):
+        np.random.seed(0)
+        k = 3
+        M_large = np.array(list(multinomstate.gen_states(6, k)))
+        M_small = np.array(list(multinomstate.gen_states(2, k)))
+        w_large = np.random.rand(len(M_large))
+        observed = reduce_hypergeometric(M_large, M_small, w_large)
+        expected = np.zeros(len(M_small))
+        for i, small in enumerate(M_small):
+            for j, large in enumerate(M_large):
+                num = 1
+                for a, b in zip(large, small):
+                    num *= Util.choose(a, b)
+                expected[i] += w_large[j] * num / float(Util.choose(6, 2))
+        self.assertTrue(np.allclose(expected, observed))
+        self.assertTrue(np.allclose(np.sum(w_large), np.sum(observed)))
+
+    def test_compensatory_rates(self):
+        M = multinomstate.get_sorted_states(6, 4)
+        T = multinomstate.get_rank_index(M)
+        for R in (create_mutation(M, T), create_recomb(M, T)):
+            self.assertTrue(np.allclose(np.sum(R, axis=1), 0))
+
+    def test_forward_helpers(self):
+        counts = np.array([3, 1, 0, 2])
+        state = np.empty(6, dtype=int)
+        expand_counts(state, counts)
+        self.assertEqual(state.tolist(), [0, 0, 0, 1, 3, 3])
+        multiple_recombination(state, counts, np.array([0, 4]))
+        self.assertEqual(state.tolist(), [2, 0, 0, 1, 1, 3])
+        self.assertEqual(counts.tolist(), [2, 2, 1, 1])
+        multiple_mutation(state, counts, np.array([5]), np.array([0]))
+        self.assertEqual(state[5], Ab_type)
+        self.assertEqual(counts.tolist(), [2, 3, 1, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
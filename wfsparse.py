@@ -0,0 +1,259 @@
+"""
+Sparse truncated Wright-Fisher transition matrices.
+
+This is a sparse counterpart of some of the wfengine functions.
+Instead of computing a log probability for every pair of states,
+each row keeps only the transitions whose log probability
+is at least a user threshold.
+The multinomial distribution is factored as a chain of binomial
+distributions, one per bin, and each binomial is searched outward
+from its mode, so the work is proportional to the number of kept entries.
+Because the partial log probability of a chain can only decrease
+as more bins are added, no transition above the threshold is missed.
+Each row is renormalized after truncation.
+The discarded probability in each row is at most
+the number of states times exp(log_threshold).
+The returned matrices are scipy.sparse csr matrices of probabilities,
+not of log probabilities.
+"""
+
+import unittest
+
+import numpy as np
+from scipy import sparse
+from scipy import special
+
+import multinomstate
+
+g_default_log_threshold = -30.0
+
+class WFSparseError(Exception): pass
+
+
+def _binomial_log_pmf(c, R, q):
+    """
+    This is vectorized.
+    @param c: counts
+    @param R: numbers of trials
+    @param q: success probabilities
+    @return: log probabilities of the counts
+    """
+    return (
+            special.gammaln(R+1)
+            - special.gammaln(c+1)
+            - special.gammaln(R-c+1)
+            + special.xlogy(c, q)
+            + special.xlog1py(R-c, -q))
+
+def _expand_binomials(R, q, budgets):
+    """
+    For each binomial find the counts whose log probability meets its budget.
+    The binomial distribution is unimodal,
+    so the counts are contiguous around the mode.
+    @param R: a numpy integer array of numbers of trials
+    @param q: a numpy array of success probabilities
+    @param budgets: a numpy array of log probability thresholds
+    @return: binomial indices, counts, and log probabilities
+    """
+    mode = np.clip(np.floor((R+1)*q).astype(int), 0, R)
+    # start with a half width from a gaussian approximation
+    sd = np.sqrt(R*q*(1-q))
+    w = np.ceil(np.sqrt(-2*np.minimum(budgets, 0)) * sd).astype(int) + 1
+    while True:
+        lo = np.maximum(mode - w, 0)
+        hi = np.minimum(mode + w, R)
+        # widen the windows whose boundaries are still above the budget
+        short = np.logical_or(
+                (lo > 0) & (_binomial_log_pmf(lo, R, q) >= budgets),
+                (hi < R) & (_binomial_log_pmf(hi, R, q) >= budgets))
+        if not np.any(short):
+            break
+        w[short] *= 2
+    # enumerate the counts in the windows
+    sizes = hi - lo + 1
+    offsets = np.cumsum(sizes) - sizes
+    indices = np.repeat(np.arange(len(R)), sizes)
+    counts = lo[indices] + np.arange(np.sum(sizes)) - offsets[indices]
+    log_probs = _binomial_log_pmf(counts, R[indices], q[indices])
+    keep = log_probs >= budgets[indices]
+    return indices[keep], counts[keep], log_probs[keep]
+
+def get_multinomial_supports(N, log_distns, log_threshold):
+    """
+    Find the likely outcomes of many multinomial distributions.
+    @param N: the number of trials
+    @param log_distns: each row is the log of a distribution over k bins
+    @param log_threshold: the smallest log probability to keep
+    @return: distribution indices, counts with k columns, log probabilities
+    """
+    log_distns = np.asarray(log_distns, dtype=float)
+    ndistns, k = log_distns.shape
+    distns = np.exp(log_distns)
+    # tails[i, p] is the probability of bin p or a later bin
+    tails = np.cumsum(distns[:, ::-1], axis=1)[:, ::-1]
+    # each item is a prefix of counts of a distribution
+    rows = np.arange(ndistns)
+    counts = np.zeros((ndistns, 0), dtype=int)
+    log_probs = np.zeros(ndistns)
+    remaining = N * np.ones(ndistns, dtype=int)
+    for p in range(k-1):
+        # the conditional probability of bin p given bins p and later
+        num = distns[rows, p]
+        den = tails[rows, p]
+        q = np.clip(num / np.where(den > 0, den, 1), 0, 1)
+        indices, c, lp = _expand_binomials(
+                remaining, q, log_threshold - log_probs)
+        rows = rows[indices]
+        counts = np.hstack((counts[indices], c[:, np.newaxis]))
+        log_probs = log_probs[indices] + lp
+        remaining = remaining[indices] - c
+    # the last bin gets the remaining trials
+    feasible = (remaining == 0) | (distns[rows, k-1] > 0)
+    rows = rows[feasible]
+    counts = np.hstack((counts[feasible], remaining[feasible, np.newaxis]))
+    log_probs = log_probs[feasible]
+    return rows, counts, log_probs
+
+def _to_csr(rows, cols, log_probs, shape):
+    """
+    Renormalize the rows and build the sparse matrix.
+    @param rows: row indices
+    @param cols: column indices
+    @param log_probs: log probabilities
+    @param shape: the shape of the matrix
+    @return: a csr matrix whose rows are distributions
+    """
+    probs = np.exp(log_probs)
+    row_sums = np.bincount(rows, weights=probs, minlength=shape[0])
+    if np.any(row_sums <= 0):
+        raise WFSparseError('the log threshold is too high')
+    probs /= row_sums[rows]
+    return sparse.csr_matrix((probs, (rows, cols)), shape=shape)
+
+def expand_multinomials(N, log_distns, log_threshold=g_default_log_threshold):
+    """
+    This is like the wfengine function with the same name.
+    The columns are ordered like multinomstate.gen_states.
+    @param N: integer population size
+    @param log_distns: numpy 2d array with ndistns rows and k columns
+    @param log_threshold: the smallest log probability to keep
+    @return: sparse matrix with ndistns rows and choose(N+k-1,N) columns
+    """
+    ndistns, k = np.shape(log_distns)
+    rows, counts, log_probs = get_multinomial_supports(
+            N, log_distns, log_threshold)
+    cols = multinomstate.get_ranks(counts)
+    shape = (ndistns, multinomstate.get_nstates(N, k))
+    return _to_csr(rows, cols, log_probs, shape)
+
+def create_genic(lps, M, T, log_threshold=g_default_log_threshold):
+    """
+    This is like the wfengine function with the same name.
+    @param lps: log probability per haplotype per state
+    @param M: allele count per haplotype per state
+    @param T: a rank index of the states from multinomstate.get_rank_index
+    @param log_threshold: the smallest log probability to keep
+    @return: sparse transition matrix
+    """
+    nstates, k = M.shape
+    N = np.sum(M[0])
+    rows, counts, log_probs = get_multinomial_supports(
+            N, lps, log_threshold)
+    cols = multinomstate.get_indices(counts, T)
+    return _to_csr(rows, cols, log_probs, (nstates, nstates))
+
+def create_genic_diallelic(N_diploid, s, log_threshold=g_default_log_threshold):
+    """
+    This is like the wfengine function with the same name.
+    State k corresponds to the presence of k preferred alleles
+    in the population when s is positive.
+    @param N_diploid: diploid population size
+    @param s: an additive selection value that is positive by convention
+    @param log_threshold: the smallest log probability to keep
+    @return: sparse transition matrix with 2N+1 states
+    """
+    N = N_diploid * 2
+    # compute the child allele probabilities as in Kai Zeng 2010
+    k = np.arange(N+1, dtype=float)
+    r = N - k
+    aa = k*k
+    ab = 0.5*(2.0 - s)*k*r
+    bb = (1.0 - s)*r*r
+    p = (aa + ab) / (aa + 2*ab + bb)
+    with np.errstate(divide='ignore'):
+        log_distns = np.log(np.vstack((p, 1-p)).T)
+    rows, counts, log_probs = get_multinomial_supports(
+            N, log_distns, log_threshold)
+    return _to_csr(rows, counts[:, 0], log_probs, (N+1, N+1))
+
+
+def _get_dense_multinomials(N, distns):
+    k = distns.shape[1]
+    states = np.array(list(multinomstate.gen_states(N, k)))
+    log_coeffs = special.gammaln(N+1) - np.sum(
+            special.gammaln(states+1), axis=1)
+    L = log_coeffs + np.sum(
+            special.xlogy(states, distns[:, np.newaxis, :]), axis=2)
+    return np.exp(L)
+
+class TestWFSparse(unittest.TestCase):
+
+    def test_expand_multinomials(self):
+        np.random.seed(0)
+        N = 7
+        distns = np.random.dirichlet(np.ones(3), size=5)
+        distns[0] = [0.5, 0.0, 0.5]
+        expected = _get_dense_multinomials(N, distns)
+        with np.errstate(divide='ignore'):
+            log_distns = np.log(distns)
+        observed = expand_multinomials(N, log_distns, -700)
+        self.assertTrue(np.allclose(expected, observed.toarray()))
+
+    def test_truncation(self):
+        np.random.seed(0)
+        N = 80
+        k = 3
+        log_threshold = -10.0
+        distns = np.random.dirichlet(np.ones(k), size=4)
+        expected = _get_dense_multinomials(N, distns)
+        observed = expand_multinomials(N, np.log(distns), log_threshold)
+        # the kept entries are exactly the entries above the threshold
+        kept = expected >= np.exp(log_threshold)
+        self.assertTrue(np.array_equal(kept, observed.toarray() > 0))
+        self.assertTrue(observed.nnz < expected.size / 4)
+        # the rows are distributions and the error is bounded
+        self.assertTrue(np.allclose(observed.sum(axis=1), 1))
+        bound = 2 * multinomstate.get_nstates(N, k) * np.exp(log_threshold)
+        self.assertTrue(np.max(np.abs(expected - observed.toarray())) < bound)
+
+    def test_create_genic(self):
+        np.random.seed(0)
+        N = 6
+        k = 4
+        M = multinomstate.get_sorted_states(N, k)
+        T = multinomstate.get_rank_index(M)
+        fitness = np.array([1.0, 0.9, 0.8, 1.1])
+        weights = M * fitness
+        with np.errstate(divide='ignore'):
+            lps = np.log(weights / np.sum(weights, axis=1)[:, np.newaxis])
+        P = create_genic(lps, M, T, -700)
+        # compare to the dense matrix with columns in sorted state order
+        perm = multinomstate.get_ranks(M)
+        expected = _get_dense_multinomials(N, np.exp(lps))[:, perm]
+        self.assertTrue(np.allclose(expected, P.toarray()))
+
+    def test_create_genic_diallelic(self):
+        N_diploid = 5
+        s = 0.03
+        P = create_genic_diallelic(N_diploid, s, -700).toarray()
+        N = 2*N_diploid
+        self.assertTrue(np.allclose(P.sum(axis=1), 1))
+        self.assertEqual(P[0, 0], 1)
+        self.assertEqual(P[N, N], 1)
+        # the preferred allele tends to increase in frequency
+        expectations = np.dot(P, np.arange(N+1))
+        self.assertTrue(np.all(expectations[1:-1] > np.arange(1, N)))
+
+
+if __name__ == '__main__':
+    unittest.main()
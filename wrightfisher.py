@@ -9,7 +9,7 @@ import unittest
 import numpy as np
 
 import MatrixUtil
-import wfengine
+from wfbackend import wfengine
 
 
 def genic_diallelic(fi, fj, ni, nj):
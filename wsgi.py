@@ -23,6 +23,10 @@ add_to_path(script_directory)
 add_to_path(extension_directory)
 
 import SnippetUtil
+import RUtil
+
+# keep R processes running between requests if RUTIL_WORKERS is set
+RUtil.start_pool_from_environment()
 
 def scriptid_is_valid(scriptid):
     """